@@ -21,12 +21,17 @@ Reads parameter from a config file checks:
 These files can be changed as required to override default settings at the project, user or
 system level.
 
+Paths for GRASS, LAStools, SPDLib and FUSION are found the first time they
+are used (see LAZY_PATHS) so importing this module is fast and doesn't
+require these packages to be installed.
+
 """
 from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
 import os
 import sys
 import glob
 import tempfile
+import multiprocessing
 if sys.version_info[0] < 3:
     import ConfigParser
 else:
@@ -54,7 +59,7 @@ def get_config_int_fallback(config, section, option, fallback=None):
     which will accept a fallback value
     """
     try:
-        return config.getint(config,section,option)
+        return config.getint(section,option)
     except:
         return fallback
 
@@ -195,6 +200,33 @@ def get_debug():
 
     return DEBUG
 
+def get_total_memory_mb():
+    """
+    Function to get the total physical memory of the machine in MB.
+
+    Uses sysconf where available (Linux / OS X), returns None
+    if this can't be determined.
+    """
+    try:
+        page_size = os.sysconf('SC_PAGE_SIZE')
+        num_pages = os.sysconf('SC_PHYS_PAGES')
+        return int(page_size * num_pages / (1024 * 1024))
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def get_default_max_memory_mb():
+    """
+    Function to get the default memory budget (in MB) for running
+    stages at the same time. Uses 75 % of the total physical memory
+    or 4096 MB if this can't be determined.
+    """
+    total_memory_mb = get_total_memory_mb()
+
+    if total_memory_mb is None:
+        return 4096
+
+    return int(total_memory_mb * 0.75)
+
 def get_lastools_path():
     """
     Function to get path to LAStools
@@ -304,38 +336,117 @@ TEMP_PATH = get_config_fallback(config,'system','TEMP_PATH',fallback=get_temp_pa
 #: DEBUG mode
 DEBUG = get_config_bool_fallback(config,'system','DEBUG',fallback=get_debug())
 
-#: Path for GRASS Library
-GRASS_LIB_PATH = get_config_fallback(config,'grass','GRASS_LIB_PATH',fallback=None)
+#: Number of processes to use for operations which can run in parallel
+NUM_PROCESSES = get_config_int_fallback(config,'system','NUM_PROCESSES',
+                                        fallback=multiprocessing.cpu_count())
 
-if GRASS_LIB_PATH is None:
-    GRASS_LIB_PATH = get_grass_lib_path()
+#: Total memory (in MB) available to stages running at the same time
+MAX_MEMORY_MB = get_config_int_fallback(config,'system','MAX_MEMORY_MB',
+                                        fallback=get_default_max_memory_mb())
 
-#: Path for GRASS Python library
-GRASS_PYTHON_LIB_PATH = get_config_fallback(config,'grass','GRASS_PYTHON_LIB_PATH',
-                           fallback=None)
+#: File to write trace of time and resources used by each stage to (None to disable)
+TRACE_FILE = get_config_fallback(config,'system','TRACE_FILE',fallback=None)
 
-if GRASS_PYTHON_LIB_PATH is None:
-    GRASS_PYTHON_LIB_PATH = get_grass_python_lib_path(GRASS_LIB_PATH=GRASS_LIB_PATH)
+#: Format for trace file (jsonl or chrome, None to set from extension)
+TRACE_FORMAT = get_config_fallback(config,'system','TRACE_FORMAT',fallback=None)
 
-# Set environmental variable for GRASS lib
-os.environ['GISBASE'] = GRASS_LIB_PATH
+#: Time (in seconds) results of checking external tools are installed are cached for (0 to only cache within a process)
+TOOLCHAIN_CACHE_TTL = get_config_int_fallback(config,'system','TOOLCHAIN_CACHE_TTL',
+                                              fallback=86400)
 
-#: Path for GRASS database template
-GRASS_DATABASE_TEMPLATE = get_config_fallback(config,'grass','GRASS_DATABASE_TEMPLATE',
-                           fallback=None)
+#: File to cache results of checking external tools are installed in
+TOOLCHAIN_CACHE_FILE = get_config_fallback(config,'system','TOOLCHAIN_CACHE_FILE',
+                                           fallback=os.path.join(TEMP_PATH,
+                                                                 'arsf_dem_toolchain.json'))
 
-if GRASS_DATABASE_TEMPLATE is None or os.path.isdir(GRASS_DATABASE_TEMPLATE) == False:
-    GRASS_DATABASE_TEMPLATE = get_grass_db_template_path()
+#: Cache rasters created from lidar data so they are reused if created again with the same inputs and parameters
+RESULT_CACHE_ENABLED = get_config_bool_fallback(config,'system','RESULT_CACHE_ENABLED',
+                                                fallback=False)
 
-if GRASS_DATABASE_TEMPLATE is None or os.path.isdir(GRASS_DATABASE_TEMPLATE) == False:
-    raise ImportError('''Could not find GRASS database template.
- Try downloading from http://arsf-dan.nerc.ac.uk/trac/raw-attachment/wiki/Help/DEM_scripts/grass_db_template.zip
- and setting path in config file using "GRASS_DATABASE_TEMPLATE"'''.format(GRASS_DATABASE_TEMPLATE),file=sys.stderr)
+#: Directory to store cached rasters in
+RESULT_CACHE_PATH = get_config_fallback(config,'system','RESULT_CACHE_PATH',
+                                        fallback=os.path.join(TEMP_PATH,
+                                                              'arsf_dem_result_cache'))
+
+#: Maximum size (in MB) of result cache, least recently used results are removed when exceeded
+RESULT_CACHE_MAX_SIZE_MB = get_config_int_fallback(config,'system','RESULT_CACHE_MAX_SIZE_MB',
+                                                   fallback=10240)
+
+#: Identify input files for result cache by a hash of their contents rather than path, size and modification time
+RESULT_CACHE_HASH_CONTENT = get_config_bool_fallback(config,'system','RESULT_CACHE_HASH_CONTENT',
+                                                     fallback=False)
+
+#: Cache tiles of reference DEMs which have been subset, offset and null filled (off by default, see dem_tile_cache)
+DEM_TILE_CACHE_ENABLED = get_config_bool_fallback(config,'system','DEM_TILE_CACHE_ENABLED',
+                                                  fallback=False)
+
+#: Directory to store cached DEM tiles in
+DEM_TILE_CACHE_PATH = get_config_fallback(config,'system','DEM_TILE_CACHE_PATH',
+                                          fallback=os.path.join(TEMP_PATH,
+                                                                'arsf_dem_tile_cache'))
+
+#: Size of cached DEM tiles (in pixels)
+DEM_TILE_CACHE_TILE_SIZE = get_config_int_fallback(config,'system','DEM_TILE_CACHE_TILE_SIZE',
+                                                   fallback=1024)
+
+#: Buffer (in pixels) used when processing DEM tiles, so null filling uses neighbouring values
+DEM_TILE_CACHE_BUFFER = get_config_int_fallback(config,'system','DEM_TILE_CACHE_BUFFER',
+                                                fallback=64)
+
+#: Maximum size (in MB) of DEM tile cache, least recently used tiles are removed when exceeded
+DEM_TILE_CACHE_MAX_SIZE_MB = get_config_int_fallback(config,'system','DEM_TILE_CACHE_MAX_SIZE_MB',
+                                                     fallback=10240)
+
+#: Maximum memory (in MB) each process should use when warping a window
+WARP_WINDOW_MEMORY_MB = get_config_int_fallback(config,'system','WARP_WINDOW_MEMORY_MB',
+                                                fallback=256)
+
+#: Minimum number of output pixels before a warp is split into windows
+CHUNKED_WARP_MIN_PIXELS = get_config_int_fallback(config,'system','CHUNKED_WARP_MIN_PIXELS',
+                                                  fallback=25000000)
+
+#: Directories for scratch files in order of preference (fastest first), the first with enough free space is used
+SCRATCH_PATHS = [scratch_path.strip() for scratch_path in
+                 get_config_fallback(config,'system','SCRATCH_PATHS',
+                                     fallback=TEMP_PATH).split(',')
+                 if scratch_path.strip() != '']
+
+#: Maximum size (in MB) of scratch files for a job (0 for no limit)
+SCRATCH_QUOTA_MB = get_config_int_fallback(config,'system','SCRATCH_QUOTA_MB',
+                                           fallback=0)
+
+#: Free space (in MB) needed in a scratch directory to use it if the size of files isn't known
+SCRATCH_MIN_FREE_MB = get_config_int_fallback(config,'system','SCRATCH_MIN_FREE_MB',
+                                              fallback=1024)
+
+#: Where to store intermediate rasters: AUTO (memory backed file system if small enough), TMPFS or DISK (TEMP_PATH)
+INTERMEDIATE_STORAGE = get_config_fallback(config,'system','INTERMEDIATE_STORAGE',
+                                           fallback='AUTO')
+
+#: Memory backed file system (tmpfs) to store intermediate rasters in
+INTERMEDIATE_TMPFS_PATH = get_config_fallback(config,'system','INTERMEDIATE_TMPFS_PATH',
+                                              fallback='/dev/shm')
+
+#: Maximum size (in MB) of an intermediate raster stored in memory, larger rasters are written to TEMP_PATH
+INTERMEDIATE_MAX_MEMORY_MB = get_config_int_fallback(config,'system','INTERMEDIATE_MAX_MEMORY_MB',
+                                                     fallback=1024)
+
+# Paths for GRASS (GRASS_LIB_PATH, GRASS_PYTHON_LIB_PATH and
+# GRASS_DATABASE_TEMPLATE) are found when first used,
+# see 'LAZY_PATHS' at the end of this file.
+
+#: Reuse GRASS databases within a process rather than copying the template each time
+GRASS_DB_POOL = get_config_bool_fallback(config,'grass','GRASS_DB_POOL',fallback=False)
+
+#: Create GRASS databases in memory (/dev/shm), if available
+GRASS_DB_USE_TMPFS = get_config_bool_fallback(config,'grass','GRASS_DB_USE_TMPFS',fallback=False)
 
 # Set some common options for raster creation
 
 #: Default method for interpolation when resampling
 RESAMPLE_METHOD = get_config_fallback(config,'rastercreation','RESAMPLE_METHOD',fallback='near')
+#: Error threshold (in pixels) for approximating transformation when warping (0 uses the exact transformation so windowed output is the same as a single warp)
+WARP_ERROR_THRESHOLD = 0
 #: Default GDAL output format
 GDAL_OUTFILE_FORMAT = get_config_fallback(config,'rastercreation','GDAL_OUTFILE_FORMAT',fallback='ENVI')
 #: Default GDAL output data type
@@ -344,6 +455,14 @@ GDAL_OUTFILE_DATATYPE = get_config_fallback(config,'rastercreation','GDAL_OUTFIL
 GDAL_CREATION_OPTIONS = get_config_fallback(config,'rastercreation','GDAL_CREATION_OPTIONS',fallback='"INTERLEAVE=BIL"')
 #: Default nodata value
 NODATA_VALUE = get_config_int_fallback(config,'rastercreation','NODATA_VALUE',fallback=-9999)
+#: Output profile (DEFAULT, COG or COG_ZSTD), sets creation options for exported rasters
+GDAL_OUTPUT_PROFILE = get_config_fallback(config,'rastercreation','GDAL_OUTPUT_PROFILE',fallback='DEFAULT')
+#: Create screenshots using a reduced resolution read with NumPy rather than GRASS (requires GDAL)
+FAST_QUICKLOOKS = get_config_bool_fallback(config,'rastercreation','FAST_QUICKLOOKS',fallback=True)
+#: Maximum width / height (in pixels) of screenshots created using NumPy
+QUICKLOOK_MAX_SIZE = get_config_int_fallback(config,'rastercreation','QUICKLOOK_MAX_SIZE',fallback=2048)
+#: Build overviews on rasters when creating screenshots, so subsequent screenshots are faster
+QUICKLOOK_BUILD_OVERVIEWS = get_config_bool_fallback(config,'rastercreation','QUICKLOOK_BUILD_OVERVIEWS',fallback=True)
 
 # Set options for lidar
 #: Default lidar resolution (in metres)
@@ -365,6 +484,38 @@ DEFAULT_LIDAR_DEM_BUFFER = {'N' : DEFAULT_LIDAR_DEM_BUFFER_DISTANCE,
                             'S' : DEFAULT_LIDAR_DEM_BUFFER_DISTANCE,
                             'W' : DEFAULT_LIDAR_DEM_BUFFER_DISTANCE}
 
+#: Run independent stages of create_patched_lidar_mosaic at the same time, each in its own GRASS workspace
+LIDAR_CONCURRENT_STAGES = get_config_bool_fallback(config,'lidar','LIDAR_CONCURRENT_STAGES',fallback=False)
+
+#: Cache points from each lidar file in a binary format which can be memory mapped (used by NumPy method).
+#: Disabled by default, if disabled points are only stored in the scratch directory for a job.
+POINT_CACHE_ENABLED = get_config_bool_fallback(config,'lidar','POINT_CACHE_ENABLED',fallback=False)
+
+#: Directory to store cached points in
+POINT_CACHE_PATH = get_config_fallback(config,'lidar','POINT_CACHE_PATH',
+                                       fallback=os.path.join(TEMP_PATH,
+                                                             'arsf_dem_point_cache'))
+
+#: Maximum size (in MB) of point cache, least recently used files are removed when exceeded
+POINT_CACHE_MAX_SIZE_MB = get_config_int_fallback(config,'lidar','POINT_CACHE_MAX_SIZE_MB',
+                                                  fallback=20480)
+
+#: Sort cached points spatially (Morton order) so points within an area are stored together
+POINT_CACHE_SPATIAL_SORT = get_config_bool_fallback(config,'lidar','POINT_CACHE_SPATIAL_SORT',fallback=True)
+
+#: Maximum memory (in MB) used for grids when creating rasters using NumPy, larger rasters are created in blocks of rows
+NUMPY_GRID_MAX_MEMORY_MB = get_config_int_fallback(config,'lidar','NUMPY_GRID_MAX_MEMORY_MB',
+                                                   fallback=2048)
+
+#: Resolution of quicklook rasters created from lidar data
+LIDAR_QUICKLOOK_RES_METRES = float(get_config_fallback(config,'lidar','LIDAR_QUICKLOOK_RES_METRES',fallback=10))
+
+#: Method used to subsample points for quicklooks (NTH, RANDOM or COPC)
+LIDAR_QUICKLOOK_SUBSAMPLE = get_config_fallback(config,'lidar','LIDAR_QUICKLOOK_SUBSAMPLE',fallback='NTH')
+
+#: Keep 1 in every LIDAR_QUICKLOOK_SUBSAMPLE_FACTOR points for quicklooks
+LIDAR_QUICKLOOK_SUBSAMPLE_FACTOR = get_config_int_fallback(config,'lidar','LIDAR_QUICKLOOK_SUBSAMPLE_FACTOR',fallback=10)
+
 #: Order of columns in ASCII format lidar data
 LIDAR_ASCII_ORDER = {'time':1,
                      'x':2,'y':3,'z':4,
@@ -478,33 +629,108 @@ DEFAULT_SENSOR_VIEW_VECTORS = get_config_fallback(config, 'hyperspectral','DEFAU
 #: Maximum view vector (in degrees) for hyperspectral data. Value from Eagle (2013).
 HYPERSPECTRAL_VIEW_ANGLE_MAX = float(get_config_fallback(config, 'hyperspectral', 'HYPERSPECTRAL_VIEW_ANGLE_MAX',fallback=18.76))
 
-# Set paths for other libraries
-#: Path to SPDLib binaries
-SPDLIB_BIN_PATH = get_config_fallback(config,'spdlib','SPDLIB_BIN_PATH',fallback=get_spdlib_path())
-
-if SPDLIB_BIN_PATH != '' and os.path.isdir(SPDLIB_BIN_PATH) == False:
-    SPDLIB_BIN_PATH = get_spdlib_path()
+# Paths for other libraries (SPDLIB_BIN_PATH, LASTOOLS_FREE_BIN_PATH,
+# LASTOOLS_NONFREE_BIN_PATH and FUSION_BIN_PATH) are found when first
+# used, see 'LAZY_PATHS' at the end of this file.
 
 #: Default interpolation used by SPDLib
 SPD_DEFAULT_INTERPOLATION = get_config_fallback(config,'spdlib','SPD_DEFAULT_INTERPOLATION',
                      fallback='NATURAL_NEIGHBOR')
 
-#: Path to open source LAStools binaries
-LASTOOLS_FREE_BIN_PATH = get_config_fallback(config,'lastools','LASTOOLS_FREE_BIN_PATH',fallback=get_lastools_path())
-#: Path to commercial LAStools binaries
-LASTOOLS_NONFREE_BIN_PATH = get_config_fallback(config,'lastools','LASTOOLS_NONFREE_BIN_PATH',fallback=get_lastools_path())
-
-if LASTOOLS_FREE_BIN_PATH != '' and os.path.isdir(LASTOOLS_FREE_BIN_PATH) == False:
-    LASTOOLS_FREE_BIN_PATH = get_lastools_path()
-
-if LASTOOLS_NONFREE_BIN_PATH != '' and os.path.isdir(LASTOOLS_NONFREE_BIN_PATH) == False:
-    LASTOOLS_NONFREE_BIN_PATH = get_lastools_path()
+#: Path to points2dem
+POINTS2GRID_BIN_PATH = get_config_fallback(config,'points2grid','POINTS2GRID_BIN_PATH',fallback='')
 
-#: Path to FUSION
-FUSION_BIN_PATH = get_config_fallback(config,'fusion','FUSION_BIN_PATH',fallback=get_fusion_bin_path())
+# Paths for GRASS and other libraries are found when first used rather than
+# when this module is imported, as searching for them is slow and many
+# scripts (and worker processes) don't need them. Each value is found once
+# using the function below and then stored as a normal module variable.
+
+def _find_grass_lib_path():
+    """Find path for GRASS library and set GISBASE"""
+    grass_lib_path = get_config_fallback(config,'grass','GRASS_LIB_PATH',fallback=None)
+    if grass_lib_path is None:
+        grass_lib_path = get_grass_lib_path()
+    # Set environmental variable for GRASS lib
+    os.environ['GISBASE'] = grass_lib_path
+    return grass_lib_path
+
+def _find_grass_python_lib_path():
+    """Find path for GRASS Python library"""
+    grass_python_lib_path = get_config_fallback(config,'grass','GRASS_PYTHON_LIB_PATH',
+                                                fallback=None)
+    if grass_python_lib_path is None:
+        grass_python_lib_path = get_grass_python_lib_path(GRASS_LIB_PATH=get_lazy_path('GRASS_LIB_PATH'))
+    return grass_python_lib_path
+
+def _find_grass_database_template():
+    """Find path for GRASS database template"""
+    grass_database_template = get_config_fallback(config,'grass','GRASS_DATABASE_TEMPLATE',
+                                                  fallback=None)
+
+    if grass_database_template is None or os.path.isdir(grass_database_template) == False:
+        grass_database_template = get_grass_db_template_path()
+
+    if grass_database_template is None or os.path.isdir(grass_database_template) == False:
+        raise ImportError('''Could not find GRASS database template.
+ Try downloading from http://arsf-dan.nerc.ac.uk/trac/raw-attachment/wiki/Help/DEM_scripts/grass_db_template.zip
+ and setting path in config file using "GRASS_DATABASE_TEMPLATE"''')
+    return grass_database_template
 
-if FUSION_BIN_PATH != '' and os.path.isdir(FUSION_BIN_PATH) == False:
-    FUSION_BIN_PATH = get_fusion_bin_path()
+def _find_bin_path(section, option, default_path_function):
+    """
+    Get path for binaries from config file, using 'default_path_function'
+    if not set or the path doesn't exist.
+    """
+    bin_path = get_config_fallback(config, section, option, fallback=None)
+    if bin_path is None or (bin_path != '' and os.path.isdir(bin_path) == False):
+        bin_path = default_path_function()
+    return bin_path
+
+#: Paths found when first used and the functions used to find them:
+#:
+#: * GRASS_LIB_PATH - Path for GRASS Library
+#: * GRASS_PYTHON_LIB_PATH - Path for GRASS Python library
+#: * GRASS_DATABASE_TEMPLATE - Path for GRASS database template
+#: * SPDLIB_BIN_PATH - Path to SPDLib binaries
+#: * LASTOOLS_FREE_BIN_PATH - Path to open source LAStools binaries
+#: * LASTOOLS_NONFREE_BIN_PATH - Path to commercial LAStools binaries
+#: * FUSION_BIN_PATH - Path to FUSION
+LAZY_PATHS = {'GRASS_LIB_PATH' : _find_grass_lib_path,
+              'GRASS_PYTHON_LIB_PATH' : _find_grass_python_lib_path,
+              'GRASS_DATABASE_TEMPLATE' : _find_grass_database_template,
+              'SPDLIB_BIN_PATH' : lambda: _find_bin_path('spdlib', 'SPDLIB_BIN_PATH',
+                                                         get_spdlib_path),
+              'LASTOOLS_FREE_BIN_PATH' : lambda: _find_bin_path('lastools', 'LASTOOLS_FREE_BIN_PATH',
+                                                                get_lastools_path),
+              'LASTOOLS_NONFREE_BIN_PATH' : lambda: _find_bin_path('lastools', 'LASTOOLS_NONFREE_BIN_PATH',
+                                                                   get_lastools_path),
+              'FUSION_BIN_PATH' : lambda: _find_bin_path('fusion', 'FUSION_BIN_PATH',
+                                                         get_fusion_bin_path)}
+
+def get_lazy_path(name):
+    """
+    Get a path from LAZY_PATHS, finding it if this is the first time
+    it has been used.
+    """
+    module_vars = globals()
+    if name not in module_vars:
+        module_vars[name] = LAZY_PATHS[name]()
+    return module_vars[name]
 
-#: Path to points2dem
-POINTS2GRID_BIN_PATH = get_config_fallback(config,'points2grid','POINTS2GRID_BIN_PATH',fallback='')
+def __getattr__(name):
+    """
+    Find paths in LAZY_PATHS the first time they are used
+    (called for module attributes which don't exist, Python 3.7+).
+    """
+    if name in LAZY_PATHS:
+        return get_lazy_path(name)
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
+
+# Module level __getattr__ is only supported by Python 3.7 and later,
+# for earlier versions find all paths now.
+if sys.version_info < (3, 7):
+    for _lazy_path in ['GRASS_LIB_PATH', 'GRASS_PYTHON_LIB_PATH',
+                       'GRASS_DATABASE_TEMPLATE', 'SPDLIB_BIN_PATH',
+                       'LASTOOLS_FREE_BIN_PATH', 'LASTOOLS_NONFREE_BIN_PATH',
+                       'FUSION_BIN_PATH']:
+        get_lazy_path(_lazy_path)
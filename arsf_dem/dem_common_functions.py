@@ -14,9 +14,19 @@ Functions have been modified so they also work under Windows.
 from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
 import os
 import sys
-import select
+import time
 import inspect
+import threading
 import subprocess
+import collections
+
+from . import dem_trace
+
+#: Number of lines of output from a subprocess to keep
+SUBPROCESS_BUFFER_LINES = 1000
+
+#: Maximum number of lines per second printed from a subprocess (None for no limit)
+SUBPROCESS_MAX_LINES_PER_SECOND = 100
 
 def WARNING(strOutput):
     """Function that emphasises text in the terminal"""
@@ -44,11 +54,139 @@ def ERROR(strOutput,tostdouttoo=False):
         # If on windows don't bother trying to change colours, it won't work
         print("Error in "+callerid+": "+str(strOutput), file=sys.stderr)
 
+def _read_subprocess_stream(stream, out_lines, line_callback=None, raw_out=None):
+    """
+    Read all lines from a subprocess stream (until it is closed) into
+    'out_lines' (a deque). Run in a separate thread for stdout and stderr
+    so neither pipe can fill up and block the child. If 'raw_out' is
+    a list the lines as read (not decoded or stripped) are also added to it.
+    """
+    for line in iter(stream.readline, b''):
+        if raw_out is not None:
+            raw_out.append(line)
+        if not isinstance(line, str):
+            line = line.decode('utf-8', 'replace')
+        line = line.rstrip()
+        out_lines.append(line)
+        if line_callback is not None:
+            line_callback(line)
+    stream.close()
+
+def run_subprocess(command, print_output=True, logger=None,
+                   buffer_lines=SUBPROCESS_BUFFER_LINES,
+                   max_lines_per_second=None,
+                   keep_raw=False):
+    """
+    Run a command, reading stdout and stderr at the same time using
+    threads so the child process never blocks on a full pipe.
+
+    Output is stored in ring buffers so only the last 'buffer_lines'
+    lines are kept. If 'print_output' is True lines are printed (or
+    passed to 'logger.info') as they are read. If 'max_lines_per_second'
+    is set lines above this rate are not printed (but are still stored).
+
+    Arguments:
+
+    * command - command to run (list).
+    * print_output - print output from command.
+    * logger - logger to use rather than print.
+    * buffer_lines - number of lines of output to keep for stdout and stderr (None for all).
+    * max_lines_per_second - maximum number of lines to print per second.
+    * keep_raw - also return all output as read from the command.
+
+    Returns:
+
+    * dictionary with keys 'returncode', 'stdout', 'stderr' (lists of lines)
+      and 'wall_time' (seconds). If 'keep_raw' is True also 'stdout_raw'
+      and 'stderr_raw' (bytes).
+
+    CPU time and other resources used by the command aren't recorded, the
+    only measure available once the child has been reaped is for all child
+    processes (resource.RUSAGE_CHILDREN), which includes other commands
+    running at the same time.
+
+    """
+    print_lock = threading.Lock()
+    print_state = {'second' : None, 'count' : 0, 'skipped' : 0}
+
+    def _print_line(line):
+        with print_lock:
+            if max_lines_per_second is not None:
+                current_second = int(time.time())
+                if current_second != print_state['second']:
+                    if print_state['skipped'] > 0:
+                        _output_line('[{} lines not shown]'.format(print_state['skipped']))
+                    print_state['second'] = current_second
+                    print_state['count'] = 0
+                    print_state['skipped'] = 0
+                if print_state['count'] >= max_lines_per_second:
+                    print_state['skipped'] += 1
+                    return
+                print_state['count'] += 1
+            _output_line(line)
+
+    def _output_line(line):
+        if logger is None:
+            print(line)
+        else:
+            logger.info(line)
+
+    line_callback = None
+    if print_output:
+        line_callback = _print_line
+
+    stdout_lines = collections.deque(maxlen=buffer_lines)
+    stderr_lines = collections.deque(maxlen=buffer_lines)
+
+    command_span = dem_trace.span(os.path.basename(str(command[0])),
+                                  category='command')
+    with command_span:
+        stdout_raw = [] if keep_raw else None
+        stderr_raw = [] if keep_raw else None
+        start_time = time.time()
+        process = subprocess.Popen(command, stderr=subprocess.PIPE,
+                                   stdout=subprocess.PIPE)
+
+        readers = [threading.Thread(target=_read_subprocess_stream,
+                                    args=(process.stdout, stdout_lines,
+                                          line_callback, stdout_raw)),
+                   threading.Thread(target=_read_subprocess_stream,
+                                    args=(process.stderr, stderr_lines,
+                                          line_callback, stderr_raw))]
+        for reader in readers:
+            reader.daemon = True
+            reader.start()
+
+        process.wait()
+
+        for reader in readers:
+            reader.join()
+
+        wall_time = time.time() - start_time
+        command_span.record(command=' '.join(str(x) for x in command),
+                            returncode=process.returncode)
+
+    if print_output and max_lines_per_second is not None and \
+            print_state['skipped'] > 0:
+        _output_line('[{} lines not shown]'.format(print_state['skipped']))
+
+    result = {'returncode' : process.returncode,
+              'stdout' : list(stdout_lines),
+              'stderr' : list(stderr_lines),
+              'wall_time' : wall_time}
+    if keep_raw:
+        result['stdout_raw'] = b''.join(stdout_raw)
+        result['stderr_raw'] = b''.join(stderr_raw)
+    return result
+
 def CallSubprocessOn(command=None,redirect=False,quiet=False,logger=None):
     """
     CallSubprocessOn - run a command via subprocess and output stdout and stderr
     if redirect == True the returns the stdout/stderr rather than printing
     if quiet == True will not print out command it is running
+
+    Raises an Exception (containing stderr) if the command writes to stderr
+    and output isn't being redirected.
     """
     if command is None:
         raise TypeError("Command to be run must be specified")
@@ -63,45 +201,33 @@ def CallSubprocessOn(command=None,redirect=False,quiet=False,logger=None):
     if not quiet:
         print("\nAttempting to run command: "+" ".join(str(x) for x in command_to_run))
 
-    redirecttext=[]
-    try:
-        process=subprocess.Popen(command_to_run,stderr=subprocess.PIPE,stdout=subprocess.PIPE)
-        # If on Windows don't try to run this, as it doesn't work
-        if sys.platform != 'win32':
-            while process.poll() is None:
-                if redirect==False and not quiet:
-                    lines, _, _ =select.select([process.stdout,process.stderr],[],[],0.1)
-                    if lines:#if there is data read a line of it
-                        someline=lines[0].readline()
-                        if someline:
-                            if logger is None:
-                                print(someline.rstrip())
-                            else:
-                                logger.info(someline.rstrip())
-
-        #Get anything left over in buffer
-        stdout,stderr=process.communicate()
-        if redirect==True:
-            redirecttext=[stdout,stderr]
-
-        #only output if not redirecting and not quiet
-        elif stdout and redirect==False and not quiet:
-            print(stdout)
-
-        #still output error if quiet but not if redirecting
-        #elif stderr and redirect==False: ERROR(stderr)
-        elif stderr and redirect==False:
-            if logger is not None:
-                logger.error(stderr)
-            raise StandardError(stderr)
-
-    except StandardError as e:
-        raise
-
-    if redirecttext:
-        return True,redirecttext
+    # If redirecting keep all output so it can be returned.
+    if redirect:
+        buffer_lines = None
     else:
-        return True
+        buffer_lines = SUBPROCESS_BUFFER_LINES
+
+    result = run_subprocess(command_to_run,
+                            print_output=(not redirect and not quiet),
+                            logger=logger,
+                            buffer_lines=buffer_lines,
+                            max_lines_per_second=SUBPROCESS_MAX_LINES_PER_SECOND,
+                            keep_raw=redirect)
+
+    if not quiet:
+        print('Command took {:.1f} s'.format(result['wall_time']))
+
+    if redirect:
+        return True,[result['stdout_raw'], result['stderr_raw']]
+
+    # Output on stderr is treated as an error
+    if len(result['stderr']) > 0:
+        stderr = '\n'.join(result['stderr'])
+        if logger is not None:
+            logger.error(stderr)
+        raise Exception(stderr)
+
+    return True
 
 def FileListInDirectory(path):
     """Function to return a list of files in the given directory"""
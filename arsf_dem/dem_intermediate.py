@@ -0,0 +1,147 @@
+#! /usr/bin/env python
+#
+# This file has been created by ARSF Data Analysis Node and
+# is licensed under the GPL v3 Licence. A copy of this
+# licence is available to download with this file.
+
+"""
+Storage for intermediate rasters which are written by one stage only to
+be read by the next (e.g., a DEM subset before null filling).
+
+Intermediate rasters are read and written by external commands (gdalwarp,
+GRASS) so need to be files, rather than in a GDAL '/vsimem/' file system
+which is only visible within a process. Rasters estimated to be smaller
+than INTERMEDIATE_MAX_MEMORY_MB are stored on a memory backed file system
+(INTERMEDIATE_TMPFS_PATH, /dev/shm by default) if there is enough space,
+larger rasters (or those of unknown size) are written to the scratch
+directory for the job (see dem_scratch).
+
+The storage used is set by INTERMEDIATE_STORAGE:
+
+* AUTO - memory if the raster is small enough, otherwise scratch directory.
+* TMPFS - memory whenever there is enough space.
+* DISK - always use scratch directory.
+
+Available functions:
+
+* get_intermediate_dir - get directory to store an intermediate raster in.
+* mkstemp - create a temporary file for an intermediate raster.
+* mkdtemp - create a temporary directory for intermediate rasters.
+* estimate_raster_size_mb - estimate size of a raster (uncompressed).
+
+Example::
+
+   from arsf_dem import dem_intermediate
+
+   tmp_fh, tmp_dem = dem_intermediate.mkstemp(prefix='dem_subset',
+                                              suffix='.dem',
+                                              size_mb=200)
+
+"""
+
+from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
+import os
+import tempfile
+
+from . import dem_scratch
+
+# Try to import GDAL
+HAVE_GDAL=True
+try:
+    from osgeo import gdal
+except ImportError:
+    # If can't import don't complain until GDAL is actually needed
+    HAVE_GDAL=False
+
+def get_intermediate_dir(size_mb=None):
+    """
+    Get directory to store an intermediate raster in. This is within the
+    scratch directory for the job (see dem_scratch) so is removed when the
+    job finishes.
+
+    Arguments:
+
+    * size_mb - estimated size of raster in MB (None if not known).
+
+    Returns:
+
+    * directory (within INTERMEDIATE_TMPFS_PATH or a scratch location)
+
+    """
+    return dem_scratch.get_scratch_manager().get_dir(size_mb, allow_memory=True)
+
+def mkstemp(prefix='tmp', suffix='', size_mb=None):
+    """
+    Create a temporary file for an intermediate raster. Same as
+    tempfile.mkstemp but the directory is chosen using
+    get_intermediate_dir.
+
+    Arguments:
+
+    * prefix - prefix for file name.
+    * suffix - suffix for file name (e.g., '.dem').
+    * size_mb - estimated size of raster in MB (None if not known).
+
+    Returns:
+
+    * file handler, path to file
+
+    """
+    return tempfile.mkstemp(prefix=prefix, suffix=suffix,
+                            dir=get_intermediate_dir(size_mb))
+
+def mkdtemp(prefix='tmp', size_mb=None):
+    """
+    Create a temporary directory for intermediate rasters. Same as
+    tempfile.mkdtemp but the directory is created within the directory
+    given by get_intermediate_dir.
+
+    Arguments:
+
+    * prefix - prefix for directory name.
+    * size_mb - estimated size of all rasters in directory in MB (None if not known).
+
+    Returns:
+
+    * path to directory
+
+    """
+    return tempfile.mkdtemp(prefix=prefix, dir=get_intermediate_dir(size_mb))
+
+def estimate_raster_size_mb(in_file, data_type=None, fraction=1.0):
+    """
+    Estimate the size of a raster (or part of a raster) when stored
+    uncompressed (e.g., ENVI format).
+
+    If GDAL is available uses the dimensions of the raster, otherwise
+    uses the size of the file.
+
+    Arguments:
+
+    * in_file - input raster.
+    * data_type - GDAL data type name of output (e.g., Float32), default is the type of the input.
+    * fraction - fraction of the raster which will be stored (e.g., for a subset).
+
+    Returns:
+
+    * size in MB (float) or None if it can't be estimated
+
+    """
+    size_bytes = None
+    if HAVE_GDAL:
+        in_ds = gdal.Open(in_file, gdal.GA_ReadOnly)
+        if in_ds is not None:
+            if data_type is None:
+                gdal_type = in_ds.GetRasterBand(1).DataType
+            else:
+                gdal_type = gdal.GetDataTypeByName(data_type)
+            size_bytes = (in_ds.RasterXSize * in_ds.RasterYSize * in_ds.RasterCount
+                          * (gdal.GetDataTypeSize(gdal_type) // 8))
+            in_ds = None
+    if size_bytes is None:
+        try:
+            size_bytes = os.path.getsize(in_file)
+        except OSError:
+            return None
+
+    return (size_bytes * fraction) / (1024.0 * 1024.0)
@@ -40,28 +40,66 @@ For example::
       # Run function to create DTM
       dem_lidar.las_to_dtm(in_las,out_dtm, method='GRASS')
 
+The modules for each method (grass_lidar, spdlib_lidar, lastools_lidar,
+fusion_lidar, points2grid_lidar and numpy_lidar) are only imported when first used
+(see lidar_backends), so dem_lidar can be imported if only some of the
+packages they require are installed.
+
 """
+import sys
 import tempfile
 import os
+from . import lidar_backends
 from . import lidar_utilities
-from . import grass_lidar
 from . import ascii_lidar
-from . import lastools_lidar
-from . import spdlib_lidar
-from . import fusion_lidar
-from . import points2grid_lidar
 from . import laspy_lidar
 from .. import dem_common
 from .. import dem_utilities
 from .. import dem_common_functions
+from .. import dem_result_cache
+from .. import dem_scratch
 from .. import grass_library
+from .. import dem_trace
 
 #: Methods which can create a DEM from LAS files
-LAS_TO_DEM_METHODS = ['GRASS','SPDLib','LAStools','FUSION','points2grid']
+LAS_TO_DEM_METHODS = lidar_backends.get_backend_names('DSM')
 #: Methods which can create an intensity image from LAS files
-LAS_TO_INTENSITY_METHODS = ['GRASS', 'LAStools']
+LAS_TO_INTENSITY_METHODS = lidar_backends.get_backend_names('INTENSITY')
 #: Methods which can't filter out noisy points in LAS files and require these to be removed first
-METHODS_REQUIRE_LAS_NOISE_REMOVAL = ['SPDLib']
+METHODS_REQUIRE_LAS_NOISE_REMOVAL = [name for name in LAS_TO_DEM_METHODS
+                                     if lidar_backends.get_backend(name).requires_las_noise_removal]
+#: Class of noise points, dropped when merging LAS files
+LAS_NOISE_CLASS = 7
+#: Distance used to remove spikes from LAStools DSMs, as a multiple of resolution.
+#: Advice is ~ 3 x average pulse spacing so approximate as 2 x resolution
+LASTOOLS_SPIKE_FREE_RES_FACTOR = 2
+#: Interpolation method used by points2grid
+POINTS2GRID_GRID_METHOD = 'idw'
+#: Window size used by points2grid to fill nulls
+POINTS2GRID_FILL_WINDOW_SIZE = 7
+
+#: Modules for methods, imported when first used
+BACKEND_MODULES = {'grass_lidar' : 'GRASS',
+                   'spdlib_lidar' : 'SPDLib',
+                   'lastools_lidar' : 'LAStools',
+                   'fusion_lidar' : 'FUSION',
+                   'points2grid_lidar' : 'points2grid',
+                   'numpy_lidar' : 'NumPy'}
+
+def __getattr__(name):
+    """
+    Import modules for methods (e.g., dem_lidar.grass_lidar) the first
+    time they are used (Python 3.7+).
+    """
+    if name in BACKEND_MODULES:
+        return lidar_backends.load_backend(BACKEND_MODULES[name])
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
+
+# Module level __getattr__ is only supported by Python 3.7 and later,
+# for earlier versions import all modules now.
+if sys.version_info < (3, 7):
+    for _backend_name in BACKEND_MODULES.values():
+        lidar_backends.load_backend(_backend_name)
 
 def _las_to_dem(in_las,out_raster,
                resolution=dem_common.DEFAULT_LIDAR_RES_METRES,
@@ -86,7 +124,7 @@ def _las_to_dem(in_las,out_raster,
     * out_raster - Output raster
     * resolution - Resolution to use for output raster.
     * projection - Projection of input LAS files (and output DEM) as GRASS location format (e.g., UTM30N).
-    * method - GRASS, SPDLib, LAStools, FUSION or points2grid
+    * method - GRASS, SPDLib, LAStools, FUSION, points2grid or NumPy
 
     Returns:
 
@@ -98,10 +136,58 @@ def _las_to_dem(in_las,out_raster,
     dem_common_functions.CheckPathExistsAndIsWritable(os.path.split(
                                            os.path.abspath(out_raster))[0])
 
-    tmp_las_handler, tmp_las_file = tempfile.mkstemp(suffix='.las')
-
-    # If a list is passed in merge to a single LAS file
-    if isinstance(in_las, list):
+    # Check method is available (only checked once per process) and
+    # import module for it.
+    backend = lidar_backends.get_backend(method)
+    if not backend.is_available():
+        raise Exception('Method "{}" is not available, check it has been '
+                        'installed. Available methods are: {}'.format(method,
+                            ', '.join(lidar_backends.get_available_backends(demtype))))
+    if demtype.upper() not in backend.raster_types:
+        raise Exception('DEM Type "{}" is not supported by {} - options are '
+                        '{}'.format(demtype, backend.name,
+                                    ', '.join(backend.raster_types)))
+    backend_module = backend.load()
+
+    # Use cached raster if one has been created previously from the same
+    # files with the same parameters.
+    cache_key = None
+    if dem_result_cache.is_enabled():
+        in_las_list = in_las if isinstance(in_las, list) else [in_las]
+        try:
+            cache_key = dem_result_cache.get_cache_key(in_las_list,
+                                    function='las_to_dem',
+                                    resolution=resolution,
+                                    projection=projection,
+                                    demtype=demtype.upper(),
+                                    method=backend.name,
+                                    out_raster_ext=os.path.splitext(out_raster)[-1].lower(),
+                                    out_raster_format=dem_common.GDAL_OUTFILE_FORMAT,
+                                    out_raster_type=dem_common.GDAL_OUTFILE_DATATYPE,
+                                    output_profile=dem_utilities.get_output_profile(),
+                                    nodata=dem_common.NODATA_VALUE,
+                                    spd_interpolation=dem_common.SPD_DEFAULT_INTERPOLATION,
+                                    drop_class=LAS_NOISE_CLASS,
+                                    lastools_spike_free_res_factor=LASTOOLS_SPIKE_FREE_RES_FACTOR,
+                                    points2grid_grid_method=POINTS2GRID_GRID_METHOD,
+                                    points2grid_fill_window_size=POINTS2GRID_FILL_WINDOW_SIZE)
+        except OSError:
+            # Input files don't exist, will raise exception below
+            cache_key = None
+        if cache_key is not None and dem_result_cache.fetch(cache_key, out_raster):
+            return
+
+    tmp_las_handler, tmp_las_file = tempfile.mkstemp(suffix='.las', dir=dem_scratch.get_dir())
+
+    # If a list is passed in merge to a single LAS file. The NumPy method
+    # reads points for each file from the point cache so doesn't need them
+    # to be merged.
+    if isinstance(in_las, list) and method.upper() == 'NUMPY':
+        for in_las_file in in_las:
+            if not os.path.isfile(in_las_file):
+                raise Exception('The file "{}" does not exist'.format(in_las_file))
+        in_las_merged = in_las
+    elif isinstance(in_las, list):
         # Check if there is only one item in the list (will get this from
         # argparse).
         if len(in_las) == 1:
@@ -112,13 +198,15 @@ def _las_to_dem(in_las,out_raster,
                 # use merge_las function.
                 print('Creating LAS file with noise points removed.'
                       ' Required for {}'.format(method))
-                lastools_lidar.merge_las(in_las, tmp_las_file, drop_class=7)
+                lidar_backends.load_backend('LAStools').merge_las(in_las, tmp_las_file,
+                                                                  drop_class=LAS_NOISE_CLASS)
                 in_las_merged = tmp_las_file
             else:
                 in_las_merged = in_las[0]
         else:
             print('Multiple LAS files have been passed in - merging')
-            lastools_lidar.merge_las(in_las, tmp_las_file, drop_class=7)
+            lidar_backends.load_backend('LAStools').merge_las(in_las, tmp_las_file,
+                                                              drop_class=LAS_NOISE_CLASS)
             in_las_merged = tmp_las_file
     else:
         in_las_merged = in_las
@@ -133,15 +221,15 @@ def _las_to_dem(in_las,out_raster,
             grass_location = dem_common.DEFAULT_LIDAR_PROJECTION_GRASS
 
         if demtype.upper() == 'DSM':
-            grass_lidar.las_to_dsm(in_las_merged, out_raster,
+            backend_module.las_to_dsm(in_las_merged, out_raster,
                                    bin_size=resolution,
                                    projection=grass_location)
         elif demtype.upper() == 'DTM':
-            grass_lidar.las_to_dtm(in_las_merged, out_raster,
+            backend_module.las_to_dtm(in_las_merged, out_raster,
                                    bin_size=resolution,
                                    projection=grass_location)
         elif demtype.upper() == 'INTENSITY':
-            grass_lidar.las_to_intensity(in_las_merged, out_raster,
+            backend_module.las_to_intensity(in_las_merged, out_raster,
                                          bin_size=resolution,
                                          projection=grass_location)
         else:
@@ -150,18 +238,18 @@ def _las_to_dem(in_las,out_raster,
     elif method.upper() == 'SPDLIB':
         # Create WKT file with projection
         if projection is not None:
-            wktfile_handler, wkt_tmp = tempfile.mkstemp(suffix='.wkt', dir=dem_common.TEMP_PATH)
+            wktfile_handler, wkt_tmp = tempfile.mkstemp(suffix='.wkt', dir=dem_scratch.get_dir())
             grass_library.grass_location_to_wkt(projection, wkt_tmp)
         else:
             wkt_tmp = None
 
         if demtype.upper() == 'DSM':
-            spdlib_lidar.las_to_dsm(in_las_merged, out_raster,
+            backend_module.las_to_dsm(in_las_merged, out_raster,
                                  bin_size=resolution,
                                  wkt=wkt_tmp,
                                  out_raster_format=out_raster_format)
         elif demtype.upper() == 'DTM':
-            spdlib_lidar.las_to_dtm(in_las_merged, out_raster,
+            backend_module.las_to_dtm(in_las_merged, out_raster,
                                  bin_size=resolution,
                                  wkt=wkt_tmp,
                                  out_raster_format=out_raster_format)
@@ -180,52 +268,51 @@ def _las_to_dem(in_las,out_raster,
         # Get projection
         try:
             if projection is not None:
-                lastools_proj = lastools_lidar.grass_proj_to_lastools_flag(projection)
+                lastools_proj = backend_module.grass_proj_to_lastools_flag(projection)
                 lastools_flags.extend([lastools_proj])
         except Exception as err:
             dem_common_functions.WARNING('Could not convert projection to LAStools flags. {}. Will try to get projection from LAS file'.format(err))
 
         if demtype.upper() == 'DSM':
-            # Set spike-free flag, advice is ~ 3 x average pulse spacing
-            # so approximate as 2 x resolution
-            lastools_flags.extend(['-spike_free {}'.format(2*float(resolution))])
-            lastools_lidar.las_to_dsm(in_las_merged, out_raster, flags=lastools_flags)
+            # Set spike-free flag
+            lastools_flags.extend(['-spike_free {}'.format(LASTOOLS_SPIKE_FREE_RES_FACTOR*float(resolution))])
+            backend_module.las_to_dsm(in_las_merged, out_raster, flags=lastools_flags)
         elif demtype.upper() == 'DTM':
-            lastools_lidar.las_to_dtm(in_las_merged, out_raster, flags=lastools_flags)
+            backend_module.las_to_dtm(in_las_merged, out_raster, flags=lastools_flags)
         elif demtype.upper() == 'INTENSITY':
-            lastools_lidar.las_to_intensity(in_las_merged, out_raster, flags=lastools_flags)
+            backend_module.las_to_intensity(in_las_merged, out_raster, flags=lastools_flags)
         else:
             raise Exception('DEM Type not recognised - options are DSM, DTM or Intensity')
 
     elif method.upper() == 'FUSION':
         if demtype.upper() == 'DSM':
-            fusion_lidar.las_to_dsm(in_las_merged, out_raster, resolution=resolution)
+            backend_module.las_to_dsm(in_las_merged, out_raster, resolution=resolution)
         elif demtype.upper() == 'DTM':
-            fusion_lidar.las_to_dtm(in_las_merged, out_raster, resolution=resolution)
+            backend_module.las_to_dtm(in_las_merged, out_raster, resolution=resolution)
         else:
             raise Exception('DEM Type not recognised - options are DSM or DTM')
 
     elif method.upper() == 'POINTS2GRID':
         # Create WKT file with projection
         if projection is not None:
-            wktfile_handler, wkt_tmp = tempfile.mkstemp(suffix='.wkt', dir=dem_common.TEMP_PATH)
+            wktfile_handler, wkt_tmp = tempfile.mkstemp(suffix='.wkt', dir=dem_scratch.get_dir())
             grass_library.grass_location_to_wkt(projection, wkt_tmp)
         else:
             wkt_tmp = None
 
         # Create surface. Use IDW interpolation
         if demtype.upper() == 'DSM':
-            points2grid_lidar.las_to_dsm(in_las_merged, out_raster,
+            backend_module.las_to_dsm(in_las_merged, out_raster,
                                  resolution=resolution,
                                  projection=wkt_tmp,
-                                 grid_method='idw',
-                                 fill_window_size=7)
+                                 grid_method=POINTS2GRID_GRID_METHOD,
+                                 fill_window_size=POINTS2GRID_FILL_WINDOW_SIZE)
         elif demtype.upper() == 'DTM':
-            points2grid_lidar.las_to_dtm(in_las_merged, out_raster,
+            backend_module.las_to_dtm(in_las_merged, out_raster,
                                  resolution=resolution,
                                  projection=wkt_tmp,
-                                 grid_method='idw',
-                                 fill_window_size=7)
+                                 grid_method=POINTS2GRID_GRID_METHOD,
+                                 fill_window_size=POINTS2GRID_FILL_WINDOW_SIZE)
         else:
             raise Exception('DEM Type not recognised - options are DSM or DTM')
 
@@ -233,6 +320,26 @@ def _las_to_dem(in_las,out_raster,
             # Close and remove temp WKT file created
             os.close(wktfile_handler)
             os.remove(wkt_tmp)
+    elif method.upper() == 'NUMPY':
+        if projection is not None:
+            wkt_projection = grass_library.grass_location_to_wkt(projection)
+        else:
+            wkt_projection = None
+
+        if demtype.upper() == 'DSM':
+            backend_module.las_to_dsm(in_las_merged, out_raster,
+                                 bin_size=resolution,
+                                 projection=wkt_projection)
+        elif demtype.upper() == 'DTM':
+            backend_module.las_to_dtm(in_las_merged, out_raster,
+                                 bin_size=resolution,
+                                 projection=wkt_projection)
+        elif demtype.upper() == 'INTENSITY':
+            backend_module.las_to_intensity(in_las_merged, out_raster,
+                                       bin_size=resolution,
+                                       projection=wkt_projection)
+        else:
+            raise Exception('DEM Type not recognised - options are DSM, DTM or Intensity')
     else:
         raise Exception('Invalid method "{}", expected GRASS, SPDLIB or LASTOOLS'.format(method))
 
@@ -244,6 +351,9 @@ def _las_to_dem(in_las,out_raster,
     os.close(tmp_las_handler)
     os.remove(tmp_las_file)
 
+    if cache_key is not None:
+        dem_result_cache.store(cache_key, out_raster)
+
 def las_to_dsm(in_las,out_raster,
                resolution=dem_common.DEFAULT_LIDAR_RES_METRES,
                projection=None,
@@ -253,7 +363,7 @@ def las_to_dsm(in_las,out_raster,
 
     Utility function to call las_to_dsm from grass_lidar, lastools_lidar or
     spdlib_lidar
-    GRASS and points2grid generate the DSM using only first return points.
+    GRASS, points2grid and NumPy generate the DSM using only first return points.
     When using LAStools the spike free method is used to generate the DSM from
     all returns.
 
@@ -359,3 +469,6 @@ def las_to_intensity(in_las,out_raster,
                 projection=projection,
                 demtype='INTENSITY',
                 method=method)
+
+# Record a span for each call to a public function when tracing is enabled
+dem_trace.trace_public_functions(globals())
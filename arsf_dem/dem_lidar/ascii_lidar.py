@@ -22,6 +22,7 @@ import os
 import csv
 # Import common files
 from .. import dem_common
+from .. import dem_trace
 
 def get_ascii_bounds(in_ascii):
     """
@@ -83,3 +84,6 @@ def get_ascii_bounds(in_ascii):
     return [[min_x,max_x],
             [min_y,max_y],
             [min_z,max_z]]
+
+# Record a span for each call to a public function when tracing is enabled
+dem_trace.trace_public_functions(globals())
@@ -0,0 +1,181 @@
+#! /usr/bin/env python
+#
+# This file has been created by ARSF Data Analysis Node and
+# is licensed under the GPL v3 Licence. A copy of this
+# licence is available to download with this file.
+
+"""
+Functions for reading points from Cloud-Optimized Point Cloud (COPC) files.
+
+https://copc.io/
+
+COPC files are LAZ 1.4 files where points are stored in an octree, so only
+the nodes which intersect a bounding box, down to the level needed for a
+given point spacing, need to be decompressed. Points are read one level
+of the octree at a time. Requires laspy 2.x with a LAZ backend (e.g.,
+'pip install laspy[lazrs]'). COPC files are also valid LAZ files so can be
+read by other methods if laspy isn't available.
+
+Available functions:
+
+* is_copc_file - check if a file is a COPC file.
+* read_points - read points within a bounding box / up to a resolution.
+
+"""
+
+from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
+import math
+import struct
+
+from .. import dem_trace
+from . import laspy_lidar
+
+#: NumPy is available
+HAVE_NUMPY = True
+try:
+    import numpy
+except ImportError:
+    HAVE_NUMPY = False
+
+#: laspy with COPC support is available
+HAVE_COPC = False
+if laspy_lidar.HAVE_LASPY:
+    try:
+        from laspy import copc as laspy_copc
+        HAVE_COPC = hasattr(laspy_copc, 'CopcReader')
+    except ImportError:
+        HAVE_COPC = False
+
+# COPC info VLR must be the first VLR in the file
+_COPC_USER_ID = b'copc'
+_COPC_INFO_RECORD_ID = 1
+
+def _checkCOPC():
+    """
+    Check if COPC files can be read.
+    """
+    return HAVE_NUMPY and HAVE_COPC
+
+def is_copc_file(in_lidar_file):
+    """
+    Check if a file is a COPC file by looking for the COPC info VLR after
+    the header. Reads the header directly so doesn't require laspy.
+
+    Arguments:
+
+    * in_lidar_file - input lidar file.
+
+    Returns:
+
+    * True / False
+
+    """
+    try:
+        with open(in_lidar_file, 'rb') as las_fh:
+            header = las_fh.read(96)
+            if len(header) < 96 or header[0:4] != b'LASF':
+                return False
+            header_size = struct.unpack('<H', header[94:96])[0]
+            las_fh.seek(header_size)
+            vlr_header = las_fh.read(20)
+    except (IOError, OSError):
+        return False
+
+    if len(vlr_header) < 20:
+        return False
+    user_id = vlr_header[2:18].rstrip(b'\x00')
+    record_id = struct.unpack('<H', vlr_header[18:20])[0]
+    return user_id == _COPC_USER_ID and record_id == _COPC_INFO_RECORD_ID
+
+def _get_levels(copc_reader, query_bounds=None, resolution=None):
+    """
+    Get octree levels which have points within the bounding box, up to
+    the level needed for a resolution (found in the same way as
+    CopcReader.query). Only the hierarchy is read.
+    """
+    level_range = None
+    if resolution is not None:
+        level_max = max(1, int(math.ceil(math.log2(copc_reader.copc_info.spacing
+                                                   / float(resolution)))) + 1)
+        level_range = range(0, level_max)
+
+    if query_bounds is not None:
+        query_bounds = query_bounds.ensure_3d(copc_reader.header.mins,
+                                              copc_reader.header.maxs)
+    nodes = laspy_copc.load_octree_for_query(copc_reader.source,
+                                             copc_reader.copc_info,
+                                             copc_reader.root_page,
+                                             query_bounds=query_bounds,
+                                             level_range=level_range)
+    return sorted(set([node.key.level for node in nodes if node.point_count > 0]))
+
+def read_points(in_copc_file, bounding_box=None, resolution=None):
+    """
+    Read points from a COPC file. Only octree nodes which intersect the
+    bounding box and levels needed to give points with the requested
+    spacing are decompressed.
+
+    Points are read one level of the octree at a time (coarsest first)
+    and returned as chunks, so all points don't need to be held in
+    memory at once.
+
+    Arguments:
+
+    * in_copc_file - input COPC file.
+    * bounding_box - List of 4 values providing the bounding box of the format: [MinY, MaxY, MinX, MaxX] in the projection of the file (default is all points).
+    * resolution - spacing of points required, coarser values read fewer levels (default is all levels).
+
+    Returns:
+
+    * generator giving a dictionary with numpy array for each column ('x',
+      'y' and 'z' as scaled integers, 'intensity', 'classification',
+      'returnnumber' and 'numberofreturns'), scale and offset for each
+      level. If there are no points a single empty chunk is given, so the
+      scale and offset are always available.
+
+    """
+    if not HAVE_NUMPY:
+        raise ImportError('Could not import NumPy')
+    if not HAVE_COPC:
+        raise ImportError('Could not import laspy with COPC support')
+
+    query_bounds = None
+    if bounding_box is not None:
+        query_bounds = laspy_copc.Bounds(mins=numpy.array([bounding_box[2], bounding_box[0]]),
+                                         maxs=numpy.array([bounding_box[3], bounding_box[1]]))
+
+    with laspy_copc.CopcReader.open(in_copc_file) as copc_reader:
+        scale = [float(value) for value in copc_reader.header.scales]
+        offset = [float(value) for value in copc_reader.header.offsets]
+
+        levels = _get_levels(copc_reader, query_bounds, resolution)
+        if len(levels) == 0:
+            yield (dict([(column_name, numpy.zeros(0)) for column_name in
+                         ['x', 'y', 'z', 'intensity', 'classification',
+                          'returnnumber', 'numberofreturns']]), scale, offset)
+
+        for level in levels:
+            points = copc_reader.query(bounds=query_bounds, level=level)
+
+            columns = {'x' : numpy.asarray(points.X),
+                       'y' : numpy.asarray(points.Y),
+                       'z' : numpy.asarray(points.Z),
+                       'intensity' : numpy.asarray(points.intensity),
+                       'classification' : numpy.asarray(points.classification),
+                       'returnnumber' : numpy.asarray(points.return_number),
+                       'numberofreturns' : numpy.asarray(points.number_of_returns)}
+            points = None
+
+            # Nodes can extend outside the bounding box so remove points outside it
+            if bounding_box is not None and len(columns['x']) > 0:
+                x = columns['x'] * scale[0] + offset[0]
+                y = columns['y'] * scale[1] + offset[1]
+                inside = ((y >= bounding_box[0]) & (y <= bounding_box[1])
+                          & (x >= bounding_box[2]) & (x <= bounding_box[3]))
+                for column_name in columns:
+                    columns[column_name] = columns[column_name][inside]
+
+            yield columns, scale, offset
+
+# Record a span for each call to a public function when tracing is enabled
+dem_trace.trace_public_functions(globals())
@@ -17,17 +17,15 @@ import shutil
 import tempfile
 # Import common files
 from .. import dem_common
-from .. import dem_common_functions
+from .. import dem_scratch
+from .. import dem_toolchain
+from .. import dem_tool_runner
+from .. import dem_trace
 
 def _checkFUSION():
     """Check if FUSION is installed."""
 
-    try:
-        dem_common_functions.CallSubprocessOn([os.path.join(dem_common.FUSION_BIN_PATH,'groundfilter.exe')],
-                          redirect=True, quiet=True)
-        return True
-    except OSError:
-        return False
+    return dem_toolchain.is_tool_available('groundfilter')
 
 def _set_windows_path(in_path):
     """
@@ -63,7 +61,7 @@ def classify_ground_las(in_las,out_las,
     groundCMD = [os.path.join(dem_common.FUSION_BIN_PATH,'groundfilter.exe'),
                  _set_windows_path(out_las), str(resolution),
                  _set_windows_path(in_las)]
-    dem_common_functions.CallSubprocessOn(groundCMD)
+    dem_tool_runner.run_tool_blocking(groundCMD)
 
 def export_dtm_raster(in_dtm, out_raster):
     """
@@ -83,7 +81,7 @@ def export_dtm_raster(in_dtm, out_raster):
         convertCMD = [os.path.join(dem_common.FUSION_BIN_PATH,'DTM2TIF.exe')]
 
     convertCMD.extend([_set_windows_path(in_dtm), _set_windows_path(out_raster)])
-    dem_common_functions.CallSubprocessOn(convertCMD)
+    dem_tool_runner.run_tool_blocking(convertCMD)
 
 
 def las_to_dsm(in_las, out_dsm,
@@ -99,14 +97,14 @@ def las_to_dsm(in_las, out_dsm,
 
 
     """
-    outdtm_handler, dtm_tmp = tempfile.mkstemp(suffix='.dtm', dir=dem_common.TEMP_PATH)
+    outdtm_handler, dtm_tmp = tempfile.mkstemp(suffix='.dtm', dir=dem_scratch.get_dir())
 
     print('Creating surface')
     surfaceCMD = [os.path.join(dem_common.FUSION_BIN_PATH,'canopymodel.exe'),
                   _set_windows_path(dtm_tmp),
                   str(resolution), 'M', 'M', '0','0','0','0',
                   _set_windows_path(in_las)]
-    dem_common_functions.CallSubprocessOn(surfaceCMD)
+    dem_tool_runner.run_tool_blocking(surfaceCMD)
 
     print('Exporting')
     export_dtm_raster(dtm_tmp, out_dsm)
@@ -128,8 +126,8 @@ def las_to_dtm(in_las, out_dtm,
     * resolution - output resolution
 
     """
-    outlas_handler, las_tmp = tempfile.mkstemp(suffix='.las', dir=dem_common.TEMP_PATH)
-    outdtm_handler, dtm_tmp = tempfile.mkstemp(suffix='.dtm', dir=dem_common.TEMP_PATH)
+    outlas_handler, las_tmp = tempfile.mkstemp(suffix='.las', dir=dem_scratch.get_dir())
+    outdtm_handler, dtm_tmp = tempfile.mkstemp(suffix='.dtm', dir=dem_scratch.get_dir())
 
     print('Classifying ground returns')
     classify_ground_las(in_las, las_tmp, resolution=resolution)
@@ -139,7 +137,7 @@ def las_to_dtm(in_las, out_dtm,
                   _set_windows_path(dtm_tmp),
                   str(resolution), 'M', 'M', '0','0','0','0',
                   _set_windows_path(las_tmp)]
-    dem_common_functions.CallSubprocessOn(surfaceCMD)
+    dem_tool_runner.run_tool_blocking(surfaceCMD)
 
     print('Exporting')
     export_dtm_raster(dtm_tmp, out_dtm)
@@ -151,3 +149,6 @@ def las_to_dtm(in_las, out_dtm,
     os.remove(dtm_tmp)
 
     return None
+
+# Record a span for each call to a public function when tracing is enabled
+dem_trace.trace_public_functions(globals())
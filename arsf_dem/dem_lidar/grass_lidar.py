@@ -26,8 +26,7 @@ Available Functions:
 """
 
 from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
-import os, sys
-import shutil
+import os
 import tempfile
 # Import common files
 from .. import dem_common
@@ -37,15 +36,11 @@ from . import lastools_lidar
 from . import ascii_lidar
 from .. import grass_library
 from .. import dem_common_functions
+from .. import dem_scratch
+from .. import dem_trace
 
-# Import GRASS
-sys.path.append(dem_common.GRASS_PYTHON_LIB_PATH)
-try:
-    import grass.script as grass
-except ImportError as err:
-    raise ImportError("Could not import grass library. "
-                      "Try setting 'GRASS_PYTHON_LIB_PATH' environmental variable."
-                      "\n{}".format(err))
+# GRASS (imported the first time it is used)
+grass = grass_library.grass
 
 def ascii_to_raster(in_ascii,out_raster=None,
                      remove_grassdb=True,
@@ -124,7 +119,7 @@ def ascii_to_raster(in_ascii,out_raster=None,
 
     # Create copy of ASCII file, if needed
     if (drop_class is not None) or (keep_class is not None) or first_only or last_only:
-        tmp_ascii_fh, in_ascii_drop = tempfile.mkstemp(suffix='.txt', prefix='lidar_',dir=dem_common.TEMP_PATH)
+        tmp_ascii_fh, in_ascii_drop = tempfile.mkstemp(suffix='.txt', prefix='lidar_',dir=dem_scratch.get_dir())
         grass_library.removeASCIIClass(in_ascii, in_ascii_drop,drop_class=drop_class, first_only=first_only, last_only=last_only)
     else:
         in_ascii_drop = in_ascii
@@ -147,10 +142,7 @@ def ascii_to_raster(in_ascii,out_raster=None,
     else:
         location = projection
         mapset = 'PERMANENT'
-        grass.setup.init(dem_common.GRASS_LIB_PATH,
-                    grassdb_path,
-                    location,
-                    mapset)
+        grass_library.grassDBinit(grassdb_path, location, mapset)
 
     # Set extent
     grass_library.SetRegion(bounds=bounding_box,res=bin_size)
@@ -179,9 +171,12 @@ def ascii_to_raster(in_ascii,out_raster=None,
                        output=out_raster,
                        nodata=dem_common.NODATA_VALUE,
                        overwrite=True,
-                       flags='fc')
+                       flags='fc',
+                       **dem_utilities.get_grass_export_options(out_raster_format,
+                                                                out_raster_type))
 
         dem_utilities.remove_gdal_aux_file(out_raster)
+        dem_utilities.apply_output_profile(out_raster)
 
     if (drop_class is not None) or (keep_class is not None) or first_only or last_only:
         os.close(tmp_ascii_fh)
@@ -189,7 +184,7 @@ def ascii_to_raster(in_ascii,out_raster=None,
 
     # Remove GRASS database if requested.
     if remove_grassdb:
-        shutil.rmtree(grassdb_path)
+        grass_library.grassDBremove(grassdb_path)
         return out_raster, None
     else:
         return out_raster_name, grassdb_path
@@ -248,7 +243,7 @@ def las_to_raster(in_las,out_raster=None,
 
     """
 
-    tmp_ascii_fh, ascii_file_tmp = tempfile.mkstemp(suffix='.txt', prefix='lidar_',dir=dem_common.TEMP_PATH)
+    tmp_ascii_fh, ascii_file_tmp = tempfile.mkstemp(suffix='.txt', prefix='lidar_',dir=dem_scratch.get_dir())
 
     if out_raster is not None:
         out_raster_name = os.path.basename(out_raster).replace("-","_")
@@ -342,7 +337,7 @@ def ascii_to_vector(in_ascii,
 
     # Create copy of ASCII file, if needed
     if (drop_class is not None) or (keep_class is not None) or first_only or last_only:
-        tmp_ascii_fh, in_ascii_drop = tempfile.mkstemp(suffix='.txt', prefix='lidar_',dir=dem_common.TEMP_PATH)
+        tmp_ascii_fh, in_ascii_drop = tempfile.mkstemp(suffix='.txt', prefix='lidar_',dir=dem_scratch.get_dir())
         grass_library.removeASCIIClass(in_ascii, in_ascii_drop,drop_class=drop_class, first_only=first_only, last_only=last_only)
     else:
         in_ascii_drop = in_ascii
@@ -365,10 +360,7 @@ def ascii_to_vector(in_ascii,
     else:
         location = projection
         mapset = 'PERMANENT'
-        grass.setup.init(dem_common.GRASS_LIB_PATH,
-                         grassdb_path,
-                         location,
-                         mapset)
+        grass_library.grassDBinit(grassdb_path, location, mapset)
 
     # Set extent
     grass_library.SetRegion(bounds=bounding_box,res=dem_common.DEFAULT_LIDAR_RES_METRES)
@@ -427,7 +419,7 @@ def las_to_vector(in_las,
 
     tmp_ascii_fh, ascii_file_tmp = tempfile.mkstemp(suffix='.txt',
                                                     prefix='lidar_',
-                                                    dir=dem_common.TEMP_PATH)
+                                                    dir=dem_scratch.get_dir())
 
     out_vector_name = os.path.basename(in_las).replace("-","_")
     out_vector_name = os.path.splitext(out_vector_name)[0]
@@ -681,3 +673,6 @@ def las_to_density(in_las,out_raster=None,
                                                   out_raster_type=out_raster_type)
 
     return out_raster_name, grassdb_path
+
+# Record a span for each call to a public function when tracing is enabled
+dem_trace.trace_public_functions(globals())
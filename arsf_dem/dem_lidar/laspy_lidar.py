@@ -22,6 +22,8 @@ Available Function:
 
 from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
 
+from .. import dem_trace
+
 #: laspy library is available
 HAVE_LASPY = True
 try:
@@ -151,3 +153,6 @@ def get_las_bounds(in_las, from_header=True):
                 [min_z,max_z]]
     else:
         raise Exception('Did not understand input, expected string or list')
+
+# Record a span for each call to a public function when tracing is enabled
+dem_trace.trace_public_functions(globals())
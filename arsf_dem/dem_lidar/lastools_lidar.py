@@ -23,27 +23,20 @@ import glob
 import subprocess
 # Import common files
 from .. import dem_common
-from .. import dem_common_functions
+from .. import dem_scratch
+from .. import dem_toolchain
+from .. import dem_tool_runner
+from .. import dem_trace
 
 def _checkFreeLAStools():
     """Check if LAStools are installed."""
 
-    try:
-        dem_common_functions.CallSubprocessOn([os.path.join(dem_common.LASTOOLS_FREE_BIN_PATH,'las2txt'),'-h'],
-                          redirect=True, quiet=True)
-        return True
-    except OSError:
-        return False
+    return dem_toolchain.is_tool_available('las2txt')
 
 def _checkPaidLAStools():
     """Check if paid LAStools are installed."""
 
-    try:
-        dem_common_functions.CallSubprocessOn([os.path.join(dem_common.LASTOOLS_NONFREE_BIN_PATH,'las2dem.exe'),'-h'],
-                          redirect=True, quiet=True)
-        return True
-    except OSError:
-        return False
+    return dem_toolchain.is_tool_available('las2dem')
 
 def _check_flags(in_flags):
     """
@@ -78,7 +71,8 @@ def _check_flags(in_flags):
     return outflags_list
 
 def convert_las_to_ascii(in_las, out_ascii, drop_class=None, keep_class=None,
-                         flags=None, print_only=False):
+                         flags=None, print_only=False,
+                         num_processes=dem_common.NUM_PROCESSES):
     """
     Convert LAS files to ASCII using las2txt
     tool.
@@ -116,6 +110,7 @@ def convert_las_to_ascii(in_las, out_ascii, drop_class=None, keep_class=None,
     * keep_class - Integer or list of integer class codes to keep
     * flags - List of additional flags for las2txt
     * print_only - Don't run commands, only print
+    * num_processes - Number of files to convert at once (if a list or directory is provided).
 
     Returns:
 
@@ -158,6 +153,7 @@ def convert_las_to_ascii(in_las, out_ascii, drop_class=None, keep_class=None,
 
     if isinstance(in_las,list):
         # If a list is passed in, run for each file
+        las2txt_cmd_list = []
         for in_las_file in in_las:
             out_ascii_base = os.path.splitext(os.path.basename(in_las_file))[0]
             out_ascii_file = os.path.join(out_ascii, out_ascii_base + '.txt')
@@ -166,7 +162,10 @@ def convert_las_to_ascii(in_las, out_ascii, drop_class=None, keep_class=None,
             if print_only:
                 print(" ", " ".join(las2txt_cmd))
             else:
-                dem_common_functions.CallSubprocessOn(las2txt_cmd)
+                las2txt_cmd_list.append(las2txt_cmd)
+
+        dem_tool_runner.run_tools(las2txt_cmd_list,
+                                  num_processes=num_processes)
 
     elif os.path.isdir(in_las):
         # If a directoy is passed in
@@ -184,6 +183,7 @@ def convert_las_to_ascii(in_las, out_ascii, drop_class=None, keep_class=None,
             raise Exception('Must provide path to existing directory if an '
                             'input directory is provided')
 
+        las2txt_cmd_list = []
         for in_las_file in in_las_list:
             out_ascii_base = os.path.splitext(os.path.basename(in_las_file))[0]
             out_ascii_file = os.path.join(out_ascii, out_ascii_base + '.txt')
@@ -193,7 +193,10 @@ def convert_las_to_ascii(in_las, out_ascii, drop_class=None, keep_class=None,
             if print_only:
                 print(" ", " ".join(las2txt_cmd))
             else:
-                dem_common_functions.CallSubprocessOn(las2txt_cmd)
+                las2txt_cmd_list.append(las2txt_cmd)
+
+        dem_tool_runner.run_tools(las2txt_cmd_list,
+                                  num_processes=num_processes)
 
     else:
         las2txt_cmd = las2txt_cmd_base + ['-i',in_las,
@@ -202,7 +205,7 @@ def convert_las_to_ascii(in_las, out_ascii, drop_class=None, keep_class=None,
         if print_only:
             print(" ", " ".join(las2txt_cmd))
         else:
-            dem_common_functions.CallSubprocessOn(las2txt_cmd)
+            dem_tool_runner.run_tool_blocking(las2txt_cmd)
 
 def merge_las(in_las_list, out_las_file,
               drop_class=None, keep_class=None, flags=None):
@@ -261,7 +264,7 @@ def merge_las(in_las_list, out_las_file,
 
     lasmerge_cmd.extend(['-o', out_las_file])
 
-    dem_common_functions.CallSubprocessOn(lasmerge_cmd)
+    dem_tool_runner.run_tool_blocking(lasmerge_cmd)
 
 def classify_ground_las(in_las,out_las, flags=None):
     """
@@ -298,7 +301,8 @@ def classify_ground_las(in_las,out_las, flags=None):
     # Run directly through subprocess, as CallSubprocessOn
     # raises exception under windows for unlicensed LAStools
     print('Attempting to run command: ' + ' '.join(lasground_cmd))
-    subprocess.check_output(lasground_cmd)
+    with dem_tool_runner.tool_slot():
+        subprocess.check_output(lasground_cmd)
 
 def las_to_dsm(in_las, out_dsm, flags=None):
     """
@@ -340,7 +344,8 @@ def las_to_dsm(in_las, out_dsm, flags=None):
     # Run directly through subprocess, as CallSubprocessOn
     # raises exception under windows for unlicensed LAStools
     print('Attempting to run command: ' + ' '.join(las2dem_cmd))
-    subprocess.check_output(las2dem_cmd)
+    with dem_tool_runner.tool_slot():
+        subprocess.check_output(las2dem_cmd)
 
 def las_to_dtm(in_las, out_dtm, keep_las=False, flags=None):
     """
@@ -367,7 +372,7 @@ def las_to_dtm(in_las, out_dtm, keep_las=False, flags=None):
     if not _checkPaidLAStools():
         raise Exception('Could not find LAStools, checked {}'.format(dem_common.LASTOOLS_NONFREE_BIN_PATH))
 
-    lasfile_grd_tmp = tempfile.mkstemp(suffix='.LAS', dir=dem_common.TEMP_PATH)[1]
+    lasfile_grd_tmp = tempfile.mkstemp(suffix='.LAS', dir=dem_scratch.get_dir())[1]
 
     print('Classifying ground returns')
     classify_ground_las(in_las, lasfile_grd_tmp, flags=['-ignore_class 7'])
@@ -384,7 +389,8 @@ def las_to_dtm(in_las, out_dtm, keep_las=False, flags=None):
     # Run directly through subprocess, as CallSubprocessOn
     # raises exception under windows for unlicensed LAStools
     print('Attempting to run command: ' + ' '.join(las2dem_cmd))
-    subprocess.check_output(las2dem_cmd)
+    with dem_tool_runner.tool_slot():
+        subprocess.check_output(las2dem_cmd)
 
     if keep_las:
         return lasfile_grd_tmp
@@ -428,7 +434,8 @@ def las_to_intensity(in_las, out_intensity, flags=None):
     # Run directly through subprocess, as CallSubprocessOn
     # raises exception under windows for unlicensed LAStools
     print('Attempting to run command: ' + ' '.join(las2dem_cmd))
-    subprocess.check_output(las2dem_cmd)
+    with dem_tool_runner.tool_slot():
+        subprocess.check_output(las2dem_cmd)
 
 
 def grass_proj_to_lastools_flag(in_grass_proj):
@@ -454,7 +461,8 @@ def grass_proj_to_lastools_flag(in_grass_proj):
         return '-utm {}'.format(in_grass_proj[3:])
 
 
-def convert_las_to_laz(in_las, out_laz=None, print_only=False, delete_las=False):
+def convert_las_to_laz(in_las, out_laz=None, print_only=False, delete_las=False,
+                       num_processes=dem_common.NUM_PROCESSES):
     """
     Compress LAS files to LAZ using laszip
     tool.
@@ -472,6 +480,7 @@ def convert_las_to_laz(in_las, out_laz=None, print_only=False, delete_las=False)
        If None will assume same as input directory
     * print_only - Don't run commands, only print
     * delete_las - Delete the input LAS files after compression
+    * num_processes - Number of files to compress at once (if a list or directory is provided).
 
     Returns:
 
@@ -487,6 +496,7 @@ def convert_las_to_laz(in_las, out_laz=None, print_only=False, delete_las=False)
 
     if isinstance(in_las,list):
         # If a list is passed in, run for each file
+        laszip_cmd_list = []
         for in_las_file in in_las:
             out_laz_base = os.path.splitext(os.path.basename(in_las_file))[0]
             out_laz_file = os.path.join(out_laz, out_laz_base + '.laz')
@@ -495,8 +505,14 @@ def convert_las_to_laz(in_las, out_laz=None, print_only=False, delete_las=False)
             if print_only:
                 print(" ", " ".join(laszip_cmd))
             else:
-                dem_common_functions.CallSubprocessOn(laszip_cmd)
-            if delete_las:
+                laszip_cmd_list.append(laszip_cmd)
+
+        dem_tool_runner.run_tools(laszip_cmd_list,
+                                  num_processes=num_processes)
+
+        # Only remove files once all have been compressed successfully
+        if delete_las:
+            for in_las_file in in_las:
                 if print_only:
                     print("Will remove file ",in_las_file)
                 else:
@@ -517,6 +533,7 @@ def convert_las_to_laz(in_las, out_laz=None, print_only=False, delete_las=False)
         elif not os.path.isdir(out_laz):
             raise Exception('Output directory must exist if supplied')
 
+        laszip_cmd_list = []
         for in_las_file in in_las_list:
             out_laz_base = os.path.splitext(os.path.basename(in_las_file))[0]
             out_laz_file = os.path.join(out_laz, out_laz_base + '.laz')
@@ -526,8 +543,14 @@ def convert_las_to_laz(in_las, out_laz=None, print_only=False, delete_las=False)
             if print_only:
                 print(" ", " ".join(laszip_cmd))
             else:
-                dem_common_functions.CallSubprocessOn(laszip_cmd)
-            if delete_las:
+                laszip_cmd_list.append(laszip_cmd)
+
+        dem_tool_runner.run_tools(laszip_cmd_list,
+                                  num_processes=num_processes)
+
+        # Only remove files once all have been compressed successfully
+        if delete_las:
+            for in_las_file in in_las_list:
                 if print_only:
                     print("Will remove file ", in_las_file)
                 else:
@@ -541,9 +564,12 @@ def convert_las_to_laz(in_las, out_laz=None, print_only=False, delete_las=False)
         if print_only:
             print(" ", " ".join(laszip_cmd))
         else:
-            dem_common_functions.CallSubprocessOn(laszip_cmd)
+            dem_tool_runner.run_tool_blocking(laszip_cmd)
         if delete_las:
             if print_only:
                 print("Will remove file ",in_las)
             else:
                 os.remove(in_las)
+
+# Record a span for each call to a public function when tracing is enabled
+dem_trace.trace_public_functions(globals())
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+#
+# This file has been created by ARSF Data Analysis Node and
+# is licensed under the GPL v3 Licence. A copy of this
+# licence is available to download with this file.
+
+"""
+Registry of backends (methods) which can create rasters from lidar data.
+
+Backend modules (e.g., grass_lidar, spdlib_lidar) are only imported the
+first time they are used, so dem_lidar can be imported on systems which
+only have some of the packages installed. Checking if a backend is
+available (e.g., if the required programs are installed) is only done
+once per process and the result cached.
+
+Available functions:
+
+* register_backend - add a backend to the registry.
+* get_backend - get LidarBackend for a method.
+* get_backend_names - get names of backends which can create a raster type.
+* get_available_backends - get names of backends which are installed.
+* is_available - check if a backend is installed.
+* load_backend - import and return the module for a backend.
+
+Example::
+
+   from arsf_dem.dem_lidar import lidar_backends
+
+   if lidar_backends.is_available('LAStools'):
+      lastools_lidar = lidar_backends.load_backend('LAStools')
+      lastools_lidar.las_to_dsm('in.las', 'out_dsm.tif')
+
+"""
+
+from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
+import importlib
+import threading
+import collections
+
+#: Raster types which can be created
+RASTER_TYPES = ['DSM', 'DTM', 'INTENSITY']
+
+# Package backend modules are in (arsf_dem.dem_lidar)
+_PACKAGE_NAME = __name__.rpartition('.')[0]
+
+# Registered backends, in the order they were added
+_BACKENDS = collections.OrderedDict()
+_BACKENDS_LOCK = threading.Lock()
+
+class LidarBackend(object):
+    """
+    A method which can create rasters from lidar data.
+
+    Attributes:
+
+    * name - name of method (e.g., GRASS).
+    * module_name - name of module within dem_lidar (e.g., grass_lidar).
+    * raster_types - list of raster types which can be created (e.g., DSM, DTM).
+    * check_function - name of function within module to check backend is installed or function to call (returns True / False).
+    * requires_las_noise_removal - backend can't filter out noisy points so these must be removed first.
+
+    """
+    def __init__(self, name, module_name, raster_types,
+                 check_function=None, requires_las_noise_removal=False):
+        self.name = name
+        self.module_name = module_name
+        self.raster_types = [raster_type.upper() for raster_type in raster_types]
+        self.check_function = check_function
+        self.requires_las_noise_removal = requires_las_noise_removal
+        self._module = None
+        self._available = None
+        self._lock = threading.RLock()
+
+    def load(self):
+        """
+        Import module for backend (only imported on the first call).
+        """
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(
+                        '{}.{}'.format(_PACKAGE_NAME, self.module_name))
+        return self._module
+
+    def is_available(self):
+        """
+        Check if backend is available, result is cached so the check is
+        only run once per process.
+        """
+        if self._available is None:
+            with self._lock:
+                if self._available is None:
+                    self._available = self._check()
+        return self._available
+
+    def _check(self):
+        """
+        Run check for backend. Returns False if the module can't be
+        imported or the check function returns False or raises an exception.
+        """
+        try:
+            if self.check_function is None:
+                self.load()
+                return True
+            elif callable(self.check_function):
+                return bool(self.check_function())
+            else:
+                return bool(getattr(self.load(), self.check_function)())
+        except Exception:
+            return False
+
+def _check_grass():
+    """
+    Check GRASS is available by importing the GRASS Python library.
+    """
+    from .. import grass_library
+    try:
+        grass_library.importGRASSModule('grass.script')
+        return True
+    except ImportError:
+        return False
+
+def register_backend(backend):
+    """
+    Add a backend to the registry, replacing any existing backend
+    with the same name.
+
+    Arguments:
+
+    * backend - LidarBackend
+
+    """
+    with _BACKENDS_LOCK:
+        _BACKENDS[backend.name.upper()] = backend
+
+def get_backend(name):
+    """
+    Get backend for method (not case sensitive).
+
+    Arguments:
+
+    * name - name of method (e.g., GRASS).
+
+    Returns:
+
+    * LidarBackend
+
+    """
+    try:
+        return _BACKENDS[name.upper()]
+    except KeyError:
+        raise Exception('Invalid method "{}", expected {}'.format(name,
+                            ', '.join(get_backend_names())))
+
+def get_backend_names(raster_type=None):
+    """
+    Get names of registered backends.
+
+    Arguments:
+
+    * raster_type - only return backends which can create this raster type (e.g., DSM).
+
+    Returns:
+
+    * list of names
+
+    """
+    return [backend.name for backend in _BACKENDS.values()
+            if raster_type is None or raster_type.upper() in backend.raster_types]
+
+def get_available_backends(raster_type=None):
+    """
+    Get names of registered backends which are available.
+
+    Arguments:
+
+    * raster_type - only return backends which can create this raster type (e.g., DSM).
+
+    Returns:
+
+    * list of names
+
+    """
+    return [name for name in get_backend_names(raster_type)
+            if get_backend(name).is_available()]
+
+def is_available(name):
+    """
+    Check if a backend is available (result is cached).
+
+    Arguments:
+
+    * name - name of method (e.g., GRASS).
+
+    Returns:
+
+    * True / False
+
+    """
+    return get_backend(name).is_available()
+
+def load_backend(name):
+    """
+    Import and return module for a backend.
+
+    Arguments:
+
+    * name - name of method (e.g., GRASS).
+
+    Returns:
+
+    * module
+
+    """
+    return get_backend(name).load()
+
+register_backend(LidarBackend('GRASS', 'grass_lidar',
+                              ['DSM', 'DTM', 'INTENSITY'],
+                              check_function=_check_grass))
+register_backend(LidarBackend('SPDLib', 'spdlib_lidar',
+                              ['DSM', 'DTM'],
+                              check_function='_checkSPDLib',
+                              requires_las_noise_removal=True))
+register_backend(LidarBackend('LAStools', 'lastools_lidar',
+                              ['DSM', 'DTM', 'INTENSITY'],
+                              check_function='_checkPaidLAStools'))
+register_backend(LidarBackend('FUSION', 'fusion_lidar',
+                              ['DSM', 'DTM'],
+                              check_function='_checkFUSION'))
+register_backend(LidarBackend('points2grid', 'points2grid_lidar',
+                              ['DSM', 'DTM'],
+                              check_function='_checkPoints2Grid'))
+register_backend(LidarBackend('NumPy', 'numpy_lidar',
+                              ['DSM', 'DTM', 'INTENSITY'],
+                              check_function='_checkNumPy'))
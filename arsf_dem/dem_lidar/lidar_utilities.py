@@ -12,22 +12,39 @@ Available functions:
 
 * create_patched_lidar_mosaic - Create mosaic from lidar data and patch with another DEM.
 * create_lidar_mosaic - Create mosaic from lidar data.
+* create_lidar_quicklooks - Create coarse quicklook raster and JPEG for each lidar file.
 * get_lidar_buffered_bb - buffer bounding box by 'DEFAULT_LIDAR_DEM_BUFFER' or user specified buffer.
+* get_las_header_info - read number of points and bounds from LAS header.
+* estimate_lidar_raster_memory_mb - estimate memory needed to grid LAS files.
 
 """
 from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
 import os
 import shutil
 import glob
-import tempfile
+import struct
+import time
 
 from .. import dem_common
 from .. import dem_utilities
 from .. import dem_nav_utilities
 from .. import dem_common_functions
+from .. import dem_task_graph
+from .. import dem_result_cache
+from .. import dem_intermediate
+from .. import dem_scratch
+from .. import get_gdal_drivers
 
-from . import grass_lidar
+from . import lidar_backends
 from .. import grass_library
+from .. import dem_trace
+
+#: Number of bytes to read from the start of a LAS file to get the header
+LAS_HEADER_READ_BYTES = 375
+
+#: Memory (in bytes) assumed for each point of the largest file when estimating memory
+#: (points read, filtered and sorted while a file is converted / gridded)
+LIDAR_MEMORY_BYTES_PER_POINT = 32
 
 def create_patched_lidar_mosaic(in_lidar,
                      outdem,
@@ -43,7 +60,8 @@ def create_patched_lidar_mosaic(in_lidar,
                      project='.',
                      nav=None,
                      lidar_bounds=True,
-                     fill_lidar_nulls=False):
+                     fill_lidar_nulls=False,
+                     concurrent_stages=None):
 
     """
     Create patched mosaic of lidar files and optionally an additional DEM to fill
@@ -70,12 +88,12 @@ def create_patched_lidar_mosaic(in_lidar,
     * nav - path to navigation data file.
     * lidar_bounds - create patched DEM using lidar bounds plus buffer (for when hyperspectral navigation data is not available.
     * fill_lidar_nulls - fill null values in lidar data.
+    * concurrent_stages - run independent stages at the same time, each in its own GRASS workspace (default is LIDAR_CONCURRENT_STAGES from config file).
 
     """
 
-    # Set up list to hold temp files
-    temp_file_list = []
-    temp_file_handler_list = []
+    # Temp files are removed when the scope is exited, including on errors
+    scratch = dem_scratch.scope()
 
     try:
         # Check output directory exists. Will raise exception if not accessible
@@ -166,15 +184,6 @@ def create_patched_lidar_mosaic(in_lidar,
             else:
                 subset_to_navigation = False
 
-        # Create temp file for DEM (if required)
-        tmd_fh, temp_mosaic_dem = tempfile.mkstemp(prefix='dem_subset',suffix='.dem', dir=dem_common.TEMP_PATH)
-        temp_mosaic_dem_header = os.path.splitext(temp_mosaic_dem)[0] + '.hdr'
-        tld_fh, temp_lidar_dem = tempfile.mkstemp(prefix='lidar_dem_mosaic',suffix='.dem', dir=dem_common.TEMP_PATH)
-        temp_lidar_dem_header = os.path.splitext(temp_lidar_dem)[0] + '.hdr'
-
-        temp_file_list.extend([temp_mosaic_dem, temp_mosaic_dem_header, temp_lidar_dem, temp_lidar_dem_header])
-        temp_file_handler_list.extend([tmd_fh, tld_fh])
-
         lidar_dem_mosaic = outdem
         lidar_dem_mosaic_header = os.path.splitext(lidar_dem_mosaic)[0] + '.hdr'
         outdem_header = os.path.splitext(outdem)[0] + '.hdr'
@@ -193,48 +202,118 @@ def create_patched_lidar_mosaic(in_lidar,
             dem_common_functions.WARNING('Skipping filling NULL values in LiDAR data by interpolation as patching with DEM')
             fill_lidar_nulls = False
 
-        if lidar_format.upper() != 'GRIDDED':
-            # Create DEM from individual lidar lines and patch together
-            # If a string is passed in convert to a list
-            if isinstance(in_lidar, str):
-                in_lidar = [in_lidar]
-
-            create_lidar_mosaic(in_lidar,lidar_dem_mosaic,
-                                out_screenshot=lidar_screenshots,
-                                shaded_relief_screenshots=shaded_relief_screenshots,
-                                in_projection=in_lidar_projection,
-                                resolution=resolution,
-                                nodata=dem_common.NODATA_VALUE,
-                                lidar_format=lidar_format,
-                                raster_type=out_raster_type,
-                                fill_nulls=fill_lidar_nulls)
-
+        # Set up stages as a task graph. If requested independent stages
+        # (creating the LiDAR mosaic and subsetting the DEM to navigation
+        # data) run at the same time, each in its own GRASS workspace.
+        # Otherwise stages are run one at a time, in the order added.
+        if concurrent_stages is None:
+            concurrent_stages = dem_common.LIDAR_CONCURRENT_STAGES
+        if concurrent_stages:
+            patch_graph = dem_task_graph.TaskGraph()
         else:
-            if isinstance(in_lidar, list):
-                if len(in_lidar) == 1:
-                    lidar_dem_mosaic = in_lidar[0]
+            patch_graph = dem_task_graph.TaskGraph(num_processes=1)
+
+        # Estimate memory needed for stages working on the full LiDAR
+        # grid so they are only run together if there is enough memory.
+        # Creating the mosaic also needs memory for the points in each file,
+        # later stages only work on the grid.
+        lidar_memory_mb = None
+        lidar_grid_memory_mb = None
+        if lidar_format.upper() == 'LAS':
+            lidar_memory_mb = estimate_lidar_raster_memory_mb(in_lidar,
+                                                              resolution)
+            lidar_grid_memory_mb = estimate_lidar_raster_memory_mb(in_lidar,
+                                                                   resolution,
+                                                                   bytes_per_point=0)
+        if lidar_memory_mb is None:
+            lidar_memory_mb = dem_task_graph.DEFAULT_TASK_MEMORY_MB
+            lidar_grid_memory_mb = dem_task_graph.DEFAULT_TASK_MEMORY_MB
+        else:
+            print('Estimated memory required to create LiDAR mosaic: '
+                  '{} MB'.format(lidar_memory_mb))
+
+        # Create temp files for DEM (if required). Use the size of a single
+        # precision grid covering the LiDAR data to decide if these can be
+        # kept in memory.
+        intermediate_size_mb = None
+        if lidar_format.upper() == 'LAS':
+            intermediate_size_mb = estimate_lidar_raster_memory_mb(in_lidar,
+                                                                   resolution,
+                                                                   n_grids=1,
+                                                                   bytes_per_point=0)
+            if intermediate_size_mb is not None:
+                intermediate_size_mb = intermediate_size_mb / 2.0
+        elif lidar_format.upper() == 'GRIDDED':
+            gridded_lidar = in_lidar[0] if isinstance(in_lidar, list) else in_lidar
+            intermediate_size_mb = dem_intermediate.estimate_raster_size_mb(gridded_lidar,
+                                                    dem_common.GDAL_OUTFILE_DATATYPE)
+
+        # Subsetting the DEM splits large outputs into windows which are
+        # warped in parallel (see dem_utilities.subset_to_bb) so can use
+        # all cores. Other stages run a single threaded tool at a time.
+        dem_subset_cpus = dem_common.NUM_PROCESSES
+        if lidar_format.upper() == 'LAS':
+            grid_info = _get_las_grid_info(in_lidar, resolution)
+            if grid_info is not None and \
+                    grid_info['n_cols'] * grid_info['n_rows'] < dem_common.CHUNKED_WARP_MIN_PIXELS:
+                dem_subset_cpus = 1
+        dem_subset_cpus = max(1, min(dem_subset_cpus, patch_graph.num_processes))
+        dem_subset_memory_mb = max(dem_task_graph.DEFAULT_TASK_MEMORY_MB,
+                                   dem_subset_cpus * dem_common.WARP_WINDOW_MEMORY_MB)
+
+        temp_mosaic_dem = scratch.get_temp_file(prefix='dem_subset',suffix='.dem',
+                                                size_mb=intermediate_size_mb,
+                                                allow_memory=True)
+        temp_lidar_dem = scratch.get_temp_file(prefix='lidar_dem_mosaic',suffix='.dem',
+                                               size_mb=intermediate_size_mb,
+                                               allow_memory=True)
+
+        lidar_state = {'lidar_dem_mosaic' : lidar_dem_mosaic}
+
+        def _create_lidar_mosaic_stage():
+            if lidar_format.upper() != 'GRIDDED':
+                # Create DEM from individual lidar lines and patch together
+                # If a string is passed in convert to a list
+                if isinstance(in_lidar, str):
+                    in_lidar_list = [in_lidar]
                 else:
-                    raise Exception('Multiple gridded lidar files are not currently'
-                                    'supported. Mosaic them first')
+                    in_lidar_list = in_lidar
+
+                create_lidar_mosaic(in_lidar_list,lidar_state['lidar_dem_mosaic'],
+                                    out_screenshot=lidar_screenshots,
+                                    shaded_relief_screenshots=shaded_relief_screenshots,
+                                    in_projection=in_lidar_projection,
+                                    resolution=resolution,
+                                    nodata=dem_common.NODATA_VALUE,
+                                    lidar_format=lidar_format,
+                                    raster_type=out_raster_type,
+                                    fill_nulls=fill_lidar_nulls)
+
             else:
-                lidar_dem_mosaic = in_lidar
-            # Check GDAL can open dataset (will raise exception if not)
-            dem_utilities.check_gdal_dataset(lidar_dem_mosaic)
+                if isinstance(in_lidar, list):
+                    if len(in_lidar) == 1:
+                        lidar_state['lidar_dem_mosaic'] = in_lidar[0]
+                    else:
+                        raise Exception('Multiple gridded lidar files are not currently'
+                                        'supported. Mosaic them first')
+                else:
+                    lidar_state['lidar_dem_mosaic'] = in_lidar
+                # Check GDAL can open dataset (will raise exception if not)
+                dem_utilities.check_gdal_dataset(lidar_state['lidar_dem_mosaic'])
 
-            print('')
-            dem_common_functions.PrintTermWidth('Using existing LiDAR mosaic',
-                                                padding_char='*')
-            print('')
+                print('')
+                dem_common_functions.PrintTermWidth('Using existing LiDAR mosaic',
+                                                    padding_char='*')
+                print('')
 
-        # Check if input projection is equal to output projection
-        if in_lidar_projection != out_patched_projection:
-            dem_utilities.call_gdalwarp(lidar_dem_mosaic, temp_lidar_dem,
+        def _reproject_lidar_mosaic_stage():
+            dem_utilities.call_gdalwarp(lidar_state['lidar_dem_mosaic'], temp_lidar_dem,
                    s_srs=grass_library.grass_location_to_proj4(in_lidar_projection),
                    t_srs=grass_library.grass_location_to_proj4(out_patched_projection))
 
             # Get no data value from LiDAR
-            lidar_mosaic_nodata = dem_utilities.get_nodata_value(lidar_dem_mosaic)
-            if lidar_dem_mosaic is None:
+            lidar_mosaic_nodata = dem_utilities.get_nodata_value(lidar_state['lidar_dem_mosaic'])
+            if lidar_state['lidar_dem_mosaic'] is None:
                 lidar_mosaic_nodata = dem_common.NODATA_VALUE
             # Check if a vertical datum shift is required.
             # At the moment only consider UKBNG to WGS84LL
@@ -260,51 +339,52 @@ def create_patched_lidar_mosaic(in_lidar,
                                                  innodata=lidar_mosaic_nodata,
                                                  outnodata=dem_common.NODATA_VALUE,
                                                  remove_grassdb=False)
-            lidar_dem_mosaic = temp_lidar_dem
+            lidar_state['lidar_dem_mosaic'] = temp_lidar_dem
 
-        if patch_with_dem:
-            print('')
-            dem_common_functions.PrintTermWidth('Patching with {}'.format(in_dem_mosaic), padding_char='*')
-            print('')
-            subset_to_nav_failed = False
-            if subset_to_navigation:
-                try:
-                    # Subset DEM
-                    dem_nav_utilities.subset_dem_to_nav(in_dem_mosaic, temp_mosaic_dem,
-                                      nav, project,
-                                      separation_file=separation_file,
-                                      ascii_separation_file=ascii_separation_file,
-                                      in_dem_projection=grass_library.grass_location_to_proj4(in_dem_mosaic_projection),
-                                      out_projection=grass_library.grass_location_to_proj4(out_patched_projection),
-                                      nodata=dem_common.NODATA_VALUE,
-                                      out_res=resolution,
-                                      remove_grassdb=True,
-                                      fill_nulls=True)
-                except Exception as err:
-                    dem_common_functions.ERROR('Could not subset DEM to navigation data.\n{}.'.format(err))
-                    dem_common_functions.WARNING('Will try to subset using lidar bounds, coverage of DEM might not be sufficient for hyperspectral processing')
-                    subset_to_nav_failed = True
-
-            if not subset_to_navigation or (subset_to_navigation and subset_to_nav_failed):
-                print('Getting bounding box from LiDAR mosaic')
-                # Get bounding box from output lidar mosaic
-                lidar_bb = dem_utilities.get_gdal_dataset_bb(lidar_dem_mosaic,
-                                                             output_ll=True)
-                buffered_lidar_bb = get_lidar_buffered_bb(lidar_bb)
-
-                dem_utilities.subset_dem_to_bounding_box(in_dem_mosaic,
-                                     temp_mosaic_dem,
-                                     bounding_box=buffered_lidar_bb,
-                                     separation_file=separation_file,
-                                     ascii_separation_file=ascii_separation_file,
-                                     in_dem_projection=grass_library.grass_location_to_proj4(in_dem_mosaic_projection),
-                                     out_projection=grass_library.grass_location_to_proj4(out_patched_projection),
-                                     nodata=dem_common.NODATA_VALUE,
-                                     out_res=resolution,
-                                     remove_grassdb=True,
-                                     fill_nulls=True)
-
-            dem_utilities.patch_files([lidar_dem_mosaic, temp_mosaic_dem],
+        def _subset_dem_to_nav_stage():
+            """Subset DEM to navigation data, returns False if this fails"""
+            try:
+                # Subset DEM
+                dem_nav_utilities.subset_dem_to_nav(in_dem_mosaic, temp_mosaic_dem,
+                                  nav, project,
+                                  separation_file=separation_file,
+                                  ascii_separation_file=ascii_separation_file,
+                                  in_dem_projection=grass_library.grass_location_to_proj4(in_dem_mosaic_projection),
+                                  out_projection=grass_library.grass_location_to_proj4(out_patched_projection),
+                                  nodata=dem_common.NODATA_VALUE,
+                                  out_res=resolution,
+                                  remove_grassdb=True,
+                                  fill_nulls=True)
+                return True
+            except Exception as err:
+                dem_common_functions.ERROR('Could not subset DEM to navigation data.\n{}.'.format(err))
+                dem_common_functions.WARNING('Will try to subset using lidar bounds, coverage of DEM might not be sufficient for hyperspectral processing')
+                return False
+
+        def _subset_dem_to_lidar_bounds_stage():
+            # Only needed if not subsetting to navigation or this failed
+            if subset_to_navigation and patch_graph.get_result('dem_subset_nav'):
+                return
+            print('Getting bounding box from LiDAR mosaic')
+            # Get bounding box from output lidar mosaic
+            lidar_bb = dem_utilities.get_gdal_dataset_bb(lidar_state['lidar_dem_mosaic'],
+                                                         output_ll=True)
+            buffered_lidar_bb = get_lidar_buffered_bb(lidar_bb)
+
+            dem_utilities.subset_dem_to_bounding_box(in_dem_mosaic,
+                                 temp_mosaic_dem,
+                                 bounding_box=buffered_lidar_bb,
+                                 separation_file=separation_file,
+                                 ascii_separation_file=ascii_separation_file,
+                                 in_dem_projection=grass_library.grass_location_to_proj4(in_dem_mosaic_projection),
+                                 out_projection=grass_library.grass_location_to_proj4(out_patched_projection),
+                                 nodata=dem_common.NODATA_VALUE,
+                                 out_res=resolution,
+                                 remove_grassdb=True,
+                                 fill_nulls=True)
+
+        def _patch_stage():
+            dem_utilities.patch_files([lidar_state['lidar_dem_mosaic'], temp_mosaic_dem],
                         out_file=outdem,
                         import_to_grass=True,
                         nodata=dem_common.NODATA_VALUE,
@@ -312,8 +392,50 @@ def create_patched_lidar_mosaic(in_lidar,
                         grassdb_path=None,
                         remove_grassdb=True)
 
+        patch_graph.add_task('lidar_mosaic', _create_lidar_mosaic_stage,
+                             grass_workspace=concurrent_stages,
+                             memory_mb=lidar_memory_mb)
+        lidar_final_stage = 'lidar_mosaic'
+
+        # Check if input projection is equal to output projection
+        if in_lidar_projection != out_patched_projection:
+            patch_graph.add_task('lidar_reproject', _reproject_lidar_mosaic_stage,
+                                 depends_on=['lidar_mosaic'],
+                                 outputs=[temp_lidar_dem],
+                                 grass_workspace=concurrent_stages,
+                                 memory_mb=lidar_grid_memory_mb)
+            lidar_final_stage = 'lidar_reproject'
+
+        if patch_with_dem:
+            print('')
+            dem_common_functions.PrintTermWidth('Patching with {}'.format(in_dem_mosaic), padding_char='*')
+            print('')
+            dem_subset_depends = [lidar_final_stage]
+            if subset_to_navigation:
+                patch_graph.add_task('dem_subset_nav', _subset_dem_to_nav_stage,
+                                     grass_workspace=concurrent_stages,
+                                     cpus=dem_subset_cpus,
+                                     memory_mb=dem_subset_memory_mb)
+                dem_subset_depends.append('dem_subset_nav')
+
+            patch_graph.add_task('dem_subset_lidar_bounds',
+                                 _subset_dem_to_lidar_bounds_stage,
+                                 depends_on=dem_subset_depends,
+                                 grass_workspace=concurrent_stages,
+                                 cpus=dem_subset_cpus,
+                                 memory_mb=dem_subset_memory_mb)
+            patch_graph.add_task('patch', _patch_stage,
+                                 depends_on=[lidar_final_stage,
+                                             'dem_subset_lidar_bounds'],
+                                 outputs=[outdem],
+                                 grass_workspace=concurrent_stages,
+                                 memory_mb=lidar_grid_memory_mb)
+
+        patch_graph.run()
+        lidar_dem_mosaic = lidar_state['lidar_dem_mosaic']
+
         # Check if file was reprojected but not patched (if so need to move from temp file)
-        elif in_lidar_projection != out_patched_projection:
+        if not patch_with_dem and in_lidar_projection != out_patched_projection:
             shutil.move(lidar_dem_mosaic,outdem)
             shutil.move(lidar_dem_mosaic_header,outdem_header)
 
@@ -338,30 +460,50 @@ def create_patched_lidar_mosaic(in_lidar,
         dem_utilities.add_dem_metadata(outdem, dem_source=patched_dem_source,
                                        other_items={'Type' : out_raster_type})
 
+    finally:
         # Remove temp files created
-        for temp_handler in temp_file_handler_list:
-            os.close(temp_handler)
-        for temp_file in temp_file_list:
-            if os.path.isfile(temp_file):
-                os.remove(temp_file)
+        scratch.cleanup()
 
-    except KeyboardInterrupt:
-        # Remove temp files created
-        for temp_handler in temp_file_handler_list:
-            os.close(temp_handler)
-        for temp_file in temp_file_list:
-            if os.path.isfile(temp_file):
-                os.remove(temp_file)
-        raise
-
-    except Exception as err:
-        # Remove temp files created
-        for temp_handler in temp_file_handler_list:
-            os.close(temp_handler)
-        for temp_file in temp_file_list:
-            if os.path.isfile(temp_file):
-                os.remove(temp_file)
-        raise
+def _get_lidar_files_list(in_lidar_files, lidar_format='LAS'):
+    """
+    Get list of lidar files from a list of files, directory containing
+    files or path to a single file (may contain wildcards).
+
+    Returns list of files and format (LAS or ASCII).
+    """
+    # Expect a list of files, if passed in string
+    # create list.
+    if isinstance(in_lidar_files,str):
+        in_lidar_files = [in_lidar_files]
+
+    # If a directory, look for files
+    if os.path.isdir(in_lidar_files[0]):
+        if lidar_format.upper() == 'LAS':
+            in_lidar_files_list = glob.glob(
+                              os.path.join(in_lidar_files[0],'*[Ll][Aa][Ss]'))
+            in_lidar_files_list.extend(glob.glob(
+                              os.path.join(in_lidar_files[0],'*[Ll][Aa][Zz]')))
+
+        # If ASCII format or not las files found check for txt files
+        if lidar_format.upper() == 'ASCII' or len(in_lidar_files_list) == 0:
+            in_lidar_files_list = glob.glob(
+                              os.path.join(in_lidar_files[0],'*txt'))
+            if len(in_lidar_files_list) != 0:
+                lidar_format = 'ASCII'
+    # Check if wild character has been passed in which wasn't expanded (e.g., on windows)
+    # or no matching files were found (which will raise exception later).
+    elif in_lidar_files[0].find('*') > -1:
+        in_lidar_files_list = glob.glob(in_lidar_files[0])
+    else:
+        in_lidar_files_list = in_lidar_files
+        if os.path.splitext(in_lidar_files_list[0])[-1].lower() != '.las' \
+          and os.path.splitext(in_lidar_files_list[0])[-1].lower() != '.laz':
+            lidar_format = 'ASCII'
+
+    if len(in_lidar_files_list) == 0:
+        raise Exception('No lidar files were passed in or found from path provided')
+
+    return in_lidar_files_list, lidar_format
 
 def create_lidar_mosaic(in_lidar_files, out_mosaic,
                      out_screenshot=None,
@@ -452,38 +594,43 @@ def create_lidar_mosaic(in_lidar_files, out_mosaic,
     out_raster_type = dem_common.GDAL_OUTFILE_DATATYPE
 
     # Sort out input lidar files
+    in_lidar_files_list, lidar_format = _get_lidar_files_list(in_lidar_files,
+                                                              lidar_format)
 
-    # Expect a list of files, if passed in string
-    # create list.
-    if isinstance(in_lidar_files,str):
-        in_lidar_files = [in_lidar_files]
-
-    # If a directory, look for files
-    if os.path.isdir(in_lidar_files[0]):
-        if lidar_format.upper() == 'LAS':
-            in_lidar_files_list = glob.glob(
-                              os.path.join(in_lidar_files[0],'*[Ll][Aa][Ss]'))
-            in_lidar_files_list.extend(glob.glob(
-                              os.path.join(in_lidar_files[0],'*[Ll][Aa][Zz]')))
-
-        # If ASCII format or not las files found check for txt files
-        if lidar_format.upper() == 'ASCII' or len(in_lidar_files_list) == 0:
-            in_lidar_files_list = glob.glob(
-                              os.path.join(in_lidar_files[0],'*txt'))
-            if len(in_lidar_files_list) != 0:
-                lidar_format = 'ASCII'
-    # Check if wild character has been passed in which wasn't expanded (e.g., on windows)
-    # or no matching files were found (which will raise exception later).
-    elif in_lidar_files[0].find('*') > -1:
-        in_lidar_files_list = glob.glob(in_lidar_files[0])
-    else:
-        in_lidar_files_list = in_lidar_files
-        if os.path.splitext(in_lidar_files_list[0])[-1].lower() != '.las' \
-          and os.path.splitext(in_lidar_files_list[0])[-1].lower() != '.laz':
-            lidar_format = 'ASCII'
+    # Record number of points (from LAS headers) in trace
+    if dem_trace.is_enabled() and lidar_format.upper() == 'LAS':
+        for in_lidar_file in in_lidar_files_list:
+            try:
+                dem_trace.record(points=get_las_header_info(in_lidar_file)['num_points'])
+            except (IOError, OSError, struct.error):
+                pass
 
-    if len(in_lidar_files_list) == 0:
-        raise Exception('No lidar files were passed in or found from path provided')
+    # Use cached mosaic if one has been created previously from the same
+    # files with the same parameters. Only used if the mosaic is being
+    # exported and not required in a GRASS database.
+    cache_key = None
+    if dem_result_cache.is_enabled() and out_mosaic is not None \
+            and remove_grassdb and grassdb_path is None and out_screenshot is None:
+        try:
+            # Order of files is kept as it determines which line is used
+            # where lines overlap.
+            cache_key = dem_result_cache.get_cache_key(in_lidar_files_list,
+                                    function='create_lidar_mosaic',
+                                    in_projection=in_projection,
+                                    resolution=resolution,
+                                    nodata=nodata,
+                                    lidar_format=lidar_format.upper(),
+                                    raster_type=raster_type.upper(),
+                                    fill_nulls=fill_nulls,
+                                    out_mosaic_ext=os.path.splitext(out_mosaic)[-1].lower(),
+                                    out_raster_format=dem_common.GDAL_OUTFILE_FORMAT,
+                                    out_raster_type=out_raster_type,
+                                    output_profile=dem_utilities.get_output_profile())
+        except OSError:
+            # Input files don't exist, will raise exception below
+            cache_key = None
+        if cache_key is not None and dem_result_cache.fetch(cache_key, out_mosaic):
+            return out_mosaic, None
 
     out_screenshots_dir = None
     try:
@@ -513,6 +660,9 @@ def create_lidar_mosaic(in_lidar_files, out_mosaic,
         dem_common_functions.PrintTermWidth('Creating LiDAR raster for a single line',padding_char='*')
     print('')
 
+    # Import GRASS module (only imported when first used)
+    grass_lidar = lidar_backends.load_backend('GRASS')
+
     for in_lidar_file in in_lidar_files_list:
         dem_common_functions.PrintTermWidth('Creating {0} raster from "{1}" ({2}/{3})'.format(raster_type,os.path.split(in_lidar_file)[-1],linenum, totlines))
         # Check file exists
@@ -607,12 +757,123 @@ def create_lidar_mosaic(in_lidar_files, out_mosaic,
 
     # Remove GRASS database created
     if remove_grassdb:
-        shutil.rmtree(grassdb_path)
+        grass_library.grassDBremove(grassdb_path)
+        if cache_key is not None:
+            dem_result_cache.store(cache_key, out_mosaic)
         return out_mosaic, None
     else:
         print(patched_name)
         return patched_name, grassdb_path
 
+def create_lidar_quicklooks(in_lidar_files, out_dir,
+                            raster_type='DSM',
+                            in_projection=dem_common.DEFAULT_LIDAR_PROJECTION_GRASS,
+                            resolution=dem_common.LIDAR_QUICKLOOK_RES_METRES,
+                            subsample_method=dem_common.LIDAR_QUICKLOOK_SUBSAMPLE,
+                            subsample_factor=dem_common.LIDAR_QUICKLOOK_SUBSAMPLE_FACTOR,
+                            lidar_format='LAS',
+                            create_jpeg=True):
+    """
+    Create a coarse quicklook raster and JPEG for each lidar file (e.g., for
+    checking data after download).
+
+    Rather than using all points, rasters are created using the NumPy method
+    from a subsample of points:
+
+    * NTH - every 'subsample_factor' point.
+    * RANDOM - 1 in 'subsample_factor' points selected at random within each block of points read.
+    * COPC - for COPC files only octree levels needed for 'resolution' are read, other files use NTH.
+
+    If a file can't be read a warning is printed and the remaining files
+    are processed.
+
+    Arguments:
+
+    * in_lidar_files - List of input lidar files in ASCII or LAS format (must all be the same format), directory containing files or path to a single file.
+    * out_dir - Output directory for quicklooks.
+    * raster_type - Type of output raster (DSM, DTM, DEM or INTENSITY, see create_lidar_mosaic).
+    * in_projection - Input projection of lidar data (e.g., UKBNG).
+    * resolution - Resolution of quicklooks in units of input projection (normally metres).
+    * subsample_method - NTH, RANDOM or COPC.
+    * subsample_factor - Use 1 in every 'subsample_factor' points (NTH and RANDOM).
+    * lidar_format - LAS or ASCII.
+    * create_jpeg - Export each quicklook as a JPEG (shaded relief for elevation).
+
+    Returns:
+
+    * list of (quicklook raster, JPEG file / None) for each file
+
+    """
+    numpy_backend = lidar_backends.get_backend('NumPy')
+    if not numpy_backend.is_available():
+        raise Exception('Quicklooks require the NumPy method, check NumPy, GDAL '
+                        'and laspy (or LAStools) have been installed')
+    numpy_lidar = numpy_backend.load()
+
+    # Set options for raster type, as for create_lidar_mosaic
+    returns_to_keep = 'all'
+    val_field = 'z'
+    if raster_type.upper() == 'DSM':
+        returns_to_keep = 'first'
+    elif raster_type.upper() == 'DTM':
+        returns_to_keep = 'last'
+    elif raster_type.upper() == 'INTENSITY':
+        val_field = 'intensity'
+    elif raster_type.upper() != 'DEM':
+        raise Exception('raster_type "{}" was not recognised, options are DSM, '
+                        'DTM, DEM or INTENSITY'.format(raster_type))
+
+    in_lidar_files_list, lidar_format = _get_lidar_files_list(in_lidar_files,
+                                                              lidar_format)
+
+    dem_common_functions.CheckPathExistsAndIsWritable(out_dir)
+
+    wkt_projection = None
+    if in_projection is not None:
+        wkt_projection = grass_library.grass_location_to_wkt(in_projection)
+
+    out_raster_ext = get_gdal_drivers.get_drivers().get_ext_from_driver(
+                                                    dem_common.GDAL_OUTFILE_FORMAT)
+
+    # For COPC files only read levels needed for the resolution
+    point_resolution = None
+    if subsample_method is not None and subsample_method.upper() == 'COPC':
+        point_resolution = resolution
+
+    quicklooks = []
+    for in_lidar_file in sorted(in_lidar_files_list):
+        start_time = time.time()
+        out_base = os.path.splitext(os.path.basename(in_lidar_file))[0]
+        out_raster = os.path.join(out_dir, '{}_{}_quicklook{}'.format(out_base,
+                                                                     raster_type.lower(),
+                                                                     out_raster_ext))
+        out_jpeg = None
+        try:
+            numpy_lidar.las_to_raster(in_lidar_file, out_raster,
+                                      val_field=val_field,
+                                      drop_class=7,
+                                      returns=returns_to_keep,
+                                      projection=wkt_projection,
+                                      bin_size=resolution,
+                                      point_resolution=point_resolution,
+                                      subsample_method=subsample_method,
+                                      subsample_factor=subsample_factor,
+                                      lidar_format=lidar_format)
+            if create_jpeg:
+                out_jpeg = dem_utilities.get_screenshot_path(out_raster, out_dir)
+                dem_utilities.export_quicklook(out_raster, out_jpeg,
+                                               shaded_relief=(raster_type.upper() != 'INTENSITY'))
+        except Exception as err:
+            dem_common_functions.WARNING('Could not create quicklook for '
+                                         '{}. {}'.format(in_lidar_file, err))
+            continue
+
+        print('Created quicklook for {} in {:.1f} s'.format(in_lidar_file,
+                                                           time.time() - start_time))
+        quicklooks.append((out_raster, out_jpeg))
+
+    return quicklooks
+
 def get_lidar_buffered_bb(in_bounding_box, bb_buffer=dem_common.DEFAULT_LIDAR_DEM_BUFFER):
     """
     Buffer a bounding box (in degrees) by the standard lidar buffer size (in m)
@@ -647,3 +908,131 @@ def get_lidar_buffered_bb(in_bounding_box, bb_buffer=dem_common.DEFAULT_LIDAR_DE
     out_bounding_box[3] = in_bounding_box[3] + east_buffer
 
     return out_bounding_box
+
+def get_las_header_info(in_las_file):
+    """
+    Read version, number of points and bounds from the header of a
+    LAS / LAZ file. Reads the header directly so doesn't require laspy.
+
+    Arguments:
+
+    * in_las_file - input LAS / LAZ file.
+
+    Returns:
+
+    * dictionary with keys 'version', 'num_points', 'min_x', 'max_x',
+      'min_y', 'max_y', 'min_z' and 'max_z'.
+
+    """
+    with open(in_las_file, 'rb') as las_fh:
+        header = las_fh.read(LAS_HEADER_READ_BYTES)
+
+    if len(header) < 227 or header[0:4] != b'LASF':
+        raise IOError('Could not read LAS header from {}'.format(in_las_file))
+
+    version_major, version_minor = struct.unpack('<BB', header[24:26])
+
+    num_points = struct.unpack('<I', header[107:111])[0]
+    # LAS 1.4 stores the number of points as a 64 bit integer. The
+    # legacy field is 0 if there are more points than fit in 32 bits.
+    if (version_major, version_minor) >= (1, 4) and len(header) >= 255:
+        num_points_64 = struct.unpack('<Q', header[247:255])[0]
+        if num_points_64 > 0:
+            num_points = num_points_64
+
+    max_x, min_x, max_y, min_y, max_z, min_z = struct.unpack('<6d',
+                                                             header[179:227])
+
+    return {'version' : '{}.{}'.format(version_major, version_minor),
+            'num_points' : num_points,
+            'min_x' : min_x,
+            'max_x' : max_x,
+            'min_y' : min_y,
+            'max_y' : max_y,
+            'min_z' : min_z,
+            'max_z' : max_z}
+
+def _get_las_grid_info(in_lidar_files, resolution):
+    """
+    Get size of grid covering LAS / LAZ files and number of points in
+    the largest file, using the header of each file.
+
+    Arguments:
+
+    * in_lidar_files - list of LAS / LAZ files, directory containing files or path to a single file.
+    * resolution - resolution of grid.
+
+    Returns:
+
+    * dictionary with keys 'n_cols', 'n_rows' and 'max_points' or None if
+      this can't be found (e.g., files are not LAS)
+
+    """
+    if isinstance(in_lidar_files, str):
+        if os.path.isdir(in_lidar_files):
+            in_lidar_files = glob.glob(os.path.join(in_lidar_files, '*.[lL][aA][sSzZ]'))
+        else:
+            in_lidar_files = [in_lidar_files]
+
+    bounds = None
+    max_points = 0
+    for in_lidar_file in in_lidar_files:
+        try:
+            header_info = get_las_header_info(in_lidar_file)
+        except (IOError, OSError, struct.error):
+            return None
+        max_points = max(max_points, header_info['num_points'])
+        if bounds is None:
+            bounds = [header_info['min_x'], header_info['max_x'],
+                      header_info['min_y'], header_info['max_y']]
+        else:
+            bounds[0] = min(bounds[0], header_info['min_x'])
+            bounds[1] = max(bounds[1], header_info['max_x'])
+            bounds[2] = min(bounds[2], header_info['min_y'])
+            bounds[3] = max(bounds[3], header_info['max_y'])
+
+    if bounds is None or resolution <= 0:
+        return None
+
+    return {'n_cols' : int((bounds[1] - bounds[0]) / resolution) + 1,
+            'n_rows' : int((bounds[3] - bounds[2]) / resolution) + 1,
+            'max_points' : max_points}
+
+def estimate_lidar_raster_memory_mb(in_lidar_files, resolution,
+                                    n_grids=3,
+                                    bytes_per_point=LIDAR_MEMORY_BYTES_PER_POINT):
+    """
+    Estimate the memory needed to create a raster mosaic from LAS / LAZ
+    files, using the bounds and number of points in the header of each file.
+
+    GRASS keeps several grids (e.g., sum and count of points) covering the
+    mosaic in memory while binning points so the estimate is the size of
+    'n_grids' double precision grids covering the bounds of all files. Files
+    are converted and gridded one at a time, so 'bytes_per_point' for each
+    point in the largest file is added to this.
+
+    Arguments:
+
+    * in_lidar_files - list of LAS / LAZ files, directory containing files or path to a single file.
+    * resolution - resolution of output raster.
+    * n_grids - number of grids held in memory at once.
+    * bytes_per_point - memory needed for each point of the largest file (0 to only include grids).
+
+    Returns:
+
+    * memory in MB (int) or None if it can't be estimated (e.g., files are not LAS)
+
+    """
+    grid_info = _get_las_grid_info(in_lidar_files, resolution)
+    if grid_info is None:
+        return None
+
+    grid_memory_mb = dem_task_graph.estimate_grid_memory_mb(grid_info['n_cols'],
+                                                            grid_info['n_rows'],
+                                                            n_grids=n_grids)
+    points_memory_mb = int(float(grid_info['max_points']) * bytes_per_point
+                           / (1024 * 1024))
+    return grid_memory_mb + points_memory_mb
+
+# Record a span for each call to a public function when tracing is enabled
+dem_trace.trace_public_functions(globals())
@@ -0,0 +1,416 @@
+#! /usr/bin/env python
+#
+# This file has been created by ARSF Data Analysis Node and
+# is licensed under the GPL v3 Licence. A copy of this
+# licence is available to download with this file.
+
+"""
+Functions for creating rasters from lidar data using NumPy.
+
+Points are read from the point cache (see point_cache) so the LAS file only
+needs to be read the first time a raster is created from it. Rasters are
+created by binning points into cells, in the same way as GRASS (r.in.xyz):
+
+* DSM - mean elevation of first returns.
+* DTM - mean elevation of last returns.
+* Intensity - mean intensity of last returns.
+
+Points flagged as noise (class 7) are dropped. Requires NumPy and GDAL, LAS
+files are read using laspy if available or las2txt.
+
+If a bounding box is provided only blocks of points which intersect it are
+read from spatially sorted caches (see POINT_CACHE_SPATIAL_SORT). For COPC
+files only the octree nodes which intersect it are decompressed.
+
+Rasters which would need more than NUMPY_GRID_MAX_MEMORY_MB for grids
+(e.g., a mosaic of several lines at a fine resolution) are created in
+blocks of rows, written to a temporary GeoTIFF in the scratch directory.
+
+Available functions:
+
+* las_to_raster - create raster from LAS file(s).
+* las_to_dsm - create DSM from LAS file(s).
+* las_to_dtm - create DTM from LAS file(s).
+* las_to_intensity - create intensity image from LAS file(s).
+
+"""
+
+from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
+import math
+
+from .. import dem_common
+from .. import dem_scratch
+from .. import dem_utilities
+from .. import dem_trace
+from .. import get_gdal_drivers
+from . import laspy_lidar
+from . import point_cache
+
+#: NumPy is available
+HAVE_NUMPY = True
+try:
+    import numpy
+except ImportError:
+    HAVE_NUMPY = False
+
+# Try to import GDAL
+HAVE_GDAL=True
+try:
+    from osgeo import gdal
+    from osgeo import gdal_array
+except ImportError:
+    # If can't import don't complain until GDAL is actually needed
+    HAVE_GDAL=False
+
+#: Statistics which can be used for cell values
+RASTER_STATISTICS = ['mean', 'min', 'max', 'n']
+
+#: Memory needed for each cell when gridding (count and value accumulators, output, temporary arrays)
+GRID_BYTES_PER_CELL = 48
+
+def _checkNumPy():
+    """
+    Check if NumPy and GDAL are available and LAS files can be read
+    (using laspy or las2txt).
+    """
+    if not HAVE_NUMPY or not HAVE_GDAL:
+        return False
+    if laspy_lidar.HAVE_LASPY:
+        return True
+    from . import lastools_lidar
+    return lastools_lidar._checkFreeLAStools()
+
+def _get_grid(points_list, resolution, bounding_box=None):
+    """
+    Get grid covering points (or bounding box), aligned to a multiple
+    of the resolution.
+
+    Returns top left (x, y) and size (columns, rows)
+    """
+    if bounding_box is not None:
+        min_y, max_y, min_x, max_x = bounding_box
+    else:
+        min_x = min([points.bounds[0][0] for points in points_list])
+        max_x = max([points.bounds[0][1] for points in points_list])
+        min_y = min([points.bounds[1][0] for points in points_list])
+        max_y = max([points.bounds[1][1] for points in points_list])
+
+    left = math.floor(min_x / resolution) * resolution
+    top = math.ceil(max_y / resolution) * resolution
+    n_cols = max(int(math.ceil((max_x - left) / resolution)), 1)
+    n_rows = max(int(math.ceil((top - min_y) / resolution)), 1)
+
+    return (left, top), (n_cols, n_rows)
+
+def _grid_rows(points_list, left, top, bin_size, n_cols, n_rows,
+               row_start, row_end,
+               val_field='z', drop_class=7, keep_class=None,
+               returns='all', raster_statistic='mean',
+               nodata=dem_common.NODATA_VALUE, bounding_box=None):
+    """
+    Bin points into cells for a block of rows (row_start to row_end) of
+    the output grid.
+
+    Returns numpy array (float64) of shape (row_end - row_start, n_cols)
+    """
+    block_rows = row_end - row_start
+    n_cells = n_cols * block_rows
+
+    # Only read points which may be within the block (with a margin for
+    # rounding, points are assigned to rows below).
+    block_bounding_box = [top - (row_end + 0.5) * bin_size,
+                          top - (row_start - 0.5) * bin_size,
+                          left - 0.5 * bin_size,
+                          left + (n_cols + 0.5) * bin_size]
+
+    cell_count = numpy.zeros(n_cells, dtype=numpy.int64)
+    if raster_statistic == 'mean':
+        cell_values = numpy.zeros(n_cells, dtype=numpy.float64)
+    elif raster_statistic == 'min':
+        cell_values = numpy.full(n_cells, numpy.inf)
+    elif raster_statistic == 'max':
+        cell_values = numpy.full(n_cells, -numpy.inf)
+
+    for points in points_list:
+        for start, end in points.iter_chunks(bounding_box=block_bounding_box):
+            mask = points.get_mask(start, end, returns=returns,
+                                   drop_class=drop_class,
+                                   keep_class=keep_class,
+                                   bounding_box=bounding_box)
+            if not mask.any():
+                continue
+            cols = numpy.floor((points.get_coordinates('x', start, end)[mask] - left)
+                               / bin_size).astype(numpy.int64)
+            rows = numpy.floor((top - points.get_coordinates('y', start, end)[mask])
+                               / bin_size).astype(numpy.int64)
+            # Points on the right / bottom edge go in the last cell
+            numpy.clip(cols, 0, n_cols - 1, out=cols)
+            numpy.clip(rows, 0, n_rows - 1, out=rows)
+            in_block = (rows >= row_start) & (rows < row_end)
+            if not in_block.any():
+                continue
+            cells = (rows[in_block] - row_start) * n_cols + cols[in_block]
+
+            cell_count += numpy.bincount(cells, minlength=n_cells)
+            if raster_statistic == 'n':
+                continue
+            values = points.get_values(val_field, start, end)[mask][in_block].astype(numpy.float64)
+            if raster_statistic == 'mean':
+                cell_values += numpy.bincount(cells, weights=values, minlength=n_cells)
+            elif raster_statistic == 'min':
+                numpy.minimum.at(cell_values, cells, values)
+            elif raster_statistic == 'max':
+                numpy.maximum.at(cell_values, cells, values)
+
+    if raster_statistic == 'n':
+        out_array = cell_count.astype(numpy.float64)
+    else:
+        out_array = numpy.full(n_cells, float(nodata))
+        has_points = cell_count > 0
+        if raster_statistic == 'mean':
+            out_array[has_points] = cell_values[has_points] / cell_count[has_points]
+        else:
+            out_array[has_points] = cell_values[has_points]
+    return out_array.reshape((block_rows, n_cols))
+
+def las_to_raster(in_las, out_raster,
+                  val_field='z',
+                  drop_class=7,
+                  keep_class=None,
+                  returns='all',
+                  raster_statistic='mean',
+                  projection=None,
+                  bin_size=dem_common.DEFAULT_LIDAR_RES_METRES,
+                  out_raster_type=dem_common.GDAL_OUTFILE_DATATYPE,
+                  nodata=dem_common.NODATA_VALUE,
+                  bounding_box=None,
+                  point_resolution=None,
+                  subsample_method=None,
+                  subsample_factor=1,
+                  lidar_format='LAS'):
+    """
+    Create raster from LAS file(s) by binning points into cells.
+
+    Arguments:
+
+    * in_las - Input LAS file or list of LAS files.
+    * out_raster - Output raster (extension determines format).
+    * val_field - field to use for cell values (z or intensity).
+    * drop_class - class / list of classes to drop.
+    * keep_class - class / list of classes to keep.
+    * returns - returns to use (all, first or last).
+    * raster_statistic - statistic for cell values (mean, min, max or n).
+    * projection - projection as WKT string (not set if None).
+    * bin_size - resolution of output raster.
+    * out_raster_type - GDAL datatype for output raster (e.g., Float32).
+    * nodata - value for cells without points.
+    * bounding_box - only create raster for points within bounding box [MinY, MaxY, MinX, MaxX] (default is all points).
+    * point_resolution - for COPC files only read octree levels needed for points with this spacing (default is all levels).
+    * subsample_method - NTH, RANDOM or COPC to only use a subsample of points (see point_cache).
+    * subsample_factor - use 1 in every 'subsample_factor' points.
+    * lidar_format - LAS or ASCII.
+
+    Returns:
+
+    * None
+
+    """
+    if not HAVE_NUMPY:
+        raise ImportError('Could not import NumPy')
+    if not HAVE_GDAL:
+        raise ImportError('Could not import GDAL')
+    if raster_statistic.lower() not in RASTER_STATISTICS:
+        raise Exception('Statistic "{}" not recognised, options are '
+                        '{}'.format(raster_statistic, ', '.join(RASTER_STATISTICS)))
+    raster_statistic = raster_statistic.lower()
+
+    if not isinstance(in_las, list):
+        in_las = [in_las]
+
+    bin_size = float(bin_size)
+    points_list = [point_cache.get_point_cache(in_las_file,
+                                               lidar_format=lidar_format,
+                                               bounding_box=bounding_box,
+                                               resolution=point_resolution,
+                                               subsample_method=subsample_method,
+                                               subsample_factor=subsample_factor)
+                   for in_las_file in in_las]
+    points_list = [points for points in points_list if points.num_points > 0]
+    if len(points_list) == 0:
+        raise Exception('No points found in {}'.format(', '.join(in_las)))
+
+    (left, top), (n_cols, n_rows) = _get_grid(points_list, bin_size, bounding_box)
+
+    # If grids for the whole raster would need too much memory split
+    # into blocks of rows.
+    grid_memory_mb = float(n_cols) * n_rows * GRID_BYTES_PER_CELL / (1024 * 1024)
+    block_rows = n_rows
+    if grid_memory_mb > dem_common.NUMPY_GRID_MAX_MEMORY_MB:
+        block_rows = max(int(n_rows * dem_common.NUMPY_GRID_MAX_MEMORY_MB / grid_memory_mb), 1)
+    num_blocks = int(math.ceil(n_rows / float(block_rows)))
+
+    print('Creating raster of {} x {} pixels from points'.format(n_cols, n_rows))
+    if num_blocks > 1:
+        print('Raster needs {:.0f} MB, more than NUMPY_GRID_MAX_MEMORY_MB ({} MB). '
+              'Creating in {} blocks of {} rows'.format(grid_memory_mb,
+                                                       dem_common.NUMPY_GRID_MAX_MEMORY_MB,
+                                                       num_blocks, block_rows))
+
+    gdal_type = gdal.GetDataTypeByName(out_raster_type)
+    numpy_type = gdal_array.GDALTypeCodeToNumericTypeCode(gdal_type)
+
+    with dem_scratch.scope() as scratch:
+        # Write to memory (or a temporary GeoTIFF if created in blocks)
+        # then copy to output format (not all drivers support Create).
+        if num_blocks > 1:
+            grid_size_mb = float(n_cols) * n_rows * numpy.dtype(numpy_type).itemsize / (1024 * 1024)
+            grid_file = scratch.get_temp_file(prefix='numpy_grid', suffix='.tif',
+                                              size_mb=grid_size_mb)
+            grid_ds = gdal.GetDriverByName('GTiff').Create(grid_file, n_cols, n_rows, 1,
+                                                           gdal_type,
+                                                           ['TILED=YES', 'BIGTIFF=IF_SAFER'])
+        else:
+            grid_ds = gdal.GetDriverByName('MEM').Create('', n_cols, n_rows, 1, gdal_type)
+        if grid_ds is None:
+            raise IOError('Could not create grid of {} x {} pixels'.format(n_cols, n_rows))
+        grid_ds.SetGeoTransform((left, bin_size, 0, top, 0, -bin_size))
+        if projection is not None:
+            grid_ds.SetProjection(projection)
+        grid_band = grid_ds.GetRasterBand(1)
+        grid_band.SetNoDataValue(nodata)
+
+        for row_start in range(0, n_rows, block_rows):
+            row_end = min(row_start + block_rows, n_rows)
+            out_array = _grid_rows(points_list, left, top, bin_size, n_cols, n_rows,
+                                   row_start, row_end,
+                                   val_field=val_field,
+                                   drop_class=drop_class,
+                                   keep_class=keep_class,
+                                   returns=returns,
+                                   raster_statistic=raster_statistic,
+                                   nodata=nodata,
+                                   bounding_box=bounding_box)
+            grid_band.WriteArray(out_array.astype(numpy_type), 0, row_start)
+            out_array = None
+
+        print('Exporting')
+        out_raster_format = dem_utilities.get_gdal_type_from_path(out_raster)
+        creation_options = dem_utilities.get_output_creation_options(out_raster_format,
+                                                                     out_raster_type)
+        if creation_options is None:
+            creation_options = get_gdal_drivers.get_drivers().get_creation_options_from_driver(out_raster_format)
+
+        out_ds = gdal.GetDriverByName(out_raster_format).CreateCopy(out_raster, grid_ds, 0,
+                                                                    creation_options)
+        if out_ds is None:
+            raise IOError('Could not create {}'.format(out_raster))
+        out_ds = None
+        grid_band = None
+        grid_ds = None
+
+    dem_utilities.remove_gdal_aux_file(out_raster)
+    dem_utilities.apply_output_profile(out_raster)
+
+    return None
+
+def las_to_dsm(in_las, out_raster,
+               projection=None,
+               bin_size=dem_common.DEFAULT_LIDAR_RES_METRES,
+               bounding_box=None):
+    """
+    Create Digital Surface Model (DSM) from LAS file(s) using the mean
+    elevation of first returns in each cell. Points flagged as noise
+    (class 7) are dropped.
+
+    Arguments:
+
+    * in_las - Input LAS file or list of LAS files.
+    * out_raster - Output raster (extension determines format).
+    * projection - projection as WKT string.
+    * bin_size - resolution of output raster.
+    * bounding_box - only create raster for points within bounding box [MinY, MaxY, MinX, MaxX] (default is all points).
+
+    Returns:
+
+    * None
+
+    """
+    las_to_raster(in_las, out_raster,
+                  val_field='z',
+                  drop_class=7,
+                  returns='first',
+                  projection=projection,
+                  bin_size=bin_size,
+                  bounding_box=bounding_box)
+
+    return None
+
+def las_to_dtm(in_las, out_raster,
+               projection=None,
+               bin_size=dem_common.DEFAULT_LIDAR_RES_METRES,
+               bounding_box=None):
+    """
+    Create Digital Terrain Model (DTM) from LAS file(s) using the mean
+    elevation of last returns in each cell. Points flagged as noise
+    (class 7) are dropped.
+
+    Not all last returns will be from the ground, therefore this is not a
+    true DTM.
+
+    Arguments:
+
+    * in_las - Input LAS file or list of LAS files.
+    * out_raster - Output raster (extension determines format).
+    * projection - projection as WKT string.
+    * bin_size - resolution of output raster.
+    * bounding_box - only create raster for points within bounding box [MinY, MaxY, MinX, MaxX] (default is all points).
+
+    Returns:
+
+    * None
+
+    """
+    las_to_raster(in_las, out_raster,
+                  val_field='z',
+                  drop_class=7,
+                  returns='last',
+                  projection=projection,
+                  bin_size=bin_size,
+                  bounding_box=bounding_box)
+
+    return None
+
+def las_to_intensity(in_las, out_raster,
+                     projection=None,
+                     bin_size=dem_common.DEFAULT_LIDAR_RES_METRES,
+                     bounding_box=None):
+    """
+    Create intensity image from LAS file(s) using the mean intensity
+    of last returns in each cell. Points flagged as noise (class 7)
+    are dropped.
+
+    Arguments:
+
+    * in_las - Input LAS file or list of LAS files.
+    * out_raster - Output raster (extension determines format).
+    * projection - projection as WKT string.
+    * bin_size - resolution of output raster.
+    * bounding_box - only create raster for points within bounding box [MinY, MaxY, MinX, MaxX] (default is all points).
+
+    Returns:
+
+    * None
+
+    """
+    las_to_raster(in_las, out_raster,
+                  val_field='intensity',
+                  drop_class=7,
+                  returns='last',
+                  projection=projection,
+                  bin_size=bin_size,
+                  bounding_box=bounding_box)
+
+    return None
+
+# Record a span for each call to a public function when tracing is enabled
+dem_trace.trace_public_functions(globals())
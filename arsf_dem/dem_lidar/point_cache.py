@@ -0,0 +1,887 @@
+#!/usr/bin/env python
+#
+# This file has been created by ARSF Data Analysis Node and
+# is licensed under the GPL v3 Licence. A copy of this
+# licence is available to download with this file.
+
+"""
+Cache of points from lidar files in a binary format which can be memory
+mapped.
+
+The first time a file is read, the points are stored as separate columns
+(x, y and z as scaled 32-bit integers, intensity, classification, return
+number and number of returns) along with a header containing the scale,
+offset and bounds. Subsequent reads map the columns directly rather than
+decompressing LAZ or parsing ASCII again, so creating rasters from the same
+file at a different resolution or of a different type is much faster.
+
+Points in a flight line are stored in the order they were acquired, so
+points in the same area of a raster are spread through the file. If
+POINT_CACHE_SPATIAL_SORT is enabled cached points are sorted by their Morton
+(Z-order) code and the bounds of each block of POINT_INDEX_CHUNK_SIZE points
+stored in an index. Points within an area are then contiguous, which gives
+better cache locality when binning, and only blocks which intersect a
+bounding box need to be read (see PointCache.iter_chunks).
+
+Points are read using laspy if available, otherwise the file is converted
+to ASCII using las2txt. For COPC files (see copc_lidar) only points within a
+bounding box and up to the octree level needed for a resolution can be read,
+these are cached separately for each bounding box and resolution.
+
+A subsample of points can be cached (e.g., for quicklooks), by keeping every
+Nth point ('NTH'), points selected at random within each block read
+('RANDOM') or, for COPC files, only reading levels needed for the resolution
+('COPC'). Subsampled points are cached separately from all points. Files
+are identified using the same fingerprint as dem_result_cache (path, size
+and modification time or a hash of the contents).
+
+The cache is stored in POINT_CACHE_PATH, when it is larger than
+POINT_CACHE_MAX_SIZE_MB the least recently used files are removed. All
+columns are memory mapped when a PointCache is created, so points can
+still be read if the entry is removed from the cache afterwards. The
+cache is disabled by default, it can be enabled using POINT_CACHE_ENABLED
+in the config file or 'set_enabled(True)'. If the cache is disabled points
+are stored in the scratch directory for the job and removed when it
+finishes.
+
+Available functions:
+
+* is_enabled - check if cache is enabled.
+* set_enabled - enable / disable cache.
+* get_point_cache - get PointCache for a lidar file (creating if needed).
+* build_point_cache - store points from a lidar file.
+* get_morton_codes - get Morton (Z-order) codes for points.
+* evict - remove least recently used files until cache is within size limit.
+* clear_cache - remove all cached points.
+
+Example::
+
+   from arsf_dem.dem_lidar import point_cache
+
+   points = point_cache.get_point_cache('in.las')
+   for start, end in points.iter_chunks():
+      z = points.get_coordinates('z', start, end)
+
+"""
+
+from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
+import os
+import json
+import math
+import time
+import shutil
+import hashlib
+import itertools
+import tempfile
+import threading
+
+from .. import dem_common
+from .. import dem_common_functions
+from .. import dem_result_cache
+from .. import dem_scratch
+from . import laspy_lidar
+from . import copc_lidar
+
+#: NumPy is available
+HAVE_NUMPY = True
+try:
+    import numpy
+except ImportError:
+    HAVE_NUMPY = False
+
+#: Version of cache format, changing this invalidates all cached points
+POINT_CACHE_VERSION = 2
+
+#: Number of points read / processed at once
+POINT_CHUNK_SIZE = 5000000
+
+#: Number of points in each block of the index for spatially sorted points
+POINT_INDEX_CHUNK_SIZE = 65536
+
+#: Number of bits x and y are quantised to for Morton codes
+MORTON_BITS = 16
+
+#: Methods which can be used to subsample points
+SUBSAMPLE_METHODS = ['NTH', 'RANDOM', 'COPC']
+
+#: Columns stored and their data types (little endian)
+POINT_COLUMNS = [('x', '<i4'),
+                 ('y', '<i4'),
+                 ('z', '<i4'),
+                 ('intensity', '<u2'),
+                 ('classification', '<u1'),
+                 ('returnnumber', '<u1'),
+                 ('numberofreturns', '<u1')]
+
+#: Scale used for coordinates read from ASCII files
+ASCII_COORDINATE_SCALE = 0.001
+
+# Name of header file within each entry
+_HEADER_FILE = 'header.json'
+# Name of index file within each entry
+_INDEX_FILE = 'chunk_index.bin'
+
+_CACHE_STATE = {'enabled' : dem_common.POINT_CACHE_ENABLED}
+_CACHE_LOCK = threading.Lock()
+
+def is_enabled():
+    """
+    Check if cache is enabled.
+    """
+    return _CACHE_STATE['enabled']
+
+def set_enabled(enabled=True):
+    """
+    Enable or disable cache (e.g., for '--no-cache').
+
+    Arguments:
+
+    * enabled - True / False
+
+    """
+    _CACHE_STATE['enabled'] = bool(enabled)
+
+class PointCache(object):
+    """
+    Points from a lidar file stored in a directory by build_point_cache.
+    All columns (and the index) are memory mapped when created, so points
+    can be read even if the directory is removed (e.g., evicted from the
+    cache by another line being added).
+
+    Attributes:
+
+    * cache_dir - directory points are stored in.
+    * num_points - number of points.
+    * scale - scale for x, y and z.
+    * offset - offset for x, y and z.
+    * bounds - bounds of points [[min_x,max_x],[min_y,max_y],[min_z,max_z]].
+    * spatial_sort - order points are sorted in ('morton' or None if not sorted).
+    * index_chunk_size - number of points in each block of the index (None if there is no index).
+
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, _HEADER_FILE), 'r') as header_fh:
+            header = json.load(header_fh)
+        if header.get('version') != POINT_CACHE_VERSION:
+            raise IOError('Point cache {} is from a different version'.format(cache_dir))
+        self.num_points = header['num_points']
+        self.scale = header['scale']
+        self.offset = header['offset']
+        self.bounds = header['bounds']
+        self.source = header.get('source')
+        self.spatial_sort = header.get('spatial_sort')
+        self.index_chunk_size = header.get('index_chunk_size')
+        self._columns = {}
+        for column_name, column_dtype in POINT_COLUMNS:
+            if self.num_points == 0:
+                self._columns[column_name] = numpy.zeros(0, dtype=column_dtype)
+            else:
+                self._columns[column_name] = numpy.memmap(os.path.join(cache_dir,
+                                                                       column_name + '.bin'),
+                                                          dtype=column_dtype, mode='r',
+                                                          shape=(self.num_points,))
+        self._chunk_index = None
+        if self.index_chunk_size is not None:
+            self._chunk_index = numpy.fromfile(os.path.join(cache_dir, _INDEX_FILE),
+                                               dtype='<f8').reshape((-1, 4))
+
+    def get_column(self, name):
+        """
+        Get a column (e.g., 'x', 'classification') as a read only
+        memory mapped array. Coordinates are scaled integers, use
+        get_coordinates to get values.
+        """
+        return self._columns[name]
+
+    def get_coordinates(self, name, start=0, end=None):
+        """
+        Get coordinates (x, y or z) for a range of points.
+
+        Arguments:
+
+        * name - x, y or z.
+        * start - index of first point.
+        * end - index after last point (default is all points).
+
+        Returns:
+
+        * numpy array (float64)
+
+        """
+        axis = ['x', 'y', 'z'].index(name)
+        column = self.get_column(name)[start:end]
+        return column * self.scale[axis] + self.offset[axis]
+
+    def get_values(self, name, start=0, end=None):
+        """
+        Get values of a field (e.g., 'z' or 'intensity') for a range of points.
+        Coordinates are scaled.
+        """
+        if name in ['x', 'y', 'z']:
+            return self.get_coordinates(name, start, end)
+        return self.get_column(name)[start:end]
+
+    def get_chunk_index(self):
+        """
+        Get index of bounds for each block of points as an array with a
+        row of [MinY, MaxY, MinX, MaxX] for each block, or None if there
+        is no index.
+        """
+        return self._chunk_index
+
+    def get_ranges_in_bounding_box(self, bounding_box):
+        """
+        Get ranges of points (start, end) which may be within a bounding box,
+        using the index. If there is no index returns the range of all points.
+
+        Arguments:
+
+        * bounding_box - List of 4 values providing the bounding box of the format: [MinY, MaxY, MinX, MaxX]
+
+        Returns:
+
+        * list of (start, end) tuples
+
+        """
+        chunk_index = self.get_chunk_index()
+        if chunk_index is None:
+            return [(0, self.num_points)]
+
+        intersects = ((chunk_index[:, 0] <= bounding_box[1])
+                      & (chunk_index[:, 1] >= bounding_box[0])
+                      & (chunk_index[:, 2] <= bounding_box[3])
+                      & (chunk_index[:, 3] >= bounding_box[2]))
+
+        # Join adjacent blocks so they can be read as a single range
+        point_ranges = []
+        for chunk_num in numpy.flatnonzero(intersects):
+            start = int(chunk_num) * self.index_chunk_size
+            end = min(start + self.index_chunk_size, self.num_points)
+            if len(point_ranges) > 0 and point_ranges[-1][1] == start:
+                point_ranges[-1][1] = end
+            else:
+                point_ranges.append([start, end])
+
+        return [tuple(point_range) for point_range in point_ranges]
+
+    def iter_chunks(self, chunk_size=POINT_CHUNK_SIZE, bounding_box=None):
+        """
+        Iterate through ranges of points (start, end), so points can be
+        processed without holding them all in memory.
+
+        If a bounding box is provided ([MinY, MaxY, MinX, MaxX]) only ranges
+        which may contain points within it are returned. Use get_mask to
+        remove points outside the bounding box.
+        """
+        if bounding_box is None:
+            point_ranges = [(0, self.num_points)]
+        else:
+            point_ranges = self.get_ranges_in_bounding_box(bounding_box)
+
+        for range_start, range_end in point_ranges:
+            for start in range(range_start, range_end, chunk_size):
+                yield start, min(start + chunk_size, range_end)
+
+    def get_mask(self, start=0, end=None, returns='all',
+                 drop_class=None, keep_class=None,
+                 bounding_box=None):
+        """
+        Get mask of points to use for a range of points.
+
+        Arguments:
+
+        * start - index of first point.
+        * end - index after last point (default is all points).
+        * returns - 'all', 'first' or 'last'.
+        * drop_class - class / list of classes to drop.
+        * keep_class - class / list of classes to keep.
+        * bounding_box - only keep points within bounding box [MinY, MaxY, MinX, MaxX].
+
+        Returns:
+
+        * boolean numpy array
+
+        """
+        if end is None:
+            end = self.num_points
+        mask = numpy.ones(end - start, dtype=bool)
+
+        if returns.lower() == 'first':
+            mask &= self.get_column('returnnumber')[start:end] <= 1
+        elif returns.lower() == 'last':
+            mask &= self.get_column('returnnumber')[start:end] >= \
+                        self.get_column('numberofreturns')[start:end]
+        elif returns.lower() != 'all':
+            raise Exception('Returns "{}" not recognised, expected all, '
+                            'first or last'.format(returns))
+
+        if drop_class is not None or keep_class is not None:
+            classification = self.get_column('classification')[start:end]
+            if drop_class is not None:
+                if not isinstance(drop_class, (list, tuple)):
+                    drop_class = [drop_class]
+                mask &= ~numpy.isin(classification, drop_class)
+            if keep_class is not None:
+                if not isinstance(keep_class, (list, tuple)):
+                    keep_class = [keep_class]
+                mask &= numpy.isin(classification, keep_class)
+
+        if bounding_box is not None:
+            x = self.get_coordinates('x', start, end)
+            y = self.get_coordinates('y', start, end)
+            mask &= ((y >= bounding_box[0]) & (y <= bounding_box[1])
+                     & (x >= bounding_box[2]) & (x <= bounding_box[3]))
+
+        return mask
+
+def _get_entry_dir(in_lidar_file, bounding_box=None, resolution=None,
+                   subsample_method=None, subsample_factor=1):
+    """
+    Get directory points for a file are cached in.
+    """
+    key_values = {'cache_version' : POINT_CACHE_VERSION,
+                  'spatial_sort' : dem_common.POINT_CACHE_SPATIAL_SORT,
+                  'bounding_box' : bounding_box,
+                  'resolution' : resolution,
+                  'subsample_method' : subsample_method,
+                  'subsample_factor' : subsample_factor,
+                  'input' : dem_result_cache.get_file_fingerprint(in_lidar_file)}
+    key_json = json.dumps(key_values, sort_keys=True, default=str)
+    cache_key = hashlib.sha256(key_json.encode('utf-8')).hexdigest()
+    return os.path.join(dem_common.POINT_CACHE_PATH, cache_key[:2], cache_key)
+
+class _ColumnWriter(object):
+    """
+    Writes chunks of points to column files, keeping track of bounds.
+    Points can be subsampled using NTH or RANDOM methods.
+    """
+    def __init__(self, out_dir, subsample_method=None, subsample_factor=1):
+        self.out_dir = out_dir
+        self.num_points = 0
+        self.bounds = None
+        self.subsample_method = subsample_method
+        self.subsample_factor = subsample_factor
+        self._num_points_read = 0
+        self._num_chunks_read = 0
+        self._column_fhs = {}
+        for column_name, _ in POINT_COLUMNS:
+            self._column_fhs[column_name] = open(os.path.join(out_dir, column_name + '.bin'), 'wb')
+
+    def write_chunk(self, columns, scale, offset):
+        """
+        Write chunk of points, 'columns' is a dictionary with a numpy array
+        for each column (x, y and z as scaled integers).
+        """
+        num_chunk_points = len(columns['x'])
+        if num_chunk_points == 0:
+            return
+
+        if self.subsample_method is not None and self.subsample_factor > 1:
+            if self.subsample_method == 'NTH':
+                keep = (numpy.arange(self._num_points_read,
+                                     self._num_points_read + num_chunk_points)
+                        % self.subsample_factor) == 0
+            elif self.subsample_method == 'RANDOM':
+                # Seed from block number so subsample is the same each time
+                random_state = numpy.random.RandomState(self._num_chunks_read)
+                keep = random_state.random_sample(num_chunk_points) < (1.0 / self.subsample_factor)
+            self._num_points_read += num_chunk_points
+            self._num_chunks_read += 1
+            columns = dict([(column_name, numpy.asarray(column_values)[keep])
+                            for column_name, column_values in columns.items()])
+            num_chunk_points = len(columns['x'])
+            if num_chunk_points == 0:
+                return
+        for column_name, column_dtype in POINT_COLUMNS:
+            numpy.asarray(columns[column_name]).astype(column_dtype).tofile(self._column_fhs[column_name])
+
+        chunk_bounds = []
+        for axis, column_name in enumerate(['x', 'y', 'z']):
+            chunk_bounds.append([float(columns[column_name].min()) * scale[axis] + offset[axis],
+                                 float(columns[column_name].max()) * scale[axis] + offset[axis]])
+        if self.bounds is None:
+            self.bounds = chunk_bounds
+        else:
+            for axis in range(3):
+                self.bounds[axis][0] = min(self.bounds[axis][0], chunk_bounds[axis][0])
+                self.bounds[axis][1] = max(self.bounds[axis][1], chunk_bounds[axis][1])
+        self.num_points += num_chunk_points
+
+    def close(self):
+        """
+        Close column files.
+        """
+        for column_fh in self._column_fhs.values():
+            column_fh.close()
+
+    def write_header(self, scale, offset, source, spatial_sort=None,
+                     index_chunk_size=None):
+        """
+        Write header, this is written last so an entry is only complete
+        once it exists.
+        """
+        with open(os.path.join(self.out_dir, _HEADER_FILE), 'w') as header_fh:
+            json.dump({'version' : POINT_CACHE_VERSION,
+                       'num_points' : self.num_points,
+                       'scale' : list(scale),
+                       'offset' : list(offset),
+                       'bounds' : self.bounds,
+                       'source' : os.path.abspath(source),
+                       'spatial_sort' : spatial_sort,
+                       'index_chunk_size' : index_chunk_size,
+                       'created' : time.time()}, header_fh)
+
+def get_morton_codes(x, y, x_range, y_range):
+    """
+    Get Morton (Z-order) codes for points by interleaving the bits of x
+    and y, after quantising them to MORTON_BITS within their ranges.
+    Points which are close together have similar codes.
+
+    Arguments:
+
+    * x - numpy array of x coordinates.
+    * y - numpy array of y coordinates.
+    * x_range - (min_x, max_x)
+    * y_range - (min_y, max_y)
+
+    Returns:
+
+    * numpy array of codes (uint32)
+
+    """
+    max_quantised = 2**MORTON_BITS - 1
+    codes = numpy.zeros(len(x), dtype=numpy.uint32)
+    for axis_num, (values, (min_value, max_value)) in enumerate([(x, x_range),
+                                                                (y, y_range)]):
+        axis_scale = float(max_quantised) / max(float(max_value - min_value), 1.0)
+        quantised = numpy.clip((numpy.asarray(values, dtype=numpy.float64) - min_value)
+                               * axis_scale, 0, max_quantised).astype(numpy.uint32)
+        # Spread bits out so there is a zero between each
+        for shift, bit_mask in [(8, 0x00FF00FF), (4, 0x0F0F0F0F),
+                                (2, 0x33333333), (1, 0x55555555)]:
+            quantised = (quantised | (quantised << numpy.uint32(shift))) & numpy.uint32(bit_mask)
+        codes |= quantised << numpy.uint32(axis_num)
+    return codes
+
+def _open_column(out_dir, column_name, num_points):
+    """
+    Memory map a column while creating an entry.
+    """
+    return numpy.memmap(os.path.join(out_dir, column_name + '.bin'),
+                        dtype=dict(POINT_COLUMNS)[column_name], mode='r',
+                        shape=(num_points,))
+
+def _spatial_sort(out_dir, num_points):
+    """
+    Sort points in an entry by their Morton code.
+
+    Requires memory for the codes and sort order (12 bytes per point) plus
+    a temporary buffer used by the sort (up to 8 bytes per point). Columns
+    are then reordered in blocks of POINT_CHUNK_SIZE points, reading through
+    a memory map and writing to a new file, so a full copy of a column
+    is never held in memory.
+    """
+    x_column = _open_column(out_dir, 'x', num_points)
+    y_column = _open_column(out_dir, 'y', num_points)
+    # Coordinates are scaled integers, so can get codes without converting
+    x_range = (int(x_column.min()), int(x_column.max()))
+    y_range = (int(y_column.min()), int(y_column.max()))
+
+    codes = numpy.empty(num_points, dtype=numpy.uint32)
+    for start in range(0, num_points, POINT_CHUNK_SIZE):
+        end = min(start + POINT_CHUNK_SIZE, num_points)
+        codes[start:end] = get_morton_codes(x_column[start:end], y_column[start:end],
+                                            x_range, y_range)
+    x_column = None
+    y_column = None
+
+    sort_order = numpy.argsort(codes, kind='mergesort')
+    codes = None
+
+    for column_name, _ in POINT_COLUMNS:
+        column_file = os.path.join(out_dir, column_name + '.bin')
+        sorted_column_file = column_file + '.sorted'
+        in_column = _open_column(out_dir, column_name, num_points)
+        with open(sorted_column_file, 'wb') as sorted_fh:
+            for start in range(0, num_points, POINT_CHUNK_SIZE):
+                end = min(start + POINT_CHUNK_SIZE, num_points)
+                in_column[sort_order[start:end]].tofile(sorted_fh)
+        in_column = None
+        os.remove(column_file)
+        os.rename(sorted_column_file, column_file)
+
+def _write_chunk_index(out_dir, num_points, scale, offset):
+    """
+    Write bounds of each block of POINT_INDEX_CHUNK_SIZE points as
+    [MinY, MaxY, MinX, MaxX].
+    """
+    x_column = _open_column(out_dir, 'x', num_points)
+    y_column = _open_column(out_dir, 'y', num_points)
+
+    num_chunks = int(math.ceil(num_points / float(POINT_INDEX_CHUNK_SIZE)))
+    chunk_index = numpy.zeros((num_chunks, 4), dtype='<f8')
+    for chunk_num in range(num_chunks):
+        start = chunk_num * POINT_INDEX_CHUNK_SIZE
+        end = min(start + POINT_INDEX_CHUNK_SIZE, num_points)
+        x_chunk = x_column[start:end]
+        y_chunk = y_column[start:end]
+        chunk_index[chunk_num] = [float(y_chunk.min()) * scale[1] + offset[1],
+                                  float(y_chunk.max()) * scale[1] + offset[1],
+                                  float(x_chunk.min()) * scale[0] + offset[0],
+                                  float(x_chunk.max()) * scale[0] + offset[0]]
+    chunk_index.tofile(os.path.join(out_dir, _INDEX_FILE))
+
+def _read_las_laspy(in_las_file, column_writer):
+    """
+    Read points from a LAS / LAZ file using laspy and write to cache.
+
+    Returns scale and offset.
+    """
+    if hasattr(laspy_lidar.laspy, 'open'):
+        # laspy 2.x
+        with laspy_lidar.laspy.open(in_las_file) as las_reader:
+            scale = [float(value) for value in las_reader.header.scales]
+            offset = [float(value) for value in las_reader.header.offsets]
+            for points in las_reader.chunk_iterator(POINT_CHUNK_SIZE):
+                column_writer.write_chunk({'x' : numpy.asarray(points.X),
+                                           'y' : numpy.asarray(points.Y),
+                                           'z' : numpy.asarray(points.Z),
+                                           'intensity' : numpy.asarray(points.intensity),
+                                           'classification' : numpy.asarray(points.classification),
+                                           'returnnumber' : numpy.asarray(points.return_number),
+                                           'numberofreturns' : numpy.asarray(points.number_of_returns)},
+                                          scale, offset)
+    else:
+        # laspy 1.x
+        in_las = laspy_lidar.laspy.file.File(in_las_file, mode='r')
+        try:
+            scale = [float(value) for value in in_las.header.scale]
+            offset = [float(value) for value in in_las.header.offset]
+            column_writer.write_chunk({'x' : in_las.X,
+                                       'y' : in_las.Y,
+                                       'z' : in_las.Z,
+                                       'intensity' : in_las.intensity,
+                                       'classification' : in_las.classification,
+                                       'returnnumber' : in_las.return_num,
+                                       'numberofreturns' : in_las.num_returns},
+                                      scale, offset)
+        finally:
+            in_las.close()
+    return scale, offset
+
+def _read_ascii(in_ascii_file, column_writer):
+    """
+    Read points from an ASCII file (columns in LIDAR_ASCII_ORDER) and
+    write to cache.
+
+    Returns scale and offset.
+    """
+    column_indices = [dem_common.LIDAR_ASCII_ORDER[column_name] - 1
+                      for column_name, _ in POINT_COLUMNS]
+    scale = [ASCII_COORDINATE_SCALE] * 3
+    offset = None
+
+    with open(in_ascii_file, 'r') as in_ascii_fh:
+        while True:
+            lines = list(itertools.islice(in_ascii_fh, POINT_CHUNK_SIZE))
+            if len(lines) == 0:
+                break
+            chunk = numpy.loadtxt(lines, usecols=column_indices, ndmin=2)
+            if offset is None:
+                # Use first point so scaled coordinates fit in 32-bit integers
+                offset = [float(numpy.floor(chunk[0, axis])) for axis in range(3)]
+            columns = {}
+            for column_num, (column_name, _) in enumerate(POINT_COLUMNS):
+                if column_num < 3:
+                    columns[column_name] = numpy.round((chunk[:, column_num] - offset[column_num])
+                                                       / scale[column_num])
+                else:
+                    columns[column_name] = chunk[:, column_num]
+            column_writer.write_chunk(columns, scale, offset)
+
+    if offset is None:
+        offset = [0.0, 0.0, 0.0]
+    return scale, offset
+
+def _read_copc(in_copc_file, column_writer, bounding_box=None, resolution=None):
+    """
+    Read points from a COPC file and write to cache.
+
+    Returns scale and offset.
+    """
+    scale = offset = None
+    for columns, scale, offset in copc_lidar.read_points(in_copc_file,
+                                                         bounding_box=bounding_box,
+                                                         resolution=resolution):
+        column_writer.write_chunk(columns, scale, offset)
+    return scale, offset
+
+def _use_copc(in_lidar_file, lidar_format):
+    """
+    Check if points can be read from a file as COPC.
+    """
+    return (lidar_format.upper() == 'LAS' and copc_lidar._checkCOPC()
+            and copc_lidar.is_copc_file(in_lidar_file))
+
+def build_point_cache(in_lidar_file, out_dir, lidar_format='LAS',
+                      spatial_sort=None, bounding_box=None, resolution=None,
+                      subsample_method=None, subsample_factor=1):
+    """
+    Read points from a lidar file and store in a directory.
+
+    LAS / LAZ files are read using laspy if available, otherwise converted
+    to ASCII using las2txt first. For COPC files only points within the
+    bounding box and octree levels needed for the resolution are read,
+    for other files these are ignored and all points are read.
+
+    Arguments:
+
+    * in_lidar_file - input lidar file.
+    * out_dir - directory to store points in (must exist).
+    * lidar_format - LAS or ASCII.
+    * spatial_sort - sort points in Morton order and write index (default is POINT_CACHE_SPATIAL_SORT).
+    * bounding_box - only read points within bounding box [MinY, MaxY, MinX, MaxX] (COPC files only).
+    * resolution - only read octree levels needed for points with this spacing (COPC files only).
+    * subsample_method - NTH or RANDOM to only keep a subsample of points.
+    * subsample_factor - keep 1 in every 'subsample_factor' points.
+
+    Returns:
+
+    * PointCache
+
+    """
+    if not HAVE_NUMPY:
+        raise ImportError('Could not import NumPy')
+
+    column_writer = _ColumnWriter(out_dir, subsample_method=subsample_method,
+                                  subsample_factor=subsample_factor)
+    scale = offset = None
+    try:
+        if lidar_format.upper() == 'ASCII':
+            scale, offset = _read_ascii(in_lidar_file, column_writer)
+        elif _use_copc(in_lidar_file, lidar_format):
+            try:
+                scale, offset = _read_copc(in_lidar_file, column_writer,
+                                           bounding_box=bounding_box,
+                                           resolution=resolution)
+            except Exception as err:
+                # e.g., no LAZ backend for laspy, COPC files are also
+                # LAZ files so can use las2txt instead
+                if column_writer.num_points > 0:
+                    raise
+                dem_common_functions.WARNING('Could not read {} as COPC ({}). '
+                                             'Will read all points'.format(in_lidar_file, err))
+        elif laspy_lidar.HAVE_LASPY:
+            try:
+                scale, offset = _read_las_laspy(in_lidar_file, column_writer)
+            except Exception as err:
+                # e.g., laspy can't decompress LAZ, use las2txt instead
+                if column_writer.num_points > 0:
+                    raise
+                dem_common_functions.WARNING('Could not read {} using laspy ({}). '
+                                             'Will convert to ASCII'.format(in_lidar_file, err))
+        if scale is None:
+            from . import lastools_lidar
+            with dem_scratch.scope() as scratch:
+                tmp_ascii = scratch.get_temp_file(prefix='lidar_', suffix='.txt')
+                lastools_lidar.convert_las_to_ascii(in_lidar_file, tmp_ascii)
+                scale, offset = _read_ascii(tmp_ascii, column_writer)
+    finally:
+        column_writer.close()
+
+    if spatial_sort is None:
+        spatial_sort = dem_common.POINT_CACHE_SPATIAL_SORT
+
+    if spatial_sort and column_writer.num_points > 0:
+        print('Sorting points')
+        _spatial_sort(out_dir, column_writer.num_points)
+        _write_chunk_index(out_dir, column_writer.num_points, scale, offset)
+        column_writer.write_header(scale, offset, in_lidar_file,
+                                   spatial_sort='morton',
+                                   index_chunk_size=POINT_INDEX_CHUNK_SIZE)
+    else:
+        column_writer.write_header(scale, offset, in_lidar_file)
+
+    return PointCache(out_dir)
+
+def get_point_cache(in_lidar_file, lidar_format='LAS',
+                    bounding_box=None, resolution=None,
+                    subsample_method=None, subsample_factor=1):
+    """
+    Get cached points for a lidar file, reading the file and adding
+    to the cache if this is the first time it has been used.
+
+    If the cache is disabled points are stored in the scratch directory
+    for the job.
+
+    For COPC files only points within the bounding box and octree levels
+    needed for the resolution are read. Other files are read in full,
+    use the bounding box with PointCache.iter_chunks and get_mask to
+    select points.
+
+    Arguments:
+
+    * in_lidar_file - input lidar file.
+    * lidar_format - LAS or ASCII.
+    * bounding_box - only read points within bounding box [MinY, MaxY, MinX, MaxX] (COPC files only).
+    * resolution - only read octree levels needed for points with this spacing (COPC files only).
+    * subsample_method - NTH, RANDOM or COPC to only keep a subsample of points (COPC uses NTH for other files).
+    * subsample_factor - keep 1 in every 'subsample_factor' points (NTH and RANDOM).
+
+    Returns:
+
+    * PointCache
+
+    """
+    if not os.path.isfile(in_lidar_file):
+        raise Exception('The file "{}" does not exist'.format(in_lidar_file))
+
+    if subsample_method is not None:
+        subsample_method = subsample_method.upper()
+        if subsample_method not in SUBSAMPLE_METHODS:
+            raise Exception('Subsample method "{}" not recognised, options are '
+                            '{}'.format(subsample_method, ', '.join(SUBSAMPLE_METHODS)))
+        if subsample_method == 'COPC':
+            # Levels to read are set by the resolution
+            if _use_copc(in_lidar_file, lidar_format):
+                subsample_method = None
+            else:
+                subsample_method = 'NTH'
+        subsample_factor = int(subsample_factor)
+        if subsample_factor <= 1:
+            subsample_method = None
+    if subsample_method is None:
+        subsample_factor = 1
+
+    # Only COPC files can be read by bounding box / resolution so
+    # for other files all points are cached.
+    if bounding_box is not None or resolution is not None:
+        if _use_copc(in_lidar_file, lidar_format):
+            if bounding_box is not None:
+                bounding_box = [float(value) for value in bounding_box]
+            if resolution is not None:
+                resolution = float(resolution)
+        else:
+            bounding_box = None
+            resolution = None
+
+    if not is_enabled():
+        return build_point_cache(in_lidar_file,
+                                 dem_scratch.get_temp_dir(prefix='point_cache'),
+                                 lidar_format=lidar_format,
+                                 bounding_box=bounding_box,
+                                 resolution=resolution,
+                                 subsample_method=subsample_method,
+                                 subsample_factor=subsample_factor)
+
+    entry_dir = _get_entry_dir(in_lidar_file, bounding_box, resolution,
+                               subsample_method, subsample_factor)
+    try:
+        points = PointCache(entry_dir)
+        os.utime(os.path.join(entry_dir, _HEADER_FILE), None)
+        print('Using cached points for {}'.format(in_lidar_file))
+        return points
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+
+    print('Adding points from {} to cache'.format(in_lidar_file))
+    entry_parent = os.path.dirname(entry_dir)
+    if not os.path.isdir(entry_parent):
+        try:
+            os.makedirs(entry_parent)
+        except OSError:
+            # Created by another process
+            if not os.path.isdir(entry_parent):
+                raise
+    # Write to temporary directory first so other processes never see
+    # a partial entry.
+    tmp_entry_dir = tempfile.mkdtemp(prefix='.tmp_', dir=entry_parent)
+    try:
+        build_point_cache(in_lidar_file, tmp_entry_dir, lidar_format=lidar_format,
+                          bounding_box=bounding_box, resolution=resolution,
+                          subsample_method=subsample_method,
+                          subsample_factor=subsample_factor)
+        try:
+            os.rename(tmp_entry_dir, entry_dir)
+            tmp_entry_dir = None
+        except OSError:
+            # Added by another process at the same time
+            pass
+    finally:
+        if tmp_entry_dir is not None:
+            shutil.rmtree(tmp_entry_dir, ignore_errors=True)
+
+    # Open (and map columns) before evicting, the new entry is kept
+    # even if it is larger than the cache on its own.
+    points = PointCache(entry_dir)
+    evict(keep=[entry_dir])
+    return points
+
+def evict(max_size_mb=None, keep=None):
+    """
+    Remove least recently used files until the cache is within
+    its size limit.
+
+    Entries which are already open as a PointCache can still be read
+    after they are removed, as their columns are memory mapped.
+
+    Arguments:
+
+    * max_size_mb - maximum size of cache (default is POINT_CACHE_MAX_SIZE_MB).
+    * keep - list of entry directories not to remove (e.g., an entry which has just been added).
+
+    Returns:
+
+    * number of files removed
+
+    """
+    if max_size_mb is None:
+        max_size_mb = dem_common.POINT_CACHE_MAX_SIZE_MB
+    max_size = max_size_mb * 1024 * 1024
+
+    if not os.path.isdir(dem_common.POINT_CACHE_PATH):
+        return 0
+
+    if keep is None:
+        keep = []
+    keep = [os.path.abspath(entry_dir) for entry_dir in keep]
+
+    with _CACHE_LOCK:
+        entries = []
+        total_size = 0
+        for prefix in os.listdir(dem_common.POINT_CACHE_PATH):
+            prefix_dir = os.path.join(dem_common.POINT_CACHE_PATH, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for cache_key in os.listdir(prefix_dir):
+                entry_dir = os.path.join(prefix_dir, cache_key)
+                try:
+                    last_used = os.path.getmtime(os.path.join(entry_dir, _HEADER_FILE))
+                    entry_size = sum([os.path.getsize(os.path.join(entry_dir, file_name))
+                                      for file_name in os.listdir(entry_dir)])
+                except OSError:
+                    # Entry being written (or removed) by another process
+                    continue
+                entries.append((last_used, entry_size, entry_dir))
+                total_size += entry_size
+
+        num_removed = 0
+        for _, entry_size, entry_dir in sorted(entries):
+            if total_size <= max_size:
+                break
+            if os.path.abspath(entry_dir) in keep:
+                continue
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_size -= entry_size
+            num_removed += 1
+
+    return num_removed
+
+def clear_cache():
+    """
+    Remove all cached points.
+    """
+    with _CACHE_LOCK:
+        if os.path.isdir(dem_common.POINT_CACHE_PATH):
+            shutil.rmtree(dem_common.POINT_CACHE_PATH, ignore_errors=True)
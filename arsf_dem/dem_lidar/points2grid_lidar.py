@@ -20,20 +20,19 @@ import shutil
 import tempfile
 # Import common files
 from .. import dem_common
-from .. import dem_common_functions
+from .. import dem_scratch
+from .. import dem_utilities
+from .. import dem_toolchain
+from .. import dem_tool_runner
 from .. import get_gdal_drivers
+from .. import dem_trace
 
 def _checkPoints2Grid():
     """
     Check if Points2Grid is installed.
     """
 
-    try:
-        dem_common_functions.CallSubprocessOn([os.path.join(dem_common.POINTS2GRID_BIN_PATH,'points2grid'),'--help'],
-                          redirect=True, quiet=True)
-        return True
-    except OSError:
-        return False
+    return dem_toolchain.is_tool_available('points2grid')
 
 def export_ascii_raster(points2dem_outfile, out_raster,
                           output_type='mean',projection=None):
@@ -56,11 +55,13 @@ def export_ascii_raster(points2dem_outfile, out_raster,
         shutil.copy(in_raster, out_raster)
     # Otherwise use gdal_translate
     else:
-        # Set output options
+        # Set output options, using those from the output profile if set
         out_ext = os.path.splitext(out_raster)[-1]
-        out_format = get_gdal_drivers.GDALDrivers().get_driver_from_ext(out_ext)
-        out_options = \
-        get_gdal_drivers.GDALDrivers().get_creation_options_from_ext(out_ext)
+        out_format = get_gdal_drivers.get_drivers().get_driver_from_ext(out_ext)
+        out_options = dem_utilities.get_output_creation_options(out_format)
+        if out_options is None:
+            out_options = \
+            get_gdal_drivers.get_drivers().get_creation_options_from_ext(out_ext)
 
         gdal_translate_cmd = ['gdal_translate',
                               '-of',out_format]
@@ -72,7 +73,9 @@ def export_ascii_raster(points2dem_outfile, out_raster,
             gdal_translate_cmd.extend(['-a_srs',projection])
 
         gdal_translate_cmd.extend([in_raster, out_raster])
-        dem_common_functions.CallSubprocessOn(gdal_translate_cmd)
+        dem_tool_runner.run_tool_blocking(gdal_translate_cmd)
+        dem_utilities.remove_gdal_aux_file(out_raster)
+        dem_utilities.apply_output_profile(out_raster)
 
 def _las_to_dem(in_las, out_dem,
                resolution=dem_common.DEFAULT_LIDAR_RES_METRES,
@@ -103,7 +106,7 @@ def _las_to_dem(in_las, out_dem,
     if not _checkPoints2Grid():
         raise Exception('Could not find points2grid, checked {}'.format(dem_common.POINTS2GRID_BIN_PATH))
 
-    outdem_handler, dem_tmp = tempfile.mkstemp(suffix='', dir=dem_common.TEMP_PATH)
+    outdem_handler, dem_tmp = tempfile.mkstemp(suffix='', dir=dem_scratch.get_dir())
 
     # Set search raduis. For 'typical' ARSF
     if search_radius is None:
@@ -147,7 +150,7 @@ def _las_to_dem(in_las, out_dem,
         raise Exception('DEM Type must be "DSM" or "DTM"')
 
     surfaceCMD.extend(['-i',in_las])
-    dem_common_functions.CallSubprocessOn(surfaceCMD, redirect=quiet)
+    dem_tool_runner.run_tool_blocking(surfaceCMD, redirect=quiet)
 
     print('Exporting')
     export_ascii_raster(dem_tmp, out_dem, projection=projection,
@@ -252,3 +255,6 @@ def classified_las_to_dtm(in_las, out_dtm,
                 quiet=quiet)
 
     return None
+
+# Record a span for each call to a public function when tracing is enabled
+dem_trace.trace_public_functions(globals())
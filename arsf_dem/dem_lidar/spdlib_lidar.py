@@ -17,22 +17,19 @@ Bunting, P., Armston, J., Clewley, D., & Lucas, R. M. (2013). Sorted pulse data
 from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
 import os
 import shutil
-import subprocess
 import tempfile
 # Import common files
 from .. import dem_common
-from .. import dem_common_functions
+from .. import dem_scratch
+from .. import dem_toolchain
+from .. import dem_tool_runner
 from .. import dem_utilities
+from .. import dem_trace
 
 def _checkSPDLib():
     """Check if SPDLib is installed."""
 
-    try:
-        dem_common_functions.CallSubprocessOn([os.path.join(dem_common.SPDLIB_BIN_PATH,'spdtranslate')],
-                          redirect=True, quiet=True)
-        return True
-    except OSError:
-        return False
+    return dem_toolchain.is_tool_available('spdtranslate')
 
 def convert_las_to_spd(in_las,out_spd,wkt=None,
                        bin_size=dem_common.DEFAULT_LIDAR_RES_METRES,
@@ -66,7 +63,7 @@ def convert_las_to_spd(in_las,out_spd,wkt=None,
     if not _checkSPDLib():
         raise Exception('Could not find SPDLib')
 
-    temp_dir = tempfile.mkdtemp(dir=dem_common.TEMP_PATH)
+    temp_dir = tempfile.mkdtemp(dir=dem_scratch.get_dir())
     spdtmppath = os.path.join(temp_dir, 'spd_tmp_')
 
     # If not using pulses import using 'LAS (No Pulse) importer
@@ -87,7 +84,7 @@ def convert_las_to_spd(in_las,out_spd,wkt=None,
     if wkt is not None:
         spdtranslate_cmd.extend(['--input_proj',wkt, '--output_proj', wkt])
 
-    subprocess.check_call(spdtranslate_cmd)
+    dem_tool_runner.run_tool_blocking(spdtranslate_cmd)
 
     # Remove temp files
     shutil.rmtree(temp_dir)
@@ -119,7 +116,7 @@ def classify_ground_spd(in_spd,out_spd,
         raise Exception('Input SPD file "{}" does not exist'.format(in_spd))
 
     spdfile_handler, spdfile_grd_tmp = tempfile.mkstemp(suffix='.spd',
-                                                        dir=dem_common.TEMP_PATH)
+                                                        dir=dem_scratch.get_dir())
 
     # 1. PMF Filter
     pmfCMD = [os.path.join(dem_common.SPDLIB_BIN_PATH,'spdpmfgrd'),
@@ -127,7 +124,7 @@ def classify_ground_spd(in_spd,out_spd,
               '--grd', '1',
               '-i',in_spd,'-o',spdfile_grd_tmp]
 
-    subprocess.check_call(pmfCMD)
+    dem_tool_runner.run_tool_blocking(pmfCMD)
 
     # 2. MCC applied to ground classified returns.
     mccCMD = [os.path.join(dem_common.SPDLIB_BIN_PATH,'spdmccgrd'),
@@ -136,7 +133,7 @@ def classify_ground_spd(in_spd,out_spd,
               '--initcurvetol', '1',
               '-i',spdfile_grd_tmp,'-o',out_spd]
 
-    subprocess.check_call(mccCMD)
+    dem_tool_runner.run_tool_blocking(mccCMD)
 
     os.close(spdfile_handler)
     os.remove(spdfile_grd_tmp)
@@ -186,7 +183,7 @@ def _spd_to_raster(in_spd, out_raster,
     else:
         raise Exception('Raster type "{}" was not recognised'.format(raster_type))
 
-    subprocess.check_call(dem_cmd)
+    dem_tool_runner.run_tool_blocking(dem_cmd)
 
     # Set nodata value (SPDLib uses nan but doesn't explicitly set as no data)
     dem_utilities.set_nodata_value(out_raster, float('NaN'))
@@ -249,7 +246,7 @@ def spd_to_dtm(in_spd, out_dtm, interpolation=dem_common.SPD_DEFAULT_INTERPOLATI
     if not os.path.isfile(in_spd):
         raise Exception('Input SPD file "{}" does not exist'.format(in_spd))
 
-    spdfile_handler, spdfile_grd_tmp = tempfile.mkstemp(suffix='.spd', dir=dem_common.TEMP_PATH)
+    spdfile_handler, spdfile_grd_tmp = tempfile.mkstemp(suffix='.spd', dir=dem_scratch.get_dir())
 
     print('Classifying ground returns')
     classify_ground_spd(in_spd, spdfile_grd_tmp)
@@ -298,7 +295,7 @@ def spd_to_chm(in_spd, out_chm, interpolation=dem_common.SPD_DEFAULT_INTERPOLATI
         raise Exception('Input SPD file "{}" does not exist'.format(in_spd))
 
     spdfile_handler, spdfile_height_tmp = tempfile.mkstemp(suffix='.spd',
-                                           dir=dem_common.TEMP_PATH)
+                                           dir=dem_scratch.get_dir())
 
     print('Classifying ground returns')
     spddefheight_cmd = [os.path.join(dem_common.SPDLIB_BIN_PATH,'spddefheight'),
@@ -306,7 +303,7 @@ def spd_to_chm(in_spd, out_chm, interpolation=dem_common.SPD_DEFAULT_INTERPOLATI
                         '--in', interpolation,
                         '-i', in_spd,
                         '-o', spdfile_height_tmp]
-    subprocess.check_call(spddefheight_cmd)
+    dem_tool_runner.run_tool_blocking(spddefheight_cmd)
 
     print('Creating CHM')
     _spd_to_raster(spdfile_height_tmp, out_chm,
@@ -352,7 +349,7 @@ def las_to_dsm(in_las, out_dsm,
     """
 
     spdfile_handler, spdfile_tmp = tempfile.mkstemp(suffix='.spd',
-                                                    dir=dem_common.TEMP_PATH)
+                                                    dir=dem_scratch.get_dir())
 
     convert_las_to_spd(in_las, spdfile_tmp,bin_size=bin_size, wkt=wkt)
     spd_to_dsm(spdfile_tmp, out_dsm,
@@ -395,7 +392,7 @@ def las_to_dtm(in_las, out_dtm,
 
     """
 
-    spdfile_handler, spdfile_tmp = tempfile.mkstemp(suffix='.spd', dir=dem_common.TEMP_PATH)
+    spdfile_handler, spdfile_tmp = tempfile.mkstemp(suffix='.spd', dir=dem_scratch.get_dir())
 
     convert_las_to_spd(in_las, spdfile_tmp,bin_size=bin_size, wkt=wkt)
     spdfile_grd_tmp = spd_to_dtm(spdfile_tmp, out_dtm,
@@ -411,3 +408,6 @@ def las_to_dtm(in_las, out_dtm,
         return spdfile_grd_tmp
     else:
         return None
+
+# Record a span for each call to a public function when tracing is enabled
+dem_trace.trace_public_functions(globals())
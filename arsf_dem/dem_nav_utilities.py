@@ -14,10 +14,12 @@ suitible for use in APL for processing hyperspectral data.
 Available Functions:
 
 * create_apl_dem_from_mosaic - function to create DEM for use in APL using standard or custom DEM mosaic.
+* create_apl_dems_per_line_from_mosaic - function to create a DEM for each flight line for use in APL.
 * subset_dem_to_nav - subset DEM to navigation data.
 * subset_dem_to_apl_nav_files - subset DEM to post-processed BIL format navigation files
 * get_bb_from_bil_nav_files - get bounding box from BIL format navigation files (used by subset_dem_to_apl_nav_files)
 * get_min_max_from_bil_nav_files - gets minimum and maximum for each band in BIL format navigation files (used by get_bb_from_bil_nav_files)
+* get_swath_footprint_from_bil_nav_files - get polygon of area imaged from BIL format navigation files (used by subset_dem_to_apl_nav_files)
 
 Known issues
 
@@ -31,11 +33,20 @@ from __future__ import print_function # Import print function (so we can use Pyt
 import os, sys
 import glob
 import math
+import json
+import hashlib
+import functools
+import tempfile
+from multiprocessing.pool import ThreadPool
+import numpy
 
 # Import arsf_dem files
 from . import dem_common
 from . import dem_utilities
+from . import grass_library
 from . import dem_common_functions
+from . import dem_scratch
+from . import dem_trace
 
 # Check DEM library is available
 # this is only used on ARSF systems
@@ -49,6 +60,8 @@ except ImportError as err:
 HAVE_GDAL=True
 try:
     from osgeo import gdal
+    from osgeo import ogr
+    from osgeo import osr
 except ImportError:
     # If can't import don't complain until GDAL is actually needed
     HAVE_GDAL=False
@@ -57,6 +70,17 @@ except ImportError:
 # smaller than the one produced by APL.
 POST_PROCESSED_DEM_BUFFER = 0.03
 
+# Suffix for files used to cache statistics from navigation files
+NAV_STATS_CACHE_SUFFIX = '_stats.json'
+
+# Number of lines to read from navigation files at once
+NAV_STATS_BLOCK_LINES = 65536
+
+# Step (in scan lines) between swath edges used to build footprint. The
+# footprint is buffered by the maximum distance of edges of skipped scan
+# lines from it, so they are still covered.
+NAV_FOOTPRINT_LINE_STEP = 50
+
 def create_apl_dem_from_mosaic(outdem,
                                dem_source=None,
                                dem_mosaic=None,
@@ -66,7 +90,8 @@ def create_apl_dem_from_mosaic(outdem,
                                bil_navigation=None,
                                fill_nulls=True,
                                remove_grassdb=True,
-                               grassdb_path=None):
+                               grassdb_path=None,
+                               use_footprint=False):
     """
     Create DEM subset for use in APL from standard or custom DEM
 
@@ -89,49 +114,16 @@ def create_apl_dem_from_mosaic(outdem,
     * bil_navigation - Directoy containing APL processed BIL format navigation files.
     * fill_nulls - fill NULL values (needed for use in APL).
     * remove_grassdb - Remove GRASS database after processing is complete.
+    * use_footprint - only subset / fill within footprint of swaths (requires bil_navigation).
 
     """
-    # ASTER DEM
-    if (dem_source is not None) and (dem_source.upper() == 'ASTER'):
-        in_dem_mosaic = dem_common.ASTER_MOSAIC_FILE
-        in_dem_projection = dem_common.WGS84_PROJ4_STRING
-        separation_file = dem_common.WWGSG_FILE
-        ascii_separation_file = dem_common.WWGSG_FILE_IS_ASCII
-        out_res = dem_common.ASTER_RES_DEGREES
-
-    # NEXTMap DEM
-    elif (dem_source is not None) and (dem_source.upper() == 'NEXTMAP'):
-        in_dem_mosaic = dem_common.NEXTMAP_MOSAIC_FILE
-        in_dem_projection = dem_common.OSTN02_PROJ4_STRING
-        separation_file = dem_common.UKBNG_SEP_FILE_WGS84
-        ascii_separation_file = dem_common.UKBNG_SEP_FILE_WGS84_IS_ASCII
-        out_res = dem_common.NEXTMAP_RES_DEGREES
-        if not os.path.isfile(dem_common.OSTN02_NTV2_BIN_FILE):
-            raise Exception("Could not find OSTN02 transform file.\nChecked {}".format(dem_common.OSTN02_NTV2_BIN_FILE))
-
-    # SRTM DEM
-    elif (dem_source is not None) and (dem_source.upper() == 'SRTM'):
-        in_dem_mosaic = dem_common.SRTM_MOSAIC_FILE
-        in_dem_projection = dem_common.WGS84_PROJ4_STRING
-        separation_file = dem_common.WWGSG_FILE
-        ascii_separation_file = dem_common.WWGSG_FILE_IS_ASCII
-        out_res = dem_common.SRTM_RES_DEGREES
-
-    # Custom DEM
-    elif dem_mosaic is not None:
-        in_dem_mosaic = dem_mosaic
-        in_dem_projection = None
-        if separation_file is not None and \
-        (os.path.splitext(separation_file)[-1] == '.dem' or os.path.splitext(separation_file)[-1] == '.bil'):
-            ascii_separation_file = False
-        else:
-            ascii_separation_file = True
-        out_res = None
-        if dem_source is None:
-            dem_source = 'DEM'
-
-    else:
-        raise Exception('DEM Source not recognised and no custom DEM supplied.')
+    dem_source_info = _get_dem_source_info(dem_source, dem_mosaic, separation_file)
+    in_dem_mosaic = dem_source_info['in_dem_mosaic']
+    in_dem_projection = dem_source_info['in_dem_projection']
+    separation_file = dem_source_info['separation_file']
+    ascii_separation_file = dem_source_info['ascii_separation_file']
+    out_res = dem_source_info['out_res']
+    dem_source = dem_source_info['dem_source']
 
     # If a name for the output DEM is not provided and don't require the output to be
     # kept in GRASS, try to figure out standard name
@@ -158,9 +150,13 @@ def create_apl_dem_from_mosaic(outdem,
                                        nodata=-9999,
                                        remove_grassdb=remove_grassdb,
                                        grassdb_path=grassdb_path,
-                                       fill_nulls=fill_nulls)
+                                       fill_nulls=fill_nulls,
+                                       use_footprint=use_footprint)
 
     else:
+        if use_footprint:
+            dem_common_functions.WARNING('Footprint can only be used with post processed navigation data. '
+                                         'Will subset to bounding box.')
         dem_common_functions.PrintTermWidth('Using navigation data for project {}'.format(project))
         # Set nodata to -9999 so an offset is also applied to pixels with a value of 0
         out_demfile, grassdb_path = subset_dem_to_nav(in_dem_mosaic,
@@ -183,6 +179,279 @@ def create_apl_dem_from_mosaic(outdem,
     return out_demfile, grassdb_path
 
 
+def create_apl_dems_per_line_from_mosaic(out_dir,
+                                         bil_navigation,
+                                         dem_source=None,
+                                         dem_mosaic=None,
+                                         separation_file=None,
+                                         fill_nulls=True,
+                                         num_threads=dem_common.NUM_PROCESSES):
+    """
+    Create a DEM for each flight line for use in APL from standard or
+    custom DEM, using post-processed navigation files.
+
+    Rather than calling create_apl_dem_from_mosaic for each line the DEM mosaic
+    is opened once (warped to a grid covering all lines) and the separation
+    file is resampled once to the same grid (using offset_null_fill_dem, so
+    values are the same as offsetting a single DEM). Each line reads its
+    window from both grids and applies the offset, then nulls are filled
+    in a separate GRASS workspace for each line, so lines are processed
+    in parallel.
+
+    Used by script 'create_apl_dem.py' with '--per_line'.
+
+    Arguments:
+
+    * out_dir - Output directory for DEMs.
+    * bil_navigation - Directory containing APL processed BIL format navigation files (or list of files).
+    * dem_source - Source of DEM.
+    * dem_mosaic - Path to DEM if not using standard DEM.
+    * separation_file - Path to separation file to use for non-standard DEM.
+    * fill_nulls - fill NULL values (needed for use in APL).
+    * num_threads - number of lines to process at once.
+
+    Returns:
+
+    * list of output DEMs
+
+    """
+    if not HAVE_GDAL:
+        raise ImportError('Could not import GDAL, check it is installed and available within PYTHONPATH')
+
+    dem_source_info = _get_dem_source_info(dem_source, dem_mosaic, separation_file)
+    dem_source = dem_source_info['dem_source']
+    separation_file = dem_source_info['separation_file']
+    ascii_separation_file = dem_source_info['ascii_separation_file']
+
+    if isinstance(bil_navigation, list):
+        nav_file_list = bil_navigation
+    elif os.path.isdir(bil_navigation):
+        nav_file_list = glob.glob(os.path.join(bil_navigation, '*' + dem_common.APL_POST_PROCESSED_NAV_SUFFIX))
+        if len(nav_file_list) == 0:
+            raise Exception('Could not find any files in "{}" matching "*{}"'.format(bil_navigation, dem_common.APL_POST_PROCESSED_NAV_SUFFIX))
+    else:
+        nav_file_list = [bil_navigation]
+
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    # Get bounding box for each line and for all lines
+    line_bbs = {}
+    for nav_bil in nav_file_list:
+        line_bbs[nav_bil] = get_bb_from_bil_nav_files(nav_bil)
+
+    all_lines_bb = [min([bb[0] for bb in line_bbs.values()]),
+                    max([bb[1] for bb in line_bbs.values()]),
+                    min([bb[2] for bb in line_bbs.values()]),
+                    max([bb[3] for bb in line_bbs.values()])]
+
+    dem_common_functions.PrintTermWidth('Creating DEM for {} lines'.format(len(nav_file_list)))
+
+    # Create VRT of mosaic warped to grid covering all lines.
+    all_lines_vrt = dem_utilities.get_subset_grid_vrt(dem_source_info['in_dem_mosaic'],
+                                                      all_lines_bb,
+                                                      in_projection=dem_source_info['in_dem_projection'],
+                                                      out_projection=dem_common.WGS84_PROJ4_STRING,
+                                                      out_res=dem_source_info['out_res'])
+
+    all_lines_ds = gdal.Open(all_lines_vrt, gdal.GA_ReadOnly)
+    grid_geotransform = all_lines_ds.GetGeoTransform()
+    grid_projection = all_lines_ds.GetProjectionRef()
+    grid_x_size = all_lines_ds.RasterXSize
+    grid_y_size = all_lines_ds.RasterYSize
+    in_nodata = all_lines_ds.GetRasterBand(1).GetNoDataValue()
+    all_lines_ds = None
+
+    out_nodata = -9999
+
+    scratch = dem_scratch.scope()
+    grid_separation_file = None
+
+    def _create_line_dem(nav_bil):
+        """
+        Create DEM for a single line from the shared grid.
+        """
+        line_bb = line_bbs[nav_bil]
+        out_line_dem = os.path.join(out_dir,
+                                    os.path.basename(nav_bil).replace(dem_common.APL_POST_PROCESSED_NAV_SUFFIX,
+                                                                      '_{}.dem'.format(dem_source.lower())))
+
+        # Get window for line within grid
+        x_start = max(0, int(math.floor((line_bb[2] - grid_geotransform[0]) / grid_geotransform[1])))
+        x_end = min(grid_x_size, int(math.ceil((line_bb[3] - grid_geotransform[0]) / grid_geotransform[1])))
+        y_start = max(0, int(math.floor((line_bb[1] - grid_geotransform[3]) / grid_geotransform[5])))
+        y_end = min(grid_y_size, int(math.ceil((line_bb[0] - grid_geotransform[3]) / grid_geotransform[5])))
+
+        print('Subsetting DEM for {}'.format(os.path.basename(nav_bil)))
+        # Datasets can't be shared between threads so open for each line.
+        line_ds = gdal.Open(all_lines_vrt, gdal.GA_ReadOnly)
+        line_data = line_ds.GetRasterBand(1).ReadAsArray(x_start, y_start,
+                                                         x_end - x_start,
+                                                         y_end - y_start)
+        line_ds = None
+        line_data = line_data.astype(numpy.float32)
+
+        if in_nodata is not None:
+            valid_data = (line_data != in_nodata)
+        else:
+            valid_data = numpy.ones(line_data.shape, dtype=bool)
+
+        if grid_separation_file is not None:
+            # Pixels without a separation value are set to no data, as
+            # in offset_null_fill_dem.
+            separation_ds = gdal.Open(grid_separation_file, gdal.GA_ReadOnly)
+            separation_data = separation_ds.GetRasterBand(1).ReadAsArray(x_start, y_start,
+                                                                         x_end - x_start,
+                                                                         y_end - y_start)
+            separation_ds = None
+            valid_data &= (separation_data != out_nodata)
+            line_data = (line_data + separation_data).astype(numpy.float32)
+
+        line_data = numpy.where(valid_data, line_data, out_nodata)
+
+        # Null filling is applied in GRASS, the same as for a single DEM,
+        # using a separate workspace for each line.
+        if fill_nulls:
+            tmp_dem_fh, line_dem_file = tempfile.mkstemp(prefix='line_dem', suffix='.dem',
+                                                         dir=dem_scratch.get_dir())
+            os.close(tmp_dem_fh)
+        else:
+            line_dem_file = out_line_dem
+
+        envi_driver = gdal.GetDriverByName('ENVI')
+        line_out_ds = envi_driver.Create(line_dem_file, line_data.shape[1],
+                                         line_data.shape[0], 1, gdal.GDT_Float32,
+                                         [dem_common.GDAL_CREATION_OPTIONS.strip('"\'')])
+        line_out_ds.SetGeoTransform((grid_geotransform[0] + x_start * grid_geotransform[1],
+                                     grid_geotransform[1], 0,
+                                     grid_geotransform[3] + y_start * grid_geotransform[5],
+                                     0, grid_geotransform[5]))
+        line_out_ds.SetProjection(grid_projection)
+        line_out_ds.GetRasterBand(1).SetNoDataValue(out_nodata)
+        line_out_ds.GetRasterBand(1).WriteArray(line_data)
+        line_out_ds = None
+
+        if fill_nulls:
+            print('Filling nulls for {}'.format(os.path.basename(nav_bil)))
+            with grass_library.GRASSWorkspace():
+                dem_utilities.offset_null_fill_dem(line_dem_file,
+                                                   out_line_dem,
+                                                   fill_nulls=True,
+                                                   nodata=out_nodata,
+                                                   projection='WGS84LL')
+            for line_dem_component in glob.glob(os.path.splitext(line_dem_file)[0] + '.*'):
+                os.remove(line_dem_component)
+
+        dem_utilities.add_dem_metadata(out_line_dem, dem_source=dem_source,
+                                       dem_filename=os.path.basename(dem_source_info['in_dem_mosaic']))
+
+        return out_line_dem
+
+    try:
+        # Resample separation file to the grid once, by adding it to a
+        # grid of zeros, rather than importing and resampling for each line.
+        if separation_file is not None:
+            print('Resampling separation file to grid covering all lines')
+            zero_grid_file = scratch.get_temp_file(prefix='zero_grid', suffix='.dem')
+            grid_separation_file = scratch.get_temp_file(prefix='separation_grid',
+                                                         suffix='.dem')
+            envi_driver = gdal.GetDriverByName('ENVI')
+            zero_grid_ds = envi_driver.Create(zero_grid_file, grid_x_size, grid_y_size,
+                                              1, gdal.GDT_Float32)
+            zero_grid_ds.SetGeoTransform(grid_geotransform)
+            zero_grid_ds.SetProjection(grid_projection)
+            zero_grid_ds.GetRasterBand(1).Fill(0)
+            zero_grid_ds = None
+            dem_utilities.offset_null_fill_dem(zero_grid_file,
+                                               grid_separation_file,
+                                               separation_file=separation_file,
+                                               ascii_separation_file=ascii_separation_file,
+                                               fill_nulls=False,
+                                               nodata=out_nodata,
+                                               out_raster_type='Float64',
+                                               projection='WGS84LL')
+            scratch.manager.release(zero_grid_file)
+
+        num_threads = max(1, min(num_threads, len(nav_file_list)))
+        line_pool = ThreadPool(num_threads)
+        try:
+            out_dems = line_pool.map(_create_line_dem, nav_file_list)
+        finally:
+            line_pool.close()
+            line_pool.join()
+    finally:
+        if os.path.isfile(all_lines_vrt):
+            os.remove(all_lines_vrt)
+        scratch.cleanup()
+
+    return out_dems
+
+def _get_dem_source_info(dem_source=None, dem_mosaic=None, separation_file=None):
+    """
+    Get mosaic, projection, separation file and resolution to use for
+    standard or custom DEM.
+
+    Arguments:
+
+    * dem_source - Source of DEM ('ASTER', 'NEXTMAP' or 'SRTM').
+    * dem_mosaic - Path to DEM if not using standard DEM.
+    * separation_file - Path to separation file to use for non-standard DEM.
+
+    Returns:
+
+    * dictionary with keys: 'in_dem_mosaic', 'in_dem_projection', 'separation_file',
+      'ascii_separation_file', 'out_res' and 'dem_source'
+
+    """
+    # ASTER DEM
+    if (dem_source is not None) and (dem_source.upper() == 'ASTER'):
+        in_dem_mosaic = dem_common.ASTER_MOSAIC_FILE
+        in_dem_projection = dem_common.WGS84_PROJ4_STRING
+        separation_file = dem_common.WWGSG_FILE
+        ascii_separation_file = dem_common.WWGSG_FILE_IS_ASCII
+        out_res = dem_common.ASTER_RES_DEGREES
+
+    # NEXTMap DEM
+    elif (dem_source is not None) and (dem_source.upper() == 'NEXTMAP'):
+        in_dem_mosaic = dem_common.NEXTMAP_MOSAIC_FILE
+        in_dem_projection = dem_common.OSTN02_PROJ4_STRING
+        separation_file = dem_common.UKBNG_SEP_FILE_WGS84
+        ascii_separation_file = dem_common.UKBNG_SEP_FILE_WGS84_IS_ASCII
+        out_res = dem_common.NEXTMAP_RES_DEGREES
+        if not os.path.isfile(dem_common.OSTN02_NTV2_BIN_FILE):
+            raise Exception("Could not find OSTN02 transform file.\nChecked {}".format(dem_common.OSTN02_NTV2_BIN_FILE))
+
+    # SRTM DEM
+    elif (dem_source is not None) and (dem_source.upper() == 'SRTM'):
+        in_dem_mosaic = dem_common.SRTM_MOSAIC_FILE
+        in_dem_projection = dem_common.WGS84_PROJ4_STRING
+        separation_file = dem_common.WWGSG_FILE
+        ascii_separation_file = dem_common.WWGSG_FILE_IS_ASCII
+        out_res = dem_common.SRTM_RES_DEGREES
+
+    # Custom DEM
+    elif dem_mosaic is not None:
+        in_dem_mosaic = dem_mosaic
+        in_dem_projection = None
+        if separation_file is not None and \
+        (os.path.splitext(separation_file)[-1] == '.dem' or os.path.splitext(separation_file)[-1] == '.bil'):
+            ascii_separation_file = False
+        else:
+            ascii_separation_file = True
+        out_res = None
+        if dem_source is None:
+            dem_source = 'DEM'
+
+    else:
+        raise Exception('DEM Source not recognised and no custom DEM supplied.')
+
+    return {'in_dem_mosaic' : in_dem_mosaic,
+            'in_dem_projection' : in_dem_projection,
+            'separation_file' : separation_file,
+            'ascii_separation_file' : ascii_separation_file,
+            'out_res' : out_res,
+            'dem_source' : dem_source}
+
 def subset_dem_to_nav(in_dem_mosaic, out_demfile,
                       nav_file, project_dir,
                       max_view_angle=dem_common.HYPERSPECTRAL_VIEW_ANGLE_MAX,
@@ -294,7 +563,8 @@ def subset_dem_to_apl_nav_files(in_dem_mosaic,
                                 nodata=dem_common.NODATA_VALUE,
                                 remove_grassdb=True,
                                 grassdb_path=None,
-                                fill_nulls=True):
+                                fill_nulls=True,
+                                use_footprint=False):
     """
     Subsets DEM to bounding box obtained from navigation files produced by aplnav
     to produce a DEM for use in aplcorr by calling:
@@ -327,6 +597,7 @@ def subset_dem_to_apl_nav_files(in_dem_mosaic,
     * remove_grassdb - Remove GRASS database after processing is complete.
     * grassdb_path - Input path to GRASS database, if not supplied will create one.
     * fill_nulls - fill null values.
+    * use_footprint - only subset / fill within footprint of swaths (pixels outside will be set to no data).
 
     Returns:
 
@@ -340,7 +611,13 @@ def subset_dem_to_apl_nav_files(in_dem_mosaic,
 
     nav_bb = get_bb_from_bil_nav_files(nav_files)
 
-    out_demfile, grassdb_path = dem_utilities.subset_dem_to_bounding_box(
+    footprint_file = None
+    if use_footprint:
+        print('Getting swath footprint from navigation data')
+        footprint_file = get_swath_footprint_from_bil_nav_files(nav_files)
+
+    try:
+        out_demfile, grassdb_path = dem_utilities.subset_dem_to_bounding_box(
                                            in_dem_mosaic,
                                            out_demfile,
                                            nav_bb,
@@ -352,7 +629,11 @@ def subset_dem_to_apl_nav_files(in_dem_mosaic,
                                            nodata=nodata,
                                            remove_grassdb=remove_grassdb,
                                            grassdb_path=grassdb_path,
-                                           fill_nulls=fill_nulls)
+                                           fill_nulls=fill_nulls,
+                                           cutline=footprint_file)
+    finally:
+        if footprint_file is not None and os.path.isfile(footprint_file):
+            os.remove(footprint_file)
 
     return out_demfile, grassdb_path
 
@@ -370,7 +651,12 @@ def get_bb_from_bil_nav_files(nav_files):
 
     """
 
-    nav_stats = get_min_max_from_bil_nav_files(nav_files)
+    # Only need position, altitude and roll to get bounding box.
+    nav_stats = get_min_max_from_bil_nav_files(nav_files,
+                                               nav_keys=['latitude',
+                                                         'longitude',
+                                                         'altitude',
+                                                         'roll'])
 
     # Get swath width
     pos_swath_buffer = nav_stats['altitude']['max'] * \
@@ -401,14 +687,383 @@ def get_bb_from_bil_nav_files(nav_files):
 
     return buffered_bb
 
-def get_min_max_from_bil_nav_files(nav_files):
+def _get_distance_to_segment(point_x, point_y, start_x, start_y, end_x, end_y):
+    """
+    Get distance of points from line segments (all arguments are numpy
+    arrays of the same size).
+    """
+    segment_x = end_x - start_x
+    segment_y = end_y - start_y
+    length_sq = segment_x**2 + segment_y**2
+    # Position along segment of closest point (0 - 1)
+    position = ((point_x - start_x) * segment_x + (point_y - start_y) * segment_y) \
+                    / numpy.where(length_sq > 0, length_sq, 1.0)
+    position = numpy.clip(position, 0, 1)
+    return numpy.hypot(point_x - (start_x + position * segment_x),
+                       point_y - (start_y + position * segment_y))
+
+def _get_swath_edges_single_nav_file(nav_bil,
+                                     max_view_angle=dem_common.HYPERSPECTRAL_VIEW_ANGLE_MAX,
+                                     line_step=NAV_FOOTPRINT_LINE_STEP):
+    """
+    Get the left and right edges of the swath for every 'line_step' scan
+    lines in a bil format navigation file.
+
+    The swath half-width for each scan line is calculated as
+    altitude x tan(view angle + |roll|), and the edges are placed
+    perpendicular to the heading.
+
+    Edges are calculated for every scan line so the maximum distance
+    between the edges of a skipped scan line and the edges of the
+    footprint (the lines joining the edges of the scan lines used either
+    side) can also be returned. Buffering the footprint by this distance
+    makes sure scan lines which are skipped are still within it (e.g., if
+    the roll or heading changes between scan lines used).
+
+    Arguments:
+
+    * nav_bil - input navigation file
+    * max_view_angle - maximum view angle of sensor (degrees)
+    * line_step - step between scan lines used
+
+    Returns:
+
+    * numpy array of left edge longitude
+    * numpy array of left edge latitude
+    * numpy array of right edge longitude
+    * numpy array of right edge latitude
+    * maximum distance of skipped edges from the footprint edges (degrees)
+
+    """
+    dataset = gdal.Open(nav_bil, gdal.GA_ReadOnly)
+    if dataset is None:
+        raise IOError('Could not open {}'.format(nav_bil))
+
+    nav_data = {}
+    for key in ['Latitude', 'Longitude', 'Altitude', 'Roll', 'Heading']:
+        band = dataset.GetRasterBand(dem_common.APL_POST_PROCESSED_NAV_BANDS[key])
+        nav_data[key] = band.ReadAsArray().ravel().astype(numpy.float64)
+    dataset = None
+
+    valid = numpy.ones(nav_data['Latitude'].shape, dtype=bool)
+    for key in nav_data.keys():
+        valid = valid & numpy.isfinite(nav_data[key])
+    for key in nav_data.keys():
+        nav_data[key] = nav_data[key][valid]
+
+    # Get swath half width (m) for each scan line.
+    view_angle = numpy.clip(max_view_angle + numpy.abs(nav_data['Roll']), 0, 89)
+    half_swath = nav_data['Altitude'] * numpy.tan(numpy.radians(view_angle))
+
+    # Offsets to right of heading (heading is clockwise from north)
+    heading = numpy.radians(nav_data['Heading'])
+    offset_lon, offset_lat = dem_utilities.m_to_deg(nav_data['Latitude'],
+                                                    half_swath * numpy.cos(heading),
+                                                    -1 * half_swath * numpy.sin(heading))
+
+    left_lon = nav_data['Longitude'] - offset_lon
+    left_lat = nav_data['Latitude'] - offset_lat
+    right_lon = nav_data['Longitude'] + offset_lon
+    right_lat = nav_data['Latitude'] + offset_lat
+
+    if left_lon.size == 0:
+        return left_lon, left_lat, right_lon, right_lat, 0.0
+
+    # Take every 'line_step' lines, making sure the last line is included
+    line_index = numpy.arange(0, left_lon.size, line_step)
+    if line_index[-1] != left_lon.size - 1:
+        line_index = numpy.append(line_index, left_lon.size - 1)
+
+    # Distance of the edges of each scan line from the edge of the
+    # footprint, between the scan lines used either side.
+    previous_index = (numpy.arange(left_lon.size) // line_step) * line_step
+    next_index = numpy.minimum(previous_index + line_step, left_lon.size - 1)
+    edge_displacement = numpy.maximum(
+        _get_distance_to_segment(left_lon, left_lat,
+                                 left_lon[previous_index], left_lat[previous_index],
+                                 left_lon[next_index], left_lat[next_index]),
+        _get_distance_to_segment(right_lon, right_lat,
+                                 right_lon[previous_index], right_lat[previous_index],
+                                 right_lon[next_index], right_lat[next_index]))
+
+    return (left_lon[line_index], left_lat[line_index],
+            right_lon[line_index], right_lat[line_index],
+            float(edge_displacement.max()))
+
+def get_swath_footprint_from_bil_nav_files(nav_files, out_footprint=None,
+                                           max_view_angle=dem_common.HYPERSPECTRAL_VIEW_ANGLE_MAX,
+                                           line_step=NAV_FOOTPRINT_LINE_STEP):
+    """
+    Gets polygon of the area imaged from bil format navigation files.
+
+    Swath edges are calculated for every 'line_step' scan lines (see
+    '_get_swath_edges_single_nav_file'), the quadrilateral between
+    consecutive scan lines used is taken and all are merged into a single
+    polygon. The polygon is buffered by the same distance used for
+    bounding boxes plus the maximum distance of the edges of a skipped
+    scan line from the edges of the polygon, so the footprint covers every
+    scan line.
+
+    For flight plans which aren't aligned N-S / E-W this covers a much
+    smaller area than the bounding box and can be used as a cutline when
+    subsetting.
+
+    Arguments:
+
+    * nav_files - input navigation file / list of files / directory
+    * out_footprint - output GeoJSON file, will create temporary file if not supplied.
+    * max_view_angle - maximum view angle of sensor (degrees)
+    * line_step - step between scan lines used
+
+    Returns:
+
+    * path to footprint (GeoJSON format, WGS84 lat/long)
+
+    """
+    if not HAVE_GDAL:
+        raise ImportError('Could not import GDAL, check it is installed and available within PYTHONPATH')
+
+    if isinstance(nav_files,str) and os.path.isdir(nav_files):
+        nav_file_list = glob.glob(os.path.join(nav_files, '*' + dem_common.APL_POST_PROCESSED_NAV_SUFFIX))
+        if len(nav_file_list) == 0:
+            raise Exception('Could not find any files in "{}" matching "*{}"'.format(nav_files, dem_common.APL_POST_PROCESSED_NAV_SUFFIX))
+    elif isinstance(nav_files,str):
+        nav_file_list = [nav_files]
+    else:
+        nav_file_list = nav_files
+
+    strip_polygons = ogr.Geometry(ogr.wkbMultiPolygon)
+    max_edge_displacement = 0.0
+
+    for nav_bil in nav_file_list:
+        try:
+            print('Getting footprint for {}'.format(nav_bil))
+            left_lon, left_lat, right_lon, right_lat, edge_displacement = \
+                    _get_swath_edges_single_nav_file(nav_bil,
+                                                     max_view_angle=max_view_angle,
+                                                     line_step=line_step)
+        except Exception as err:
+            dem_common_functions.WARNING('Could not get footprint for {}\n{}'.format(nav_bil,err))
+            continue
+        max_edge_displacement = max(max_edge_displacement, edge_displacement)
+
+        for i in range(left_lon.size - 1):
+            strip_points = ogr.Geometry(ogr.wkbMultiPoint)
+            for lon, lat in [(left_lon[i], left_lat[i]),
+                             (right_lon[i], right_lat[i]),
+                             (right_lon[i+1], right_lat[i+1]),
+                             (left_lon[i+1], left_lat[i+1])]:
+                point = ogr.Geometry(ogr.wkbPoint)
+                point.AddPoint_2D(float(lon), float(lat))
+                strip_points.AddGeometry(point)
+            # Use convex hull so polygon is valid if heading changes
+            # between scan lines.
+            strip_hull = strip_points.ConvexHull()
+            if strip_hull.GetGeometryType() == ogr.wkbPolygon:
+                strip_polygons.AddGeometry(strip_hull)
+
+    if strip_polygons.GetGeometryCount() == 0:
+        raise Exception('Could not get footprint from any navigation files')
+
+    footprint = strip_polygons.UnionCascaded()
+    footprint = footprint.Buffer(dem_common.DEFAULT_APL_DEM_BUFFER_DISTANCE +
+                                 POST_PROCESSED_DEM_BUFFER +
+                                 max_edge_displacement)
+
+    if out_footprint is None:
+        footprint_fh, out_footprint = tempfile.mkstemp(prefix='nav_footprint',
+                                                       suffix='.geojson',
+                                                       dir=dem_scratch.get_dir())
+        os.close(footprint_fh)
+    if os.path.isfile(out_footprint):
+        os.remove(out_footprint)
+
+    wgs84_srs = osr.SpatialReference()
+    wgs84_srs.ImportFromProj4(dem_common.WGS84_PROJ4_STRING.strip('"\''))
+
+    geojson_driver = ogr.GetDriverByName('GeoJSON')
+    footprint_ds = geojson_driver.CreateDataSource(out_footprint)
+    footprint_layer = footprint_ds.CreateLayer('footprint', wgs84_srs,
+                                               ogr.wkbMultiPolygon)
+    footprint_feature = ogr.Feature(footprint_layer.GetLayerDefn())
+    footprint_feature.SetGeometry(ogr.ForceToMultiPolygon(footprint))
+    footprint_layer.CreateFeature(footprint_feature)
+    footprint_feature = None
+    footprint_ds = None
+
+    return out_footprint
+
+def _get_nav_stats_cache_files(nav_bil):
+    """
+    Get possible locations for the cached statistics for a navigation file.
+
+    The first location is a sidecar file next to the navigation file, the
+    second is within TEMP_PATH (used if the delivery is not writable).
+
+    Arguments:
+
+    * nav_bil - input navigation file
+
+    Returns:
+
+    * list of paths for cache file
+
+    """
+    nav_bil = os.path.abspath(nav_bil)
+    sidecar_file = nav_bil + NAV_STATS_CACHE_SUFFIX
+
+    path_hash = hashlib.sha1(nav_bil.encode('utf-8')).hexdigest()
+    temp_cache_file = os.path.join(dem_common.TEMP_PATH, 'arsf_dem_nav_stats',
+                                   path_hash + NAV_STATS_CACHE_SUFFIX)
+
+    return [sidecar_file, temp_cache_file]
+
+def _get_nav_file_fingerprint(nav_bil):
+    """
+    Get fingerprint (path, size and modification time) for a navigation
+    file, used to check cached statistics are still valid.
+
+    """
+    nav_stat = os.stat(nav_bil)
+    return {'path' : os.path.abspath(nav_bil),
+            'size' : nav_stat.st_size,
+            'mtime' : nav_stat.st_mtime}
+
+def _read_nav_stats_cache(nav_bil, fingerprint):
+    """
+    Read cached statistics for a navigation file.
+
+    Returns:
+
+    * dictionary with min / max for cached parameters (empty if there
+      are no valid cached statistics).
+
+    """
+    for cache_file in _get_nav_stats_cache_files(nav_bil):
+        if not os.path.isfile(cache_file):
+            continue
+        try:
+            with open(cache_file, 'r') as f:
+                cached = json.load(f)
+            if cached['fingerprint'] == fingerprint:
+                return cached['stats']
+        except Exception:
+            # If the cache can't be read just recalculate
+            pass
+
+    return {}
+
+def _write_nav_stats_cache(nav_bil, fingerprint, file_stats):
+    """
+    Write statistics for a navigation file to cache. Tries a sidecar file
+    first and falls back to TEMP_PATH if this isn't possible. Failing to
+    write the cache is not an error.
+
+    """
+    for cache_file in _get_nav_stats_cache_files(nav_bil):
+        try:
+            cache_dir = os.path.dirname(cache_file)
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            # Write to temporary file and rename so an incomplete
+            # cache is never read.
+            tmp_cache_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+            with open(tmp_cache_file, 'w') as f:
+                json.dump({'fingerprint' : fingerprint,
+                           'stats' : file_stats}, f)
+            if os.path.isfile(cache_file):
+                os.remove(cache_file)
+            os.rename(tmp_cache_file, cache_file)
+            return
+        except (IOError, OSError):
+            pass
+
+def _get_min_max_single_nav_file(nav_bil, nav_keys, use_cache=True):
+    """
+    Gets minimum and maximum values for a single bil format navigation file.
+
+    Only the bands required are read, and they are read in blocks so the
+    whole file isn't loaded into memory.
+
+    Arguments:
+
+    * nav_bil - input navigation file
+    * nav_keys - list of parameters to get statistics for (e.g., ['latitude', 'longitude'])
+    * use_cache - use cached statistics if available
+
+    Returns:
+
+    * dictionary with min / max for each parameter or None if the file couldn't be read.
+
+    """
+    try:
+        fingerprint = _get_nav_file_fingerprint(nav_bil)
+
+        file_stats = {}
+        if use_cache:
+            file_stats = _read_nav_stats_cache(nav_bil, fingerprint)
+
+        missing_keys = [key for key in nav_keys if key not in file_stats]
+
+        if len(missing_keys) == 0:
+            print('Using cached statistics for {}'.format(nav_bil))
+            return file_stats
+
+        print('Reading {}'.format(nav_bil))
+        dataset = gdal.Open(nav_bil, gdal.GA_ReadOnly)
+        if dataset is None:
+            raise IOError('Could not open {}'.format(nav_bil))
+
+        x_size = dataset.RasterXSize
+        y_size = dataset.RasterYSize
+
+        for key in missing_keys:
+            band = dataset.GetRasterBand(
+                        dem_common.APL_POST_PROCESSED_NAV_BANDS[key.capitalize()])
+
+            band_min = None
+            band_max = None
+            for y_offset in range(0, y_size, NAV_STATS_BLOCK_LINES):
+                block_lines = min(NAV_STATS_BLOCK_LINES, y_size - y_offset)
+                block = band.ReadAsArray(0, y_offset, x_size, block_lines)
+                if band_min is None or block.min() < band_min:
+                    band_min = block.min()
+                if band_max is None or block.max() > band_max:
+                    band_max = block.max()
+
+            # Convert to Python float so can be stored as JSON
+            file_stats[key] = {'min' : float(band_min),
+                               'max' : float(band_max)}
+
+        dataset = None
+
+        if use_cache:
+            _write_nav_stats_cache(nav_bil, fingerprint, file_stats)
+
+        return file_stats
+
+    except Exception as err:
+        dem_common_functions.WARNING('Could not get bounds for {}\n{}'.format(nav_bil,err))
+        return None
+
+def get_min_max_from_bil_nav_files(nav_files, nav_keys=None,
+                                   num_threads=dem_common.NUM_PROCESSES,
+                                   use_cache=True):
     """
     Gets minimum and maximum values for single bil format navigation file or a list
     of bil format navigation files.
 
+    Only bands for the requested parameters are read and files are read
+    in parallel. Statistics for each file are cached alongside the
+    navigation file (or within TEMP_PATH if this isn't writable) so
+    running again on the same files doesn't require them to be read.
+
     Arguments:
 
     * nav_files - input navigation file / list of files / directory
+    * nav_keys - list of parameters to get statistics for. Default is all of: 'time', 'latitude', 'longitude', 'altitude', 'roll', 'pitch', 'heading'
+    * num_threads - number of files to read at once
+    * use_cache - use cached statistics if available and store statistics.
 
     Returns:
 
@@ -442,63 +1097,49 @@ def get_min_max_from_bil_nav_files(nav_files):
     else:
         raise Exception('Did not understand input, expected string or list')
 
+    if nav_keys is None:
+        nav_keys = ['time', 'latitude', 'longitude', 'altitude',
+                    'roll', 'pitch', 'heading']
+
+    for key in nav_keys:
+        if key.capitalize() not in dem_common.APL_POST_PROCESSED_NAV_BANDS:
+            raise Exception('Did not recognise navigation parameter "{}"'.format(key))
+
     # Set up dictionary for output stats
     nav_stats = {}
-    nav_stats['time'] = {'min' : None, 'max' : None}
-    nav_stats['latitude'] = {'min' : None, 'max' : None}
-    nav_stats['longitude'] = {'min' : None, 'max' : None}
-    nav_stats['altitude'] = {'min' : None, 'max' : None}
-    nav_stats['roll'] = {'min' : None, 'max' : None}
-    nav_stats['pitch'] = {'min' : None, 'max' : None}
-    nav_stats['heading'] = {'min' : None, 'max' : None}
+    for key in nav_keys:
+        nav_stats[key] = {'min' : None, 'max' : None}
 
-    for nav_bil in nav_file_list:
-        try:
-            print('Reading {}'.format(nav_bil))
-            dataset = gdal.Open(nav_bil, gdal.GA_ReadOnly)
-
-            # Set up GDAL bands for each band
-            time_band = dataset.GetRasterBand(dem_common.APL_POST_PROCESSED_NAV_BANDS['Time'])
-            latitude_band = dataset.GetRasterBand(dem_common.APL_POST_PROCESSED_NAV_BANDS['Latitude'])
-            longitude_band = dataset.GetRasterBand(dem_common.APL_POST_PROCESSED_NAV_BANDS['Longitude'])
-            altitude_band = dataset.GetRasterBand(dem_common.APL_POST_PROCESSED_NAV_BANDS['Altitude'])
-            roll_band = dataset.GetRasterBand(dem_common.APL_POST_PROCESSED_NAV_BANDS['Roll'])
-            pitch_band = dataset.GetRasterBand(dem_common.APL_POST_PROCESSED_NAV_BANDS['Pitch'])
-            heading_band = dataset.GetRasterBand(dem_common.APL_POST_PROCESSED_NAV_BANDS['Heading'])
-
-            # Read to NumPy arrays, only dealing with small datasets
-            # so loading all the bands to memory at once shouldn't cause any problems
-            time = time_band.ReadAsArray()
-            latitude = latitude_band.ReadAsArray()
-            longitude = longitude_band.ReadAsArray()
-            altitude = altitude_band.ReadAsArray()
-            roll = roll_band.ReadAsArray()
-            pitch = pitch_band.ReadAsArray()
-            heading = heading_band.ReadAsArray()
-
-            # Set up dictionary of numpy arrays
-            # Use same keys as stats
-            nav_data = {'time' : time,
-                        'latitude' : latitude,
-                        'longitude' : longitude,
-                        'altitude' : altitude,
-                        'roll' : roll,
-                        'pitch' : pitch,
-                        'heading' : heading}
-
-            for key in nav_stats.keys():
-                if nav_stats[key]['min'] is None:
-                    nav_stats[key]['min'] = nav_data[key].min()
-                elif nav_data[key].min() < nav_stats[key]['min']:
-                    nav_stats[key]['min'] = nav_data[key].min()
-                if nav_stats[key]['max'] is None:
-                    nav_stats[key]['max'] = nav_data[key].max()
-                elif nav_data[key].max() > nav_stats[key]['max']:
-                    nav_stats[key]['max'] = nav_data[key].max()
-
-            dataset = None
+    get_file_stats = functools.partial(_get_min_max_single_nav_file,
+                                       nav_keys=nav_keys,
+                                       use_cache=use_cache)
 
-        except Exception as err:
-            dem_common_functions.WARNING('Could not get bounds for {}\n{}'.format(nav_bil,err))
+    # Reading is mostly I/O so use threads rather than processes.
+    num_threads = max(1, min(num_threads, len(nav_file_list)))
+    if num_threads > 1:
+        nav_pool = ThreadPool(num_threads)
+        try:
+            all_file_stats = nav_pool.map(get_file_stats, nav_file_list)
+        finally:
+            nav_pool.close()
+            nav_pool.join()
+    else:
+        all_file_stats = [get_file_stats(nav_bil) for nav_bil in nav_file_list]
+
+    for file_stats in all_file_stats:
+        if file_stats is None:
+            continue
+        for key in nav_stats.keys():
+            if nav_stats[key]['min'] is None:
+                nav_stats[key]['min'] = file_stats[key]['min']
+            elif file_stats[key]['min'] < nav_stats[key]['min']:
+                nav_stats[key]['min'] = file_stats[key]['min']
+            if nav_stats[key]['max'] is None:
+                nav_stats[key]['max'] = file_stats[key]['max']
+            elif file_stats[key]['max'] > nav_stats[key]['max']:
+                nav_stats[key]['max'] = file_stats[key]['max']
 
     return nav_stats
+
+# Record a span for each call to a public function when tracing is enabled
+dem_trace.trace_public_functions(globals())
@@ -0,0 +1,366 @@
+#! /usr/bin/env python
+#
+# This file has been created by ARSF Data Analysis Node and
+# is licensed under the GPL v3 Licence. A copy of this
+# licence is available to download with this file.
+
+"""
+Cache for rasters derived from lidar data (e.g., per-line DSMs).
+
+Results are stored under a key which is a hash of the input files
+(path, size and modification time or, if RESULT_CACHE_HASH_CONTENT
+is set, a hash of their contents) and all parameters used to create
+them (e.g., resolution, projection, raster type, method and version of
+arsf_dem, see get_arsf_dem_version). If a raster is requested again with the same inputs and
+parameters it is copied from the cache rather than being created again.
+
+The total size of the cache is limited to RESULT_CACHE_MAX_SIZE_MB, when
+it is exceeded the least recently used results are removed. The cache
+is disabled by default, it can be enabled using RESULT_CACHE_ENABLED in the
+config file or 'set_enabled(True)' and disabled for a single run using the
+'--no-cache' option of the command line scripts.
+
+Lidar mosaics (create_lidar_mosaic) and rasters created from lidar files
+using the standard functions (e.g., las_to_dsm) are cached. Rasters for
+each line created within create_lidar_mosaic are only kept in the GRASS
+database so are not cached, storing and restoring them would require
+exporting each line from GRASS and importing it again which takes about
+as long as binning the points.
+
+Available functions:
+
+* is_enabled - check if cache is enabled.
+* set_enabled - enable / disable cache.
+* get_cache_key - get key for a set of input files and parameters.
+* get_arsf_dem_version - get version of arsf_dem code used in keys.
+* fetch - copy cached result to an output file.
+* store - add an output file to the cache.
+* evict - remove least recently used results until cache is within size limit.
+* clear_cache - remove all cached results.
+
+Example::
+
+   from arsf_dem import dem_result_cache
+
+   cache_key = dem_result_cache.get_cache_key(['in.las'], resolution=2,
+                                              raster_type='DSM')
+   if not dem_result_cache.fetch(cache_key, 'out_dsm.tif'):
+      create_dsm('in.las', 'out_dsm.tif')
+      dem_result_cache.store(cache_key, 'out_dsm.tif')
+
+"""
+
+from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+
+from . import dem_common
+from . import dem_common_functions
+
+#: Version of cache format, changing this invalidates all cached results
+RESULT_CACHE_VERSION = 1
+
+#: Version of arsf_dem included in key so results are recreated after the code
+#: changes (found when first needed, see get_arsf_dem_version)
+ARSF_DEM_VERSION = None
+
+# Name of file within each entry listing files stored
+_ENTRY_INFO_FILE = 'entry.json'
+
+# Size of blocks used to hash file contents
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+_CACHE_STATE = {'enabled' : dem_common.RESULT_CACHE_ENABLED}
+_CACHE_LOCK = threading.Lock()
+
+def is_enabled():
+    """
+    Check if cache is enabled.
+    """
+    return _CACHE_STATE['enabled']
+
+def set_enabled(enabled=True):
+    """
+    Enable or disable cache (e.g., for '--no-cache').
+
+    Arguments:
+
+    * enabled - True / False
+
+    """
+    _CACHE_STATE['enabled'] = bool(enabled)
+
+def get_arsf_dem_version():
+    """
+    Get version of arsf_dem code, used as part of the cache key. This is
+    a hash of all Python source files in the package (including
+    dem_lidar) so any change to the code gives a new version. Found the
+    first time it is needed.
+
+    Returns:
+
+    * version (first 16 characters of SHA256 hex digest)
+
+    """
+    global ARSF_DEM_VERSION
+    if ARSF_DEM_VERSION is None:
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        source_hash = hashlib.sha256()
+        source_files = []
+        for dir_path, _, file_names in os.walk(package_dir):
+            source_files.extend([os.path.join(dir_path, file_name)
+                                 for file_name in file_names
+                                 if file_name.endswith('.py')])
+        for source_file in sorted(source_files):
+            source_hash.update(os.path.relpath(source_file, package_dir).encode('utf-8'))
+            with open(source_file, 'rb') as source_fh:
+                source_hash.update(source_fh.read())
+        ARSF_DEM_VERSION = source_hash.hexdigest()[:16]
+    return ARSF_DEM_VERSION
+
+def _get_file_hash(in_file):
+    """
+    Get SHA256 hash of the contents of a file.
+    """
+    file_hash = hashlib.sha256()
+    with open(in_file, 'rb') as in_fh:
+        for block in iter(lambda: in_fh.read(_HASH_BLOCK_SIZE), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+def get_file_fingerprint(in_file, hash_content=None):
+    """
+    Get fingerprint of an input file, used as part of cache key.
+
+    Arguments:
+
+    * in_file - input file.
+    * hash_content - use a hash of the file contents rather than the path, size and modification time. Default is RESULT_CACHE_HASH_CONTENT.
+
+    Returns:
+
+    * list of values identifying file
+
+    """
+    if hash_content is None:
+        hash_content = dem_common.RESULT_CACHE_HASH_CONTENT
+
+    file_stat = os.stat(in_file)
+    if hash_content:
+        return [file_stat.st_size, _get_file_hash(in_file)]
+    return [os.path.abspath(in_file), file_stat.st_size, file_stat.st_mtime]
+
+def get_cache_key(in_files, **parameters):
+    """
+    Get key for a set of input files and parameters used to
+    create a result.
+
+    Arguments:
+
+    * in_files - input file or list of input files.
+    * parameters - all parameters which affect the result (e.g., resolution=2, raster_type='DSM').
+
+    Returns:
+
+    * cache key (SHA256 hex digest)
+
+    """
+    if not isinstance(in_files, (list, tuple)):
+        in_files = [in_files]
+
+    key_values = {'cache_version' : RESULT_CACHE_VERSION,
+                  'arsf_dem_version' : get_arsf_dem_version(),
+                  'inputs' : [get_file_fingerprint(in_file) for in_file in in_files],
+                  'parameters' : parameters}
+
+    key_json = json.dumps(key_values, sort_keys=True, default=str)
+    return hashlib.sha256(key_json.encode('utf-8')).hexdigest()
+
+def _get_entry_dir(cache_key):
+    """
+    Get directory results for a key are stored in.
+    """
+    return os.path.join(dem_common.RESULT_CACHE_PATH, cache_key[:2], cache_key)
+
+def _get_output_files(out_file):
+    """
+    Get output file and any files GDAL creates alongside it
+    (e.g., ENVI header, .aux.xml) which exist.
+    """
+    out_files = [out_file,
+                 os.path.splitext(out_file)[0] + '.hdr',
+                 out_file + '.aux.xml']
+    return [output_file for output_file in out_files
+            if os.path.isfile(output_file)]
+
+def _get_dir_size(in_dir):
+    """
+    Get total size (in bytes) of files in a directory.
+    """
+    total_size = 0
+    for file_name in os.listdir(in_dir):
+        total_size += os.path.getsize(os.path.join(in_dir, file_name))
+    return total_size
+
+def fetch(cache_key, out_file):
+    """
+    Copy cached result for key to an output file. Files stored
+    alongside the result (e.g., ENVI header) are also copied.
+
+    Arguments:
+
+    * cache_key - key from get_cache_key.
+    * out_file - output file.
+
+    Returns:
+
+    * True if result was in cache, False if not (or cache is disabled).
+
+    """
+    if not is_enabled():
+        return False
+
+    entry_dir = _get_entry_dir(cache_key)
+    entry_info_file = os.path.join(entry_dir, _ENTRY_INFO_FILE)
+
+    try:
+        with open(entry_info_file, 'r') as entry_info_fh:
+            entry_info = json.load(entry_info_fh)
+        out_base = os.path.splitext(out_file)[0]
+        for suffix, stored_name in entry_info['files']:
+            if suffix == '.hdr':
+                copy_to = out_base + suffix
+            else:
+                copy_to = out_file + suffix
+            shutil.copyfile(os.path.join(entry_dir, stored_name), copy_to)
+    except (IOError, OSError, ValueError, KeyError):
+        return False
+
+    # Update modification time of entry so it is used for
+    # least recently used eviction.
+    try:
+        os.utime(entry_info_file, None)
+    except OSError:
+        pass
+
+    print('Using cached result for {}'.format(out_file))
+    return True
+
+def store(cache_key, out_file):
+    """
+    Add an output file (and any files GDAL created alongside it) to
+    the cache. If the cache is larger than RESULT_CACHE_MAX_SIZE_MB after
+    adding, the least recently used results are removed.
+
+    Not being able to write to the cache is not treated as an error.
+
+    Arguments:
+
+    * cache_key - key from get_cache_key.
+    * out_file - output file.
+
+    """
+    if not is_enabled() or not os.path.isfile(out_file):
+        return
+
+    entry_dir = _get_entry_dir(cache_key)
+    if os.path.isfile(os.path.join(entry_dir, _ENTRY_INFO_FILE)):
+        return
+
+    tmp_entry_dir = None
+    try:
+        entry_parent = os.path.dirname(entry_dir)
+        if not os.path.isdir(entry_parent):
+            os.makedirs(entry_parent)
+        # Copy to temporary directory first so other processes never see
+        # a partial entry.
+        tmp_entry_dir = tempfile.mkdtemp(prefix='.tmp_', dir=entry_parent)
+
+        stored_files = []
+        out_base = os.path.splitext(out_file)[0]
+        for file_num, output_file in enumerate(_get_output_files(out_file)):
+            if output_file == out_file:
+                suffix = ''
+            elif output_file == out_base + '.hdr':
+                suffix = '.hdr'
+            else:
+                suffix = output_file[len(out_file):]
+            stored_name = 'result{}{}'.format(file_num, suffix)
+            shutil.copyfile(output_file, os.path.join(tmp_entry_dir, stored_name))
+            stored_files.append([suffix, stored_name])
+
+        with open(os.path.join(tmp_entry_dir, _ENTRY_INFO_FILE), 'w') as entry_info_fh:
+            json.dump({'files' : stored_files,
+                       'created' : time.time()}, entry_info_fh)
+
+        os.rename(tmp_entry_dir, entry_dir)
+        tmp_entry_dir = None
+    except (IOError, OSError) as err:
+        dem_common_functions.WARNING('Could not add {} to cache. {}'.format(out_file, err))
+    finally:
+        if tmp_entry_dir is not None:
+            shutil.rmtree(tmp_entry_dir, ignore_errors=True)
+
+    evict()
+
+def evict(max_size_mb=None):
+    """
+    Remove least recently used results until the cache is within
+    its size limit.
+
+    Arguments:
+
+    * max_size_mb - maximum size of cache (default is RESULT_CACHE_MAX_SIZE_MB).
+
+    Returns:
+
+    * number of results removed
+
+    """
+    if max_size_mb is None:
+        max_size_mb = dem_common.RESULT_CACHE_MAX_SIZE_MB
+    max_size = max_size_mb * 1024 * 1024
+
+    if not os.path.isdir(dem_common.RESULT_CACHE_PATH):
+        return 0
+
+    with _CACHE_LOCK:
+        entries = []
+        total_size = 0
+        for prefix in os.listdir(dem_common.RESULT_CACHE_PATH):
+            prefix_dir = os.path.join(dem_common.RESULT_CACHE_PATH, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for cache_key in os.listdir(prefix_dir):
+                entry_dir = os.path.join(prefix_dir, cache_key)
+                try:
+                    last_used = os.path.getmtime(os.path.join(entry_dir, _ENTRY_INFO_FILE))
+                    entry_size = _get_dir_size(entry_dir)
+                except OSError:
+                    # Entry being written (or removed) by another process
+                    continue
+                entries.append((last_used, entry_size, entry_dir))
+                total_size += entry_size
+
+        num_removed = 0
+        for _, entry_size, entry_dir in sorted(entries):
+            if total_size <= max_size:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_size -= entry_size
+            num_removed += 1
+
+    return num_removed
+
+def clear_cache():
+    """
+    Remove all cached results.
+    """
+    with _CACHE_LOCK:
+        if os.path.isdir(dem_common.RESULT_CACHE_PATH):
+            shutil.rmtree(dem_common.RESULT_CACHE_PATH, ignore_errors=True)
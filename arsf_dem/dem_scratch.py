@@ -0,0 +1,535 @@
+#! /usr/bin/env python
+#
+# This file has been created by ARSF Data Analysis Node and
+# is licensed under the GPL v3 Licence. A copy of this
+# licence is available to download with this file.
+
+"""
+Manager for scratch (temporary) files created while running a job.
+
+Scratch files are created within a directory for the job, in the first
+directory in SCRATCH_PATHS (fastest first) which is writable and has
+enough free space. Small intermediate rasters can also be stored on a
+memory backed file system (see dem_intermediate).
+
+The total size of scratch files for a job can be limited using
+SCRATCH_QUOTA_MB, an exception is raised if creating a file would
+exceed the quota.
+
+Scratch directories are removed when the process exits and any left by
+processes which no longer exist (e.g., following a crash) are removed the
+next time a manager is created. Scripts can call install_signal_handlers
+so they are also removed if the process is stopped using SIGTERM / SIGHUP.
+
+Available functions:
+
+* get_scratch_manager - get shared ScratchManager for the process.
+* get_dir - get directory for scratch files using the shared manager.
+* get_temp_file - create a scratch file using the shared manager.
+* get_temp_dir - create a scratch directory using the shared manager.
+* scope - get a ScratchScope from the shared manager.
+* clean_stale_scratch - remove scratch directories left by processes which no longer exist.
+* install_signal_handlers - exit cleanly on SIGTERM / SIGHUP so scratch files are removed.
+
+Example::
+
+   from arsf_dem import dem_scratch
+
+   with dem_scratch.scope() as scratch:
+      temp_dem = scratch.get_temp_file(prefix='dem_subset', suffix='.dem')
+      subset_dem(in_dem, temp_dem)
+      null_fill_dem(temp_dem, out_dem)
+   # temp_dem (and header) removed here, even if an exception was raised
+
+"""
+
+from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
+import os
+import sys
+import glob
+import json
+import errno
+import atexit
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+
+from . import dem_common
+from . import dem_common_functions
+
+#: Prefix for job directories within scratch locations
+SCRATCH_JOB_PREFIX = 'arsf_dem_scratch_'
+
+#: Free space needed in a location, as a multiple of the size of the files
+#: being created (allows for headers and other files written at the same time).
+FREE_SPACE_FACTOR = 2
+
+# Name of file within each job directory identifying the process which created it
+_OWNER_FILE = 'owner.json'
+
+# Shared instance of ScratchManager, created by get_scratch_manager
+_SCRATCH_MANAGER = {'instance' : None}
+_SCRATCH_MANAGER_LOCK = threading.Lock()
+
+def _get_free_space_mb(in_dir):
+    """
+    Get free space (in MB) available in a directory, returns None if
+    this can't be found (e.g., on Windows).
+    """
+    try:
+        dir_stat = os.statvfs(in_dir)
+    except (AttributeError, OSError):
+        return None
+    return (dir_stat.f_bavail * dir_stat.f_frsize) / (1024.0 * 1024.0)
+
+def _get_path_size(in_path):
+    """
+    Get size (in bytes) of a file or all files within a directory.
+    """
+    if os.path.isfile(in_path):
+        return os.path.getsize(in_path)
+    total_size = 0
+    for dir_path, _, file_names in os.walk(in_path):
+        for file_name in file_names:
+            try:
+                total_size += os.path.getsize(os.path.join(dir_path, file_name))
+            except OSError:
+                pass
+    return total_size
+
+def _is_writable_dir(in_dir):
+    """
+    Check directory exists and is writable.
+    """
+    return in_dir is not None and os.path.isdir(in_dir) and os.access(in_dir, os.W_OK)
+
+def _pid_running(pid):
+    """
+    Check if a process is running. Always returns True if this can't be
+    checked (e.g., on Windows).
+    """
+    if os.name != 'posix':
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError as err:
+        return err.errno == errno.EPERM
+    return True
+
+def get_memory_location(size_mb=None):
+    """
+    Get memory backed file system (INTERMEDIATE_TMPFS_PATH) to use
+    for a file, following INTERMEDIATE_STORAGE.
+
+    Arguments:
+
+    * size_mb - estimated size of file in MB (None if not known).
+
+    Returns:
+
+    * INTERMEDIATE_TMPFS_PATH or None if the file shouldn't be stored in memory.
+
+    """
+    storage = dem_common.INTERMEDIATE_STORAGE.upper()
+    if storage not in ['AUTO', 'TMPFS', 'DISK']:
+        raise Exception('INTERMEDIATE_STORAGE "{}" was not recognised. Options '
+                        'are AUTO, TMPFS or DISK'.format(storage))
+
+    if storage == 'DISK' or not _is_writable_dir(dem_common.INTERMEDIATE_TMPFS_PATH):
+        return None
+
+    if storage == 'AUTO' and (size_mb is None or
+                              size_mb > dem_common.INTERMEDIATE_MAX_MEMORY_MB):
+        return None
+
+    # If size isn't known need space for the largest file
+    # which would be stored in memory.
+    if size_mb is None:
+        size_mb = dem_common.INTERMEDIATE_MAX_MEMORY_MB
+    free_space_mb = _get_free_space_mb(dem_common.INTERMEDIATE_TMPFS_PATH)
+    if free_space_mb is None or free_space_mb < size_mb * FREE_SPACE_FACTOR:
+        return None
+
+    return dem_common.INTERMEDIATE_TMPFS_PATH
+
+def clean_stale_scratch(locations=None):
+    """
+    Remove job directories left by processes on this host which
+    no longer exist (e.g., following a crash).
+
+    Arguments:
+
+    * locations - list of scratch locations to check (default is SCRATCH_PATHS and INTERMEDIATE_TMPFS_PATH).
+
+    Returns:
+
+    * number of directories removed
+
+    """
+    if locations is None:
+        locations = list(dem_common.SCRATCH_PATHS)
+        locations.append(dem_common.INTERMEDIATE_TMPFS_PATH)
+
+    host_name = socket.gethostname()
+    num_removed = 0
+    for location in locations:
+        if not _is_writable_dir(location):
+            continue
+        for job_dir in glob.glob(os.path.join(location, SCRATCH_JOB_PREFIX + '*')):
+            try:
+                with open(os.path.join(job_dir, _OWNER_FILE), 'r') as owner_fh:
+                    owner = json.load(owner_fh)
+                if owner['host'] != host_name or owner['pid'] == os.getpid() \
+                        or _pid_running(owner['pid']):
+                    continue
+            except (IOError, OSError, ValueError, KeyError):
+                # Directory being created (or not one of ours)
+                continue
+            print('Removing scratch directory left by process {}: '
+                  '{}'.format(owner['pid'], job_dir))
+            shutil.rmtree(job_dir, ignore_errors=True)
+            num_removed += 1
+
+    return num_removed
+
+class ScratchScope(object):
+    """
+    Set of scratch files which are removed together, when the scope
+    is exited or 'cleanup' is called.
+
+    Created using ScratchManager.scope()
+    """
+    def __init__(self, manager):
+        self.manager = manager
+        self.paths = []
+
+    def get_temp_file(self, prefix='tmp', suffix='', size_mb=None, allow_memory=False):
+        """
+        Create a scratch file, see ScratchManager.get_temp_file.
+        """
+        temp_file = self.manager.get_temp_file(prefix=prefix, suffix=suffix,
+                                               size_mb=size_mb,
+                                               allow_memory=allow_memory)
+        self.paths.append(temp_file)
+        return temp_file
+
+    def get_temp_dir(self, prefix='tmp', size_mb=None, allow_memory=False):
+        """
+        Create a scratch directory, see ScratchManager.get_temp_dir.
+        """
+        temp_dir = self.manager.get_temp_dir(prefix=prefix, size_mb=size_mb,
+                                             allow_memory=allow_memory)
+        self.paths.append(temp_dir)
+        return temp_dir
+
+    def cleanup(self):
+        """
+        Remove all files and directories created in this scope.
+        """
+        while len(self.paths) > 0:
+            self.manager.release(self.paths.pop())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cleanup()
+
+class ScratchManager(object):
+    """
+    Creates scratch files and directories for a job and removes them
+    once finished with.
+
+    Attributes:
+
+    * locations - directories which can be used for scratch files, fastest first.
+    * quota_mb - maximum size of scratch files (0 for no limit).
+
+    Example usage::
+
+       with dem_scratch.ScratchManager() as scratch:
+          temp_dem = scratch.get_temp_file(suffix='.dem')
+
+    """
+    def __init__(self, locations=None, quota_mb=None):
+        if locations is None:
+            locations = dem_common.SCRATCH_PATHS
+        if quota_mb is None:
+            quota_mb = dem_common.SCRATCH_QUOTA_MB
+        self.locations = list(locations)
+        self.quota_mb = quota_mb
+        # Job directory within each location used
+        self._job_dirs = {}
+        self._lock = threading.RLock()
+
+        clean_stale_scratch()
+
+    def get_location(self, size_mb=None, allow_memory=False):
+        """
+        Get first location which is writable and has enough free space.
+        If none have enough space the last location is used.
+
+        Arguments:
+
+        * size_mb - estimated size of files to be created in MB (None if not known).
+        * allow_memory - use a memory backed file system if the files are small enough (see get_memory_location).
+
+        Returns:
+
+        * directory
+
+        """
+        if allow_memory:
+            memory_location = get_memory_location(size_mb)
+            if memory_location is not None:
+                return memory_location
+
+        if size_mb is None:
+            space_needed_mb = dem_common.SCRATCH_MIN_FREE_MB
+        else:
+            space_needed_mb = size_mb * FREE_SPACE_FACTOR
+
+        for location in self.locations:
+            if not _is_writable_dir(location):
+                continue
+            free_space_mb = _get_free_space_mb(location)
+            if free_space_mb is None or free_space_mb >= space_needed_mb:
+                return location
+
+        dem_common_functions.WARNING('None of the scratch locations ({}) are writable '
+                                     'with {} MB free. Using '
+                                     '{}'.format(', '.join(self.locations),
+                                                 int(space_needed_mb),
+                                                 dem_common.TEMP_PATH))
+        return dem_common.TEMP_PATH
+
+    def _get_job_dir(self, location):
+        """
+        Get directory for this job within a location, creating it if needed.
+        """
+        with self._lock:
+            if location in self._job_dirs and os.path.isdir(self._job_dirs[location]):
+                return self._job_dirs[location]
+            job_dir = tempfile.mkdtemp(prefix=SCRATCH_JOB_PREFIX, dir=location)
+            with open(os.path.join(job_dir, _OWNER_FILE), 'w') as owner_fh:
+                json.dump({'host' : socket.gethostname(),
+                           'pid' : os.getpid()}, owner_fh)
+            self._job_dirs[location] = job_dir
+            return job_dir
+
+    def get_usage_mb(self):
+        """
+        Get total size (in MB) of scratch files for this job.
+        """
+        with self._lock:
+            job_dirs = list(self._job_dirs.values())
+        total_size = 0
+        for job_dir in job_dirs:
+            if os.path.isdir(job_dir):
+                total_size += _get_path_size(job_dir)
+        return total_size / (1024.0 * 1024.0)
+
+    def _check_quota(self, size_mb):
+        """
+        Raise an exception if creating files of size_mb would
+        exceed the quota.
+        """
+        if self.quota_mb is None or self.quota_mb <= 0:
+            return
+        usage_mb = self.get_usage_mb()
+        if size_mb is not None:
+            usage_mb += size_mb
+        if usage_mb > self.quota_mb:
+            raise Exception('Scratch quota of {} MB exceeded ({:.0f} MB '
+                            'required). Increase SCRATCH_QUOTA_MB in the '
+                            'config file'.format(self.quota_mb, usage_mb))
+
+    def get_dir(self, size_mb=None, allow_memory=False):
+        """
+        Get directory to create scratch files in.
+
+        Arguments:
+
+        * size_mb - estimated size of files to be created in MB (None if not known).
+        * allow_memory - use a memory backed file system if the files are small enough.
+
+        Returns:
+
+        * directory for this job within best location
+
+        """
+        self._check_quota(size_mb)
+        return self._get_job_dir(self.get_location(size_mb, allow_memory))
+
+    def get_temp_file(self, prefix='tmp', suffix='', size_mb=None, allow_memory=False):
+        """
+        Create a scratch file.
+
+        Arguments:
+
+        * prefix - prefix for file name.
+        * suffix - suffix for file name (e.g., '.dem').
+        * size_mb - estimated size of file in MB (None if not known).
+        * allow_memory - use a memory backed file system if the file is small enough.
+
+        Returns:
+
+        * path to file
+
+        """
+        temp_fh, temp_file = tempfile.mkstemp(prefix=prefix, suffix=suffix,
+                                              dir=self.get_dir(size_mb, allow_memory))
+        os.close(temp_fh)
+        return temp_file
+
+    def get_temp_dir(self, prefix='tmp', size_mb=None, allow_memory=False):
+        """
+        Create a scratch directory.
+
+        Arguments:
+
+        * prefix - prefix for directory name.
+        * size_mb - estimated size of all files in directory in MB (None if not known).
+        * allow_memory - use a memory backed file system if the files are small enough.
+
+        Returns:
+
+        * path to directory
+
+        """
+        return tempfile.mkdtemp(prefix=prefix, dir=self.get_dir(size_mb, allow_memory))
+
+    def release(self, in_path):
+        """
+        Remove a scratch file (and any files with the same name but different
+        extension, e.g., ENVI header) or directory.
+
+        Arguments:
+
+        * in_path - scratch file or directory.
+
+        """
+        if os.path.isdir(in_path):
+            shutil.rmtree(in_path, ignore_errors=True)
+            return
+        for scratch_file in glob.glob(os.path.splitext(in_path)[0] + '.*'):
+            try:
+                os.remove(scratch_file)
+            except OSError:
+                pass
+        if os.path.isfile(in_path):
+            os.remove(in_path)
+
+    def scope(self):
+        """
+        Get a ScratchScope, files created using the scope are removed
+        when it is exited.
+        """
+        return ScratchScope(self)
+
+    def cleanup(self):
+        """
+        Remove all scratch directories for this job.
+        """
+        with self._lock:
+            for job_dir in self._job_dirs.values():
+                if os.path.isdir(job_dir):
+                    shutil.rmtree(job_dir, ignore_errors=True)
+            self._job_dirs = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cleanup()
+
+def _exit_on_signal(signum, frame):
+    """
+    Exit when a signal is received so scratch files are removed
+    (by 'finally' blocks and atexit).
+    """
+    sys.exit(128 + signum)
+
+def _is_main_thread():
+    """
+    Check if running in the main thread.
+    """
+    try:
+        return threading.current_thread() is threading.main_thread()
+    except AttributeError:
+        # Python 2 doesn't have threading.main_thread
+        return threading.current_thread().name == 'MainThread'
+
+def install_signal_handlers():
+    """
+    Exit cleanly on SIGTERM and SIGHUP, so scratch files are removed.
+    Intended to be called from the '__main__' block of scripts, only
+    installed from the main thread and if the default handler hasn't
+    been changed.
+    """
+    if not _is_main_thread():
+        return
+    for signal_name in ['SIGTERM', 'SIGHUP']:
+        signum = getattr(signal, signal_name, None)
+        if signum is None:
+            continue
+        try:
+            if signal.getsignal(signum) == signal.SIG_DFL:
+                signal.signal(signum, _exit_on_signal)
+        except (ValueError, OSError):
+            pass
+
+def _cleanup_scratch_manager():
+    """
+    Remove scratch files for shared ScratchManager.
+    Registered to run when the process exits.
+    """
+    if _SCRATCH_MANAGER['instance'] is not None:
+        _SCRATCH_MANAGER['instance'].cleanup()
+
+atexit.register(_cleanup_scratch_manager)
+
+def get_scratch_manager():
+    """
+    Get shared ScratchManager for the process, which is created
+    the first time this function is called.
+    """
+    if _SCRATCH_MANAGER['instance'] is None:
+        with _SCRATCH_MANAGER_LOCK:
+            if _SCRATCH_MANAGER['instance'] is None:
+                _SCRATCH_MANAGER['instance'] = ScratchManager()
+    return _SCRATCH_MANAGER['instance']
+
+def get_dir(size_mb=None, allow_memory=False):
+    """
+    Get directory to create scratch files in using the shared ScratchManager
+    (e.g., for 'dir' argument of tempfile.mkstemp). See ScratchManager.get_dir.
+    """
+    return get_scratch_manager().get_dir(size_mb=size_mb,
+                                         allow_memory=allow_memory)
+
+def get_temp_file(prefix='tmp', suffix='', size_mb=None, allow_memory=False):
+    """
+    Create a scratch file using the shared ScratchManager.
+    See ScratchManager.get_temp_file.
+    """
+    return get_scratch_manager().get_temp_file(prefix=prefix, suffix=suffix,
+                                               size_mb=size_mb,
+                                               allow_memory=allow_memory)
+
+def get_temp_dir(prefix='tmp', size_mb=None, allow_memory=False):
+    """
+    Create a scratch directory using the shared ScratchManager.
+    See ScratchManager.get_temp_dir.
+    """
+    return get_scratch_manager().get_temp_dir(prefix=prefix, size_mb=size_mb,
+                                              allow_memory=allow_memory)
+
+def scope():
+    """
+    Get a ScratchScope from the shared ScratchManager, files created
+    using the scope are removed when it is exited.
+    """
+    return get_scratch_manager().scope()
@@ -0,0 +1,434 @@
+#! /usr/bin/env python
+#
+# This file has been created by ARSF Data Analysis Node and
+# is licensed under the GPL v3 Licence. A copy of this
+# licence is available to download with this file.
+
+"""
+Simple dependency aware task graph for running the stages of a DEM
+workflow.
+
+Each stage is added as a task, which declares the tasks it depends on
+and/or the files it reads (inputs) and writes (outputs). A task depending
+on a file produced by another task will wait for that task. Tasks which
+don't depend on each other are run at the same time using a pool of
+threads. If a task fails, only tasks which depend on it (directly or
+indirectly) are cancelled, other tasks continue to run.
+
+Tasks which use GRASS should set 'grass_workspace=True' so they are run
+in their own GRASS workspace (see grass_library.GRASSWorkspace).
+
+Each task can also give the number of cores ('cpus') and an estimate of
+the memory ('memory_mb') it needs. A task is only started if these fit
+within the CPU and memory budget left by the tasks already running. The
+budget is taken from NUM_PROCESSES and MAX_MEMORY_MB in the config file
+and can be changed (e.g., from command line options) using
+'set_resource_budget'.
+
+Available classes:
+
+* Task - a single stage.
+* TaskGraph - set of tasks and dependencies between them.
+
+Available functions:
+
+* set_resource_budget - set CPU and memory budget used by all task graphs.
+* estimate_grid_memory_mb - estimate memory needed to hold a raster grid.
+
+Example::
+
+   from arsf_dem import dem_task_graph
+
+   graph = dem_task_graph.TaskGraph()
+   graph.add_task('lidar', create_lidar_mosaic, args=(in_lidar, lidar_dem),
+                  outputs=[lidar_dem], grass_workspace=True)
+   graph.add_task('dem', subset_dem_to_nav, args=(in_dem, dem_subset),
+                  outputs=[dem_subset], grass_workspace=True)
+   graph.add_task('patch', patch_files, args=([lidar_dem, dem_subset],),
+                  inputs=[lidar_dem, dem_subset], grass_workspace=True)
+   graph.run()
+
+"""
+
+from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
+import os
+import threading
+import traceback
+from multiprocessing.pool import ThreadPool
+
+from . import dem_common
+from . import dem_common_functions
+from . import grass_library
+from . import dem_trace
+
+#: Task states
+TASK_PENDING = 'pending'
+TASK_RUNNING = 'running'
+TASK_SUCCEEDED = 'succeeded'
+TASK_FAILED = 'failed'
+TASK_CANCELLED = 'cancelled'
+
+#: Memory (in MB) assumed for a task if no estimate is given
+DEFAULT_TASK_MEMORY_MB = 256
+
+# CPU and memory budget shared by all task graphs (None to use
+# values from config file).
+_RESOURCE_BUDGET = {'num_processes' : None,
+                    'max_memory_mb' : None}
+
+def set_resource_budget(num_processes=None, max_memory_mb=None):
+    """
+    Set the CPU and memory budget used by task graphs created
+    after this is called. Values which are None are left unchanged.
+
+    Arguments:
+
+    * num_processes - number of cores tasks can use at once.
+    * max_memory_mb - total memory (in MB) tasks can use at once.
+
+    """
+    if num_processes is not None:
+        if num_processes < 1:
+            raise Exception('Number of processes must be at least 1')
+        _RESOURCE_BUDGET['num_processes'] = int(num_processes)
+    if max_memory_mb is not None:
+        if max_memory_mb <= 0:
+            raise Exception('Maximum memory must be greater than 0')
+        _RESOURCE_BUDGET['max_memory_mb'] = int(max_memory_mb)
+
+def get_resource_budget():
+    """
+    Get the current CPU and memory budget.
+
+    Returns:
+
+    * tuple (num_processes, max_memory_mb)
+
+    """
+    num_processes = _RESOURCE_BUDGET['num_processes']
+    if num_processes is None:
+        num_processes = dem_common.NUM_PROCESSES
+    max_memory_mb = _RESOURCE_BUDGET['max_memory_mb']
+    if max_memory_mb is None:
+        max_memory_mb = dem_common.MAX_MEMORY_MB
+    return max(1, num_processes), max_memory_mb
+
+def estimate_grid_memory_mb(n_cols, n_rows, bytes_per_cell=8, n_grids=1,
+                            overhead_mb=64):
+    """
+    Estimate the memory needed to hold a raster grid (or several grids
+    of the same size) in memory.
+
+    Arguments:
+
+    * n_cols - number of columns.
+    * n_rows - number of rows.
+    * bytes_per_cell - bytes for each cell (8 for double precision).
+    * n_grids - number of grids held at once.
+    * overhead_mb - memory needed regardless of grid size.
+
+    Returns:
+
+    * memory in MB (int)
+
+    """
+    grid_bytes = float(n_cols) * float(n_rows) * bytes_per_cell * n_grids
+    return int(grid_bytes / (1024 * 1024)) + overhead_mb
+
+class Task(object):
+    """
+    A single stage within a TaskGraph.
+
+    Attributes:
+
+    * name - unique name for task.
+    * function - function to call.
+    * args / kwargs - arguments to pass to function.
+    * depends_on - names of tasks which must complete first.
+    * inputs - files read by task.
+    * outputs - files written by task.
+    * grass_workspace - run task in its own GRASS workspace.
+    * cpus - number of cores used by task.
+    * memory_mb - estimated memory (in MB) used by task.
+    * state - current state (pending, running, succeeded, failed or cancelled).
+    * result - value returned by function.
+    * error - exception raised by function (if failed).
+
+    """
+    def __init__(self, name, function, args=(), kwargs=None,
+                 depends_on=None, inputs=None, outputs=None,
+                 grass_workspace=False, cpus=1,
+                 memory_mb=DEFAULT_TASK_MEMORY_MB):
+        self.name = name
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs if kwargs is not None else {}
+        self.depends_on = list(depends_on) if depends_on is not None else []
+        self.inputs = list(inputs) if inputs is not None else []
+        self.outputs = list(outputs) if outputs is not None else []
+        self.grass_workspace = grass_workspace
+        self.cpus = max(1, int(cpus))
+        self.memory_mb = max(0, int(memory_mb))
+        self.state = TASK_PENDING
+        self.result = None
+        self.error = None
+
+    def run(self):
+        """
+        Run task function (in GRASS workspace if requested).
+        """
+        if self.grass_workspace:
+            with grass_library.GRASSWorkspace():
+                return self.function(*self.args, **self.kwargs)
+        else:
+            return self.function(*self.args, **self.kwargs)
+
+class TaskGraph(object):
+    """
+    A set of tasks and the dependencies between them.
+
+    Tasks are added using 'add_task' and all run using 'run'.
+
+    If 'num_processes' or 'max_memory_mb' are not given the budget set
+    using 'set_resource_budget' (or from the config file) is used.
+
+    """
+    def __init__(self, num_processes=None, max_memory_mb=None):
+        budget_processes, budget_memory_mb = get_resource_budget()
+        if num_processes is None:
+            num_processes = budget_processes
+        if max_memory_mb is None:
+            max_memory_mb = budget_memory_mb
+        self.num_processes = max(1, num_processes)
+        self.max_memory_mb = max_memory_mb
+        self.tasks = {}
+        self._task_order = []
+        self._condition = threading.Condition()
+
+    def add_task(self, name, function, args=(), kwargs=None,
+                 depends_on=None, inputs=None, outputs=None,
+                 grass_workspace=False, cpus=1,
+                 memory_mb=DEFAULT_TASK_MEMORY_MB):
+        """
+        Add a task to the graph.
+
+        Arguments:
+
+        * name - unique name for task.
+        * function - function to call.
+        * args - list of arguments to pass to function.
+        * kwargs - dictionary of keyword arguments to pass to function.
+        * depends_on - list of names of tasks which must complete first.
+        * inputs - list of files read by task, will wait for any task which has them as an output.
+        * outputs - list of files written by task.
+        * grass_workspace - run task in its own GRASS workspace.
+        * cpus - number of cores used by task.
+        * memory_mb - estimated memory (in MB) used by task.
+
+        Returns:
+
+        * Task
+
+        """
+        if name in self.tasks:
+            raise Exception('A task named "{}" has already been added'.format(name))
+        task = Task(name, function, args=args, kwargs=kwargs,
+                    depends_on=depends_on, inputs=inputs, outputs=outputs,
+                    grass_workspace=grass_workspace, cpus=cpus,
+                    memory_mb=memory_mb)
+        self.tasks[name] = task
+        self._task_order.append(name)
+        return task
+
+    def get_dependencies(self, name):
+        """
+        Get names of tasks a task depends on, either directly or through
+        its inputs being the outputs of another task.
+
+        Arguments:
+
+        * name - name of task
+
+        Returns:
+
+        * list of task names
+
+        """
+        task = self.tasks[name]
+        dependencies = list(task.depends_on)
+
+        task_inputs = [os.path.abspath(in_file) for in_file in task.inputs]
+        for other_name in self._task_order:
+            if other_name == name or other_name in dependencies:
+                continue
+            other_outputs = [os.path.abspath(out_file)
+                             for out_file in self.tasks[other_name].outputs]
+            for in_file in task_inputs:
+                if in_file in other_outputs:
+                    dependencies.append(other_name)
+                    break
+
+        for dependency in dependencies:
+            if dependency not in self.tasks:
+                raise Exception('Task "{}" depends on unknown task "{}"'.format(name, dependency))
+
+        return dependencies
+
+    def get_result(self, name):
+        """
+        Get value returned by a task (None if it hasn't run successfully).
+        """
+        return self.tasks[name].result
+
+    def succeeded(self, name):
+        """
+        Check if a task has completed successfully.
+        """
+        return self.tasks[name].state == TASK_SUCCEEDED
+
+    def _check_no_cycles(self, dependencies):
+        """
+        Check there are no circular dependencies between tasks.
+        """
+        visited = {}
+
+        def _visit(name, path):
+            if visited.get(name) == 'done':
+                return
+            if visited.get(name) == 'visiting':
+                raise Exception('Circular dependency between tasks: '
+                                '{}'.format(' -> '.join(path + [name])))
+            visited[name] = 'visiting'
+            for dependency in dependencies[name]:
+                _visit(dependency, path + [name])
+            visited[name] = 'done'
+
+        for name in self._task_order:
+            _visit(name, [])
+
+    def _can_start(self, task, running_tasks):
+        """
+        Check if the cores and memory needed by a task are available
+        given the tasks already running.
+
+        If no tasks are running a task is always started (even if it
+        needs more than the budget) so the graph can't stall.
+        """
+        if len(running_tasks) == 0:
+            if task.cpus > self.num_processes or \
+                    task.memory_mb > self.max_memory_mb:
+                dem_common_functions.WARNING('Task "{}" needs {} cores and {} MB '
+                                             'which is more than the budget of '
+                                             '{} cores and {} MB. Running on its '
+                                             'own.'.format(task.name, task.cpus,
+                                                           task.memory_mb,
+                                                           self.num_processes,
+                                                           self.max_memory_mb))
+            return True
+
+        used_cpus = sum([running.cpus for running in running_tasks])
+        used_memory_mb = sum([running.memory_mb for running in running_tasks])
+
+        if used_cpus + task.cpus > self.num_processes:
+            return False
+        if used_memory_mb + task.memory_mb > self.max_memory_mb:
+            return False
+        return True
+
+    def _run_task(self, task):
+        """
+        Run a single task in a worker thread and record the result.
+        """
+        try:
+            with dem_trace.span(task.name, category='stage'):
+                task.result = task.run()
+            state = TASK_SUCCEEDED
+        except Exception as err:
+            task.error = err
+            state = TASK_FAILED
+            dem_common_functions.ERROR('Task "{}" failed:\n{}'.format(task.name,
+                                                                      traceback.format_exc()))
+        with self._condition:
+            task.state = state
+            self._condition.notify_all()
+
+    def run(self, raise_on_error=True):
+        """
+        Run all tasks. Tasks are started as soon as all the tasks they depend
+        on have completed successfully and the cores and memory they need
+        are available.
+
+        If a task fails all tasks depending on it are cancelled, other tasks
+        continue to run.
+
+        Arguments:
+
+        * raise_on_error - raise an exception once all tasks have finished if any task failed.
+
+        Returns:
+
+        * dictionary of results for each task which completed successfully
+
+        """
+        dependencies = {}
+        for name in self._task_order:
+            dependencies[name] = self.get_dependencies(name)
+
+        self._check_no_cycles(dependencies)
+
+        task_pool = ThreadPool(self.num_processes)
+        try:
+            with self._condition:
+                while True:
+                    waiting = 0
+                    changed = False
+                    running_tasks = [self.tasks[name] for name in self._task_order
+                                     if self.tasks[name].state == TASK_RUNNING]
+                    for name in self._task_order:
+                        task = self.tasks[name]
+                        if task.state != TASK_PENDING:
+                            continue
+                        dependency_states = [self.tasks[dependency].state
+                                             for dependency in dependencies[name]]
+                        if TASK_FAILED in dependency_states or \
+                                TASK_CANCELLED in dependency_states:
+                            print('Cancelling task "{}" as a task it depends '
+                                  'on did not complete'.format(name))
+                            task.state = TASK_CANCELLED
+                            changed = True
+                        elif all([state == TASK_SUCCEEDED
+                                  for state in dependency_states]) and \
+                                self._can_start(task, running_tasks):
+                            task.state = TASK_RUNNING
+                            running_tasks.append(task)
+                            task_pool.apply_async(self._run_task, (task,))
+                            changed = True
+                        else:
+                            waiting += 1
+
+                    running = len(running_tasks)
+                    if running == 0 and waiting == 0:
+                        break
+                    # If a task was cancelled, check again as tasks
+                    # depending on it also need cancelling.
+                    if changed and running == 0:
+                        continue
+                    # Wait for a task to finish
+                    self._condition.wait()
+        finally:
+            task_pool.close()
+            task_pool.join()
+
+        failed = [name for name in self._task_order
+                  if self.tasks[name].state == TASK_FAILED]
+
+        if raise_on_error and len(failed) > 0:
+            raise Exception('The following tasks failed: {}\n{}'.format(
+                                ', '.join(failed), self.tasks[failed[0]].error))
+
+        results = {}
+        for name in self._task_order:
+            if self.tasks[name].state == TASK_SUCCEEDED:
+                results[name] = self.tasks[name].result
+
+        return results
@@ -0,0 +1,581 @@
+#! /usr/bin/env python
+#
+# This file has been created by ARSF Data Analysis Node and
+# is licensed under the GPL v3 Licence. A copy of this
+# licence is available to download with this file.
+
+"""
+Cache of processed tiles from reference DEMs (e.g., ASTER, SRTM, NEXTMAP).
+
+When subsetting a DEM mosaic to a bounding box (using
+dem_utilities.subset_dem_to_bounding_box) the output is split into tiles
+on a fixed grid for the output projection and resolution. Each tile is
+subset, offset to the ellipsoid and null filled once and stored in
+DEM_TILE_CACHE_PATH. Subsequent requests for the same area (e.g., the
+same site flown in a different season) are assembled from the cached
+tiles, only tiles which haven't been created previously are processed.
+
+Tiles are processed with a buffer of DEM_TILE_CACHE_BUFFER pixels, so
+null filling uses values from neighbouring tiles. Areas of no data wider
+than the buffer are filled differently from filling the whole area at once
+and can leave seams at tile edges. For this reason the cache is disabled by
+default, it can be enabled using DEM_TILE_CACHE_ENABLED in the config file
+or 'set_enabled(True)' and disabled again using the '--no-cache' option of
+the command line scripts.
+
+Tiles are stored separately for each input DEM, separation file and set
+of parameters. The total size of the cache is limited to
+DEM_TILE_CACHE_MAX_SIZE_MB, when exceeded the least recently used tiles
+are removed. Tiles being used to create an output (listed in an 'in use'
+file in the cache directory) are not removed.
+
+Available functions:
+
+* is_enabled - check if cache is enabled.
+* set_enabled - enable / disable cache.
+* get_tile_grid - get grid tiles are stored on for a DEM and output projection.
+* subset_dem_from_tiles - subset DEM to bounding box using cached tiles.
+* evict - remove least recently used tiles until cache is within size limit.
+* clear_cache - remove all cached tiles.
+
+"""
+
+from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
+import os
+import math
+import json
+import glob
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+
+from . import dem_common
+from . import dem_tool_runner
+from . import dem_utilities
+from . import dem_result_cache
+from . import dem_intermediate
+from . import dem_scratch
+from . import grass_library
+
+# Try to import GDAL
+HAVE_GDAL=True
+try:
+    from osgeo import gdal
+    from osgeo import osr
+except ImportError:
+    # If can't import don't complain until GDAL is actually needed
+    HAVE_GDAL=False
+
+#: Version of tile cache, changing this invalidates all cached tiles
+DEM_TILE_CACHE_VERSION = 1
+
+#: Creation options for cached tiles (stored as GeoTIFF)
+DEM_TILE_CREATION_OPTIONS = 'COMPRESS=LZW'
+
+#: Time (in seconds) after which an 'in use' file is assumed to have been left by a process which didn't finish
+IN_USE_MAX_AGE = 24 * 60 * 60
+
+_CACHE_STATE = {'enabled' : dem_common.DEM_TILE_CACHE_ENABLED}
+_CACHE_LOCK = threading.Lock()
+
+def is_enabled():
+    """
+    Check if cache is enabled.
+    """
+    return _CACHE_STATE['enabled']
+
+def set_enabled(enabled=True):
+    """
+    Enable or disable cache (e.g., for '--no-cache').
+
+    Arguments:
+
+    * enabled - True / False
+
+    """
+    _CACHE_STATE['enabled'] = bool(enabled)
+
+class TileGrid(object):
+    """
+    Fixed grid of tiles in the output projection.
+
+    Attributes:
+
+    * projection - Proj4 string of output projection.
+    * res_x / res_y - pixel size (positive values).
+    * origin_x / origin_y - coordinates of a corner of a tile (grid is aligned to this).
+    * tile_size - size of tiles (in pixels).
+
+    """
+    def __init__(self, projection, res_x, res_y, origin_x=0.0, origin_y=0.0,
+                 tile_size=dem_common.DEM_TILE_CACHE_TILE_SIZE):
+        self.projection = projection
+        self.res_x = float(res_x)
+        self.res_y = float(res_y)
+        self.origin_x = float(origin_x)
+        self.origin_y = float(origin_y)
+        self.tile_size = int(tile_size)
+        self.tile_width = self.tile_size * self.res_x
+        self.tile_height = self.tile_size * self.res_y
+
+    def get_tile_indices(self, bounding_box):
+        """
+        Get indices (column, row) of tiles covering a bounding box.
+
+        Arguments:
+
+        * bounding_box - List of 4 values providing the bounding box of the format: [MinY, MaxY, MinX, MaxX] in grid projection.
+
+        Returns:
+
+        * list of (column, row) tuples
+
+        """
+        # Allow a small tolerance so a bounding box which ends on a tile
+        # edge doesn't include the next tile.
+        tolerance = 1e-6
+        min_col = int(math.floor((bounding_box[2] - self.origin_x) / self.tile_width + tolerance))
+        max_col = int(math.floor((bounding_box[3] - self.origin_x) / self.tile_width - tolerance))
+        min_row = int(math.floor((bounding_box[0] - self.origin_y) / self.tile_height + tolerance))
+        max_row = int(math.floor((bounding_box[1] - self.origin_y) / self.tile_height - tolerance))
+
+        return [(col, row) for row in range(min_row, max_row + 1)
+                for col in range(min_col, max_col + 1)]
+
+    def get_tile_bounding_box(self, col, row, buffer_pixels=0):
+        """
+        Get bounding box of a tile.
+
+        Arguments:
+
+        * col / row - indices of tile.
+        * buffer_pixels - number of pixels to buffer tile by.
+
+        Returns:
+
+        * bounding box - List of 4 values of the format: [MinY, MaxY, MinX, MaxX]
+
+        """
+        buffer_x = buffer_pixels * self.res_x
+        buffer_y = buffer_pixels * self.res_y
+        min_x = self.origin_x + col * self.tile_width
+        min_y = self.origin_y + row * self.tile_height
+        return [min_y - buffer_y, min_y + self.tile_height + buffer_y,
+                min_x - buffer_x, min_x + self.tile_width + buffer_x]
+
+def _is_wgs84ll(projection):
+    """
+    Check if a projection (Proj4 string or None) is WGS84LL.
+    """
+    return projection is None or \
+           grass_library.proj4_to_grass_location(projection) == 'WGS84LL'
+
+def _get_input_srs(in_dem_mosaic, in_dem_projection=None):
+    """
+    Get geotransform and spatial reference of input DEM
+    (None, None if it can't be opened).
+    """
+    in_ds = gdal.Open(in_dem_mosaic, gdal.GA_ReadOnly)
+    if in_ds is None:
+        return None, None
+    in_geotransform = in_ds.GetGeoTransform()
+    in_srs = osr.SpatialReference()
+    if in_dem_projection is not None:
+        in_srs.ImportFromProj4(in_dem_projection.strip('"\''))
+    else:
+        in_srs.ImportFromWkt(in_ds.GetProjection())
+    in_ds = None
+    return in_geotransform, in_srs
+
+def get_tile_grid(in_dem_mosaic, in_dem_projection=None,
+                  out_projection=None, out_res=None):
+    """
+    Get grid tiles are stored on.
+
+    If the output resolution isn't provided it is taken from the
+    input DEM, and the grid is aligned to the input DEM so pixels
+    aren't resampled. This is only possible if the output is not being
+    reprojected.
+
+    Arguments:
+
+    * in_dem_mosaic - Mosaic of DEM to subset.
+    * in_dem_projection - Input projection of DEM mosaic (Proj4 format)
+    * out_projection - Output projection (Proj4 format) if not WGS84LL.
+    * out_res - Out resolution e.g., (0.002,0.002)
+
+    Returns:
+
+    * TileGrid or None if a grid can't be determined (tile cache can't be used).
+
+    """
+    if not HAVE_GDAL:
+        return None
+
+    reproject = not _is_wgs84ll(out_projection)
+    grid_projection = out_projection if reproject else dem_common.WGS84_PROJ4_STRING
+
+    in_geotransform, in_srs = _get_input_srs(in_dem_mosaic, in_dem_projection)
+    if in_geotransform is None:
+        return None
+
+    in_res = (abs(in_geotransform[1]), abs(in_geotransform[5]))
+
+    if out_res is not None:
+        if isinstance(out_res, list) or isinstance(out_res, tuple):
+            res = (abs(float(out_res[0])), abs(float(out_res[1])))
+        else:
+            res = (abs(float(out_res)), abs(float(out_res)))
+    elif not reproject and in_srs.IsGeographic():
+        res = in_res
+    else:
+        return None
+
+    # If the output is the same projection and resolution as the input
+    # align grid to input so pixels aren't resampled.
+    origin = (0.0, 0.0)
+    if not reproject and in_srs.IsGeographic() and \
+            abs(res[0] - in_res[0]) < 1e-12 and abs(res[1] - in_res[1]) < 1e-12:
+        origin = (in_geotransform[0] % (res[0] * dem_common.DEM_TILE_CACHE_TILE_SIZE),
+                  in_geotransform[3] % (res[1] * dem_common.DEM_TILE_CACHE_TILE_SIZE))
+
+    return TileGrid(grid_projection, res[0], res[1], origin[0], origin[1])
+
+def _get_cache_dir(tile_grid, in_dem_mosaic, separation_file,
+                   ascii_separation_file, in_dem_projection,
+                   nodata, fill_nulls):
+    """
+    Get directory tiles for a DEM and set of parameters are stored in.
+    """
+    key_values = {'cache_version' : DEM_TILE_CACHE_VERSION,
+                  'in_dem_mosaic' : dem_result_cache.get_file_fingerprint(in_dem_mosaic),
+                  'separation_file' : None,
+                  'ascii_separation_file' : ascii_separation_file,
+                  'in_dem_projection' : in_dem_projection,
+                  'grid' : [tile_grid.projection, tile_grid.res_x, tile_grid.res_y,
+                            tile_grid.origin_x, tile_grid.origin_y, tile_grid.tile_size],
+                  'buffer' : dem_common.DEM_TILE_CACHE_BUFFER,
+                  'nodata' : nodata,
+                  'fill_nulls' : fill_nulls,
+                  'out_raster_type' : dem_common.GDAL_OUTFILE_DATATYPE,
+                  'resample_method' : dem_common.RESAMPLE_METHOD}
+    if separation_file is not None:
+        key_values['separation_file'] = dem_result_cache.get_file_fingerprint(separation_file)
+
+    key_json = json.dumps(key_values, sort_keys=True, default=str)
+    cache_key = hashlib.sha256(key_json.encode('utf-8')).hexdigest()
+    return os.path.join(dem_common.DEM_TILE_CACHE_PATH, cache_key)
+
+def _create_tile(tile_file, tile_grid, col, row,
+                 in_dem_mosaic, in_dem_is_wgs84ll,
+                 separation_file=None,
+                 ascii_separation_file=False,
+                 in_dem_projection=None,
+                 nodata=dem_common.NODATA_VALUE,
+                 fill_nulls=True):
+    """
+    Subset, offset and null fill a single tile following the same steps
+    as dem_utilities.subset_dem_to_bounding_box.
+    """
+    tile_bb = tile_grid.get_tile_bounding_box(col, row)
+    buffered_bb = tile_grid.get_tile_bounding_box(col, row,
+                                    buffer_pixels=dem_common.DEM_TILE_CACHE_BUFFER)
+    tile_res = (tile_grid.res_x, tile_grid.res_y)
+    reproject = not _is_wgs84ll(tile_grid.projection)
+
+    # Allow for input subset, buffered tile and tile
+    buffered_size = tile_grid.tile_size + 2 * dem_common.DEM_TILE_CACHE_BUFFER
+    tmp_size_mb = (3 * buffered_size * buffered_size * 4) / (1024.0 * 1024.0)
+    tmp_dir = dem_intermediate.mkdtemp(prefix='dem_tile', size_mb=tmp_size_mb)
+    try:
+        tmp_tile = os.path.join(tmp_dir, 'tile.tif')
+
+        if reproject and in_dem_is_wgs84ll:
+            # Offset and fill in projection of input DEM (as separation files
+            # are in this projection) then reproject to tile.
+            tmp_in_dem = os.path.join(tmp_dir, 'tile_in.dem')
+            buffered_bb_ll = dem_utilities.reproject_bounding_box(buffered_bb,
+                                                    tile_grid.projection,
+                                                    dem_common.WGS84_PROJ4_STRING)
+            buffered_bb_ll = dem_utilities.buffer_bounding_box_proportion(buffered_bb_ll)
+            dem_utilities.subset_to_bb(in_dem_mosaic, tmp_in_dem, buffered_bb_ll,
+                                       in_projection=in_dem_projection,
+                                       out_projection=in_dem_projection,
+                                       num_processes=1,
+                                       final_output=False)
+            if separation_file is not None or fill_nulls:
+                dem_utilities.offset_null_fill_dem(tmp_in_dem, tmp_in_dem,
+                                        separation_file=separation_file,
+                                        ascii_separation_file=ascii_separation_file,
+                                        nodata=-9999,
+                                        remove_grassdb=True,
+                                        fill_nulls=fill_nulls)
+            dem_utilities.call_gdalwarp(tmp_in_dem, tmp_tile,
+                                        s_srs=in_dem_projection,
+                                        t_srs=tile_grid.projection,
+                                        of='GTiff',
+                                        co=DEM_TILE_CREATION_OPTIONS,
+                                        target_res=tile_res,
+                                        out_extent=tile_bb)
+        elif reproject:
+            dem_utilities.call_gdalwarp(in_dem_mosaic, tmp_tile,
+                                        s_srs=in_dem_projection,
+                                        t_srs=tile_grid.projection,
+                                        of='GTiff',
+                                        co=DEM_TILE_CREATION_OPTIONS,
+                                        target_res=tile_res,
+                                        out_extent=tile_bb)
+        else:
+            # Subset with a buffer so null filling can use values
+            # from neighbouring tiles, then remove buffer.
+            tmp_buffered = os.path.join(tmp_dir, 'tile_buffered.dem')
+            dem_utilities.call_gdalwarp(in_dem_mosaic, tmp_buffered,
+                                        s_srs=in_dem_projection,
+                                        t_srs=tile_grid.projection,
+                                        target_res=tile_res,
+                                        out_extent=buffered_bb)
+            if separation_file is not None or fill_nulls:
+                dem_utilities.offset_null_fill_dem(tmp_buffered, tmp_buffered,
+                                        separation_file=separation_file,
+                                        ascii_separation_file=ascii_separation_file,
+                                        nodata=nodata,
+                                        remove_grassdb=True,
+                                        fill_nulls=fill_nulls)
+            gdal_translate_cmd = ['gdal_translate',
+                                  '-srcwin', str(dem_common.DEM_TILE_CACHE_BUFFER),
+                                  str(dem_common.DEM_TILE_CACHE_BUFFER),
+                                  str(tile_grid.tile_size), str(tile_grid.tile_size),
+                                  '-of', 'GTiff',
+                                  '-co', DEM_TILE_CREATION_OPTIONS,
+                                  tmp_buffered, tmp_tile]
+            dem_tool_runner.run_tool_blocking(gdal_translate_cmd)
+
+        if not os.path.isfile(tmp_tile):
+            raise Exception('Could not create DEM tile {}'.format(tile_file))
+
+        # Move into cache once complete so other processes never
+        # see a partial tile. Temporary directory might be on a different
+        # file system so copy next to tile first.
+        tmp_cache_tile = '{}.{}_{}.tmp'.format(tile_file, os.getpid(),
+                                               threading.current_thread().ident)
+        try:
+            shutil.move(tmp_tile, tmp_cache_tile)
+            os.rename(tmp_cache_tile, tile_file)
+        finally:
+            if os.path.isfile(tmp_cache_tile):
+                os.remove(tmp_cache_tile)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def subset_dem_from_tiles(in_dem_mosaic,
+                          out_demfile,
+                          bounding_box,
+                          separation_file=None,
+                          ascii_separation_file=False,
+                          in_dem_projection=None,
+                          out_projection=None,
+                          out_res=None,
+                          nodata=dem_common.NODATA_VALUE,
+                          fill_nulls=True):
+    """
+    Subset DEM to bounding box, apply offset and fill null values using
+    cached tiles. Tiles not in the cache are created and added to it.
+
+    Takes the same arguments as dem_utilities.subset_dem_to_bounding_box.
+
+    Arguments:
+
+    * in_dem_mosaic - Mosaic of large DEM to subset, can be anything GDAL can read (including a virtual raster file).
+    * out_demfile - Output file.
+    * bounding_box - List of 4 values providing the bounding box of the format: [MinY, MaxY, MinX, MaxX]. Values are lat/long in degrees.
+    * separation_file - Datum offset fill to add to heights.
+    * ascii_separation_file - Bool to specify is separation file is ASCII format.
+    * in_dem_projection - Input projection of DEM mosaic (Proj4 format)
+    * out_projection - Output projection if not WGS84LL.
+    * out_res - Out resolution e.g., (0.002,0.002)
+    * nodata - No data value.
+    * fill_nulls - Null fill values
+
+    Returns:
+
+    * True if output was created from tiles, False if tiles can't be used (e.g., output resolution can't be determined).
+
+    """
+    tile_grid = get_tile_grid(in_dem_mosaic, in_dem_projection=in_dem_projection,
+                              out_projection=out_projection, out_res=out_res)
+    if tile_grid is None:
+        return False
+
+    cache_dir = _get_cache_dir(tile_grid, in_dem_mosaic, separation_file,
+                               ascii_separation_file, in_dem_projection,
+                               nodata, fill_nulls)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    if _is_wgs84ll(tile_grid.projection):
+        out_bounding_box = list(bounding_box)
+    else:
+        out_bounding_box = dem_utilities.reproject_bounding_box(list(bounding_box),
+                                                    dem_common.WGS84_PROJ4_STRING,
+                                                    tile_grid.projection)
+
+    # Check if input DEM is WGS84LL (determines where offset and fill are applied)
+    if in_dem_projection is not None:
+        in_dem_is_wgs84ll = _is_wgs84ll(in_dem_projection)
+    else:
+        in_dem_is_wgs84ll = _get_input_srs(in_dem_mosaic)[1].IsGeographic()
+
+    tile_indices = tile_grid.get_tile_indices(out_bounding_box)
+    tile_files = [os.path.join(cache_dir, 'tile_{}_{}.tif'.format(col, row))
+                  for col, row in tile_indices]
+    num_created = 0
+
+    # Mark tiles as in use so they aren't evicted by another process
+    # before the output has been created from them.
+    in_use_file = _mark_in_use(cache_dir, tile_files)
+    try:
+        for (col, row), tile_file in zip(tile_indices, tile_files):
+            if os.path.isfile(tile_file):
+                # Update modification time, used for least recently used eviction
+                try:
+                    os.utime(tile_file, None)
+                except OSError:
+                    pass
+            else:
+                num_created += 1
+                print('Creating DEM tile {} / {} ({}, {})'.format(num_created,
+                                                            len(tile_indices), col, row))
+                _create_tile(tile_file, tile_grid, col, row,
+                             in_dem_mosaic, in_dem_is_wgs84ll,
+                             separation_file=separation_file,
+                             ascii_separation_file=ascii_separation_file,
+                             in_dem_projection=in_dem_projection,
+                             nodata=nodata,
+                             fill_nulls=fill_nulls)
+
+        print('Using {} cached DEM tiles, created {}'.format(len(tile_files) - num_created,
+                                                            num_created))
+
+        # Assemble tiles into a VRT and subset to bounding box
+        vrt_fh, tiles_vrt = tempfile.mkstemp(prefix='dem_tiles', suffix='.vrt',
+                                             dir=dem_scratch.get_dir())
+        os.close(vrt_fh)
+        try:
+            dem_tool_runner.run_tool_blocking(['gdalbuildvrt', '-overwrite',
+                                               tiles_vrt] + tile_files)
+            dem_utilities.subset_to_bb(tiles_vrt, out_demfile, out_bounding_box,
+                                       in_projection=tile_grid.projection,
+                                       out_projection=tile_grid.projection)
+        finally:
+            if os.path.isfile(tiles_vrt):
+                os.remove(tiles_vrt)
+    finally:
+        _unmark_in_use(in_use_file)
+
+    evict()
+
+    return True
+
+def _mark_in_use(cache_dir, tile_files):
+    """
+    Write file listing tiles in use by this process / thread, these won't
+    be removed by evict until the file is removed.
+
+    Returns path of file.
+    """
+    in_use_file = os.path.join(cache_dir, 'in_use_{}_{}.json'.format(os.getpid(),
+                                                    threading.current_thread().ident))
+    tmp_in_use_file = in_use_file + '.tmp'
+    with open(tmp_in_use_file, 'w') as in_use_fh:
+        json.dump([os.path.basename(tile_file) for tile_file in tile_files],
+                  in_use_fh)
+    os.rename(tmp_in_use_file, in_use_file)
+    return in_use_file
+
+def _unmark_in_use(in_use_file):
+    """
+    Remove file listing tiles in use.
+    """
+    try:
+        os.remove(in_use_file)
+    except OSError:
+        pass
+
+def _get_tiles_in_use():
+    """
+    Get set of tiles listed in 'in use' files. Files older than
+    IN_USE_MAX_AGE are assumed to be left from processes which didn't
+    finish and are removed.
+    """
+    tiles_in_use = set()
+    for in_use_file in glob.glob(os.path.join(dem_common.DEM_TILE_CACHE_PATH,
+                                              '*', 'in_use_*.json')):
+        try:
+            if time.time() - os.path.getmtime(in_use_file) > IN_USE_MAX_AGE:
+                os.remove(in_use_file)
+                continue
+            with open(in_use_file, 'r') as in_use_fh:
+                tile_names = json.load(in_use_fh)
+        except (OSError, IOError, ValueError):
+            continue
+        cache_dir = os.path.dirname(in_use_file)
+        for tile_name in tile_names:
+            tiles_in_use.add(os.path.join(cache_dir, tile_name))
+    return tiles_in_use
+
+def evict(max_size_mb=None):
+    """
+    Remove least recently used tiles until the cache is within
+    its size limit. Tiles in use by another process are not removed.
+
+    Arguments:
+
+    * max_size_mb - maximum size of cache (default is DEM_TILE_CACHE_MAX_SIZE_MB).
+
+    Returns:
+
+    * number of tiles removed
+
+    """
+    if max_size_mb is None:
+        max_size_mb = dem_common.DEM_TILE_CACHE_MAX_SIZE_MB
+    max_size = max_size_mb * 1024 * 1024
+
+    with _CACHE_LOCK:
+        tiles = []
+        total_size = 0
+        for tile_file in glob.glob(os.path.join(dem_common.DEM_TILE_CACHE_PATH,
+                                                '*', 'tile_*.tif')):
+            try:
+                tile_stat = os.stat(tile_file)
+            except OSError:
+                continue
+            tiles.append((tile_stat.st_mtime, tile_stat.st_size, tile_file))
+            total_size += tile_stat.st_size
+
+        tiles_in_use = _get_tiles_in_use()
+
+        num_removed = 0
+        for _, tile_size, tile_file in sorted(tiles):
+            if total_size <= max_size:
+                break
+            if tile_file in tiles_in_use:
+                continue
+            try:
+                os.remove(tile_file)
+            except OSError:
+                continue
+            total_size -= tile_size
+            num_removed += 1
+
+    return num_removed
+
+def clear_cache():
+    """
+    Remove all cached tiles.
+    """
+    with _CACHE_LOCK:
+        if os.path.isdir(dem_common.DEM_TILE_CACHE_PATH):
+            shutil.rmtree(dem_common.DEM_TILE_CACHE_PATH, ignore_errors=True)
@@ -0,0 +1,180 @@
+#! /usr/bin/env python
+#
+# This file has been created by ARSF Data Analysis Node and
+# is licensed under the GPL v3 Licence. A copy of this
+# licence is available to download with this file.
+
+"""
+Functions to run external tools (e.g., LAStools, SPDLib, GDAL utilities)
+with a limit on the number running at once.
+
+A single semaphore (sized to NUM_PROCESSES, the number of cores by default)
+is shared by all tools run through this module, so running several batches
+at once won't start more child processes than there are cores.
+
+Available functions:
+
+* run_tool - run a tool, returns an awaitable for use with asyncio.
+* run_tool_blocking - run a tool, waiting until it has finished.
+* run_tools - run a list of tools concurrently, waiting until all have finished.
+* tool_slot - hold one of the slots while running a tool some other way.
+
+Example::
+
+   import asyncio
+   from arsf_dem import dem_tool_runner
+
+   async def convert():
+      await dem_tool_runner.run_tool(['laszip', '-i', 'in.las', '-o', 'out.laz'])
+
+   # Or for a batch of commands without using asyncio directly
+   dem_tool_runner.run_tools([['laszip', '-i', 'in1.las', '-o', 'out1.laz'],
+                              ['laszip', '-i', 'in2.las', '-o', 'out2.laz']])
+
+"""
+
+from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
+import functools
+import threading
+from multiprocessing.pool import ThreadPool
+
+from . import dem_common
+from . import dem_common_functions
+
+# asyncio is only available for Python 3. If not available
+# run_tools will use a thread pool instead.
+HAVE_ASYNCIO = True
+try:
+    import asyncio
+except ImportError:
+    HAVE_ASYNCIO = False
+
+#: Maximum number of tools to run at once
+MAX_CONCURRENT_TOOLS = max(1, dem_common.NUM_PROCESSES)
+
+_TOOL_SEMAPHORE = threading.BoundedSemaphore(MAX_CONCURRENT_TOOLS)
+
+def tool_slot():
+    """
+    Get a context manager which holds one of the MAX_CONCURRENT_TOOLS slots,
+    for tools which can't be run using CallSubprocessOn::
+
+       with dem_tool_runner.tool_slot():
+          subprocess.check_output(command)
+
+    """
+    return _TOOL_SEMAPHORE
+
+def run_tool_blocking(command, quiet=False, logger=None, redirect=False):
+    """
+    Run a tool using CallSubprocessOn once fewer than
+    MAX_CONCURRENT_TOOLS tools are running.
+
+    Arguments:
+
+    * command - command to run (list).
+    * quiet - don't print command or output.
+    * logger - logger to use rather than print.
+    * redirect - return output rather than printing (see CallSubprocessOn).
+
+    Returns:
+
+    * True (raises exception if the command fails) or output of command if
+      'redirect' is True.
+
+    """
+    with _TOOL_SEMAPHORE:
+        return dem_common_functions.CallSubprocessOn(command, redirect=redirect,
+                                                     quiet=quiet, logger=logger)
+
+def run_tool(command, quiet=False, logger=None, loop=None):
+    """
+    Run a tool without blocking the asyncio event loop. The tool is run in
+    the default executor of the loop once fewer than MAX_CONCURRENT_TOOLS
+    tools are running::
+
+       await dem_tool_runner.run_tool(command)
+
+    Arguments:
+
+    * command - command to run (list).
+    * quiet - don't print command or output.
+    * logger - logger to use rather than print.
+    * loop - event loop to use, if not supplied uses the current loop.
+
+    Returns:
+
+    * awaitable (asyncio Future) which gives True when the tool has finished.
+
+    """
+    if not HAVE_ASYNCIO:
+        raise ImportError('Could not import asyncio (requires Python 3). '
+                          'Use run_tool_blocking or run_tools instead.')
+
+    if loop is None:
+        try:
+            loop = asyncio.get_running_loop()
+        except (AttributeError, RuntimeError):
+            loop = asyncio.get_event_loop()
+
+    return loop.run_in_executor(None,
+                                functools.partial(run_tool_blocking, command,
+                                                  quiet=quiet, logger=logger))
+
+def run_tools(commands, num_processes=MAX_CONCURRENT_TOOLS, quiet=False,
+              logger=None):
+    """
+    Run a list of tools concurrently and wait for them all to finish.
+
+    At most 'num_processes' of the commands are run at once (and never
+    more than MAX_CONCURRENT_TOOLS across all calls).
+
+    Arguments:
+
+    * commands - list of commands to run (each a list).
+    * num_processes - maximum number of commands to run at once.
+    * quiet - don't print commands or output.
+    * logger - logger to use rather than print.
+
+    Returns:
+
+    * None (raises exception if any of the commands fail)
+
+    """
+    if len(commands) == 0:
+        return None
+
+    num_processes = max(1, min(num_processes, len(commands)))
+
+    if num_processes == 1:
+        for command in commands:
+            run_tool_blocking(command, quiet=quiet, logger=logger)
+        return None
+
+    if HAVE_ASYNCIO:
+        loop = asyncio.new_event_loop()
+        try:
+            batch_semaphore = threading.BoundedSemaphore(num_processes)
+
+            def _run_batch_tool(command):
+                with batch_semaphore:
+                    return run_tool_blocking(command, quiet=quiet,
+                                             logger=logger)
+
+            tool_futures = [loop.run_in_executor(None,
+                                                 functools.partial(_run_batch_tool,
+                                                                   command))
+                            for command in commands]
+            loop.run_until_complete(asyncio.gather(*tool_futures))
+        finally:
+            loop.close()
+    else:
+        tool_pool = ThreadPool(num_processes)
+        try:
+            tool_pool.map(functools.partial(run_tool_blocking, quiet=quiet,
+                                            logger=logger), commands)
+        finally:
+            tool_pool.close()
+            tool_pool.join()
+
+    return None
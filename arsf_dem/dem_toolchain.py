@@ -0,0 +1,298 @@
+#! /usr/bin/env python
+#
+# This file has been created by ARSF Data Analysis Node and
+# is licensed under the GPL v3 Licence. A copy of this
+# licence is available to download with this file.
+
+"""
+Registry of external tools (e.g., LAStools, SPDLib) used by the library.
+
+Each tool is only probed (run to check it is installed) once per process.
+The result, along with the version and which of the flags of interest
+the tool supports, is also saved to a cache file (TOOLCHAIN_CACHE_FILE) so
+other processes can use it until it is older than TOOLCHAIN_CACHE_TTL
+seconds or the tool binary changes. Checking if a tool is available is
+then a dictionary lookup.
+
+Available functions:
+
+* register_tool - add a tool to the registry.
+* get_tool_info - get information on a tool (probing it if required).
+* is_tool_available - check if a tool is installed.
+* tool_supports_flag - check if a tool supports a flag (e.g., '-cores').
+* clear_cache - remove cached results (in memory and on disk).
+
+Example::
+
+   from arsf_dem import dem_toolchain
+
+   if dem_toolchain.is_tool_available('las2dem'):
+      print(dem_toolchain.get_tool_info('las2dem')['version'])
+
+"""
+
+from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
+import os
+import re
+import json
+import time
+import tempfile
+import threading
+
+from . import dem_common
+from . import dem_common_functions
+
+#: Version of cache file format
+TOOLCHAIN_CACHE_VERSION = 1
+
+# Registered tools
+_TOOLS = {}
+# Results of probing tools in this process
+_TOOL_INFO = {}
+_TOOLCHAIN_LOCK = threading.RLock()
+
+class ExternalTool(object):
+    """
+    An external tool which can be probed to check it is installed.
+
+    Attributes:
+
+    * name - name of tool (e.g., las2dem).
+    * path_function - function which returns the full path to the tool.
+    * probe_args - arguments to pass when running tool to probe it (e.g., ['-h']).
+    * flags - list of flags to check are listed in the output of probe (e.g., ['-cores']).
+    * version_regex - regular expression to get version from output of probe.
+
+    """
+    def __init__(self, name, path_function, probe_args=None, flags=None,
+                 version_regex=r'[Vv]ersion:?\s*([0-9][0-9A-Za-z.\-]*)'):
+        self.name = name
+        self.path_function = path_function
+        self.probe_args = list(probe_args) if probe_args is not None else []
+        self.flags = list(flags) if flags is not None else []
+        self.version_regex = version_regex
+
+    def get_path(self):
+        """
+        Get full path to tool.
+        """
+        return self.path_function()
+
+    def probe(self):
+        """
+        Run tool to check it is installed and get version and supported flags.
+
+        Returns:
+
+        * dictionary with keys 'available', 'path', 'version', 'flags' and 'checked'
+
+        """
+        tool_path = self.get_path()
+        tool_info = {'available' : False,
+                     'path' : tool_path,
+                     'version' : None,
+                     'flags' : [],
+                     'checked' : time.time(),
+                     'mtime' : _get_mtime(tool_path)}
+        try:
+            _, tool_output = dem_common_functions.CallSubprocessOn([tool_path] + self.probe_args,
+                                                                   redirect=True, quiet=True)
+        except OSError:
+            return tool_info
+
+        tool_info['available'] = True
+        tool_output = '\n'.join([output.decode('utf-8', 'replace')
+                                  if isinstance(output, bytes) else output
+                                  for output in tool_output])
+
+        if self.version_regex is not None:
+            version_match = re.search(self.version_regex, tool_output)
+            if version_match is not None:
+                tool_info['version'] = version_match.group(1)
+
+        tool_info['flags'] = [flag for flag in self.flags
+                              if re.search(r'(^|\s){}(\s|$)'.format(re.escape(flag)),
+                                           tool_output, re.MULTILINE) is not None]
+        return tool_info
+
+def _get_mtime(tool_path):
+    """
+    Get modification time of a tool (None if it doesn't exist
+    or isn't a full path).
+    """
+    try:
+        return os.path.getmtime(tool_path)
+    except (OSError, TypeError):
+        return None
+
+def _read_cache_file():
+    """
+    Read tool information from cache file. Returns an empty dictionary
+    if the cache is disabled or can't be read.
+    """
+    if dem_common.TOOLCHAIN_CACHE_TTL <= 0:
+        return {}
+    try:
+        with open(dem_common.TOOLCHAIN_CACHE_FILE, 'r') as cache_fh:
+            cache = json.load(cache_fh)
+        if cache.get('version') != TOOLCHAIN_CACHE_VERSION:
+            return {}
+        return cache.get('tools', {})
+    except (IOError, OSError, ValueError):
+        return {}
+
+def _write_cache_file(tools_info):
+    """
+    Write tool information to cache file. Writes to a temporary
+    file first so other processes never read a partial file.
+    """
+    if dem_common.TOOLCHAIN_CACHE_TTL <= 0:
+        return
+    cache_dir = os.path.dirname(os.path.abspath(dem_common.TOOLCHAIN_CACHE_FILE))
+    try:
+        cache_fh, cache_tmp = tempfile.mkstemp(prefix='.toolchain',
+                                               suffix='.json', dir=cache_dir)
+        with os.fdopen(cache_fh, 'w') as cache_out:
+            json.dump({'version' : TOOLCHAIN_CACHE_VERSION,
+                       'tools' : tools_info}, cache_out)
+        try:
+            os.rename(cache_tmp, dem_common.TOOLCHAIN_CACHE_FILE)
+        except OSError:
+            # Under Windows rename fails if the file exists
+            os.remove(dem_common.TOOLCHAIN_CACHE_FILE)
+            os.rename(cache_tmp, dem_common.TOOLCHAIN_CACHE_FILE)
+    except (IOError, OSError):
+        # Not being able to write the cache isn't fatal
+        pass
+
+def _cached_info_is_valid(tool, cached_info):
+    """
+    Check information from cache file is still valid (not older than
+    TOOLCHAIN_CACHE_TTL and the tool path and binary haven't changed).
+    """
+    if cached_info is None:
+        return False
+    if time.time() - cached_info.get('checked', 0) > dem_common.TOOLCHAIN_CACHE_TTL:
+        return False
+    tool_path = tool.get_path()
+    if cached_info.get('path') != tool_path:
+        return False
+    if cached_info.get('mtime') != _get_mtime(tool_path):
+        return False
+    return True
+
+def register_tool(tool):
+    """
+    Add a tool to the registry, replacing any existing tool with
+    the same name.
+
+    Arguments:
+
+    * tool - ExternalTool
+
+    """
+    with _TOOLCHAIN_LOCK:
+        _TOOLS[tool.name] = tool
+        _TOOL_INFO.pop(tool.name, None)
+
+def get_tool_info(name):
+    """
+    Get information on a tool. The tool is only probed the first time
+    this is called in a process, unless a valid result is in the cache file.
+
+    Arguments:
+
+    * name - name of tool (e.g., las2dem).
+
+    Returns:
+
+    * dictionary with keys 'available', 'path', 'version', 'flags' and 'checked'
+
+    """
+    try:
+        return _TOOL_INFO[name]
+    except KeyError:
+        pass
+
+    with _TOOLCHAIN_LOCK:
+        if name in _TOOL_INFO:
+            return _TOOL_INFO[name]
+        try:
+            tool = _TOOLS[name]
+        except KeyError:
+            raise KeyError('Tool "{}" has not been registered'.format(name))
+
+        cached_tools = _read_cache_file()
+        tool_info = cached_tools.get(name)
+
+        if not _cached_info_is_valid(tool, tool_info):
+            tool_info = tool.probe()
+            cached_tools[name] = tool_info
+            _write_cache_file(cached_tools)
+
+        _TOOL_INFO[name] = tool_info
+        return tool_info
+
+def is_tool_available(name):
+    """
+    Check if a tool is installed.
+
+    Arguments:
+
+    * name - name of tool (e.g., las2dem).
+
+    Returns:
+
+    * True / False
+
+    """
+    return get_tool_info(name)['available']
+
+def tool_supports_flag(name, flag):
+    """
+    Check if a tool supports a flag (only flags listed when the tool
+    was registered are checked).
+
+    Arguments:
+
+    * name - name of tool (e.g., las2dem).
+    * flag - flag (e.g., -cores).
+
+    Returns:
+
+    * True / False
+
+    """
+    return flag in get_tool_info(name)['flags']
+
+def clear_cache(remove_cache_file=True):
+    """
+    Remove cached results so tools are probed again.
+
+    Arguments:
+
+    * remove_cache_file - also remove cache file.
+
+    """
+    with _TOOLCHAIN_LOCK:
+        _TOOL_INFO.clear()
+        if remove_cache_file and os.path.isfile(dem_common.TOOLCHAIN_CACHE_FILE):
+            os.remove(dem_common.TOOLCHAIN_CACHE_FILE)
+
+register_tool(ExternalTool('las2txt',
+                           lambda: os.path.join(dem_common.LASTOOLS_FREE_BIN_PATH, 'las2txt'),
+                           probe_args=['-h'],
+                           flags=['-cores'],
+                           version_regex=r'version\s+([0-9]+)'))
+register_tool(ExternalTool('las2dem',
+                           lambda: os.path.join(dem_common.LASTOOLS_NONFREE_BIN_PATH, 'las2dem.exe'),
+                           probe_args=['-h'],
+                           flags=['-cores', '-spike_free'],
+                           version_regex=r'version\s+([0-9]+)'))
+register_tool(ExternalTool('spdtranslate',
+                           lambda: os.path.join(dem_common.SPDLIB_BIN_PATH, 'spdtranslate')))
+register_tool(ExternalTool('groundfilter',
+                           lambda: os.path.join(dem_common.FUSION_BIN_PATH, 'groundfilter.exe')))
+register_tool(ExternalTool('points2grid',
+                           lambda: os.path.join(dem_common.POINTS2GRID_BIN_PATH, 'points2grid'),
+                           probe_args=['--help']))
@@ -0,0 +1,375 @@
+#! /usr/bin/env python
+#
+# This file has been created by ARSF Data Analysis Node and
+# is licensed under the GPL v3 Licence. A copy of this
+# licence is available to download with this file.
+
+"""
+Tracing of the time and resources used by each stage of a run.
+
+When tracing is enabled (using 'enable_tracing', the '--trace' option of
+the command line scripts or TRACE_FILE in the config file) a span is
+recorded for each call to a public function in dem_utilities,
+dem_nav_utilities, grass_library and dem_lidar and for each external
+command. Each span records:
+
+* wall_time - elapsed time (seconds).
+* cpu_time - CPU time used (seconds) by the calling thread (where
+  available). For commands this is the thread waiting for the command, CPU
+  time of the command itself isn't recorded as only a total for all child
+  processes is available, which would include other commands running at
+  the same time.
+* max_rss_kb - peak resident memory (KB) of the process at the end of the span.
+* read_bytes / write_bytes - bytes read and written by the process while
+  the span was open (from /proc/self/io).
+* points - number of points processed (only for stages which record it).
+
+Traces are written as JSON lines (one span per line, written as each
+span finishes) if the output file ends in '.jsonl', otherwise in Chrome
+trace format (which can be loaded in chrome://tracing or Perfetto) when
+the program exits.
+
+When tracing is disabled spans do nothing so there is very little
+overhead.
+
+Available functions:
+
+* enable_tracing - start recording spans to a file.
+* disable_tracing - stop recording and write trace.
+* is_enabled - check if tracing is enabled.
+* span - context manager to record a span.
+* record - add values (e.g., number of points) to the current span.
+* traced - decorator to record a span for each call to a function.
+* trace_public_functions - apply 'traced' to all public functions in a module.
+* write_trace - write recorded spans to the output file.
+
+Example::
+
+   from arsf_dem import dem_trace
+
+   dem_trace.enable_tracing('trace.json')
+
+   with dem_trace.span('mosaic', category='stage'):
+      create_mosaic()
+      dem_trace.record(points=num_points)
+
+"""
+
+from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
+import os
+import sys
+import json
+import time
+import atexit
+import inspect
+import functools
+import threading
+
+from . import dem_common
+
+# resource is only available on UNIX, if not available
+# peak memory won't be recorded.
+HAVE_RESOURCE = True
+try:
+    import resource
+except ImportError:
+    HAVE_RESOURCE = False
+
+#: Trace formats
+TRACE_FORMAT_JSONL = 'jsonl'
+TRACE_FORMAT_CHROME = 'chrome'
+
+_TRACE_STATE = {'enabled' : False,
+                'out_file' : None,
+                'format' : None,
+                'start_time' : None,
+                'events' : []}
+
+_TRACE_LOCK = threading.Lock()
+_THREAD_SPANS = threading.local()
+
+def _get_thread_cpu_time():
+    """
+    Get CPU time used by the current thread (or the process
+    if this isn't available).
+    """
+    try:
+        return time.thread_time()
+    except AttributeError:
+        pass
+    try:
+        return time.process_time()
+    except AttributeError:
+        process_times = os.times()
+        return process_times[0] + process_times[1]
+
+def _get_max_rss_kb():
+    """
+    Get peak resident memory of the process in KB
+    (None if not available).
+    """
+    if not HAVE_RESOURCE:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on OS X and KB on Linux
+    if sys.platform == 'darwin':
+        max_rss = int(max_rss / 1024)
+    return max_rss
+
+def _get_io_bytes():
+    """
+    Get bytes read and written by the process from /proc/self/io
+    (None if not available).
+    """
+    try:
+        io_counts = {}
+        with open('/proc/self/io', 'r') as io_fh:
+            for line in io_fh:
+                key, value = line.split(':')
+                io_counts[key.strip()] = int(value)
+        return io_counts['rchar'], io_counts['wchar']
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+class _Span(object):
+    """
+    A single recorded span, created by 'span'.
+    """
+    def __init__(self, name, category, values):
+        self.name = name
+        self.category = category
+        self.values = dict(values)
+
+    def record(self, **values):
+        """
+        Add values to span. Counts (e.g., points) are added to
+        any existing value, other values are replaced.
+        """
+        for key, value in values.items():
+            if key == 'points' and self.values.get(key) is not None:
+                self.values[key] += value
+            else:
+                self.values[key] = value
+
+    def __enter__(self):
+        self.thread_id = threading.current_thread().ident
+        self.start_io = _get_io_bytes()
+        self.start_cpu = _get_thread_cpu_time()
+        self.start_time = time.time()
+        if not hasattr(_THREAD_SPANS, 'stack'):
+            _THREAD_SPANS.stack = []
+        _THREAD_SPANS.stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        end_time = time.time()
+        end_cpu = _get_thread_cpu_time()
+        end_io = _get_io_bytes()
+
+        _THREAD_SPANS.stack.pop()
+
+        measured = {'wall_time' : end_time - self.start_time,
+                    'cpu_time' : end_cpu - self.start_cpu,
+                    'max_rss_kb' : _get_max_rss_kb()}
+        if self.start_io is not None and end_io is not None:
+            measured['read_bytes'] = end_io[0] - self.start_io[0]
+            measured['write_bytes'] = end_io[1] - self.start_io[1]
+        if exc_type is not None:
+            measured['error'] = str(exc_value)
+
+        # Values recorded within the span (e.g., for commands) take
+        # priority over those measured.
+        measured.update(self.values)
+
+        _add_event(self.name, self.category, self.start_time,
+                   self.thread_id, measured)
+        return False
+
+class _NullSpan(object):
+    """
+    Span used when tracing is disabled, does nothing.
+    """
+    def record(self, **values):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+def _add_event(name, category, start_time, thread_id, values):
+    """
+    Add a finished span to the trace. For JSON lines it is written
+    straight away, for Chrome traces it is stored until 'write_trace'
+    is called.
+    """
+    with _TRACE_LOCK:
+        if not _TRACE_STATE['enabled']:
+            return
+        if _TRACE_STATE['format'] == TRACE_FORMAT_JSONL:
+            event = {'name' : name,
+                     'category' : category,
+                     'start' : start_time,
+                     'pid' : os.getpid(),
+                     'thread' : thread_id}
+            event.update(values)
+            with open(_TRACE_STATE['out_file'], 'a') as trace_fh:
+                trace_fh.write(json.dumps(event) + '\n')
+        else:
+            wall_time = values.get('wall_time', 0)
+            event = {'name' : name,
+                     'cat' : category,
+                     'ph' : 'X',
+                     'ts' : int((start_time - _TRACE_STATE['start_time']) * 1e6),
+                     'dur' : int(wall_time * 1e6),
+                     'pid' : os.getpid(),
+                     'tid' : thread_id,
+                     'args' : values}
+            _TRACE_STATE['events'].append(event)
+
+def enable_tracing(out_file, trace_format=None):
+    """
+    Start recording spans to a file.
+
+    Arguments:
+
+    * out_file - output trace file.
+    * trace_format - 'jsonl' or 'chrome'. If not provided uses JSON lines if out_file ends with '.jsonl', else Chrome trace format.
+
+    """
+    if trace_format is None:
+        if out_file.lower().endswith('.jsonl'):
+            trace_format = TRACE_FORMAT_JSONL
+        else:
+            trace_format = TRACE_FORMAT_CHROME
+
+    if trace_format not in [TRACE_FORMAT_JSONL, TRACE_FORMAT_CHROME]:
+        raise Exception('Trace format "{}" was not recognised. Options are '
+                        '"{}" or "{}"'.format(trace_format, TRACE_FORMAT_JSONL,
+                                              TRACE_FORMAT_CHROME))
+
+    with _TRACE_LOCK:
+        _TRACE_STATE['out_file'] = os.path.abspath(out_file)
+        _TRACE_STATE['format'] = trace_format
+        _TRACE_STATE['start_time'] = time.time()
+        _TRACE_STATE['events'] = []
+        _TRACE_STATE['enabled'] = True
+
+    # Start with an empty file for JSON lines as spans are appended
+    if trace_format == TRACE_FORMAT_JSONL:
+        open(_TRACE_STATE['out_file'], 'w').close()
+
+def disable_tracing():
+    """
+    Stop recording spans and write trace to file.
+    """
+    write_trace()
+    with _TRACE_LOCK:
+        _TRACE_STATE['enabled'] = False
+
+def is_enabled():
+    """
+    Check if tracing is enabled.
+    """
+    return _TRACE_STATE['enabled']
+
+def write_trace():
+    """
+    Write spans recorded so far to the output file (Chrome trace format only,
+    JSON lines are written as each span finishes).
+    """
+    with _TRACE_LOCK:
+        if not _TRACE_STATE['enabled'] or \
+                _TRACE_STATE['format'] != TRACE_FORMAT_CHROME:
+            return
+        with open(_TRACE_STATE['out_file'], 'w') as trace_fh:
+            json.dump({'traceEvents' : _TRACE_STATE['events'],
+                       'displayTimeUnit' : 'ms'}, trace_fh)
+
+def span(name, category='function', **values):
+    """
+    Get a context manager which records a span::
+
+       with dem_trace.span('patch', category='stage'):
+          patch_files(in_files, out_file)
+
+    Arguments:
+
+    * name - name of span.
+    * category - category of span (e.g., function, command or stage).
+    * values - any additional values to record.
+
+    Returns:
+
+    * span (context manager)
+
+    """
+    if not _TRACE_STATE['enabled']:
+        return _NULL_SPAN
+    return _Span(name, category, values)
+
+def record(**values):
+    """
+    Add values (e.g., points=num_points) to the innermost span
+    open in the current thread. Does nothing if tracing is disabled.
+    """
+    if not _TRACE_STATE['enabled']:
+        return
+    span_stack = getattr(_THREAD_SPANS, 'stack', None)
+    if span_stack:
+        span_stack[-1].record(**values)
+
+def traced(function, category='function'):
+    """
+    Decorator to record a span for each call to a function.
+    """
+    span_name = '{}.{}'.format(function.__module__, function.__name__)
+
+    @functools.wraps(function)
+    def _traced_function(*args, **kwargs):
+        if not _TRACE_STATE['enabled']:
+            return function(*args, **kwargs)
+        with _Span(span_name, category, {}):
+            return function(*args, **kwargs)
+
+    _traced_function.__traced__ = True
+    return _traced_function
+
+def trace_public_functions(namespace, category='function'):
+    """
+    Apply 'traced' to all public functions defined in a module.
+    Called at the end of a module as::
+
+       dem_trace.trace_public_functions(globals())
+
+    Arguments:
+
+    * namespace - dictionary of module globals.
+    * category - category for spans.
+
+    """
+    module_name = namespace['__name__']
+    for name, value in list(namespace.items()):
+        if name.startswith('_') or not inspect.isfunction(value):
+            continue
+        # Only functions defined in this module, not imported ones
+        if value.__module__ != module_name:
+            continue
+        if inspect.isgeneratorfunction(value) or \
+                getattr(value, '__traced__', False):
+            continue
+        namespace[name] = traced(value, category=category)
+
+@atexit.register
+def _write_trace_at_exit():
+    try:
+        write_trace()
+    except Exception as err:
+        print('Could not write trace: {}'.format(err), file=sys.stderr)
+
+# Enable from config file if a trace file has been set
+if dem_common.TRACE_FILE is not None:
+    enable_tracing(dem_common.TRACE_FILE, trace_format=dem_common.TRACE_FORMAT)
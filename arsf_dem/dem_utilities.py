@@ -18,11 +18,20 @@ Available functions:
 * patch_files - patches files together.
 * offset_null_fill_dem - apply elevation offset and fill null values in DEM.
 * export_screenshot - exports JPEG format screenshot.
+* export_quicklook - exports JPEG format screenshot from reduced resolution read using NumPy.
+* build_overviews - builds overviews for a raster.
+* set_output_profile - sets output profile (e.g., COG) for exported rasters.
+* get_output_creation_options - gets creation options for a format from the output profile.
+* get_grass_export_options - gets r.out.gdal options for a format from the output profile.
+* apply_output_profile - converts exported raster to COG (if required by output profile).
 * get_gdal_dataset_bb - gets bounding box of GDAL readable dataset.
 * buffer_bounding_box_proportion - buffer bounding box by proportion of extent.
 * reproject_bounding_box - reprojects bounding box.
 * call_gdaldem - calls gdaldem command.
 * call_gdalwarp - calls gdalwarp command.
+* rasterize_polygon_to_raster_grid - rasterizes polygon to grid of existing raster.
+* get_subset_grid_vrt - creates VRT of raster warped to bounding box (used by subset_to_bb).
+* write_raster_in_windows - writes a (warped) raster in windows using multiple processes.
 * reproject_bng_to_wgs84 - reprojects raster from UKBNG to WGS84LL.
 * reproject_wgs84_to_bng - reprojects raster from WGS84LL to UKBNG.
 * subset_to_bb - subsets raster to bounding box
@@ -39,10 +48,11 @@ Available functions:
 """
 
 from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
-import os, sys
+import os
+import glob
 import shutil
-import subprocess
 import tempfile
+import multiprocessing
 import numpy
 
 # Import common files
@@ -50,25 +60,119 @@ from . import dem_common
 from . import dem_common_functions
 from . import grass_library
 from . import get_gdal_drivers
+from . import dem_tool_runner
+from . import dem_intermediate
+from . import dem_scratch
+from . import dem_trace
 
-# Import GRASS
-sys.path.append(dem_common.GRASS_PYTHON_LIB_PATH)
-try:
-    import grass.script as grass
-except ImportError as err:
-    raise ImportError("Could not import grass library. "
-                      "Try setting 'GRASS_PYTHON_LIB_PATH' environmental variable."
-                      "\n{}".format(err))
+# GRASS (imported the first time it is used)
+grass = grass_library.grass
 
 # Try to import GDAL
 HAVE_GDAL=True
 try:
     from osgeo import gdal
+    from osgeo import gdal_array
+    from osgeo import ogr
     from osgeo import osr
 except ImportError:
     # If can't import don't complain until GDAL is actually needed
     HAVE_GDAL=False
 
+#: GDAL dataset for the window being written by a worker process
+#: (set by _init_window_worker)
+_WINDOW_SOURCE_DS = None
+
+# Output profile used for exported rasters (set using set_output_profile)
+_OUTPUT_PROFILE = {'profile' : dem_common.GDAL_OUTPUT_PROFILE}
+
+def set_output_profile(profile):
+    """
+    Set output profile used for exported rasters.
+
+    Arguments:
+
+    * profile - Output profile (DEFAULT, COG or COG_ZSTD).
+
+    """
+    # Check profile is valid (raises exception if not)
+    get_gdal_drivers.get_profile_creation_options(profile, 'GTiff')
+    _OUTPUT_PROFILE['profile'] = profile.upper()
+
+def get_output_profile():
+    """
+    Get output profile used for exported rasters.
+    """
+    return _OUTPUT_PROFILE['profile']
+
+def get_output_creation_options(out_format,
+                                out_raster_type=dem_common.GDAL_OUTFILE_DATATYPE):
+    """
+    Get creation options for an exported raster from the output profile.
+
+    Arguments:
+
+    * out_format - GDAL format name for output raster (e.g., GTiff).
+    * out_raster_type - GDAL datatype for output raster (e.g., Float32).
+
+    Returns:
+
+    * List of creation options or None if the profile doesn't set options for this format.
+
+    """
+    return get_gdal_drivers.get_profile_creation_options(get_output_profile(),
+                                                         out_format,
+                                                         out_raster_type)
+
+def get_grass_export_options(out_format,
+                             out_raster_type=dem_common.GDAL_OUTFILE_DATATYPE):
+    """
+    Get additional options for r.out.gdal from the output profile.
+    """
+    creation_options = get_output_creation_options(out_format, out_raster_type)
+    if creation_options is None:
+        return {}
+    return {'createopt' : ','.join(creation_options)}
+
+def apply_output_profile(out_file):
+    """
+    Finish an exported raster according to the output profile. For the COG
+    profiles GeoTIFFs are converted to Cloud-Optimized GeoTIFF (if the GDAL
+    COG driver is available) or internal overviews are added.
+
+    Arguments:
+
+    * out_file - Exported raster.
+
+    """
+    profile = get_output_profile()
+    if profile not in get_gdal_drivers.OUTPUT_PROFILES_WITH_OVERVIEWS or not HAVE_GDAL:
+        return
+
+    out_ds = gdal.Open(out_file, gdal.GA_ReadOnly)
+    if out_ds is None or out_ds.GetDriver().ShortName != 'GTiff':
+        out_ds = None
+        return
+    out_raster_type = gdal.GetDataTypeName(out_ds.GetRasterBand(1).DataType)
+    out_ds = None
+
+    if gdal.GetDriverByName('COG') is not None:
+        cog_options = get_gdal_drivers.get_profile_creation_options(profile, 'COG',
+                                                                    out_raster_type)
+        tmp_cog_file = os.path.splitext(out_file)[0] + '_cog_tmp.tif'
+        cog_ds = gdal.Translate(tmp_cog_file, out_file,
+                                options=gdal.TranslateOptions(format='COG',
+                                                              creationOptions=cog_options))
+        if cog_ds is None:
+            raise IOError('Could not convert "{}" to COG'.format(out_file))
+        cog_ds = None
+        os.remove(out_file)
+        shutil.move(tmp_cog_file, out_file)
+    else:
+        build_overviews(out_file, internal=True)
+
+    remove_gdal_aux_file(out_file)
+
 def offset_null_fill_dem(in_demfile, out_demfile=None,
                          import_to_grass=True,
                          separation_file=None,
@@ -79,7 +183,8 @@ def offset_null_fill_dem(in_demfile, out_demfile=None,
                          out_raster_type=dem_common.GDAL_OUTFILE_DATATYPE,
                          projection=None,
                          remove_grassdb=True,
-                         grassdb_path=None):
+                         grassdb_path=None,
+                         mask_file=None):
     """
     Applies elevation offset to DEM and/or fills null values
     using GRASS.
@@ -103,6 +208,7 @@ def offset_null_fill_dem(in_demfile, out_demfile=None,
     * projection - Projection to use (e.g., UKBNG) if not supplied will get from 'in_demfile'.
     * remove_grassdb - Remove GRASS database after processing is complete.
     * grassdb_path - Input path to GRASS database, if not supplied will create one.
+    * mask_file - Polygon (any format OGR can read) of area to process. If supplied pixels outside will be set to no data.
 
     Returns:
 
@@ -169,10 +275,7 @@ def offset_null_fill_dem(in_demfile, out_demfile=None,
     else:
         location = projection
         mapset   = 'PERMANENT'
-        grass.setup.init(dem_common.GRASS_LIB_PATH,
-                    grassdb_path,
-                    location,
-                    mapset)
+        grass_library.grassDBinit(grassdb_path, location, mapset)
 
     grass_library.setLocation(in_proj)
 
@@ -197,90 +300,121 @@ def offset_null_fill_dem(in_demfile, out_demfile=None,
     # Set region
     grass_library.SetRegion(rast=demname)
 
-    # Import separation file
-    if separation_file is not None:
-        print('Importing separation file')
-        separation_name = os.path.split(separation_file)[-1]
-        print('Using separation file: {}'.format(separation_file))
-        if ascii_separation_file:
-            grass.run_command('r.in.ascii',
-                        input=separation_file,
-                        output=separation_name,
+    # Set mask so only pixels within polygon are processed
+    if mask_file is not None:
+        if not import_to_grass:
+            raise Exception('Can only apply "mask_file" if "import_to_grass" is True')
+        print('Applying mask from {}'.format(mask_file))
+        mask_fh, mask_raster = dem_intermediate.mkstemp(prefix='dem_mask',suffix='.bsq',
+                        size_mb=dem_intermediate.estimate_raster_size_mb(in_demfile, 'Byte'))
+        os.close(mask_fh)
+        mask_name = 'footprint_mask'
+        try:
+            rasterize_polygon_to_raster_grid(mask_file, in_demfile, mask_raster)
+            grass.run_command('r.in.gdal',
+                        input=mask_raster,
+                        output=mask_name,
+                        flags='o',
                         overwrite=True)
-        else:
-            grass.run_command('r.external',
-                  input=separation_file,
-                  output=separation_name,
-                  overwrite=True)
+        finally:
+            for mask_component in glob.glob(os.path.splitext(mask_raster)[0] + '.*'):
+                os.remove(mask_component)
+        grass.mapcalc('MASK=if({0} == 1,1,null())'.format(mask_name),
+                      overwrite=True)
 
-        if not grass_library.checkFileExists(separation_name):
-            raise Exception('Could not import {}'.format(separation_file))
+    try:
+        # Import separation file
+        if separation_file is not None:
+            print('Importing separation file')
+            separation_name = os.path.split(separation_file)[-1]
+            print('Using separation file: {}'.format(separation_file))
+            if ascii_separation_file:
+                grass.run_command('r.in.ascii',
+                            input=separation_file,
+                            output=separation_name,
+                            overwrite=True)
+            else:
+                grass.run_command('r.external',
+                      input=separation_file,
+                      output=separation_name,
+                      overwrite=True)
 
-        # Add offset
-        elevated_name = 'patched_elevated'
-        if subtract_seperation:
-            print('Subtracting offset')
-            grass.mapcalc('{0}=if({1} != {3},{1}-{2},0)'.format(elevated_name,demname,separation_name,nodata),
-                                 overwrite=True)
+            if not grass_library.checkFileExists(separation_name):
+                raise Exception('Could not import {}'.format(separation_file))
 
-        else:
-            print('Adding offset')
-            grass.mapcalc('{0}=if({1} != {3},{1}+{2},0)'.format(elevated_name,demname,separation_name, nodata),
-                                 overwrite=True)
+            # Add offset
+            elevated_name = 'patched_elevated'
+            if subtract_seperation:
+                print('Subtracting offset')
+                grass.mapcalc('{0}=if({1} != {3},{1}-{2},0)'.format(elevated_name,demname,separation_name,nodata),
+                                     overwrite=True)
 
-        if not grass_library.checkFileExists(elevated_name):
-            raise Exception('Could not apply offset to DEM')
-    else:
-        elevated_name = demname
+            else:
+                print('Adding offset')
+                grass.mapcalc('{0}=if({1} != {3},{1}+{2},0)'.format(elevated_name,demname,separation_name, nodata),
+                                     overwrite=True)
 
-    if fill_nulls:
-        # Fill Null values
-        print('Filling Null values')
-        null_filled_name = 'patched_elevated_filled'
-        try:
-            grass.run_command('r.fillnulls',
-                              input=elevated_name,
-                              output=null_filled_name,
-                              tension=40,
-                              smooth=0.1,
-                              overwrite=True)
-        # If this fails, pass. Will check for file in following step and print
-        # warning there.
-        except Exception as err:
-            pass
-        # Check file exists (to confirm command has run correctly
-        if not grass_library.checkFileExists(null_filled_name):
-            dem_common_functions.WARNING('Could not NULL fill DEM, possibly there are no NULL values to fill')
-            null_filled_name = elevated_name
-
-        # Smooth
-        print('Smoothing')
-        smoothed_name = 'patched_elevated_filled_smoothed'
-        grass.run_command('r.neighbors',
-                          input=null_filled_name,
-                          output=smoothed_name,
-                          overwrite=True)
-        if not grass_library.checkFileExists(smoothed_name):
-            raise Exception('Could not smooth file')
-    else:
-        smoothed_name=elevated_name
+            if not grass_library.checkFileExists(elevated_name):
+                raise Exception('Could not apply offset to DEM')
+        else:
+            elevated_name = demname
 
-    # Export
-    if out_demfile is not None:
-        print('Exporting')
-        grass.run_command('r.out.gdal',
-                          format=out_raster_format,
-                          type=out_raster_type,
-                          input=smoothed_name,
-                          output=out_demfile,
-                          nodata=nodata,
-                          flags='fc',
-                          overwrite=True)
-        remove_gdal_aux_file(out_demfile)
+        if fill_nulls:
+            # Fill Null values
+            print('Filling Null values')
+            null_filled_name = 'patched_elevated_filled'
+            try:
+                grass.run_command('r.fillnulls',
+                                  input=elevated_name,
+                                  output=null_filled_name,
+                                  tension=40,
+                                  smooth=0.1,
+                                  overwrite=True)
+            # If this fails, pass. Will check for file in following step and print
+            # warning there.
+            except Exception as err:
+                pass
+            # Check file exists (to confirm command has run correctly
+            if not grass_library.checkFileExists(null_filled_name):
+                dem_common_functions.WARNING('Could not NULL fill DEM, possibly there are no NULL values to fill')
+                null_filled_name = elevated_name
+
+            # Smooth
+            print('Smoothing')
+            smoothed_name = 'patched_elevated_filled_smoothed'
+            grass.run_command('r.neighbors',
+                              input=null_filled_name,
+                              output=smoothed_name,
+                              overwrite=True)
+            if not grass_library.checkFileExists(smoothed_name):
+                raise Exception('Could not smooth file')
+        else:
+            smoothed_name=elevated_name
+
+        # Export
+        if out_demfile is not None:
+            print('Exporting')
+            grass.run_command('r.out.gdal',
+                              format=out_raster_format,
+                              type=out_raster_type,
+                              input=smoothed_name,
+                              output=out_demfile,
+                              nodata=nodata,
+                              flags='fc',
+                              overwrite=True,
+                              **get_grass_export_options(out_raster_format,
+                                                         out_raster_type))
+            remove_gdal_aux_file(out_demfile)
+            apply_output_profile(out_demfile)
+    finally:
+        # Remove mask so doesn't apply to subsequent processing (or
+        # processing in the same database if an exception was raised)
+        if mask_file is not None:
+            grass.run_command('r.mask', flags='r')
 
     # Remove GRASS database created
     if remove_grassdb:
-        shutil.rmtree(grassdb_path)
+        grass_library.grassDBremove(grassdb_path)
         return out_demfile, None
     else:
         return smoothed_name, grassdb_path
@@ -363,10 +497,7 @@ def patch_files(in_file_list,
     else:
         location = in_proj
         mapset   = 'PERMANENT'
-        grass.setup.init(dem_common.GRASS_LIB_PATH,
-                    grassdb_path,
-                    location,
-                    mapset)
+        grass_library.grassDBinit(grassdb_path, location, mapset)
 
     grass_library.setLocation(in_proj)
 
@@ -426,12 +557,15 @@ def patch_files(in_file_list,
                      output=out_file,
                      nodata=nodata,
                      flags='fc',
-                     overwrite=True)
+                     overwrite=True,
+                     **get_grass_export_options(out_raster_format,
+                                                out_raster_type))
         remove_gdal_aux_file(out_file)
+        apply_output_profile(out_file)
 
     # Remove GRASS database created
     if remove_grassdb:
-        shutil.rmtree(grassdb_path)
+        grass_library.grassDBremove(grassdb_path)
         return out_file, None
     else:
         return patched_name, grassdb_path
@@ -496,10 +630,7 @@ def replace_nodata_val(in_demfile, out_demfile=None,
     else:
         location = projection
         mapset   = 'PERMANENT'
-        grass.setup.init(dem_common.GRASS_LIB_PATH,
-                         grassdb_path,
-                         location,
-                         mapset)
+        grass_library.grassDBinit(grassdb_path, location, mapset)
 
     grass_library.setLocation(in_proj)
 
@@ -542,12 +673,15 @@ def replace_nodata_val(in_demfile, out_demfile=None,
                           output=out_demfile,
                           nodata=outnodata,
                           flags='fc',
-                          overwrite=True)
+                          overwrite=True,
+                          **get_grass_export_options(out_raster_format,
+                                                     out_raster_type))
         remove_gdal_aux_file(out_demfile)
+        apply_output_profile(out_demfile)
 
     # Remove GRASS database created
     if remove_grassdb:
-        shutil.rmtree(grassdb_path)
+        grass_library.grassDBremove(grassdb_path)
         return out_demfile, None
     else:
         return replace_nodata_name, grassdb_path
@@ -564,7 +698,8 @@ def subset_dem_to_bounding_box(in_dem_mosaic,
                      nodata=dem_common.NODATA_VALUE,
                      remove_grassdb=True,
                      grassdb_path=None,
-                     fill_nulls=True):
+                     fill_nulls=True,
+                     cutline=None):
     """
     Subsets DEM to bounding box to produce a DEM for use in APL. Can also supply output projection
     for patching with another DEM (e.g., from LiDAR). Note, supplying
@@ -590,6 +725,11 @@ def subset_dem_to_bounding_box(in_dem_mosaic,
     * remove_grassdb - Remove GRASS database after processing is complete.
     * grassdb_path - Input path to GRASS database, if not supplied will create one.
     * fill_nulls - Null fill values
+    * cutline - Polygon (e.g., swath footprint) to cut DEM to. Pixels outside will be set to no data and not offset or filled.
+
+    If the tile cache is enabled (see dem_tile_cache), the output is
+    exported (remove_grassdb is True) and no cutline is supplied, the
+    output is assembled from cached tiles.
 
     Returns:
 
@@ -599,11 +739,31 @@ def subset_dem_to_bounding_box(in_dem_mosaic,
     """
     out_dem_name = None
 
+    # If the output is being exported (rather than kept in GRASS) assemble
+    # from cached tiles which have already been offset and null filled.
+    if out_demfile is not None and remove_grassdb and grassdb_path is None \
+            and cutline is None:
+        # Imported here as dem_tile_cache imports dem_utilities
+        from . import dem_tile_cache
+        if dem_tile_cache.is_enabled() and \
+                dem_tile_cache.subset_dem_from_tiles(in_dem_mosaic,
+                                        out_demfile,
+                                        bounding_box,
+                                        separation_file=separation_file,
+                                        ascii_separation_file=ascii_separation_file,
+                                        in_dem_projection=in_dem_projection,
+                                        out_projection=out_projection,
+                                        out_res=out_res,
+                                        nodata=nodata,
+                                        fill_nulls=fill_nulls):
+            return out_demfile, None
+
     if out_demfile is None:
         # If an output isn't supplied this is OK, as long as it's being kept in GRASS
         if remove_grassdb:
             raise Exception('No out_demfile specified and remove_grassdb set to True. This would produce no output')
-        tmp_outdem_fh, tmp_out_dem_name = tempfile.mkstemp(prefix='dem_subset',suffix='.dem', dir=dem_common.TEMP_PATH)
+        tmp_outdem_fh, tmp_out_dem_name = dem_intermediate.mkstemp(prefix='dem_subset',suffix='.dem',
+                        size_mb=_estimate_subset_size_mb(in_dem_mosaic, bounding_box))
         tmp_out_dem_header = os.path.splitext(tmp_out_dem_name)[0] + '.hdr'
     else:
         tmp_out_dem_name = out_demfile
@@ -613,7 +773,8 @@ def subset_dem_to_bounding_box(in_dem_mosaic,
     # When subsetting perform horizontal reprojection
     # If output projection is not WGS84LL need to reproject bounding box
     if out_projection is not None and grass_library.proj4_to_grass_location(out_projection) != 'WGS84LL':
-        tm_fh, temp_mosaic_dem = tempfile.mkstemp(prefix='dem_subset',suffix='.dem', dir=dem_common.TEMP_PATH)
+        tm_fh, temp_mosaic_dem = dem_intermediate.mkstemp(prefix='dem_subset',suffix='.dem',
+                        size_mb=_estimate_subset_size_mb(in_dem_mosaic, bounding_box))
         temp_mosaic_dem_header = os.path.splitext(temp_mosaic_dem)[0] + '.hdr'
 
         bounding_box_reproj = reproject_bounding_box(bounding_box,
@@ -628,7 +789,9 @@ def subset_dem_to_bounding_box(in_dem_mosaic,
             subset_to_bb(in_dem_mosaic, temp_mosaic_dem,
                                        buffer_bounding_box_proportion(bounding_box),
                                        in_projection=in_dem_projection,
-                                       out_projection=in_dem_projection)
+                                       out_projection=in_dem_projection,
+                                       cutline=cutline,
+                                       final_output=False)
 
             if separation_file is not None or fill_nulls:
                 out_dem_name, grassdb_path = offset_null_fill_dem(
@@ -639,12 +802,15 @@ def subset_dem_to_bounding_box(in_dem_mosaic,
                                                 nodata=-9999,
                                                 remove_grassdb=remove_grassdb,
                                                 grassdb_path=grassdb_path,
-                                                fill_nulls=fill_nulls)
+                                                fill_nulls=fill_nulls,
+                                                mask_file=cutline)
 
             subset_to_bb(temp_mosaic_dem, tmp_out_dem_name, bounding_box_reproj,
                                            in_projection=in_dem_projection,
                                            out_projection=out_projection,
-                                           out_res=out_res)
+                                           out_res=out_res,
+                                           cutline=cutline,
+                                           final_output=out_demfile is not None)
 
             os.close(tm_fh)
             if os.path.isfile(temp_mosaic_dem):
@@ -656,12 +822,19 @@ def subset_dem_to_bounding_box(in_dem_mosaic,
             subset_to_bb(in_dem_mosaic, tmp_out_dem_name, bounding_box_reproj,
                                         in_projection=in_dem_projection,
                                         out_projection=out_projection,
-                                        out_res=out_res)
+                                        out_res=out_res,
+                                        cutline=cutline,
+                                        final_output=out_demfile is not None)
 
     else:
+        # If an offset or null filling is applied the output profile is
+        # applied when exporting from GRASS.
         subset_to_bb(in_dem_mosaic, tmp_out_dem_name, bounding_box,
                                     in_projection=in_dem_projection,
-                                    out_res=out_res)
+                                    out_res=out_res,
+                                    cutline=cutline,
+                                    final_output=out_demfile is not None and \
+                                        separation_file is None and not fill_nulls)
 
         # Apply datum height offset and fill null values.
         if separation_file is not None or fill_nulls:
@@ -672,7 +845,8 @@ def subset_dem_to_bounding_box(in_dem_mosaic,
                                            nodata=nodata,
                                            remove_grassdb=remove_grassdb,
                                            grassdb_path=grassdb_path,
-                                           fill_nulls=fill_nulls)
+                                           fill_nulls=fill_nulls,
+                                           mask_file=cutline)
 
     # If a temporary output file was created remove it
     if out_demfile is None:
@@ -687,6 +861,31 @@ def subset_dem_to_bounding_box(in_dem_mosaic,
     else:
         return out_demfile, None
 
+def _estimate_subset_size_mb(in_dem_mosaic, bounding_box):
+    """
+    Estimate size (in MB) of a DEM subset to a lat/long bounding box,
+    allowing for buffering and reprojection.
+
+    Returns None if it can't be estimated.
+    """
+    try:
+        in_bounding_box = get_gdal_dataset_bb(in_dem_mosaic, output_ll=True)
+    except Exception:
+        return None
+
+    in_area = (in_bounding_box[1] - in_bounding_box[0]) * \
+                (in_bounding_box[3] - in_bounding_box[2])
+    if in_area <= 0:
+        return None
+    overlap_y = min(in_bounding_box[1], bounding_box[1]) - max(in_bounding_box[0], bounding_box[0])
+    overlap_x = min(in_bounding_box[3], bounding_box[3]) - max(in_bounding_box[2], bounding_box[2])
+    fraction = (max(0, overlap_y) * max(0, overlap_x)) / in_area
+
+    # Double to allow for buffer and changes in pixel size when reprojecting
+    return dem_intermediate.estimate_raster_size_mb(in_dem_mosaic,
+                                                    dem_common.GDAL_OUTFILE_DATATYPE,
+                                                    fraction=min(1.0, fraction * 2))
+
 def get_screenshot_path(in_file,out_screenshots_dir):
     """
     Gets filepath for screenshot file.
@@ -728,12 +927,21 @@ def export_screenshot(in_file, out_file,
     * remove_grassdb - Remove GRASS database after processing is complete.
     * grassdb_path - Input path to GRASS database, if not supplied will create one. Required if import_to_grass=False
 
+    If 'in_file' is a file which isn't being kept in GRASS and FAST_QUICKLOOKS
+    is set, export_quicklook is used instead of GRASS.
+
       Returns:
 
     * out_file path / rescaled file name in GRASS database
     * path to GRASS database / None
 
      """
+    # If only a JPEG is required create using NumPy from a reduced
+    # resolution version of the file rather than importing into GRASS.
+    if dem_common.FAST_QUICKLOOKS and HAVE_GDAL and import_to_grass \
+            and remove_grassdb and grassdb_path is None:
+        export_quicklook(in_file, out_file, shaded_relief=shaded_relief)
+        return out_file, None
 
     # Set projection based on input file
     in_proj = None
@@ -756,10 +964,7 @@ def export_screenshot(in_file, out_file,
     else:
         location = projection
         mapset   = 'PERMANENT'
-        grass.setup.init(dem_common.GRASS_LIB_PATH,
-                    grassdb_path,
-                    location,
-                    mapset)
+        grass_library.grassDBinit(grassdb_path, location, mapset)
 
     grass_location = grass_library.setLocation(in_proj)
 
@@ -819,15 +1024,232 @@ def export_screenshot(in_file, out_file,
 
     # Remove GRASS database created
     if remove_grassdb:
-        shutil.rmtree(grassdb_path)
+        grass_library.grassDBremove(grassdb_path)
         return out_file, None
     else:
         return rescaled_name, grassdb_path
 
+def build_overviews(in_file, min_size=256, resampling='AVERAGE',
+                    internal=False):
+    """
+    Build overviews for a raster. Overviews are not built if the raster
+    already has them.
+
+    Arguments:
+
+    * in_file - Input file in any GDAL format.
+    * min_size - Smallest overview will have a width / height of at least this many pixels.
+    * resampling - Resampling method (e.g., AVERAGE, NEAREST).
+    * internal - Store overviews within file (e.g., for GeoTIFF), if False stored in an external .ovr file.
+
+    Returns:
+
+    * List of overview levels built (empty if none were required).
+
+    """
+    if not HAVE_GDAL:
+        raise ImportError('Could not import GDAL')
+
+    if internal:
+        in_ds = gdal.Open(in_file, gdal.GA_Update)
+    else:
+        in_ds = gdal.Open(in_file, gdal.GA_ReadOnly)
+    if in_ds is None:
+        raise Exception('Could not open {}'.format(in_file))
+
+    if in_ds.GetRasterBand(1).GetOverviewCount() > 0:
+        in_ds = None
+        return []
+
+    overview_levels = []
+    level = 2
+    while min(in_ds.RasterXSize, in_ds.RasterYSize) // level >= min_size:
+        overview_levels.append(level)
+        level *= 2
+
+    if len(overview_levels) > 0:
+        print('Building overviews for {}'.format(in_file))
+        in_ds.BuildOverviews(resampling, overview_levels)
+    in_ds = None
+
+    return overview_levels
+
+def _hillshade_array(elevation, x_pixel_size, y_pixel_size,
+                     azimuth=315.0, altitude=45.0):
+    """
+    Calculate hillshade (0 - 1) for an array of elevation values.
+    No data values should be set to NaN, NaN will be returned for these
+    pixels and their neighbours.
+
+    Arguments:
+
+    * elevation - NumPy array of elevation values.
+    * x_pixel_size / y_pixel_size - pixel size in the same units as elevation.
+    * azimuth - azimuth of light source (degrees).
+    * altitude - altitude of light source (degrees).
+
+    Returns:
+
+    * NumPy array of hillshade values.
+
+    """
+    dz_dy, dz_dx = numpy.gradient(elevation, y_pixel_size, x_pixel_size)
+
+    slope = numpy.pi/2.0 - numpy.arctan(numpy.hypot(dz_dx, dz_dy))
+    aspect = numpy.arctan2(-dz_dy, dz_dx)
+
+    azimuth_rad = numpy.deg2rad(azimuth)
+    altitude_rad = numpy.deg2rad(altitude)
+
+    shaded = numpy.sin(altitude_rad) * numpy.sin(slope) + \
+             numpy.cos(altitude_rad) * numpy.cos(slope) * \
+             numpy.cos(azimuth_rad - aspect)
+
+    return numpy.clip(shaded, 0, 1)
+
+def _histogram_equalise(in_array, num_bins=4096):
+    """
+    Rescale an array to 1 - 255 using histogram equalisation.
+    NaN values are set to 0.
+
+    Arguments:
+
+    * in_array - NumPy array.
+    * num_bins - Number of bins for histogram.
+
+    Returns:
+
+    * NumPy array (uint8).
+
+    """
+    out_array = numpy.zeros(in_array.shape, dtype=numpy.uint8)
+    valid = numpy.isfinite(in_array)
+    if not numpy.any(valid):
+        return out_array
+
+    valid_values = in_array[valid]
+    histogram, bin_edges = numpy.histogram(valid_values, bins=num_bins)
+    cdf = numpy.cumsum(histogram).astype(numpy.float64)
+    cdf = cdf / cdf[-1]
+
+    equalised = numpy.interp(valid_values, bin_edges[1:], cdf)
+    out_array[valid] = (1 + numpy.round(equalised * 254)).astype(numpy.uint8)
+
+    return out_array
+
+def export_quicklook(in_file, out_file,
+                     shaded_relief=False,
+                     max_size=dem_common.QUICKLOOK_MAX_SIZE,
+                     build_overviews_first=dem_common.QUICKLOOK_BUILD_OVERVIEWS):
+    """
+    Export a quicklook in JPEG format with pixel values rescaled using
+    histogram equalisation or as a shaded relief (hillshade) image.
+
+    Rather than using GRASS, reads a reduced resolution version of the
+    raster (using overviews if available) so the output is at most
+    'max_size' pixels wide / high and calculates hillshade and histogram
+    equalisation using NumPy. No data pixels are set to 0.
+
+    Arguments:
+
+    * in_file - Input file in any GDAL format.
+    * out_file - Output quicklook file (.jpg).
+    * shaded_relief - Export shaded relief image instead of rescaled image (for DEMs).
+    * max_size - Maximum width / height of output (pixels).
+    * build_overviews_first - Build overviews on 'in_file' (if it doesn't have them) so subsequent quicklooks are faster.
+
+    Returns:
+
+    * out_file path
+
+    """
+    if not HAVE_GDAL:
+        raise ImportError('Could not import GDAL')
+
+    if build_overviews_first:
+        in_ds = gdal.Open(in_file, gdal.GA_ReadOnly)
+        if in_ds is None:
+            raise Exception('Could not open {}'.format(in_file))
+        needs_overviews = max(in_ds.RasterXSize, in_ds.RasterYSize) > max_size
+        in_ds = None
+        if needs_overviews:
+            try:
+                build_overviews(in_file)
+            except Exception as err:
+                dem_common_functions.WARNING('Could not build overviews for {}. {}'.format(in_file, err))
+
+    in_ds = gdal.Open(in_file, gdal.GA_ReadOnly)
+    if in_ds is None:
+        raise Exception('Could not open {}'.format(in_file))
+
+    in_band = in_ds.GetRasterBand(1)
+    in_geotransform = in_ds.GetGeoTransform()
+    in_projection = in_ds.GetProjection()
+
+    # Get size of reduced resolution version to read
+    scale_factor = max(1.0, max(in_ds.RasterXSize, in_ds.RasterYSize) / float(max_size))
+    out_x_size = max(1, int(round(in_ds.RasterXSize / scale_factor)))
+    out_y_size = max(1, int(round(in_ds.RasterYSize / scale_factor)))
+
+    # GDAL will read from overviews if available
+    in_array = in_band.ReadAsArray(0, 0, in_ds.RasterXSize, in_ds.RasterYSize,
+                                   buf_xsize=out_x_size,
+                                   buf_ysize=out_y_size).astype(numpy.float64)
+
+    nodata = in_band.GetNoDataValue()
+    if nodata is not None:
+        in_array[in_array == nodata] = numpy.nan
+    in_array[~numpy.isfinite(in_array)] = numpy.nan
+
+    x_scale = in_ds.RasterXSize / float(out_x_size)
+    y_scale = in_ds.RasterYSize / float(out_y_size)
+    out_geotransform = (in_geotransform[0], in_geotransform[1] * x_scale,
+                        in_geotransform[2] * y_scale,
+                        in_geotransform[3], in_geotransform[4] * x_scale,
+                        in_geotransform[5] * y_scale)
+
+    x_pixel_size = abs(out_geotransform[1])
+    y_pixel_size = abs(out_geotransform[5])
+
+    if shaded_relief:
+        # If geographic convert pixel size to metres at centre of image
+        in_srs = osr.SpatialReference()
+        in_srs.ImportFromWkt(in_projection)
+        if in_projection != '' and in_srs.IsGeographic():
+            centre_lat = in_geotransform[3] + in_geotransform[5] * in_ds.RasterYSize / 2.0
+            x_pixel_size, y_pixel_size = deg_to_m(centre_lat, x_pixel_size, y_pixel_size)
+        in_array = _hillshade_array(in_array, x_pixel_size, y_pixel_size)
+
+    out_array = _histogram_equalise(in_array)
+
+    in_band = None
+    in_ds = None
+
+    # Write to memory then copy to JPEG (can't create JPEG directly)
+    mem_ds = gdal.GetDriverByName('MEM').Create('', out_x_size, out_y_size,
+                                                1, gdal.GDT_Byte)
+    mem_ds.SetGeoTransform(out_geotransform)
+    mem_ds.SetProjection(in_projection)
+    mem_ds.GetRasterBand(1).WriteArray(out_array)
+
+    jpeg_ds = gdal.GetDriverByName('JPEG').CreateCopy(out_file, mem_ds, 0,
+                                                      ['QUALITY=90'])
+    if jpeg_ds is None:
+        raise Exception('Could not create {}'.format(out_file))
+    jpeg_ds = None
+    mem_ds = None
+
+    remove_gdal_aux_file(out_file)
+
+    return out_file
+
 def subset_to_bb(in_dem_mosaic, out_demfile, bounding_box,
                      in_projection=None,
                      out_projection=dem_common.WGS84_PROJ4_STRING,
-                     out_res=None):
+                     out_res=None,
+                     num_processes=dem_common.NUM_PROCESSES,
+                     cutline=None,
+                     final_output=True):
     """
     Subset a raster to a bounding box using gdalwarp, if reprojection is also required or gdal_translate
     if bounding_box and input DEM have the same projection.
@@ -835,6 +1257,15 @@ def subset_to_bb(in_dem_mosaic, out_demfile, bounding_box,
     Takes and exports raster in any projection, can supply WKT file or Proj4 string using
     'in_projection' and 'out_projection'.
 
+    If the output is larger than 'CHUNKED_WARP_MIN_PIXELS' and more than one
+    process is available the output is split into windows which are processed
+    in parallel using 'write_raster_in_windows'. The size is estimated from
+    the bounding box first, so the warped VRT used to split the output is only
+    created for large outputs.
+
+    If a cutline is supplied gdalwarp is always used and pixels outside
+    the cutline are set to 'NODATA_VALUE' without being warped.
+
     Arguments:
 
     * in_dem_mosaic - Mosaic of large DEM to subset, can be anything GDAL can read (including a virtual raster file).
@@ -843,6 +1274,9 @@ def subset_to_bb(in_dem_mosaic, out_demfile, bounding_box,
     * in_projection - Projection of input mosaic as EPSG code, Proj4 string or WKT file. If not supplied will read from file.
     * out_projection - Projection of output mosaic, must be the same as bounding box.
     * out_res - Out resolution e.g., (10,-10)
+    * num_processes - Number of processes to use for large subsets.
+    * cutline - Polygon (any format OGR can read) to cut raster to.
+    * final_output - output is a final product so the output profile (e.g., COG) is applied, set to False for temporary files.
 
     Returns:
 
@@ -853,18 +1287,59 @@ def subset_to_bb(in_dem_mosaic, out_demfile, bounding_box,
     if len(bounding_box) != 4:
         raise Exception('Expected four values for bounding box')
 
+    # For large outputs split into windows and run in parallel.
+    use_windows = HAVE_GDAL and num_processes is not None and num_processes > 1
+    if use_windows:
+        estimated_pixels = _estimate_subset_pixels(in_dem_mosaic, bounding_box,
+                                                   in_projection=in_projection,
+                                                   out_projection=out_projection,
+                                                   out_res=out_res)
+        if estimated_pixels is not None and \
+                estimated_pixels < dem_common.CHUNKED_WARP_MIN_PIXELS:
+            use_windows = False
+    if use_windows:
+        out_grid_vrt = get_subset_grid_vrt(in_dem_mosaic, bounding_box,
+                                            in_projection=in_projection,
+                                            out_projection=out_projection,
+                                            out_res=out_res,
+                                            cutline=cutline)
+        try:
+            out_grid_ds = gdal.Open(out_grid_vrt, gdal.GA_ReadOnly)
+            out_pixels = out_grid_ds.RasterXSize * out_grid_ds.RasterYSize
+            out_grid_ds = None
+
+            if out_pixels >= dem_common.CHUNKED_WARP_MIN_PIXELS:
+                print('Output is {} pixels, splitting into windows and '
+                      'running using {} processes'.format(out_pixels,
+                                                          num_processes))
+                write_raster_in_windows(out_grid_vrt, out_demfile,
+                                        num_processes=num_processes)
+                if final_output:
+                    apply_output_profile(out_demfile)
+                return None
+        finally:
+            if os.path.isfile(out_grid_vrt):
+                os.remove(out_grid_vrt)
+
     # If input and output projections are the same then calling gdalwarp will regrid
     # to align with bounding box. Can use gdaltranslate with 'projwin' instead.
-    if in_projection == out_projection:
+    if in_projection == out_projection and cutline is None:
         gdal_translate_cmd = ['gdal_translate', '-projwin',str(bounding_box[2]),
                                                 str(bounding_box[1]),
                                                 str(bounding_box[3]),
                                                 str(bounding_box[0])]
         gdal_translate_cmd.extend(['-of',dem_common.GDAL_OUTFILE_FORMAT])
         gdal_translate_cmd.extend(['-ot',dem_common.GDAL_OUTFILE_DATATYPE])
-        gdal_translate_cmd.extend(['-co',dem_common.GDAL_CREATION_OPTIONS])
+        profile_options = get_output_creation_options(dem_common.GDAL_OUTFILE_FORMAT)
+        if profile_options is not None:
+            for creation_option in profile_options:
+                gdal_translate_cmd.extend(['-co', creation_option])
+        else:
+            gdal_translate_cmd.extend(['-co',dem_common.GDAL_CREATION_OPTIONS])
         gdal_translate_cmd.extend([in_dem_mosaic, out_demfile])
-        dem_common_functions.CallSubprocessOn(gdal_translate_cmd)
+        dem_tool_runner.run_tool_blocking(gdal_translate_cmd)
+        if final_output:
+            apply_output_profile(out_demfile)
     else:
         call_gdalwarp(in_dem_mosaic, out_demfile,
                        s_srs=in_projection,
@@ -874,7 +1349,10 @@ def subset_to_bb(in_dem_mosaic, out_demfile, bounding_box,
                        co=dem_common.GDAL_CREATION_OPTIONS,
                        r=dem_common.RESAMPLE_METHOD,
                        out_extent=bounding_box,
-                       target_res=out_res)
+                       target_res=out_res,
+                       cutline=cutline,
+                       dstnodata=dem_common.NODATA_VALUE if cutline is not None else None,
+                       final_output=final_output)
 
 
 def reproject_bng_to_wgs84(in_file, out_file, vertical_reproject=False):
@@ -909,7 +1387,9 @@ def reproject_bng_to_wgs84(in_file, out_file, vertical_reproject=False):
             raise Exception('Could not find UKBNG seperation file in speficied location:'
                               ' "{}"'.format(dem_common.UKBNG_SEP_FILE_WGS84))
 
-        tr_fh, temp_reproject_dem = tempfile.mkstemp(prefix='reproject_dem',suffix='.dem', dir=dem_common.TEMP_PATH)
+        tr_fh, temp_reproject_dem = dem_intermediate.mkstemp(prefix='reproject_dem',suffix='.dem',
+                        size_mb=dem_intermediate.estimate_raster_size_mb(in_file,
+                                                    dem_common.GDAL_OUTFILE_DATATYPE))
         temp_reproject_dem_header = os.path.splitext(temp_reproject_dem)[0] + '.hdr'
         temp_file_list = [temp_reproject_dem, temp_reproject_dem_header]
 
@@ -940,7 +1420,8 @@ def reproject_bng_to_wgs84(in_file, out_file, vertical_reproject=False):
     else:
         gdalout = call_gdalwarp(in_file, out_file,
                        s_srs=dem_common.OSTN02_PROJ4_STRING,
-                       t_srs=dem_common.WGS84_PROJ4_STRING)
+                       t_srs=dem_common.WGS84_PROJ4_STRING,
+                       final_output=True)
         if gdalout != 0:
             return None
 
@@ -972,7 +1453,9 @@ def reproject_wgs84_to_bng(in_file, out_file, vertical_reproject=False):
         raise Exception("Could not find OSTN02 transform file.\nChecked {}".format(dem_common.OSTN02_NTV2_BIN_FILE))
 
     if vertical_reproject:
-        temp_reproject_dem = tempfile.mkstemp(prefix='reproject_dem',suffix='.dem', dir=dem_common.TEMP_PATH)[1]
+        temp_reproject_dem = dem_intermediate.mkstemp(prefix='reproject_dem',suffix='.dem',
+                        size_mb=dem_intermediate.estimate_raster_size_mb(in_file,
+                                                    dem_common.GDAL_OUTFILE_DATATYPE))[1]
         temp_reproject_dem_header = os.path.splitext(temp_reproject_dem)[0] + '.hdr'
         temp_file_list = [temp_reproject_dem, temp_reproject_dem_header]
 
@@ -1005,7 +1488,8 @@ def reproject_wgs84_to_bng(in_file, out_file, vertical_reproject=False):
     else:
         gdalout = call_gdalwarp(in_file, out_file,
                        s_srs=dem_common.WGS84_PROJ4_STRING,
-                       t_srs=dem_common.OSTN02_PROJ4_STRING)
+                       t_srs=dem_common.OSTN02_PROJ4_STRING,
+                       final_output=True)
         if gdalout != 0:
             return None
 
@@ -1020,7 +1504,9 @@ def call_gdalwarp(in_file, out_file, s_srs=None, t_srs=dem_common.WGS84_PROJ4_ST
                      dstnodata=None,
                      target_res=None,
                      out_extent=None,
-                     overwrite=True):
+                     cutline=None,
+                     overwrite=True,
+                     final_output=False):
 
     """
     Python utility to call gdalwarp
@@ -1033,10 +1519,10 @@ def call_gdalwarp(in_file, out_file, s_srs=None, t_srs=dem_common.WGS84_PROJ4_ST
     Note to get correct projection to/from BNG need to use
     OSTN02 transform file. This is passed in as part of Proj4 string.
 
-    TODO: Update to use Python functions.
-    Needs some work as there isn't a Python equivalent of gdalwarp.
-    Currently has to call subprocess using shell=True so creation options are
-    passed in correctly.
+    The command is run as a list of arguments using dem_tool_runner (so
+    it counts towards the limit on tools running at once), so projections,
+    creation options and paths don't need to be quoted. Any quotes around
+    them (e.g., from the config file) are removed.
 
     Arguments:
 
@@ -1046,20 +1532,30 @@ def call_gdalwarp(in_file, out_file, s_srs=None, t_srs=dem_common.WGS84_PROJ4_ST
     * t_srs - target projection (default is WGS84).
     * of - GDAL name for output image format (e.g., ENVI).
     * ot - GDAL name for output image type (e.g., Float32).
-    * co - creation options.
+    * co - creation options (string or list). If the default is used and the output profile sets options for 'of' these are used instead.
     * r - resample method (near, bilinear, cubic).
     * srcnodata - nodata value for in_file.
     * dstnodata - nodata value for out_file.
     * target_res - resulution of output image (will determine from in_file if not supplied).
     * out_extent - extent of output image (in t_srs projection).
+    * cutline - polygon (any format OGR can read) to cut image to.
     * overwrite - overwrite existing image if it exists.
+    * final_output - output is a final product so the output profile (e.g., COG) is applied, rather than a temporary file.
 
     Returns:
 
-    * Command return status.
+    * 0 (command return status, raises exception if gdalwarp writes to stderr, see CallSubprocessOn).
 
     """
 
+    # Use creation options from output profile if not set
+    use_output_profile = False
+    if co == dem_common.GDAL_CREATION_OPTIONS:
+        profile_options = get_output_creation_options(of, ot)
+        if profile_options is not None:
+            co = profile_options
+            use_output_profile = True
+
     # Construct GDAL command
     gdalwarp_cmd = ['gdalwarp']
 
@@ -1084,7 +1580,7 @@ def call_gdalwarp(in_file, out_file, s_srs=None, t_srs=dem_common.WGS84_PROJ4_ST
             gdalwarp_cmd.extend(['-tr',str(target_res),
                                  str(target_res)])
     if s_srs is not None:
-        gdalwarp_cmd.extend(['-s_srs','"{}"'.format(s_srs)])
+        gdalwarp_cmd.extend(['-s_srs',s_srs.strip('"\'')])
 
     if srcnodata is not None:
         gdalwarp_cmd.extend(['-srcnodata',str(srcnodata)])
@@ -1092,23 +1588,388 @@ def call_gdalwarp(in_file, out_file, s_srs=None, t_srs=dem_common.WGS84_PROJ4_ST
     if dstnodata is not None:
         gdalwarp_cmd.extend(['-dstnodata',str(dstnodata)])
 
-    gdalwarp_cmd.extend(['-t_srs','"{}"'.format(t_srs)])
-    gdalwarp_cmd.extend(['-of',of,'-ot',ot,
-                         '-co','"{}"'.format(co)])
+    if cutline is not None:
+        gdalwarp_cmd.extend(['-cutline',cutline])
+
+    gdalwarp_cmd.extend(['-t_srs',t_srs.strip('"\'')])
+    gdalwarp_cmd.extend(['-of',of,'-ot',ot])
+    if not isinstance(co, list):
+        co = [co]
+    for creation_option in co:
+        if creation_option.strip('"\'') != '':
+            gdalwarp_cmd.extend(['-co',creation_option.strip('"\'')])
     gdalwarp_cmd.extend(['-r',r])
+    gdalwarp_cmd.extend(['-et',str(dem_common.WARP_ERROR_THRESHOLD)])
     gdalwarp_cmd.extend([in_file, out_file])
 
-    cmd_str = ""
+    dem_tool_runner.run_tool_blocking(gdalwarp_cmd)
+    remove_gdal_aux_file(out_file)
+    if use_output_profile and final_output:
+        apply_output_profile(out_file)
+
+    return 0
+
+
+def _estimate_subset_pixels(in_file, bounding_box,
+                            in_projection=None,
+                            out_projection=dem_common.WGS84_PROJ4_STRING,
+                            out_res=None):
+    """
+    Estimate the number of pixels in the output of subset_to_bb from the
+    bounding box, without creating the output grid. If the output
+    resolution isn't supplied it is assumed to be the same as the input.
+
+    Returns None if it can't be estimated.
+    """
+    height = bounding_box[1] - bounding_box[0]
+    width = bounding_box[3] - bounding_box[2]
+
+    if out_res is not None:
+        if isinstance(out_res, list) or isinstance(out_res, tuple):
+            x_res = abs(float(out_res[0]))
+            y_res = abs(float(out_res[1]))
+        else:
+            x_res = y_res = abs(float(out_res))
+        # Round in the same way as gdalwarp
+        return int(width / x_res + 0.5) * int(height / y_res + 0.5)
+
+    try:
+        in_ds = gdal.Open(in_file, gdal.GA_ReadOnly)
+        if in_ds is None:
+            return None
+        in_geotransform = in_ds.GetGeoTransform()
+        in_wkt = in_ds.GetProjectionRef()
+        in_ds = None
+
+        if in_projection != out_projection:
+            # Get bounding box in projection of input to compare with
+            # input pixel size.
+            if in_projection is None:
+                in_srs = osr.SpatialReference()
+                in_srs.ImportFromWkt(in_wkt)
+                in_projection = in_srs.ExportToProj4()
+            in_bounding_box = reproject_bounding_box(list(bounding_box),
+                                                     out_projection,
+                                                     in_projection)
+            height = abs(in_bounding_box[1] - in_bounding_box[0])
+            width = abs(in_bounding_box[3] - in_bounding_box[2])
+    except Exception:
+        return None
+
+    return int(width / abs(in_geotransform[1]) + 0.5) * \
+           int(height / abs(in_geotransform[5]) + 0.5)
+
+def get_subset_grid_vrt(in_file, bounding_box,
+                         in_projection=None,
+                         out_projection=dem_common.WGS84_PROJ4_STRING,
+                         out_res=None,
+                         cutline=None):
+    """
+    Create a temporary VRT describing the output of subset_to_bb.
+    Can be opened using GDAL and read as if it was the output of subset_to_bb,
+    with the warping carried out for the pixels read.
+
+    Uses the same GDAL code and options as gdalwarp / gdal_translate (including
+    the error threshold, 'WARP_ERROR_THRESHOLD', used by call_gdalwarp) so the
+    output is the same as running the command in a single piece. This relies
+    on 'WARP_ERROR_THRESHOLD' being 0, with an approximate transformation
+    pixel values depend on how the output is split into windows.
+
+    Arguments:
+
+    * in_file - Input raster, can be anything GDAL can read.
+    * bounding_box - List of 4 values providing the bounding box of the format: [MinY, MaxY, MinX, MaxX]
+    * in_projection - Projection of input raster. If not supplied will read from file.
+    * out_projection - Projection of output raster, must be the same as bounding box.
+    * out_res - Out resolution e.g., (10,-10)
+    * cutline - Polygon to cut raster to.
+
+    Returns:
+
+    * Path to VRT file (needs to be removed by caller).
+
+    """
+    if not HAVE_GDAL:
+        raise ImportError('Could not import GDAL')
+
+    vrt_fh, out_vrt = tempfile.mkstemp(prefix='subset_grid', suffix='.vrt',
+                                       dir=dem_scratch.get_dir())
+    os.close(vrt_fh)
+
+    out_type = gdal.GetDataTypeByName(dem_common.GDAL_OUTFILE_DATATYPE)
+
+    if in_projection == out_projection and cutline is None:
+        vrt_options = gdal.TranslateOptions(format='VRT',
+                                            outputType=out_type,
+                                            projWin=[bounding_box[2],
+                                                     bounding_box[1],
+                                                     bounding_box[3],
+                                                     bounding_box[0]])
+        vrt_ds = gdal.Translate(out_vrt, in_file, options=vrt_options)
+    else:
+        x_res = None
+        y_res = None
+        if out_res is not None:
+            if isinstance(out_res, list) or isinstance(out_res, tuple):
+                x_res = abs(float(out_res[0]))
+                y_res = abs(float(out_res[1]))
+            else:
+                x_res = abs(float(out_res))
+                y_res = abs(float(out_res))
+
+        # Remove quotes around projections (only needed when passing
+        # to the command line).
+        if in_projection is not None:
+            in_projection = in_projection.strip('"\'')
+        out_projection = out_projection.strip('"\'')
+
+        cutline_options = {}
+        if cutline is not None:
+            cutline_options = {'cutlineDSName' : cutline,
+                               'dstNodata' : dem_common.NODATA_VALUE}
+
+        vrt_options = gdal.WarpOptions(format='VRT',
+                                       outputBounds=[bounding_box[2],
+                                                     bounding_box[0],
+                                                     bounding_box[3],
+                                                     bounding_box[1]],
+                                       xRes=x_res, yRes=y_res,
+                                       srcSRS=in_projection,
+                                       dstSRS=out_projection,
+                                       outputType=out_type,
+                                       resampleAlg=dem_common.RESAMPLE_METHOD,
+                                       errorThreshold=dem_common.WARP_ERROR_THRESHOLD,
+                                       **cutline_options)
+        vrt_ds = gdal.Warp(out_vrt, in_file, options=vrt_options)
+
+    if vrt_ds is None:
+        os.remove(out_vrt)
+        raise Exception('Could not create output grid for {}'.format(in_file))
+
+    # Close dataset so VRT is written to disk
+    vrt_ds = None
+
+    return out_vrt
+
+def _init_window_worker(in_file, cache_mb):
+    """
+    Initialiser for worker processes used by write_raster_in_windows.
+
+    Opens the input dataset once per process and limits the GDAL block
+    cache so memory use per process is bounded.
+    """
+    global _WINDOW_SOURCE_DS
+    gdal.SetCacheMax(int(cache_mb * 1024 * 1024))
+    _WINDOW_SOURCE_DS = gdal.Open(in_file, gdal.GA_ReadOnly)
+
+def _write_window(window):
+    """
+    Read a window of rows from the input dataset and write directly to the
+    region of the pre-created (raw) output file. Called by worker processes in
+    write_raster_in_windows.
+
+    Arguments:
+
+    * window - tuple of (data_file, numpy dtype, x_size, y_size, y_offset, window_rows)
+
+    Returns:
 
-    for option in gdalwarp_cmd:
-        cmd_str += option + " "
+    * Number of rows written
+
+    """
+    data_file, dtype, x_size, y_size, y_offset, window_rows = window
+    item_size = numpy.dtype(dtype).itemsize
+
+    for band_num in range(1, _WINDOW_SOURCE_DS.RasterCount + 1):
+        window_data = _WINDOW_SOURCE_DS.GetRasterBand(band_num).ReadAsArray(
+                                                0, y_offset,
+                                                x_size, window_rows)
+        if window_data is None:
+            raise IOError('Could not read rows {} - {} of band {}'.format(
+                              y_offset, y_offset + window_rows, band_num))
+
+        # Output is BSQ so each band follows the previous one
+        byte_offset = (((band_num - 1) * y_size) + y_offset) * x_size * item_size
+        out_window = numpy.memmap(data_file, dtype=dtype, mode='r+',
+                                  offset=byte_offset,
+                                  shape=(window_rows, x_size))
+        out_window[:] = window_data
+        out_window.flush()
+        del out_window
+
+    return window_rows
+
+def write_raster_in_windows(in_file, out_file,
+                            num_processes=dem_common.NUM_PROCESSES,
+                            window_memory_mb=dem_common.WARP_WINDOW_MEMORY_MB,
+                            of=dem_common.GDAL_OUTFILE_FORMAT,
+                            co=dem_common.GDAL_CREATION_OPTIONS):
+    """
+    Write a GDAL dataset to a new file by splitting the output into windows
+    (blocks of rows) which are read in parallel using a pool of processes.
+
+    Intended to be used with a warped VRT (as created by subset_to_bb for
+    large outputs) so each process only warps the part of the input needed
+    for its own window. The output is pre-created as a raw ENVI file and
+    each process writes its window directly to its own region of the file,
+    so the whole output is never held in memory.
+
+    The number of rows in each window is chosen so a window uses
+    approximately 'window_memory_mb' in each process.
+
+    Arguments:
+
+    * in_file - Input raster, can be anything GDAL can read (including a VRT).
+    * out_file - Output file.
+    * num_processes - Number of processes to use.
+    * window_memory_mb - Approximate memory (in MB) to use for each process.
+    * of - GDAL name for output image format (e.g., ENVI).
+    * co - creation options.
+
+    Returns:
+
+    * None
+
+    """
+    if not HAVE_GDAL:
+        raise ImportError('Could not import GDAL')
+
+    in_ds = gdal.Open(in_file, gdal.GA_ReadOnly)
+    if in_ds is None:
+        raise IOError('Could not open "{}" using GDAL'.format(in_file))
+
+    x_size = in_ds.RasterXSize
+    y_size = in_ds.RasterYSize
+    num_bands = in_ds.RasterCount
+    gdal_type = in_ds.GetRasterBand(1).DataType
+    nodata = in_ds.GetRasterBand(1).GetNoDataValue()
+    geotransform = in_ds.GetGeoTransform()
+    projection = in_ds.GetProjectionRef()
+    in_ds = None
+
+    dtype = numpy.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(gdal_type))
+
+    # Assume source and destination buffers used when warping a window
+    # are around four times the size of the window being written.
+    row_bytes = x_size * dtype.itemsize * 4
+    window_rows = max(1, int((window_memory_mb * 1024 * 1024) // row_bytes))
+
+    creation_options = []
+    profile_options = None
+    if co == dem_common.GDAL_CREATION_OPTIONS:
+        profile_options = get_output_creation_options(of, gdal.GetDataTypeName(gdal_type))
+    if profile_options is not None:
+        creation_options = profile_options
+    elif co is not None and co.strip('"\'') != '':
+        creation_options = [co.strip('"\'')]
+
+    # If output is a single band ENVI file can write directly to it
+    # (BIL and BSQ are the same for a single band). Otherwise write to
+    # temporary BSQ file and convert once all windows are complete.
+    write_direct = (of == 'ENVI' and num_bands == 1)
+
+    if write_direct:
+        raw_file = out_file
+        raw_options = creation_options
+    else:
+        # Windows are written using memory maps, so if the output is small
+        # enough keep on a memory backed file system.
+        raw_size_mb = (x_size * y_size * num_bands * dtype.itemsize) / (1024.0 * 1024.0)
+        raw_fh, raw_file = dem_intermediate.mkstemp(prefix='windowed_', suffix='.bsq',
+                                                    size_mb=raw_size_mb)
+        os.close(raw_fh)
+        raw_options = ['INTERLEAVE=BSQ']
+
+    envi_driver = gdal.GetDriverByName('ENVI')
+    raw_ds = envi_driver.Create(raw_file, x_size, y_size, num_bands,
+                                gdal_type, raw_options)
+    if raw_ds is None:
+        raise IOError('Could not create "{}"'.format(raw_file))
+    raw_ds.SetGeoTransform(geotransform)
+    raw_ds.SetProjection(projection)
+    if nodata is not None:
+        for band_num in range(1, num_bands + 1):
+            raw_ds.GetRasterBand(band_num).SetNoDataValue(nodata)
+    raw_file_list = raw_ds.GetFileList()
+    raw_data_file = raw_file_list[0]
+    raw_ds = None
+
+    # Allocate full size of output so each process can map its own region.
+    with open(raw_data_file, 'r+b') as f:
+        f.truncate(x_size * y_size * num_bands * dtype.itemsize)
+
+    windows = []
+    for y_offset in range(0, y_size, window_rows):
+        windows.append((raw_data_file, dtype.str, x_size, y_size, y_offset,
+                        min(window_rows, y_size - y_offset)))
+
+    print('Writing {} windows of up to {} rows using {} '
+          'processes'.format(len(windows), window_rows, num_processes))
+
+    window_pool = multiprocessing.Pool(processes=num_processes,
+                                       initializer=_init_window_worker,
+                                       initargs=(in_file,
+                                                 window_memory_mb / 2.0))
+    try:
+        window_pool.map(_write_window, windows)
+    finally:
+        window_pool.close()
+        window_pool.join()
+
+    if not write_direct:
+        translate_options = gdal.TranslateOptions(format=of,
+                                                  creationOptions=creation_options)
+        out_ds = gdal.Translate(out_file, raw_file, options=translate_options)
+        if out_ds is None:
+            raise IOError('Could not write "{}"'.format(out_file))
+        out_ds = None
+
+        for raw_component in raw_file_list:
+            if os.path.isfile(raw_component):
+                os.remove(raw_component)
 
-    print('Attempting to run command:' ,cmd_str)
-    cmdOut = subprocess.call(cmd_str,shell=True)
     remove_gdal_aux_file(out_file)
 
-    return cmdOut
+def rasterize_polygon_to_raster_grid(in_polygon, in_raster, out_raster):
+    """
+    Rasterize a polygon to the same grid (extent, pixel size and projection)
+    as an existing raster. Pixels within the polygon are set to 1, all others
+    are 0. The polygon will be reprojected if required.
 
+    Arguments:
+
+    * in_polygon - Input polygon (any format OGR can read).
+    * in_raster - Raster to take grid from.
+    * out_raster - Output raster (ENVI format, Byte).
+
+    Returns:
+
+    * None
+
+    """
+    if not HAVE_GDAL:
+        raise ImportError('Could not import GDAL')
+
+    template_ds = gdal.Open(in_raster, gdal.GA_ReadOnly)
+    if template_ds is None:
+        raise IOError('Could not open "{}" using GDAL'.format(in_raster))
+
+    envi_driver = gdal.GetDriverByName('ENVI')
+    out_ds = envi_driver.Create(out_raster, template_ds.RasterXSize,
+                                template_ds.RasterYSize, 1, gdal.GDT_Byte)
+    out_ds.SetGeoTransform(template_ds.GetGeoTransform())
+    out_ds.SetProjection(template_ds.GetProjectionRef())
+    out_ds.GetRasterBand(1).Fill(0)
+    template_ds = None
+
+    polygon_ds = ogr.Open(in_polygon)
+    if polygon_ds is None:
+        raise IOError('Could not open "{}" using OGR'.format(in_polygon))
+
+    gdal.RasterizeLayer(out_ds, [1], polygon_ds.GetLayer(0),
+                        burn_values=[1], options=['ALL_TOUCHED=TRUE'])
+    polygon_ds = None
+    out_ds = None
 
 def call_gdaldem(in_file, out_file, dem_product='hillshade',
                               of=dem_common.GDAL_OUTFILE_FORMAT):
@@ -1130,7 +1991,7 @@ def call_gdaldem(in_file, out_file, dem_product='hillshade',
     gdaldem_cmd = ['gdaldem',dem_product,
                    '-of',of,
                    in_file, out_file]
-    dem_common_functions.CallSubprocessOn(gdaldem_cmd)
+    dem_tool_runner.run_tool_blocking(gdaldem_cmd)
     remove_gdal_aux_file(out_file)
 
 def get_gdal_dataset_bb(in_file, output_ll=False):
@@ -1433,7 +2294,7 @@ def get_gdal_type_from_path(file_name):
     extension = os.path.splitext(file_name)[-1].lower()
 
     try:
-        gdal_str = get_gdal_drivers.GDALDrivers().get_driver_from_ext(extension)
+        gdal_str = get_gdal_drivers.get_drivers().get_driver_from_ext(extension)
     except KeyError:
         # If the extension isn't recognised go with ENVI.
         gdal_str = 'ENVI'
@@ -1560,3 +2421,6 @@ def set_nodata_value(in_file, nodata_value):
     gdal_ds = gdal.Open(in_file, gdal.GA_Update)
     gdal_ds.GetRasterBand(1).SetNoDataValue(nodata_value)
     gdal_ds = None
+
+# Record a span for each call to a public function when tracing is enabled
+dem_trace.trace_public_functions(globals())
@@ -15,14 +15,27 @@ options to specify the interleave.
 
 Available functions:
 
+* get_drivers - Get shared GDALDrivers instance (created on first call)
 * GDALDrivers().get_driver_from_ext - Get GDAL driver from extension
 * GDALDrivers().get_ext_from_driver - Get extension from GDAL driver name
 * GDALDrivers().get_creation_options_from_ext - Get GDAL creation options from extension
 * GDALDrivers().get_creation_options_from_driver - Get GDAL creation options driver name
+* get_profile_creation_options - Get GDAL creation options for a driver from an output profile (e.g., COG)
+
+Creating a GDALDrivers instance reads the metadata for every GDAL driver,
+so use 'get_drivers' rather than creating a new instance for each lookup.
 
 """
 
-from osgeo import gdal
+import threading
+
+# Try to import GDAL
+HAVE_GDAL=True
+try:
+    from osgeo import gdal
+except ImportError:
+    # If can't import don't complain until GDAL is actually needed
+    HAVE_GDAL=False
 
 #: List of Non-GDAL extensions (mostly for ENVI)
 NON_GDAL_DRIVER_FROM_EXT = {'bil' : 'ENVI',
@@ -33,12 +46,80 @@ NON_GDAL_DRIVER_FROM_EXT = {'bil' : 'ENVI',
                             'h5'  : 'HDF5',
                             'tiff': 'GTiff'}
 
+# Shared instance of GDALDrivers, created by get_drivers
+_GDAL_DRIVERS = {'instance' : None}
+_GDAL_DRIVERS_LOCK = threading.Lock()
+
 #: Preferred creation options for GDAL
 GDAL_CREATION_OPTIONS = {'bil' : ['INTERLEAVE=BIL'],
                          'bsq' : ['INTERLEAVE=BSQ'],
                          'tif' : ['COMPRESS=LZW'],
                          'nc'  : ['FORMAT=NC4C', 'COMPRESS=DEFLATE']}
 
+#: Output profiles. Creation options for each driver, drivers not listed
+#: use the default creation options. The COG profiles create tiled and
+#: compressed GeoTIFFs with internal overviews (Cloud-Optimized GeoTIFF).
+#: If the GDAL 'COG' driver (GDAL 3.1+) is available GeoTIFFs are converted
+#: to COG once written, else overviews are added to the GeoTIFF.
+OUTPUT_PROFILES = {'DEFAULT' : {},
+                   'COG' : {'GTiff' : ['TILED=YES', 'BLOCKXSIZE=512',
+                                       'BLOCKYSIZE=512', 'COMPRESS=DEFLATE',
+                                       'BIGTIFF=IF_SAFER'],
+                            'COG' : ['BLOCKSIZE=512', 'COMPRESS=DEFLATE',
+                                     'OVERVIEWS=AUTO', 'BIGTIFF=IF_SAFER']},
+                   'COG_ZSTD' : {'GTiff' : ['TILED=YES', 'BLOCKXSIZE=512',
+                                            'BLOCKYSIZE=512', 'COMPRESS=ZSTD',
+                                            'BIGTIFF=IF_SAFER'],
+                                 'COG' : ['BLOCKSIZE=512', 'COMPRESS=ZSTD',
+                                          'OVERVIEWS=AUTO', 'BIGTIFF=IF_SAFER']}}
+
+#: Output profiles which require internal overviews
+OUTPUT_PROFILES_WITH_OVERVIEWS = ['COG', 'COG_ZSTD']
+
+#: Data types which use the floating point predictor when compressing
+FLOAT_DATA_TYPES = ['Float32', 'Float64']
+
+def get_profile_creation_options(profile, driver_name, data_type='Float32'):
+    """
+    Get creation options for a GDAL driver from an output profile.
+
+    For compressed profiles a predictor is added, floating point predictor
+    (3) for floating point data and horizontal differencing (2) for integers.
+
+    Example usage::
+
+       get_gdal_drivers.get_profile_creation_options('COG', 'GTiff')
+
+    :param profile: Output profile (e.g., DEFAULT, COG, COG_ZSTD)
+    :type profile: str
+    :param driver_name: Driver Name (e.g., GTiff)
+    :type driver_name: str
+    :param data_type: GDAL data type name of output (e.g., Float32)
+    :type data_type: str
+
+    :returns: List of creation options or None if the profile doesn't set options for this driver.
+
+    """
+    try:
+        profile_options = OUTPUT_PROFILES[profile.upper()]
+    except KeyError:
+        raise Exception('Output profile "{}" was not recognised. Options are '
+                        '{}'.format(profile, ', '.join(sorted(OUTPUT_PROFILES.keys()))))
+
+    if driver_name not in profile_options:
+        return None
+
+    creation_options = list(profile_options[driver_name])
+    if driver_name == 'GTiff':
+        if data_type in FLOAT_DATA_TYPES:
+            creation_options.append('PREDICTOR=3')
+        else:
+            creation_options.append('PREDICTOR=2')
+    elif driver_name == 'COG':
+        creation_options.append('PREDICTOR=YES')
+
+    return creation_options
+
 class GDALDrivers(object):
     """
     Class to get GDAL drivers or
@@ -50,12 +131,15 @@ class GDALDrivers(object):
     Example usage::
 
        import get_gdal_drivers
-       get_gdal_drivers.GDALDrivers().get_driver_from_ext('.tif')
-       get_gdal_drivers.GDALDrivers().get_ext_from_driver('GTiff')
+       get_gdal_drivers.get_drivers().get_driver_from_ext('.tif')
+       get_gdal_drivers.get_drivers().get_ext_from_driver('GTiff')
 
     """
 
     def __init__(self):
+        if not HAVE_GDAL:
+            raise ImportError('Could not import GDAL')
+
         # Set up two empty dictionaries
         # One uses the extension as the key and one the driver
         self.gdal_ext_from_driver = {}
@@ -85,6 +169,12 @@ class GDALDrivers(object):
         # Add non-GDAL drivers
         self.gdal_driver_from_ext.update(NON_GDAL_DRIVER_FROM_EXT)
 
+        # Cache of results for extensions as passed in (e.g., '.tif' or 'tif')
+        # and driver names, so repeated lookups are a single dictionary lookup.
+        self._driver_from_ext_cache = {}
+        self._creation_options_from_ext_cache = {}
+        self._creation_options_from_driver_cache = {}
+
     def get_driver_from_ext(self, file_ext):
         """
         Get GDAL driver short name from file
@@ -94,12 +184,18 @@ class GDALDrivers(object):
         :type file_ext: str
 
         """
+        try:
+            return self._driver_from_ext_cache[file_ext]
+        except KeyError:
+            pass
         # Remove '.' if there is one before the extension.
-        file_ext = file_ext.lstrip('.')
+        stripped_ext = file_ext.lstrip('.')
         try:
-            return self.gdal_driver_from_ext[file_ext]
+            driver_name = self.gdal_driver_from_ext[stripped_ext]
         except KeyError:
-            raise KeyError('The driver for file extension {} could not be found'.format(file_ext))
+            raise KeyError('The driver for file extension {} could not be found'.format(stripped_ext))
+        self._driver_from_ext_cache[file_ext] = driver_name
+        return driver_name
 
     def get_ext_from_driver(self, driver_name):
         """
@@ -124,13 +220,15 @@ class GDALDrivers(object):
         :type file_ext: str
 
         """
-        # Remove '.' if there is one before the extension.
-        file_ext = file_ext.lstrip('.')
         try:
-            return GDAL_CREATION_OPTIONS[file_ext]
+            return self._creation_options_from_ext_cache[file_ext]
         except KeyError:
-            # If there are no creation options defined return an empty list
-            return []
+            pass
+        # Remove '.' if there is one before the extension.
+        # If there are no creation options defined use an empty list
+        creation_options = GDAL_CREATION_OPTIONS.get(file_ext.lstrip('.'), [])
+        self._creation_options_from_ext_cache[file_ext] = creation_options
+        return creation_options
 
     def get_creation_options_from_driver(self, driver_name):
         """
@@ -141,13 +239,16 @@ class GDALDrivers(object):
         :type driver_name: str
 
         """
-        file_ext = self.get_ext_from_driver(driver_name)
-        file_ext = file_ext.lstrip('.')
         try:
-            return GDAL_CREATION_OPTIONS[file_ext]
+            return self._creation_options_from_driver_cache[driver_name]
         except KeyError:
-            # If there are no creation options defined return an empty list
-            return []
+            pass
+        file_ext = self.get_ext_from_driver(driver_name)
+        file_ext = file_ext.lstrip('.')
+        # If there are no creation options defined use an empty list
+        creation_options = GDAL_CREATION_OPTIONS.get(file_ext, [])
+        self._creation_options_from_driver_cache[driver_name] = creation_options
+        return creation_options
 
     def get_all_gdal_extensions(self):
         """
@@ -160,3 +261,19 @@ class GDALDrivers(object):
         Get all available GDAL drivers
         """
         return self.gdal_ext_from_driver.keys()
+
+def get_drivers():
+    """
+    Get shared GDALDrivers instance, which is created the
+    first time this function is called.
+
+    Example usage::
+
+       get_gdal_drivers.get_drivers().get_driver_from_ext('.tif')
+
+    """
+    if _GDAL_DRIVERS['instance'] is None:
+        with _GDAL_DRIVERS_LOCK:
+            if _GDAL_DRIVERS['instance'] is None:
+                _GDAL_DRIVERS['instance'] = GDALDrivers()
+    return _GDAL_DRIVERS['instance']
@@ -21,13 +21,22 @@ Nothing needs to be done to use these inside of grass, they will work as default
 
 or use setGrassPythonLoc after import sys.
 
+Within this library grass is only imported the first time it is used
+(see LazyGRASSModule) so importing the library doesn't require grass.
+
 Most of these functions should work in grass 7 if we update to that.
 
 Available functions:
 
 * grassDBsetup: Open and create an instance of grass for scripting. Must be run before anything else or grass will have a fit.
+* grassDBremove: Remove (or return to pool for reuse) a database created by grassDBsetup.
+* grassDBinit: Initialise grass to use an existing database.
+* GRASSWorkspace: Isolated grass session (database, GISRC and environment) for use from multiple threads.
 * setGrassQuiet: Set grass verbosity level.
 * setGrassPythonLoc: place in imports to make grass.script work.
+* getGISBASE: Get path to the grass library (found when first used).
+* importGRASSModule: Import a grass python module.
+* LazyGRASSModule: Grass python module which is imported when first used.
 * createTiffDem: Create a dem from a list of tiles and a spheroid file.
 * readAsciiLidar: Read and patch together a series of ascii lidar files.
 * readDem: Read a dem file, works with all gdal types.
@@ -71,6 +80,8 @@ import subprocess
 # Import from arsf_dem
 from . import dem_common_functions
 from . import dem_common
+from . import dem_scratch
+from . import dem_trace
 
 # Check DEM library is available
 # this is only used on ARSF systems
@@ -85,15 +96,11 @@ try:
 except Exception as err:
     pass
 
-#gives us access to grass and its pythony bits
-sys.path.append(dem_common.GRASS_PYTHON_LIB_PATH)
-try:
-    import grass.script as grass
-    import grass.script.setup as gsetup
-except ImportError as err:
-    raise ImportError("Could not import grass library. Try setting 'GRASS_PYTHON_LIB_PATH' environmental variable.", file=sys.stderr)
+import importlib
 import shutil
 import time
+import atexit
+import threading
 import numpy
 import tempfile
 # Try to import GDAL
@@ -108,8 +115,22 @@ except ImportError:
 ################################################################################
 ###############################Global Variables#################################
 ################################################################################
-#You'll be told repeatedly the script needs to be run inside of grass if this is wrong.
-GISBASE = os.environ['GISBASE'] = dem_common.GRASS_LIB_PATH
+#Lock used when importing grass python modules.
+_GRASS_IMPORT_LOCK = threading.Lock()
+
+#grass start_command before it was wrapped to pass workspace environment.
+_GRASS_START_COMMAND = {'function' : None}
+
+#Location of in memory filesystem, used for GRASS databases if GRASS_DB_USE_TMPFS is set.
+TMPFS_PATH = '/dev/shm'
+
+#GRASS databases available for reuse and all databases created for the pool.
+_GRASSDB_POOL = []
+_GRASSDB_POOL_CREATED = set()
+_GRASSDB_POOL_LOCK = threading.Lock()
+
+#GRASSWorkspace active in each thread.
+_WORKSPACE_LOCAL = threading.local()
 
 ################################################################################
 ###############################Grass Setup Functions############################
@@ -129,6 +150,142 @@ def _remove_leading_trailing_quotes(in_string):
 
     return in_string
 
+def _grassDBbasePath():
+    """Function _grassDBbasePath
+
+       Gets the directory to create GRASS databases in. If GRASS_DB_USE_TMPFS
+       is set and /dev/shm is available uses this, otherwise the first of
+       SCRATCH_PATHS with enough free space. Databases can be kept after
+       the process exits so aren't created within the scratch directory
+       for the job.
+
+       Returns: directory for GRASS databases
+    """
+    if dem_common.GRASS_DB_USE_TMPFS and os.path.isdir(TMPFS_PATH) \
+            and os.access(TMPFS_PATH, os.W_OK):
+        return TMPFS_PATH
+    return dem_scratch.get_scratch_manager().get_location()
+
+def _grassDBcreate():
+    """Function _grassDBcreate
+
+       Creates a new GRASS database by copying the template database.
+
+       Returns: The created grass database location
+    """
+    # Use mkdtemp so name is unique, even if processes with the same
+    # PID are started at the same time (e.g., in containers).
+    pid = os.getpid()
+    t = time.strftime("%H%M%S")
+    tempfolder = tempfile.mkdtemp(prefix="grassdb-%s-%s-" % (pid,t),
+                                  dir=_grassDBbasePath())
+    print("Grass database created at: {}".format(tempfolder))
+    for item in os.listdir(dem_common.GRASS_DATABASE_TEMPLATE):
+        template_item = os.path.join(dem_common.GRASS_DATABASE_TEMPLATE, item)
+        if os.path.isdir(template_item):
+            shutil.copytree(template_item, os.path.join(tempfolder, item))
+        else:
+            shutil.copy2(template_item, tempfolder)
+    return tempfolder
+
+def _removeItemsNotInTemplate(in_path, template_path):
+    """Function _removeItemsNotInTemplate
+
+       Removes files and directories which aren't in the template. Directories
+       which are in the template are checked in the same way, files which are
+       in the template are kept.
+
+       Arguments:
+                in_path: directory to remove items from
+                template_path: corresponding directory in template
+
+       Returns:
+    """
+    for item in os.listdir(in_path):
+        item_path = os.path.join(in_path, item)
+        template_item_path = os.path.join(template_path, item)
+        if os.path.isdir(template_item_path) and os.path.isdir(item_path):
+            _removeItemsNotInTemplate(item_path, template_item_path)
+        elif not os.path.exists(template_item_path):
+            if os.path.isdir(item_path):
+                shutil.rmtree(item_path)
+            else:
+                os.remove(item_path)
+
+def _grassDBreset(grassdb_path):
+    """Function _grassDBreset
+
+       Resets a GRASS database to the same state as the template without
+       copying the template. Locations and mapsets not in the template
+       are removed, as are maps and other files added to template mapsets
+       (e.g., PERMANENT). Only the region file (WIND) is copied back from the
+       template, as it is changed by g.region.
+
+       Arguments:
+                grassdb_path: path to GRASS database
+
+       Returns:
+    """
+    template_path = dem_common.GRASS_DATABASE_TEMPLATE
+
+    # Remove anything not in the template
+    _removeItemsNotInTemplate(grassdb_path, template_path)
+
+    # Restore current region for each mapset
+    for location in os.listdir(template_path):
+        template_location_path = os.path.join(template_path, location)
+        if not os.path.isdir(template_location_path):
+            continue
+        # Copy back any locations removed from database
+        if not os.path.isdir(os.path.join(grassdb_path, location)):
+            shutil.copytree(template_location_path,
+                            os.path.join(grassdb_path, location))
+            continue
+        for mapset in os.listdir(template_location_path):
+            template_wind = os.path.join(template_location_path, mapset, 'WIND')
+            if os.path.isfile(template_wind):
+                shutil.copy2(template_wind,
+                             os.path.join(grassdb_path, location, mapset, 'WIND'))
+
+def _grassDBcleanupPool():
+    """Function _grassDBcleanupPool
+
+       Removes all GRASS databases in the pool which aren't in use.
+       Registered to run when the process exits.
+    """
+    with _GRASSDB_POOL_LOCK:
+        while len(_GRASSDB_POOL) > 0:
+            grassdb_path = _GRASSDB_POOL.pop()
+            _GRASSDB_POOL_CREATED.discard(grassdb_path)
+            if os.path.isdir(grassdb_path):
+                shutil.rmtree(grassdb_path, ignore_errors=True)
+
+atexit.register(_grassDBcleanupPool)
+
+def _grassDBacquire():
+    """Function _grassDBacquire
+
+       Gets a GRASS database from the pool, or creates a new one if the
+       pool is empty or not being used.
+
+       Returns: grass database location
+    """
+    tempfolder = None
+    if dem_common.GRASS_DB_POOL:
+        with _GRASSDB_POOL_LOCK:
+            if len(_GRASSDB_POOL) > 0:
+                tempfolder = _GRASSDB_POOL.pop()
+        if tempfolder is not None:
+            print("Reusing Grass database at: {}".format(tempfolder))
+
+    if tempfolder is None:
+        tempfolder = _grassDBcreate()
+        if dem_common.GRASS_DB_POOL:
+            with _GRASSDB_POOL_LOCK:
+                _GRASSDB_POOL_CREATED.add(tempfolder)
+
+    return tempfolder
+
 def grassDBsetup():
     """Function grassDBsetup
 
@@ -136,26 +293,303 @@ def grassDBsetup():
        Gsetup is a grass function, which creates a temporary grassrc for this session
        and initialises grass for interaction.
 
+       If GRASS_DB_POOL is set in the config file a database which has been
+       returned using grassDBremove will be reused if available.
+
+       If a GRASSWorkspace is active in the current thread the database for
+       the workspace is used instead.
+
        Arguments:
 
        Returns: The created grass database location
     """
-    pid = os.getpid()
-    t = time.strftime("%H%M%S")
-    tempfolder = "grassdb-%s-%s" % (pid,t)
-    tempfolder = os.path.join(dem_common.TEMP_PATH,tempfolder)
-    print("Grass database created at: {}".format(tempfolder))
-    shutil.copytree(dem_common.GRASS_DATABASE_TEMPLATE,
-                    tempfolder)
+    workspace = getActiveWorkspace()
+    if workspace is not None:
+        workspace.setLocation("WGS84LL", "PERMANENT")
+        return workspace.grassdb_path
+
+    tempfolder = _grassDBacquire()
+
     gisdbase = os.path.join(tempfolder)
     location = "WGS84LL"
     mapset   = "PERMANENT"
-    gsetup.init(GISBASE,
+    gsetup.init(getGISBASE(),
                 gisdbase,
                 location,
                 mapset)
     return tempfolder
 
+def grassDBinit(grassdb_path, location, mapset="PERMANENT"):
+    """Function grassDBinit
+
+       Initialises grass to use an existing database, location and mapset.
+       If a GRASSWorkspace is active in the current thread only the workspace
+       is changed, otherwise the process wide grass settings are changed
+       (using gsetup.init).
+
+       Arguments:
+                grassdb_path: path to GRASS database
+                location: location to use
+                mapset: mapset to use
+
+       Returns:
+    """
+    workspace = getActiveWorkspace()
+    if workspace is not None:
+        if os.path.abspath(grassdb_path) != os.path.abspath(workspace.grassdb_path):
+            raise Exception('GRASS database {} is not the database for the active workspace ({})'.format(grassdb_path, workspace.grassdb_path))
+        workspace.setLocation(location, mapset)
+    else:
+        gsetup.init(getGISBASE(),
+                    grassdb_path,
+                    location,
+                    mapset)
+
+def grassDBremove(grassdb_path):
+    """Function grassDBremove
+
+       Removes a GRASS database created by grassDBsetup once it is no longer needed.
+
+       If GRASS_DB_POOL is set in the config file and the database was created by
+       grassDBsetup in this process, the database is reset and kept
+       so it can be reused by the next call to grassDBsetup. Otherwise the database
+       is deleted.
+
+       Arguments:
+                grassdb_path: path to GRASS database
+
+       Returns:
+    """
+    if grassdb_path is None or not os.path.isdir(grassdb_path):
+        return
+
+    # Database for active workspace is removed when workspace is closed
+    workspace = getActiveWorkspace()
+    if workspace is not None and \
+            os.path.abspath(grassdb_path) == os.path.abspath(workspace.grassdb_path):
+        return
+
+    with _GRASSDB_POOL_LOCK:
+        pooled = grassdb_path in _GRASSDB_POOL_CREATED
+
+    if pooled:
+        try:
+            _grassDBreset(grassdb_path)
+        except (IOError, OSError) as err:
+            dem_common_functions.WARNING('Could not reset GRASS database {}, will remove.\n{}'.format(grassdb_path, err))
+            with _GRASSDB_POOL_LOCK:
+                _GRASSDB_POOL_CREATED.discard(grassdb_path)
+            shutil.rmtree(grassdb_path, ignore_errors=True)
+            return
+        with _GRASSDB_POOL_LOCK:
+            _GRASSDB_POOL.append(grassdb_path)
+    else:
+        shutil.rmtree(grassdb_path)
+
+def _getWorkspaceEnv(gisbase, gisrc, in_env=None):
+    """Function _getWorkspaceEnv
+
+       Gets a copy of the environment with the variables needed to run grass
+       modules set, the same as gsetup.init does for the process environment
+       (PATH, library path, PYTHONPATH, GISBASE, GISRC and GIS_LOCK).
+
+       Arguments:
+                gisbase: path to the GRASS library
+                gisrc: GISRC file to use
+                in_env: environment to copy (default is os.environ)
+
+       Returns: dictionary with environment
+    """
+    if in_env is None:
+        in_env = os.environ
+    env = dict(in_env)
+
+    path_list = [env['PATH']] if env.get('PATH') else []
+    path_list.extend([os.path.join(gisbase, 'bin'),
+                      os.path.join(gisbase, 'scripts')])
+    if sys.platform.startswith('win'):
+        path_list.append(os.path.join(gisbase, 'lib'))
+    env['PATH'] = os.pathsep.join(path_list)
+
+    if sys.platform == 'darwin':
+        library_path_var = 'DYLD_LIBRARY_PATH'
+    else:
+        library_path_var = 'LD_LIBRARY_PATH'
+    library_path_list = [env[library_path_var]] if env.get(library_path_var) else []
+    library_path_list.append(os.path.join(gisbase, 'lib'))
+    env[library_path_var] = os.pathsep.join(library_path_list)
+
+    # Needed for grass python scripts (e.g., r.fillnulls)
+    python_path_list = [os.path.join(gisbase, 'etc', 'python')]
+    if env.get('PYTHONPATH'):
+        python_path_list.append(env['PYTHONPATH'])
+    env['PYTHONPATH'] = os.pathsep.join(python_path_list)
+
+    env['GIS_LOCK'] = str(os.getpid())
+    env['GISBASE'] = gisbase
+    env['GISRC'] = gisrc
+
+    return env
+
+def getActiveWorkspace():
+    """Function getActiveWorkspace
+
+       Returns: the GRASSWorkspace active in the current thread or None
+    """
+    return getattr(_WORKSPACE_LOCAL, 'workspace', None)
+
+class GRASSWorkspace(object):
+    """Class GRASSWorkspace
+
+       An isolated GRASS session which can be used from multiple threads (or
+       processes) at once.
+
+       Each workspace has its own database (in a unique temporary directory),
+       its own GISRC file and a copy of the environment set up in the same
+       way as gsetup.init (see _getWorkspaceEnv). While the workspace is active in a thread the environment is
+       passed to every grass command run from that thread (through
+       grass.run_command, read_command, mapcalc etc.), so the process wide
+       environment variables are not used or changed.
+
+       Functions which call grassDBsetup, grassDBinit and grassDBremove
+       (e.g., dem_utilities.patch_files) use the workspace database when
+       called from a thread with an active workspace::
+
+          with grass_library.GRASSWorkspace() as workspace:
+              dem_utilities.patch_files(in_files, out_file=out_file)
+
+    """
+    def __init__(self, location="WGS84LL", mapset="PERMANENT"):
+        self.grassdb_path = _grassDBacquire()
+        self.gisrc = os.path.join(self.grassdb_path, '.grassrc')
+        self.env = _getWorkspaceEnv(getGISBASE(), self.gisrc)
+        self._previous_workspace = None
+        self.setLocation(location, mapset)
+
+    def setLocation(self, location, mapset="PERMANENT"):
+        """Set the location and mapset for the workspace (writes GISRC file)"""
+        with open(self.gisrc, 'w') as f:
+            f.write('GISDBASE: {}\n'.format(self.grassdb_path))
+            f.write('LOCATION_NAME: {}\n'.format(location))
+            f.write('MAPSET: {}\n'.format(mapset))
+            f.write('GUI: text\n')
+
+    def run_command(self, *args, **kwargs):
+        """Run a grass command using the workspace environment"""
+        kwargs['env'] = self.env
+        return grass.run_command(*args, **kwargs)
+
+    def read_command(self, *args, **kwargs):
+        """Run a grass command using the workspace environment and return stdout"""
+        kwargs['env'] = self.env
+        return grass.read_command(*args, **kwargs)
+
+    def activate(self):
+        """Make this the active workspace for the current thread"""
+        self._previous_workspace = getActiveWorkspace()
+        _WORKSPACE_LOCAL.workspace = self
+
+    def deactivate(self):
+        """Restore the workspace which was active before 'activate' was called"""
+        _WORKSPACE_LOCAL.workspace = self._previous_workspace
+        self._previous_workspace = None
+
+    def close(self):
+        """Remove (or return to pool) the database for the workspace"""
+        if self.grassdb_path is not None:
+            if os.path.isfile(self.gisrc):
+                os.remove(self.gisrc)
+            grassdb_path = self.grassdb_path
+            self.grassdb_path = None
+            grassDBremove(grassdb_path)
+
+    def __enter__(self):
+        self.activate()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.deactivate()
+        self.close()
+        return False
+
+def _start_command_workspace_env(*args, **kwargs):
+    """
+    Wrapper around grass.script.core.start_command which passes the
+    environment of the active workspace (if there is one) to the command.
+    All grass commands run through grass.script are started by start_command.
+    """
+    workspace = getActiveWorkspace()
+    if workspace is not None and kwargs.get('env') is None:
+        kwargs['env'] = workspace.env
+    return _GRASS_START_COMMAND['function'](*args, **kwargs)
+
+def getGISBASE():
+    """Function getGISBASE
+
+       Gets path to the GRASS library (GISBASE), setting the GISBASE
+       environmental variable the first time it is called.
+       You'll be told repeatedly the script needs to be run inside of grass if this is wrong.
+
+       Returns: GISBASE path
+    """
+    return dem_common.get_lazy_path('GRASS_LIB_PATH')
+
+def importGRASSModule(module_name):
+    """Function importGRASSModule
+
+       Imports a grass python module (e.g., grass.script), adding the grass
+       python library to the path first. The first time grass is imported
+       start_command is wrapped so commands use the environment of the
+       active GRASSWorkspace.
+
+       Arguments:
+                module_name: name of module to import
+
+       Returns: module
+    """
+    with _GRASS_IMPORT_LOCK:
+        getGISBASE()
+        setGrassPythonLoc()
+        try:
+            grass_module = importlib.import_module(module_name)
+            grass_core_module = importlib.import_module('grass.script.core')
+        except ImportError as err:
+            raise ImportError("Could not import grass library. "
+                              "Try setting 'GRASS_PYTHON_LIB_PATH' environmental variable."
+                              "\n{}".format(err))
+        if _GRASS_START_COMMAND['function'] is None:
+            _GRASS_START_COMMAND['function'] = grass_core_module.start_command
+            grass_core_module.start_command = _start_command_workspace_env
+    return grass_module
+
+class LazyGRASSModule(object):
+    """
+    A grass python module which is only imported (using importGRASSModule)
+    the first time one of its attributes is used. Importing grass is slow
+    and requires the grass paths to be found, so this avoids the cost for
+    scripts and processes which don't use grass::
+
+       grass = LazyGRASSModule('grass.script')
+       grass.run_command('g.region', flags='p')
+
+    """
+    def __init__(self, module_name):
+        self._module_name = module_name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importGRASSModule(self._module_name)
+        return self._module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+#gives us access to grass and its pythony bits (imported when first used)
+grass = LazyGRASSModule('grass.script')
+grass_core = LazyGRASSModule('grass.script.core')
+gsetup = LazyGRASSModule('grass.script.setup')
+
 def setGrassQuiet(verbosity=0):
     """Function grassDBsetup
 
@@ -173,7 +607,8 @@ def setGrassPythonLoc():
     """Function setGrassPythonLoc
     gives us access to grass and its python bits, run in imports after sys
     """
-    sys.path.append(dem_common.GRASS_PYTHON_LIB_PATH)
+    if dem_common.GRASS_PYTHON_LIB_PATH not in sys.path:
+        sys.path.append(dem_common.GRASS_PYTHON_LIB_PATH)
 
 
 ################################################################################
@@ -312,7 +747,7 @@ def readLasLidar(lasfolder,location=None,patch=True,datacolumn=dem_common.LIDAR_
        Returns: list of grass internal raster names
     """
     #Create a tmp folder for storing the ascii files
-    tempdir=tempfile.mkdtemp(dir=dem_common.TEMP_PATH)
+    tempdir=tempfile.mkdtemp(dir=dem_scratch.get_dir())
 
     from .dem_lidar import lastools_lidar
     lastools_lidar.convert_las_to_ascii(lasfolder, tempdir)
@@ -376,7 +811,7 @@ def readAsciiLidar(lasfolder, location=None,patch=True,datacolumn=dem_common.LID
                           w=bounds[0],)
 
         if ignoreclassification:
-            updatedfilename=tempfile.mkstemp()[1]
+            updatedfilename=tempfile.mkstemp(dir=dem_scratch.get_dir())[1]
             removeASCIIClass(lasfile, updatedfilename)
         else:
             updatedfilename=lasfile
@@ -1569,3 +2004,6 @@ def checkFileExists(file_name):
         return True
     else:
         return False
+
+# Record a span for each call to a public function when tracing is enabled
+dem_trace.trace_public_functions(globals())
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+#Description: Benchmark time taken to import arsf_dem modules.
+"""
+Benchmark time taken to import arsf_dem modules using
+'python -X importtime' (requires Python 3.7+).
+
+Each module is imported in a new Python process several times and the
+fastest time is reported, along with the modules which took longest to
+import. Results can be appended to a JSON lines file so changes in import
+time can be tracked.
+
+This file has been created by ARSF Data Analysis Node and
+is licensed under the GPL v3 Licence. A copy of this
+licence is available to download with this file.
+
+"""
+
+from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+#: Modules to benchmark by default
+DEFAULT_MODULES = ['arsf_dem.dem_common',
+                   'arsf_dem.grass_library',
+                   'arsf_dem.dem_utilities',
+                   'arsf_dem.dem_nav_utilities',
+                   'arsf_dem.dem_lidar']
+
+def get_import_times(module_name, python_exe=sys.executable):
+    """
+    Import a module in a new Python process using '-X importtime'.
+
+    Arguments:
+
+    * module_name - name of module to import.
+    * python_exe - Python interpreter to use.
+
+    Returns:
+
+    * dictionary of cumulative import time (in microseconds) for each module imported.
+
+    """
+    import_process = subprocess.Popen([python_exe, '-X', 'importtime',
+                                       '-c', 'import {}'.format(module_name)],
+                                      stdout=subprocess.PIPE,
+                                      stderr=subprocess.PIPE)
+    _, import_stderr = import_process.communicate()
+    import_stderr = import_stderr.decode('utf-8', 'replace')
+
+    if import_process.returncode != 0:
+        error_lines = [line for line in import_stderr.splitlines()
+                       if not line.startswith('import time:')]
+        raise Exception('Could not import {}:\n{}'.format(module_name,
+                                                          '\n'.join(error_lines)))
+
+    import_times = {}
+    for line in import_stderr.splitlines():
+        # Lines are of the form:
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:'):
+            continue
+        elements = line[len('import time:'):].split('|')
+        if len(elements) != 3:
+            continue
+        try:
+            cumulative_us = int(elements[1])
+        except ValueError:
+            # Header line
+            continue
+        import_times[elements[2].strip()] = cumulative_us
+
+    return import_times
+
+def benchmark_import(module_name, repeats=5, num_slowest=10):
+    """
+    Benchmark import of a module, taking the fastest of several runs.
+
+    Arguments:
+
+    * module_name - name of module to import.
+    * repeats - number of times to import module.
+    * num_slowest - number of slowest imported modules to report.
+
+    Returns:
+
+    * dictionary with keys 'module', 'import_time_ms', 'num_modules' and
+      'slowest' (list of [module, time_ms] pairs).
+
+    """
+    best_times = None
+    for _ in range(repeats):
+        import_times = get_import_times(module_name)
+        if best_times is None or \
+                import_times.get(module_name, 0) < best_times.get(module_name, 0):
+            best_times = import_times
+
+    slowest = sorted(best_times.items(), key=lambda item: item[1],
+                     reverse=True)
+    slowest = [[name, round(time_us / 1000.0, 2)]
+               for name, time_us in slowest[:num_slowest]]
+
+    return {'module' : module_name,
+            'import_time_ms' : round(best_times.get(module_name, 0) / 1000.0, 2),
+            'num_modules' : len(best_times),
+            'slowest' : slowest}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark time taken to '
+                                                 'import arsf_dem modules '
+                                                 'using "python -X importtime"')
+    parser.add_argument('modules', nargs='*',
+                        help='Modules to import (default={})'.format(
+                            ', '.join(DEFAULT_MODULES)),
+                        default=DEFAULT_MODULES)
+    parser.add_argument('-r', '--repeats',
+                        help='Number of times to import each module (default=5)',
+                        type=int,
+                        default=5,
+                        required=False)
+    parser.add_argument('-n', '--num_slowest',
+                        help='Number of slowest imports to show (default=10)',
+                        type=int,
+                        default=10,
+                        required=False)
+    parser.add_argument('-o', '--outfile',
+                        help='JSON lines file to append results to',
+                        default=None,
+                        required=False)
+    args = parser.parse_args()
+
+    if sys.version_info < (3, 7):
+        print('Requires Python 3.7 or later for "-X importtime"', file=sys.stderr)
+        sys.exit(1)
+
+    results = []
+    for module_name in args.modules:
+        try:
+            result = benchmark_import(module_name, repeats=args.repeats,
+                                      num_slowest=args.num_slowest)
+        except Exception as err:
+            print(err, file=sys.stderr)
+            continue
+        results.append(result)
+
+        print('\n{} : {:.1f} ms ({} modules imported)'.format(result['module'],
+                                                             result['import_time_ms'],
+                                                             result['num_modules']))
+        for name, time_ms in result['slowest']:
+            print('   {:>10.1f} ms  {}'.format(time_ms, name))
+
+    if args.outfile is not None:
+        with open(args.outfile, 'a') as out_fh:
+            for result in results:
+                result['time'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+                result['python'] = sys.version.split()[0]
+                result['platform'] = sys.platform
+                out_fh.write(json.dumps(result) + '\n')
+        print('\nResults appended to {}'.format(os.path.abspath(args.outfile)))
@@ -18,8 +18,13 @@ import argparse
 # Import DEM library
 try:
     from arsf_dem import dem_common
+    from arsf_dem import dem_scratch
     from arsf_dem import dem_nav_utilities
     from arsf_dem import dem_common_functions
+    from arsf_dem import dem_trace
+    from arsf_dem import dem_tile_cache
+    from arsf_dem import dem_utilities
+    from arsf_dem import get_gdal_drivers
 except ImportError as err:
     print("Could not import ARSF DEM library", file=sys.stderr)
     print(err, file=sys.stderr)
@@ -29,6 +34,8 @@ except ImportError as err:
 DEBUG = dem_common.DEBUG
 
 if __name__ == '__main__':
+    # Remove scratch files if stopped using SIGTERM / SIGHUP
+    dem_scratch.install_signal_handlers()
 
     description_str = '''A script to create a DEM for use in APL subset to bounds
  of hyperspectral navigation data.
@@ -75,6 +82,10 @@ if __name__ == '__main__':
   create_apl_dem.py --demmosaic strm_mosaic.vrt --separation_file {0} \\
             --bil_navigation flightlines/navigation -o 2014_216_strm.dem
 
+ 8) Create a separate ASTER DEM for each flight line using post-processed navigation data
+
+  create_apl_dem.py --aster --bil_navigation flightlines/navigation --per_line -o line_dems
+
  If calling from within the project directory, there should be no need to specify the
  project path as it will be found from the current location.
 
@@ -144,13 +155,59 @@ if __name__ == '__main__':
                                      "flightlines/navigation" within delivery directory''',
                             default=None,
                             required=False)
+        parser.add_argument('--footprint',
+                            action='store_true',
+                            help='''Only create DEM within footprint of flight lines
+                                    (calculated from "--bil_navigation"). Pixels outside
+                                    will be set to no data. Reduces processing time for
+                                    flight lines which are not aligned N-S or E-W.''',
+                            default=False,
+                            required=False)
+        parser.add_argument('--per_line',
+                            action='store_true',
+                            help='''Create a separate DEM for each flight line
+                                    (requires "--bil_navigation"). The output
+                                    ("-o") is treated as a directory.''',
+                            default=False,
+                            required=False)
         parser.add_argument('--keepgrassdb',
                             action='store_true',
                             help='Keep GRASS database (default=False)',
                             default=False,
                             required=False)
+        parser.add_argument('--trace',
+                            metavar ='Trace file',
+                            help ='Write time and resources used by each stage to '
+                                  'a trace file (JSON lines if ending ".jsonl", '
+                                  'otherwise Chrome trace format)',
+                            default=None,
+                            required=False)
+        parser.add_argument('--no-cache',
+                            dest='no_cache',
+                            action='store_true',
+                            help='Don\'t use cached DEM tiles, subset, offset '
+                                 'and fill DEM again (default=False)',
+                            default=False,
+                            required=False)
+        parser.add_argument('--output_profile',
+                            metavar ='Output Profile',
+                            help ='Output profile for GeoTIFF outputs. Options are:\n{}\n'
+                                  'COG creates Cloud-Optimized GeoTIFFs (tiled, compressed '
+                                  'with internal overviews) (default={})'.format(
+                                    ','.join(sorted(get_gdal_drivers.OUTPUT_PROFILES.keys())),
+                                    dem_common.GDAL_OUTPUT_PROFILE),
+                            default=dem_common.GDAL_OUTPUT_PROFILE,
+                            required=False)
         args=parser.parse_args()
 
+        if args.trace is not None:
+            dem_trace.enable_tracing(args.trace)
+
+        if args.no_cache:
+            dem_tile_cache.set_enabled(False)
+
+        dem_utilities.set_output_profile(args.output_profile)
+
         dem_source = None
 
         # ASTER DEM
@@ -172,6 +229,22 @@ if __name__ == '__main__':
                   '"--demmosaic"', file=sys.stderr)
             sys.exit(1)
 
+        if args.per_line:
+            if args.bil_navigation is None or args.outdem is None:
+                print('Must provide "--bil_navigation" and an output '
+                      'directory ("-o") with "--per_line"', file=sys.stderr)
+                sys.exit(1)
+            if args.footprint or args.keepgrassdb:
+                print('"--footprint" and "--keepgrassdb" can not be used '
+                      'with "--per_line"', file=sys.stderr)
+                sys.exit(1)
+            dem_nav_utilities.create_apl_dems_per_line_from_mosaic(args.outdem,
+                       args.bil_navigation,
+                       dem_source=dem_source,
+                       dem_mosaic=args.demmosaic,
+                       separation_file=args.separation_file)
+            sys.exit(0)
+
         dem_nav_utilities.create_apl_dem_from_mosaic(args.outdem,
                        dem_source=dem_source,
                        dem_mosaic=args.demmosaic,
@@ -179,7 +252,8 @@ if __name__ == '__main__':
                        project=args.project,
                        nav=args.nav,
                        bil_navigation=args.bil_navigation,
-                       remove_grassdb=(not args.keepgrassdb))
+                       remove_grassdb=(not args.keepgrassdb),
+                       use_footprint=args.footprint)
 
     except KeyboardInterrupt:
         sys.exit(2)
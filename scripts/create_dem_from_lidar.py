@@ -17,8 +17,16 @@ import argparse
 # Import DEM library
 try:
     from arsf_dem import dem_common
+    from arsf_dem import dem_scratch
     from arsf_dem import dem_lidar
+    from arsf_dem.dem_lidar import point_cache
+    from arsf_dem import dem_result_cache
+    from arsf_dem import dem_tile_cache
+    from arsf_dem import dem_utilities
+    from arsf_dem import get_gdal_drivers
     from arsf_dem import dem_common_functions
+    from arsf_dem import dem_task_graph
+    from arsf_dem import dem_trace
 except ImportError as err:
     print("Could not import ARSF DEM library.", file=sys.stderr)
     print(err, file=sys.stderr)
@@ -28,6 +36,9 @@ except ImportError as err:
 DEBUG = dem_common.DEBUG
 
 if __name__ == '__main__':
+    # Remove scratch files if stopped using SIGTERM / SIGHUP
+    dem_scratch.install_signal_handlers()
+
     description_str = '''A script to create a DEM from LiDAR data in LAS or ASCII format and optionally patch with a DEM
 
  Typical usage
@@ -188,8 +199,59 @@ if __name__ == '__main__':
                             help='Keep GRASS database (default=False)',
                             default=False,
                             required=False)
+        parser.add_argument('--nprocesses',
+                            metavar ='Number of cores',
+                            help ='Number of cores stages can use at once '
+                                  '(default={})'.format(dem_common.NUM_PROCESSES),
+                            type=int,
+                            default=None,
+                            required=False)
+        parser.add_argument('--max_memory',
+                            metavar ='Memory (MB)',
+                            help ='Total memory in MB stages can use at once '
+                                  '(default={})'.format(dem_common.MAX_MEMORY_MB),
+                            type=int,
+                            default=None,
+                            required=False)
+        parser.add_argument('--trace',
+                            metavar ='Trace file',
+                            help ='Write time and resources used by each stage to '
+                                  'a trace file (JSON lines if ending ".jsonl", '
+                                  'otherwise Chrome trace format)',
+                            default=None,
+                            required=False)
+        parser.add_argument('--no-cache',
+                            dest='no_cache',
+                            action='store_true',
+                            help='Don\'t use cached rasters, points or DEM tiles, '
+                                 'create all rasters again (default=False)',
+                            default=False,
+                            required=False)
+        parser.add_argument('--output_profile',
+                            metavar ='Output Profile',
+                            help ='Output profile for GeoTIFF outputs. Options are:\n{}\n'
+                                  'COG creates Cloud-Optimized GeoTIFFs (tiled, compressed '
+                                  'with internal overviews) (default={})'.format(
+                                    ','.join(sorted(get_gdal_drivers.OUTPUT_PROFILES.keys())),
+                                    dem_common.GDAL_OUTPUT_PROFILE),
+                            default=dem_common.GDAL_OUTPUT_PROFILE,
+                            required=False)
         args=parser.parse_args()
 
+        if args.no_cache:
+            dem_result_cache.set_enabled(False)
+            point_cache.set_enabled(False)
+            dem_tile_cache.set_enabled(False)
+
+        dem_utilities.set_output_profile(args.output_profile)
+
+        if args.trace is not None:
+            dem_trace.enable_tracing(args.trace)
+
+        # Set budget for stages run at the same time
+        dem_task_graph.set_resource_budget(num_processes=args.nprocesses,
+                                           max_memory_mb=args.max_memory)
+
         # Set format for input lidar data
         lidar_format = 'LAS'
         if args.ascii:
@@ -0,0 +1,2 @@
+@echo off
+python "%~dp0\create_lidar_quicklooks.py" %*
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+#Description: A script to create quicklook rasters for each lidar file.
+"""
+Created on: 18 October 2026
+
+This file has been created by ARSF Data Analysis Node and
+is licensed under the GPL v3 Licence. A copy of this
+licence is available to download with this file.
+
+"""
+
+from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
+import sys
+import argparse
+# Import DEM library
+try:
+    from arsf_dem import dem_common
+    from arsf_dem import dem_scratch
+    from arsf_dem import dem_lidar
+    from arsf_dem.dem_lidar import point_cache
+    from arsf_dem import dem_utilities
+    from arsf_dem import get_gdal_drivers
+    from arsf_dem import dem_common_functions
+except ImportError as err:
+    print("Could not import ARSF DEM library.", file=sys.stderr)
+    print(err, file=sys.stderr)
+    sys.exit(1)
+
+#: Debug mode
+DEBUG = dem_common.DEBUG
+
+if __name__ == '__main__':
+    # Remove scratch files if stopped using SIGTERM / SIGHUP
+    dem_scratch.install_signal_handlers()
+
+    description_str = '''A script to create a coarse quicklook raster and JPEG for each LiDAR file
+for checking data.
+
+Quicklooks are created from a subsample of points at a coarse resolution,
+so are much faster to create than a full resolution mosaic.
+
+ Typical usage
+
+1) Create DSM quicklooks for all LAS files in a directory
+
+ create_lidar_quicklooks.py -o quicklooks las1.0
+
+2) Create DTM quicklooks at 5 m resolution, using 1 in 20 points
+
+ create_lidar_quicklooks.py -o quicklooks -t DTM -r 5 --subsample_factor 20 las1.0
+
+3) Create quicklooks from COPC files, reading only the octree levels needed
+
+ create_lidar_quicklooks.py -o quicklooks --subsample COPC copc
+
+ 'create_lidar_quicklooks' was created by ARSF-DAN at Plymouth Marine Laboratory (PML)
+ and is made available under the terms of the GPLv3 license.
+
+'''
+    try:
+        parser = argparse.ArgumentParser(description=description_str,formatter_class=argparse.RawDescriptionHelpFormatter)
+        parser.add_argument("lidarfiles", nargs='+',type=str, help="List or directory containing input LiDAR files")
+        parser.add_argument('-o', '--outdir',
+                            metavar ='Out directory',
+                            help ='Output directory for quicklooks',
+                            required=True)
+        parser.add_argument('-t', '--rastertype',
+                            metavar ='Output raster type',
+                            help ='Output raster type (DSM, DTM, DEM or INTENSITY; default DSM)',
+                            default='DSM',
+                            required=False)
+        parser.add_argument('--ascii',
+                            action='store_true',
+                            help='Input LiDAR data are in ASCII format '
+                                 '(default=False)',
+                            default=False,
+                            required=False)
+        parser.add_argument('-r', '--resolution',
+                            metavar ='Resolution',
+                            help ='Resolution for quicklooks (default={})'.format(dem_common.LIDAR_QUICKLOOK_RES_METRES),
+                            default=dem_common.LIDAR_QUICKLOOK_RES_METRES,
+                            type=float,
+                            required=False)
+        parser.add_argument('--in_projection',
+                            metavar ='In Projection',
+                            help ='Input projection (e.g., UTM30N; default={})'.format(dem_common.DEFAULT_LIDAR_PROJECTION_GRASS),
+                            default=dem_common.DEFAULT_LIDAR_PROJECTION_GRASS,
+                            required=False)
+        parser.add_argument('--subsample',
+                            metavar ='Subsample method',
+                            help ='Method to subsample points. Options are:\n{}\n'
+                                  '(default={})'.format(','.join(point_cache.SUBSAMPLE_METHODS),
+                                                        dem_common.LIDAR_QUICKLOOK_SUBSAMPLE),
+                            default=dem_common.LIDAR_QUICKLOOK_SUBSAMPLE,
+                            required=False)
+        parser.add_argument('--subsample_factor',
+                            metavar ='Subsample factor',
+                            help ='Use 1 in every N points (default={})'.format(dem_common.LIDAR_QUICKLOOK_SUBSAMPLE_FACTOR),
+                            default=dem_common.LIDAR_QUICKLOOK_SUBSAMPLE_FACTOR,
+                            type=int,
+                            required=False)
+        parser.add_argument('--nojpeg',
+                            action='store_true',
+                            help='Don\'t export quicklooks as JPEG (default=False)',
+                            default=False,
+                            required=False)
+        parser.add_argument('--no-cache',
+                            dest='no_cache',
+                            action='store_true',
+                            help='Don\'t use cached points, read all files '
+                                 'again (default=False)',
+                            default=False,
+                            required=False)
+        parser.add_argument('--output_profile',
+                            metavar ='Output Profile',
+                            help ='Output profile for GeoTIFF outputs. Options are:\n{}\n'
+                                  'COG creates Cloud-Optimized GeoTIFFs (tiled, compressed '
+                                  'with internal overviews) (default={})'.format(
+                                    ','.join(sorted(get_gdal_drivers.OUTPUT_PROFILES.keys())),
+                                    dem_common.GDAL_OUTPUT_PROFILE),
+                            default=dem_common.GDAL_OUTPUT_PROFILE,
+                            required=False)
+        args=parser.parse_args()
+
+        if args.no_cache:
+            point_cache.set_enabled(False)
+
+        dem_utilities.set_output_profile(args.output_profile)
+
+        lidar_format = 'LAS'
+        if args.ascii:
+            lidar_format = 'ASCII'
+
+        quicklooks = dem_lidar.lidar_utilities.create_lidar_quicklooks(args.lidarfiles,
+                                                    args.outdir,
+                                                    raster_type=args.rastertype,
+                                                    in_projection=args.in_projection,
+                                                    resolution=args.resolution,
+                                                    subsample_method=args.subsample,
+                                                    subsample_factor=args.subsample_factor,
+                                                    lidar_format=lidar_format,
+                                                    create_jpeg=not args.nojpeg)
+
+        print('Created {} quicklooks in {}'.format(len(quicklooks), args.outdir))
+
+    except KeyboardInterrupt:
+        sys.exit(2)
+    except Exception as err:
+        if DEBUG:
+            raise
+        dem_common_functions.ERROR(err)
+        sys.exit(1)
@@ -16,8 +16,12 @@ import argparse
 # Import DEM library
 try:
     from arsf_dem import dem_common
+    from arsf_dem import dem_scratch
     from arsf_dem import dem_utilities
+    from arsf_dem import get_gdal_drivers
     from arsf_dem import dem_lidar
+    from arsf_dem.dem_lidar import point_cache
+    from arsf_dem import dem_result_cache
     from arsf_dem import dem_common_functions
 except ImportError as err:
     print("Could not import ARSF DEM library.", file=sys.stderr)
@@ -28,6 +32,9 @@ except ImportError as err:
 DEBUG = dem_common.DEBUG
 
 if __name__ == '__main__':
+    # Remove scratch files if stopped using SIGTERM / SIGHUP
+    dem_scratch.install_signal_handlers()
+
     description_str = '''Create a Digital Surface Model (DSM) from a LAS file(s).
 
  'las_to_dsm' was created by ARSF-DAN at Plymouth Marine Laboratory (PML)
@@ -66,8 +73,30 @@ if __name__ == '__main__':
                             help ='Software package to use. Options are:\n{}'.format(','.join(dem_lidar.LAS_TO_DEM_METHODS)),
                             default='GRASS',
                             required=False)
+        parser.add_argument('--no-cache',
+                            dest='no_cache',
+                            action='store_true',
+                            help='Don\'t use cached rasters or points, create all '
+                                 'rasters again (default=False)',
+                            default=False,
+                            required=False)
+        parser.add_argument('--output_profile',
+                            metavar ='Output Profile',
+                            help ='Output profile for GeoTIFF outputs. Options are:\n{}\n'
+                                  'COG creates Cloud-Optimized GeoTIFFs (tiled, compressed '
+                                  'with internal overviews) (default={})'.format(
+                                    ','.join(sorted(get_gdal_drivers.OUTPUT_PROFILES.keys())),
+                                    dem_common.GDAL_OUTPUT_PROFILE),
+                            default=dem_common.GDAL_OUTPUT_PROFILE,
+                            required=False)
         args=parser.parse_args()
 
+        if args.no_cache:
+            dem_result_cache.set_enabled(False)
+            point_cache.set_enabled(False)
+
+        dem_utilities.set_output_profile(args.output_profile)
+
         dem_lidar.las_to_dsm(args.lasfile, args.outdem,
                              resolution=args.resolution,
                              projection=args.projection,
@@ -20,6 +20,7 @@ import argparse
 # Import DEM library
 try:
     from arsf_dem import dem_common
+    from arsf_dem import dem_scratch
     from arsf_dem.dem_lidar import grass_lidar
     from arsf_dem import dem_common_functions
 except ImportError as err:
@@ -168,6 +169,9 @@ def load_files_to_grass(in_lidar_files,
                                                         in_projection))
 
 if __name__ == '__main__':
+    # Remove scratch files if stopped using SIGTERM / SIGHUP
+    dem_scratch.install_signal_handlers()
+
     description_str = '''Load LiDAR files into GRASS for further processing.
 
  For LAS files converts to ASCII first using las2txt.
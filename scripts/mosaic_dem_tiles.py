@@ -16,6 +16,7 @@ import argparse
 import glob
 from arsf_dem import dem_utilities
 from arsf_dem import dem_common
+from arsf_dem import dem_scratch
 from arsf_dem import dem_common_functions
 
 description_str = """
@@ -28,6 +29,9 @@ Entire extent of DEM is kept. If subsetting to navigation data is required
 use 'create_apl_dem.py' instead. See example 7 in help.
 
 """
+# Remove scratch files if stopped using SIGTERM / SIGHUP
+dem_scratch.install_signal_handlers()
+
 try:
     parser = argparse.ArgumentParser(description=description_str, formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument("demtiles", nargs='+',type=str, help="Tiles to create DEM from")
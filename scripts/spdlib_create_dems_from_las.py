@@ -18,6 +18,7 @@ import tempfile
 from arsf_dem import dem_common
 from arsf_dem import dem_lidar
 from arsf_dem import dem_common_functions
+from arsf_dem import dem_scratch
 from arsf_dem import grass_library
 
 #: Debug mode
@@ -35,6 +36,9 @@ def create_directory(directory_name):
 
 
 if __name__ == '__main__':
+    # Remove scratch files if stopped using SIGTERM / SIGHUP
+    dem_scratch.install_signal_handlers()
+
     description_str = '''Create a Digital Terrain Model (DTM), Digital Surface
   Model (DSM) and optionally Canopy Height Model (CHM) from LAS file(s). Uses
   SPDLib.
@@ -54,7 +58,7 @@ if __name__ == '__main__':
  '''
 
 
-    temp_dir = tempfile.mkdtemp(dir=dem_common.TEMP_PATH)
+    temp_dir = tempfile.mkdtemp(dir=dem_scratch.get_dir())
     try:
         parser = argparse.ArgumentParser(description=description_str)
         parser.add_argument("lasfile", nargs='+', type=str,
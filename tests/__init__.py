@@ -0,0 +1,92 @@
+# Tests for arsf_dem
+#
+# Run using:
+#
+#   python -m unittest discover -s tests -t .
+#
+# Tests which require GRASS, GDAL or lidar tools are skipped if they
+# are not available.
+
+import numpy
+
+from arsf_dem import dem_common
+from arsf_dem import grass_library
+
+def _have_grass():
+    """
+    Check if GRASS is available.
+    """
+    try:
+        grass_library.getGISBASE()
+        grass_library.importGRASSModule('grass.script')
+    except Exception:
+        return False
+    return True
+
+#: GRASS is available
+HAVE_GRASS = _have_grass()
+
+#: GDAL is available
+HAVE_GDAL = grass_library.HAVE_GDAL
+
+if HAVE_GDAL:
+    from osgeo import gdal
+    from osgeo import osr
+
+def create_raster(out_file, data, top_left, resolution, nodata, epsg=4326):
+    """
+    Create an ENVI format raster from a NumPy array.
+
+    Arguments:
+
+    * out_file - output file.
+    * data - 2D NumPy array.
+    * top_left - (x, y) of top left corner.
+    * resolution - pixel size.
+    * nodata - no data value.
+    * epsg - EPSG code of projection.
+
+    """
+    spatial_ref = osr.SpatialReference()
+    spatial_ref.ImportFromEPSG(epsg)
+    out_ds = gdal.GetDriverByName('ENVI').Create(out_file, data.shape[1],
+                                                data.shape[0], 1,
+                                                gdal.GDT_Float32)
+    out_ds.SetGeoTransform((top_left[0], resolution, 0,
+                            top_left[1], 0, -resolution))
+    out_ds.SetProjection(spatial_ref.ExportToWkt())
+    out_ds.GetRasterBand(1).SetNoDataValue(nodata)
+    out_ds.GetRasterBand(1).WriteArray(data)
+    out_ds = None
+
+def read_raster(in_file):
+    """
+    Read first band of a raster as a NumPy array.
+
+    Returns:
+
+    * data, geotransform
+
+    """
+    in_ds = gdal.Open(in_file, gdal.GA_ReadOnly)
+    data = in_ds.GetRasterBand(1).ReadAsArray()
+    geotransform = in_ds.GetGeoTransform()
+    in_ds = None
+    return data, geotransform
+
+def create_ascii_lidar(out_file, columns):
+    """
+    Create an ASCII lidar file with columns in LIDAR_ASCII_ORDER.
+
+    Arguments:
+
+    * out_file - output file.
+    * columns - dictionary with a NumPy array for each column (e.g., x, y, z, classification), columns not provided are set to 0.
+
+    """
+    num_points = len(columns['x'])
+    ascii_data = numpy.zeros((num_points, max(dem_common.LIDAR_ASCII_ORDER.values())))
+    for column_name, column_num in dem_common.LIDAR_ASCII_ORDER.items():
+        if column_name in columns:
+            ascii_data[:, column_num - 1] = columns[column_name]
+    numpy.savetxt(out_file, ascii_data, fmt='%.3f')
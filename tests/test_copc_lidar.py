@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+#Description: Tests for dem_lidar.copc_lidar
+"""
+Tests for dem_lidar.copc_lidar. Files are checked using the header only,
+so laspy isn't required.
+
+This file has been created by ARSF Data Analysis Node and
+is licensed under the GPL v3 Licence. A copy of this
+licence is available to download with this file.
+
+"""
+
+from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from arsf_dem.dem_lidar import copc_lidar
+from arsf_dem.dem_lidar import point_cache
+
+#: Size of a LAS 1.4 header
+LAS_14_HEADER_SIZE = 375
+
+def create_las_header(out_file, user_id=b'copc', record_id=1):
+    """
+    Create a file with a LAS 1.4 header followed by the header of the
+    first VLR (no points).
+    """
+    header = bytearray(LAS_14_HEADER_SIZE)
+    header[0:4] = b'LASF'
+    header[24:26] = bytearray([1, 4])
+    header[94:96] = struct.pack('<H', LAS_14_HEADER_SIZE)
+    vlr_header = (b'\x00\x00' + user_id.ljust(16, b'\x00')
+                  + struct.pack('<H', record_id) + struct.pack('<H', 160)
+                  + b'\x00' * 32)
+    with open(out_file, 'wb') as out_fh:
+        out_fh.write(bytes(header) + vlr_header)
+
+class TestCOPC(unittest.TestCase):
+    """
+    Tests for is_copc_file and checks if COPC files can be read.
+    """
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix='test_copc_lidar')
+        self.copc_file = os.path.join(self.test_dir, 'points.copc.laz')
+        create_las_header(self.copc_file)
+        self.original_have_copc = copc_lidar.HAVE_COPC
+
+    def tearDown(self):
+        copc_lidar.HAVE_COPC = self.original_have_copc
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_is_copc_file(self):
+        self.assertTrue(copc_lidar.is_copc_file(self.copc_file))
+
+        # LAS file where first VLR isn't COPC info
+        las_file = os.path.join(self.test_dir, 'points.las')
+        create_las_header(las_file, user_id=b'LASF_Projection', record_id=2112)
+        self.assertFalse(copc_lidar.is_copc_file(las_file))
+
+        # COPC user ID but not the info record
+        las_file = os.path.join(self.test_dir, 'hierarchy.las')
+        create_las_header(las_file, record_id=1000)
+        self.assertFalse(copc_lidar.is_copc_file(las_file))
+
+        # Not a LAS file
+        ascii_file = os.path.join(self.test_dir, 'points.txt')
+        with open(ascii_file, 'w') as ascii_fh:
+            ascii_fh.write('1.0 2.0 3.0\n')
+        self.assertFalse(copc_lidar.is_copc_file(ascii_file))
+
+        # Truncated and missing files
+        truncated_file = os.path.join(self.test_dir, 'truncated.las')
+        with open(self.copc_file, 'rb') as in_fh:
+            truncated_header = in_fh.read(LAS_14_HEADER_SIZE + 10)
+        with open(truncated_file, 'wb') as out_fh:
+            out_fh.write(truncated_header)
+        self.assertFalse(copc_lidar.is_copc_file(truncated_file))
+        self.assertFalse(copc_lidar.is_copc_file(os.path.join(self.test_dir,
+                                                              'missing.laz')))
+
+    def test_without_laspy(self):
+        copc_lidar.HAVE_COPC = False
+        self.assertFalse(copc_lidar._checkCOPC())
+        # Read as a standard LAS file rather than COPC
+        self.assertFalse(point_cache._use_copc(self.copc_file, 'LAS'))
+        with self.assertRaises(ImportError):
+            next(copc_lidar.read_points(self.copc_file))
+
+    def test_use_copc(self):
+        copc_lidar.HAVE_COPC = True
+        if not copc_lidar.HAVE_NUMPY:
+            self.skipTest('NumPy not available')
+        self.assertTrue(point_cache._use_copc(self.copc_file, 'LAS'))
+        self.assertFalse(point_cache._use_copc(self.copc_file, 'ASCII'))
+
+if __name__ == '__main__':
+    unittest.main()
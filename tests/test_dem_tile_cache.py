@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+#Description: Tests for dem_tile_cache
+"""
+Tests for dem_tile_cache. Tests which subset DEMs are skipped if GRASS
+or GDAL are not available.
+
+This file has been created by ARSF Data Analysis Node and
+is licensed under the GPL v3 Licence. A copy of this
+licence is available to download with this file.
+
+"""
+
+from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from arsf_dem import dem_common
+from arsf_dem import dem_utilities
+from arsf_dem import dem_tile_cache
+from . import HAVE_GRASS, HAVE_GDAL, create_raster, read_raster
+
+class TestEvict(unittest.TestCase):
+    """
+    Tests for evict.
+    """
+    def setUp(self):
+        self.cache_path = tempfile.mkdtemp(prefix='test_dem_tile_cache')
+        self.original_cache_path = dem_common.DEM_TILE_CACHE_PATH
+        dem_common.DEM_TILE_CACHE_PATH = self.cache_path
+
+        self.cache_dir = os.path.join(self.cache_path, 'test_key')
+        os.makedirs(self.cache_dir)
+        self.tile_files = []
+        for col in range(3):
+            tile_file = os.path.join(self.cache_dir, 'tile_{}_0.tif'.format(col))
+            with open(tile_file, 'wb') as tile_fh:
+                tile_fh.write(b'\x00' * 1024)
+            self.tile_files.append(tile_file)
+
+    def tearDown(self):
+        dem_common.DEM_TILE_CACHE_PATH = self.original_cache_path
+        shutil.rmtree(self.cache_path, ignore_errors=True)
+
+    def test_evict_skips_tiles_in_use(self):
+        in_use_file = dem_tile_cache._mark_in_use(self.cache_dir,
+                                                  self.tile_files[:1])
+        num_removed = dem_tile_cache.evict(max_size_mb=0)
+        self.assertEqual(num_removed, 2)
+        self.assertTrue(os.path.isfile(self.tile_files[0]))
+
+        dem_tile_cache._unmark_in_use(in_use_file)
+        num_removed = dem_tile_cache.evict(max_size_mb=0)
+        self.assertEqual(num_removed, 1)
+        self.assertFalse(os.path.isfile(self.tile_files[0]))
+
+@unittest.skipUnless(HAVE_GRASS and HAVE_GDAL, 'GRASS or GDAL not available')
+class TestSubsetFromTiles(unittest.TestCase):
+    """
+    Tests for subset_dem_from_tiles.
+    """
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix='test_dem_tile_cache')
+        self.original_cache_path = dem_common.DEM_TILE_CACHE_PATH
+        self.original_enabled = dem_tile_cache.is_enabled()
+        dem_common.DEM_TILE_CACHE_PATH = os.path.join(self.test_dir, 'cache')
+
+        # DEM with a small void (narrower than tile buffer) to be filled
+        dem_data = numpy.fromfunction(lambda row, col: 100 + 0.5 * row + 0.25 * col,
+                                      (300, 300), dtype=numpy.float32)
+        dem_data[140:146, 150:156] = -9999
+        self.dem_mosaic = os.path.join(self.test_dir, 'dem_mosaic.dem')
+        create_raster(self.dem_mosaic, dem_data, (-4.0, 52.0), 0.01, -9999)
+
+    def tearDown(self):
+        dem_common.DEM_TILE_CACHE_PATH = self.original_cache_path
+        dem_tile_cache.set_enabled(self.original_enabled)
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_tiled_matches_untiled(self):
+        bounding_box = [50.5, 51.5, -3.5, -2.5]
+        out_dems = {}
+        for use_tiles in [False, True]:
+            dem_tile_cache.set_enabled(use_tiles)
+            out_dem = os.path.join(self.test_dir,
+                                   'subset_tiles_{}.dem'.format(use_tiles))
+            dem_utilities.subset_dem_to_bounding_box(self.dem_mosaic,
+                                                     out_dem,
+                                                     bounding_box,
+                                                     fill_nulls=True)
+            out_dems[use_tiles] = read_raster(out_dem)
+
+        untiled_data, untiled_geotransform = out_dems[False]
+        tiled_data, tiled_geotransform = out_dems[True]
+        numpy.testing.assert_allclose(tiled_geotransform, untiled_geotransform)
+        self.assertEqual(tiled_data.shape, untiled_data.shape)
+        numpy.testing.assert_allclose(tiled_data, untiled_data, atol=1e-3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+#Description: Tests for dem_utilities
+"""
+Tests for dem_utilities. Tests which warp rasters are skipped if GDAL
+is not available.
+
+This file has been created by ARSF Data Analysis Node and
+is licensed under the GPL v3 Licence. A copy of this
+licence is available to download with this file.
+
+"""
+
+from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from arsf_dem import dem_common
+from arsf_dem import dem_utilities
+from . import HAVE_GDAL, create_raster, read_raster
+
+#: UTM zone 30N, used for test rasters
+TEST_EPSG = 32630
+
+@unittest.skipUnless(HAVE_GDAL, 'GDAL not available')
+class TestWindowedWarp(unittest.TestCase):
+    """
+    Tests for subset_to_bb split into windows.
+    """
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix='test_dem_utilities')
+
+        # Non-linear surface so resampling differences would show
+        in_data = numpy.fromfunction(lambda row, col: 100 + numpy.sin(row / 7.0) * 20
+                                                    + numpy.cos(col / 11.0) * 15,
+                                     (400, 500), dtype=numpy.float32)
+        self.in_raster = os.path.join(self.test_dir, 'in_raster.dem')
+        create_raster(self.in_raster, in_data, (500000, 5600000), 10, -9999,
+                      epsg=TEST_EPSG)
+        self.bounding_box = [50.51, 50.54, -3.0, -2.95]
+        self.out_res = (0.0001, 0.0001)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_windowed_matches_single(self):
+        single_raster = os.path.join(self.test_dir, 'single.dem')
+        dem_utilities.subset_to_bb(self.in_raster, single_raster, self.bounding_box,
+                                   in_projection=None,
+                                   out_projection=dem_common.WGS84_PROJ4_STRING,
+                                   out_res=self.out_res,
+                                   num_processes=1,
+                                   final_output=False)
+
+        # Split into many small windows
+        windowed_raster = os.path.join(self.test_dir, 'windowed.dem')
+        out_grid_vrt = dem_utilities.get_subset_grid_vrt(self.in_raster,
+                                            self.bounding_box,
+                                            out_projection=dem_common.WGS84_PROJ4_STRING,
+                                            out_res=self.out_res)
+        try:
+            dem_utilities.write_raster_in_windows(out_grid_vrt, windowed_raster,
+                                                  num_processes=2,
+                                                  window_memory_mb=0.01)
+        finally:
+            os.remove(out_grid_vrt)
+
+        single_data, single_geotransform = read_raster(single_raster)
+        windowed_data, windowed_geotransform = read_raster(windowed_raster)
+        numpy.testing.assert_allclose(windowed_geotransform, single_geotransform)
+        self.assertEqual(windowed_data.shape, single_data.shape)
+        self.assertTrue(numpy.array_equal(windowed_data, single_data))
+
+    def test_estimate_subset_pixels(self):
+        estimated_pixels = dem_utilities._estimate_subset_pixels(self.in_raster,
+                                            self.bounding_box,
+                                            out_projection=dem_common.WGS84_PROJ4_STRING,
+                                            out_res=self.out_res)
+        self.assertEqual(estimated_pixels, 300 * 500)
+
+if __name__ == '__main__':
+    unittest.main()
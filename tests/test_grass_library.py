@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+#Description: Tests for grass_library
+"""
+Tests for grass_library. Tests which run GRASS modules are skipped if
+GRASS is not available.
+
+This file has been created by ARSF Data Analysis Node and
+is licensed under the GPL v3 Licence. A copy of this
+licence is available to download with this file.
+
+"""
+
+from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
+import os
+import threading
+import unittest
+
+from arsf_dem import grass_library
+from . import HAVE_GRASS
+
+class TestWorkspaceEnv(unittest.TestCase):
+    """
+    Tests for environment used by GRASSWorkspace.
+    """
+    def test_env_matches_gsetup(self):
+        gisbase = os.path.join(os.sep, 'opt', 'grass')
+        in_env = {'PATH' : os.path.join(os.sep, 'usr', 'bin'),
+                  'LD_LIBRARY_PATH' : os.path.join(os.sep, 'usr', 'lib'),
+                  'DYLD_LIBRARY_PATH' : os.path.join(os.sep, 'usr', 'lib')}
+        env = grass_library._getWorkspaceEnv(gisbase, 'grassrc', in_env)
+
+        path_list = env['PATH'].split(os.pathsep)
+        self.assertEqual(path_list[0], in_env['PATH'])
+        self.assertIn(os.path.join(gisbase, 'bin'), path_list)
+        self.assertIn(os.path.join(gisbase, 'scripts'), path_list)
+        library_path_var = 'DYLD_LIBRARY_PATH' if grass_library.sys.platform == 'darwin' \
+                                               else 'LD_LIBRARY_PATH'
+        self.assertIn(os.path.join(gisbase, 'lib'),
+                      env[library_path_var].split(os.pathsep))
+        self.assertIn(os.path.join(gisbase, 'etc', 'python'),
+                      env['PYTHONPATH'].split(os.pathsep))
+        self.assertEqual(env['GIS_LOCK'], str(os.getpid()))
+        self.assertEqual(env['GISBASE'], gisbase)
+        self.assertEqual(env['GISRC'], 'grassrc')
+        # Input environment shouldn't be changed
+        self.assertEqual(in_env['PATH'], os.path.join(os.sep, 'usr', 'bin'))
+
+@unittest.skipUnless(HAVE_GRASS, 'GRASS not available')
+class TestGRASSWorkspace(unittest.TestCase):
+    """
+    Tests for running GRASS modules within a GRASSWorkspace.
+    """
+    def test_region_in_new_thread(self):
+        result = {}
+
+        def _print_region():
+            try:
+                with grass_library.GRASSWorkspace() as workspace:
+                    result['region'] = grass_library.grass.read_command('g.region',
+                                                                        flags='p')
+                    result['grassdb_path'] = workspace.grassdb_path
+            except Exception as err:
+                result['error'] = err
+
+        region_thread = threading.Thread(target=_print_region)
+        region_thread.start()
+        region_thread.join()
+
+        if 'error' in result:
+            raise result['error']
+        self.assertIn('projection', result['region'])
+        # Database should be removed when workspace is closed (pool not used)
+        if not grass_library.dem_common.GRASS_DB_POOL:
+            self.assertFalse(os.path.isdir(result['grassdb_path']))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+#Description: Tests for dem_lidar.lidar_utilities
+"""
+Tests for dem_lidar.lidar_utilities. Tests which run GRASS modules are
+skipped if GRASS or GDAL are not available.
+
+This file has been created by ARSF Data Analysis Node and
+is licensed under the GPL v3 Licence. A copy of this
+licence is available to download with this file.
+
+"""
+
+from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from arsf_dem.dem_lidar import lidar_utilities
+from . import HAVE_GRASS, HAVE_GDAL, create_raster, read_raster
+
+#: UTM zone 30N, used for test rasters
+TEST_EPSG = 32630
+
+@unittest.skipUnless(HAVE_GRASS and HAVE_GDAL, 'GRASS or GDAL not available')
+class TestPatchedLidarMosaic(unittest.TestCase):
+    """
+    Tests for create_patched_lidar_mosaic.
+    """
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix='test_lidar_utilities')
+
+        # Gridded lidar with a gap in the middle to be filled from DEM
+        lidar_data = numpy.fromfunction(lambda row, col: 50 + 0.1 * row + 0.05 * col,
+                                        (100, 120), dtype=numpy.float32)
+        lidar_data[40:60, 50:70] = -9999
+        self.lidar_raster = os.path.join(self.test_dir, 'lidar_mosaic.dem')
+        create_raster(self.lidar_raster, lidar_data, (500000, 5600000), 2, -9999,
+                      epsg=TEST_EPSG)
+
+        # Coarser DEM covering lidar with a buffer
+        dem_data = numpy.fromfunction(lambda row, col: 40 + 0.5 * row + 0.2 * col,
+                                      (200, 200), dtype=numpy.float32)
+        self.dem_mosaic = os.path.join(self.test_dir, 'dem_mosaic.dem')
+        create_raster(self.dem_mosaic, dem_data, (498000, 5602000), 20, -9999,
+                      epsg=TEST_EPSG)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_concurrent_matches_serial(self):
+        out_mosaics = {}
+        for concurrent_stages in [False, True]:
+            out_mosaic = os.path.join(self.test_dir,
+                                      'patched_concurrent_{}.dem'.format(concurrent_stages))
+            lidar_utilities.create_patched_lidar_mosaic(self.lidar_raster,
+                                                        out_mosaic,
+                                                        in_lidar_projection='UTM30N',
+                                                        out_projection='UTM30N',
+                                                        resolution=2,
+                                                        lidar_format='GRIDDED',
+                                                        dem_mosaic=self.dem_mosaic,
+                                                        concurrent_stages=concurrent_stages)
+            out_mosaics[concurrent_stages] = read_raster(out_mosaic)
+
+        serial_data, serial_geotransform = out_mosaics[False]
+        concurrent_data, concurrent_geotransform = out_mosaics[True]
+        self.assertEqual(serial_geotransform, concurrent_geotransform)
+        self.assertEqual(serial_data.shape, concurrent_data.shape)
+        self.assertTrue(numpy.array_equal(serial_data, concurrent_data))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+#Description: Tests for dem_lidar.numpy_lidar
+"""
+Tests for dem_lidar.numpy_lidar. Points are binned into grids directly
+(without creating a raster) so only NumPy is required.
+
+This file has been created by ARSF Data Analysis Node and
+is licensed under the GPL v3 Licence. A copy of this
+licence is available to download with this file.
+
+"""
+
+from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from arsf_dem.dem_lidar import numpy_lidar
+from arsf_dem.dem_lidar import point_cache
+from . import create_ascii_lidar
+
+class TestGridRows(unittest.TestCase):
+    """
+    Tests for _grid_rows.
+    """
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix='test_numpy_lidar')
+
+        # Points within a 10 x 8 grid of 2 m cells
+        random_state = numpy.random.RandomState(1)
+        num_points = 3000
+        self.bin_size = 2.0
+        self.points = {'x' : numpy.round(random_state.uniform(100.001, 119.999, num_points), 3),
+                       'y' : numpy.round(random_state.uniform(200.001, 215.999, num_points), 3),
+                       'z' : numpy.round(random_state.uniform(10, 50, num_points), 3),
+                       'classification' : random_state.randint(1, 8, num_points),
+                       'returnnumber' : numpy.ones(num_points),
+                       'numberofreturns' : numpy.ones(num_points)}
+        # Leave some cells empty
+        keep = ~((self.points['x'] < 104) & (self.points['y'] > 212))
+        self.points = dict([(column_name, column_values[keep])
+                            for column_name, column_values in self.points.items()])
+
+        in_ascii = os.path.join(self.test_dir, 'points.txt')
+        create_ascii_lidar(in_ascii, self.points)
+        self.original_index_chunk_size = point_cache.POINT_INDEX_CHUNK_SIZE
+        point_cache.POINT_INDEX_CHUNK_SIZE = 100
+        self.point_caches = {}
+        for spatial_sort in [False, True]:
+            out_dir = tempfile.mkdtemp(dir=self.test_dir)
+            self.point_caches[spatial_sort] = point_cache.build_point_cache(in_ascii, out_dir,
+                                                          lidar_format='ASCII',
+                                                          spatial_sort=spatial_sort)
+
+    def tearDown(self):
+        point_cache.POINT_INDEX_CHUNK_SIZE = self.original_index_chunk_size
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _get_expected_mean(self, left, top, n_cols, n_rows, nodata):
+        """
+        Get mean elevation of points in each cell, dropping class 7.
+        """
+        use_points = self.points['classification'] != 7
+        cols = numpy.floor((self.points['x'][use_points] - left) / self.bin_size).astype(int)
+        rows = numpy.floor((top - self.points['y'][use_points]) / self.bin_size).astype(int)
+        z_values = self.points['z'][use_points]
+        expected = numpy.full((n_rows, n_cols), float(nodata))
+        for row in range(n_rows):
+            for col in range(n_cols):
+                in_cell = (rows == row) & (cols == col)
+                if in_cell.any():
+                    expected[row, col] = z_values[in_cell].mean()
+        return expected
+
+    def test_grid_mean(self):
+        nodata = -9999
+        for spatial_sort, points in self.point_caches.items():
+            (left, top), (n_cols, n_rows) = numpy_lidar._get_grid([points], self.bin_size)
+            self.assertEqual((left, top, n_cols, n_rows), (100, 216, 10, 8))
+            expected = self._get_expected_mean(left, top, n_cols, n_rows, nodata)
+            self.assertTrue((expected == nodata).any())
+
+            # All rows at once
+            out_array = numpy_lidar._grid_rows([points], left, top, self.bin_size,
+                                               n_cols, n_rows, 0, n_rows,
+                                               drop_class=7, nodata=nodata)
+            numpy.testing.assert_allclose(out_array, expected, atol=1e-6)
+
+            # Blocks of rows, as used for large rasters
+            block_arrays = [numpy_lidar._grid_rows([points], left, top, self.bin_size,
+                                                   n_cols, n_rows, row_start,
+                                                   min(row_start + 3, n_rows),
+                                                   drop_class=7, nodata=nodata)
+                            for row_start in range(0, n_rows, 3)]
+            numpy.testing.assert_allclose(numpy.vstack(block_arrays), expected, atol=1e-6)
+
+    def test_grid_count(self):
+        points = self.point_caches[True]
+        (left, top), (n_cols, n_rows) = numpy_lidar._get_grid([points], self.bin_size)
+        out_array = numpy_lidar._grid_rows([points], left, top, self.bin_size,
+                                           n_cols, n_rows, 0, n_rows,
+                                           drop_class=None, raster_statistic='n')
+        self.assertEqual(out_array.sum(), len(self.points['x']))
+
+if __name__ == '__main__':
+    unittest.main()
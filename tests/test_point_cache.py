@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+#Description: Tests for dem_lidar.point_cache
+"""
+Tests for dem_lidar.point_cache. Points are read from ASCII files so
+only NumPy is required.
+
+This file has been created by ARSF Data Analysis Node and
+is licensed under the GPL v3 Licence. A copy of this
+licence is available to download with this file.
+
+"""
+
+from __future__ import print_function # Import print function (so we can use Python 3 syntax with Python 2)
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from arsf_dem.dem_lidar import point_cache
+from . import create_ascii_lidar
+
+def get_test_points(num_points=2000, seed=0):
+    """
+    Get random points, coordinates are rounded to the scale used for
+    ASCII files so they are stored exactly.
+    """
+    random_state = numpy.random.RandomState(seed)
+    number_of_returns = random_state.randint(1, 4, num_points)
+    return {'x' : numpy.round(random_state.uniform(1000, 1100, num_points), 3),
+            'y' : numpy.round(random_state.uniform(2000, 2050, num_points), 3),
+            'z' : numpy.round(random_state.uniform(10, 50, num_points), 3),
+            'intensity' : random_state.randint(0, 1000, num_points),
+            'classification' : random_state.randint(1, 8, num_points),
+            'returnnumber' : random_state.randint(0, 3, num_points) % number_of_returns + 1,
+            'numberofreturns' : number_of_returns}
+
+def get_point_rows(columns):
+    """
+    Get points as rows of (x, y, z, classification) sorted so sets of
+    points can be compared regardless of order.
+    """
+    point_rows = numpy.column_stack([numpy.round(numpy.asarray(columns[column_name],
+                                                               dtype=numpy.float64), 3)
+                                     for column_name in ['x', 'y', 'z', 'classification']])
+    return point_rows[numpy.lexsort(point_rows.T[::-1])]
+
+class TestPointCache(unittest.TestCase):
+    """
+    Tests for build_point_cache and PointCache.
+    """
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix='test_point_cache')
+        self.points = get_test_points()
+        self.in_ascii = os.path.join(self.test_dir, 'points.txt')
+        create_ascii_lidar(self.in_ascii, self.points)
+        self.original_index_chunk_size = point_cache.POINT_INDEX_CHUNK_SIZE
+        # Use small blocks so the index has several entries
+        point_cache.POINT_INDEX_CHUNK_SIZE = 64
+
+    def tearDown(self):
+        point_cache.POINT_INDEX_CHUNK_SIZE = self.original_index_chunk_size
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _build_point_cache(self, spatial_sort=False, **kwargs):
+        out_dir = tempfile.mkdtemp(dir=self.test_dir)
+        return point_cache.build_point_cache(self.in_ascii, out_dir,
+                                             lidar_format='ASCII',
+                                             spatial_sort=spatial_sort,
+                                             **kwargs)
+
+    def test_round_trip(self):
+        points = self._build_point_cache()
+        self.assertEqual(points.num_points, len(self.points['x']))
+        for column_name in ['x', 'y', 'z']:
+            numpy.testing.assert_allclose(points.get_values(column_name),
+                                          self.points[column_name], atol=1e-6)
+        for column_name in ['intensity', 'classification', 'returnnumber',
+                            'numberofreturns']:
+            numpy.testing.assert_array_equal(points.get_values(column_name),
+                                             self.points[column_name])
+        numpy.testing.assert_allclose(points.bounds[0], [self.points['x'].min(),
+                                                         self.points['x'].max()], atol=1e-6)
+        numpy.testing.assert_allclose(points.bounds[1], [self.points['y'].min(),
+                                                         self.points['y'].max()], atol=1e-6)
+
+    def test_round_trip_sorted(self):
+        points = self._build_point_cache(spatial_sort=True)
+        self.assertEqual(points.spatial_sort, 'morton')
+        self.assertEqual(points.num_points, len(self.points['x']))
+        cached_columns = dict([(column_name, points.get_values(column_name))
+                               for column_name in ['x', 'y', 'z', 'classification']])
+        numpy.testing.assert_allclose(get_point_rows(cached_columns),
+                                      get_point_rows(self.points), atol=1e-6)
+
+    def test_bounding_box(self):
+        bounding_box = [2010.0, 2025.0, 1020.0, 1045.0]
+        in_bounding_box = ((self.points['y'] >= bounding_box[0])
+                           & (self.points['y'] <= bounding_box[1])
+                           & (self.points['x'] >= bounding_box[2])
+                           & (self.points['x'] <= bounding_box[3]))
+        expected_rows = get_point_rows(dict([(column_name, column_values[in_bounding_box])
+                                             for column_name, column_values
+                                             in self.points.items()]))
+
+        for spatial_sort in [False, True]:
+            points = self._build_point_cache(spatial_sort=spatial_sort)
+            selected_columns = dict([(column_name, [])
+                                     for column_name in ['x', 'y', 'z', 'classification']])
+            for start, end in points.iter_chunks(chunk_size=50, bounding_box=bounding_box):
+                mask = points.get_mask(start, end, bounding_box=bounding_box)
+                for column_name in selected_columns.keys():
+                    selected_columns[column_name].append(points.get_values(column_name,
+                                                                           start, end)[mask])
+            selected_rows = get_point_rows(dict([(column_name, numpy.concatenate(column_values))
+                                                 for column_name, column_values
+                                                 in selected_columns.items()]))
+            numpy.testing.assert_allclose(selected_rows, expected_rows, atol=1e-6)
+
+    def test_mask_classes_and_returns(self):
+        points = self._build_point_cache()
+        mask = points.get_mask(returns='last', drop_class=7)
+        expected_mask = ((self.points['returnnumber'] >= self.points['numberofreturns'])
+                         & (self.points['classification'] != 7))
+        numpy.testing.assert_array_equal(mask, expected_mask)
+
+class TestSpatialSort(unittest.TestCase):
+    """
+    Tests for Morton ordering and the index of sorted points.
+    """
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix='test_point_cache')
+        self.original_index_chunk_size = point_cache.POINT_INDEX_CHUNK_SIZE
+        point_cache.POINT_INDEX_CHUNK_SIZE = 64
+
+    def tearDown(self):
+        point_cache.POINT_INDEX_CHUNK_SIZE = self.original_index_chunk_size
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_morton_codes(self):
+        # 4 x 4 grid of points, quantised to their positions (0 - 3) when
+        # the range is 2**MORTON_BITS - 1.
+        max_quantised = 2**point_cache.MORTON_BITS - 1
+        x, y = numpy.meshgrid(numpy.arange(4), numpy.arange(4))
+        x = x.ravel()
+        y = y.ravel()
+        codes = point_cache.get_morton_codes(x, y, (0, max_quantised),
+                                             (0, max_quantised))
+        # Bits of x and y are interleaved, with x in the lowest bit
+        expected_codes = numpy.array([0, 1, 4, 5,
+                                      2, 3, 6, 7,
+                                      8, 9, 12, 13,
+                                      10, 11, 14, 15])
+        numpy.testing.assert_array_equal(codes, expected_codes)
+
+        # Sorting by code visits each 2 x 2 quadrant in turn (Z-order)
+        sort_order = numpy.argsort(codes, kind='mergesort')
+        numpy.testing.assert_array_equal(x[sort_order][:4], [0, 1, 0, 1])
+        numpy.testing.assert_array_equal(y[sort_order][:4], [0, 0, 1, 1])
+        numpy.testing.assert_array_equal(x[sort_order][4:8], [2, 3, 2, 3])
+        numpy.testing.assert_array_equal(y[sort_order][4:8], [0, 0, 1, 1])
+
+    def test_sorted_cache_order(self):
+        points = get_test_points()
+        in_ascii = os.path.join(self.test_dir, 'points.txt')
+        create_ascii_lidar(in_ascii, points)
+        out_dir = tempfile.mkdtemp(dir=self.test_dir)
+        sorted_points = point_cache.build_point_cache(in_ascii, out_dir,
+                                                      lidar_format='ASCII',
+                                                      spatial_sort=True)
+        x_column = sorted_points.get_column('x')
+        y_column = sorted_points.get_column('y')
+        codes = point_cache.get_morton_codes(x_column, y_column,
+                                             (x_column.min(), x_column.max()),
+                                             (y_column.min(), y_column.max()))
+        self.assertTrue((numpy.diff(codes.astype(numpy.int64)) >= 0).all())
+
+    def test_ranges_in_bounding_box(self):
+        points = get_test_points(num_points=5000, seed=2)
+        in_ascii = os.path.join(self.test_dir, 'points.txt')
+        create_ascii_lidar(in_ascii, points)
+        out_dir = tempfile.mkdtemp(dir=self.test_dir)
+        sorted_points = point_cache.build_point_cache(in_ascii, out_dir,
+                                                      lidar_format='ASCII',
+                                                      spatial_sort=True)
+        x = sorted_points.get_coordinates('x')
+        y = sorted_points.get_coordinates('y')
+        chunk_index = sorted_points.get_chunk_index()
+        self.assertEqual(len(chunk_index), int(numpy.ceil(5000 / 64.0)))
+
+        for bounding_box in [[2010.0, 2025.0, 1020.0, 1045.0],
+                             [2000.0, 2005.0, 1090.0, 1100.0],
+                             [2049.5, 2060.0, 990.0, 1001.0]]:
+            inside = ((y >= bounding_box[0]) & (y <= bounding_box[1])
+                      & (x >= bounding_box[2]) & (x <= bounding_box[3]))
+            point_ranges = sorted_points.get_ranges_in_bounding_box(bounding_box)
+            in_ranges = numpy.zeros(sorted_points.num_points, dtype=bool)
+            for start, end in point_ranges:
+                in_ranges[start:end] = True
+
+            # All points within the bounding box are in the ranges and
+            # ranges only include blocks which intersect it
+            self.assertFalse((inside & ~in_ranges).any())
+            for chunk_num, (min_y, max_y, min_x, max_x) in enumerate(chunk_index):
+                start = chunk_num * 64
+                intersects = (min_y <= bounding_box[1] and max_y >= bounding_box[0]
+                              and min_x <= bounding_box[3] and max_x >= bounding_box[2])
+                self.assertEqual(bool(in_ranges[start]), intersects)
+
+            # Selecting points within ranges gives exactly the points in
+            # the bounding box
+            selected = numpy.zeros(sorted_points.num_points, dtype=bool)
+            for start, end in point_ranges:
+                selected[start:end] = sorted_points.get_mask(start, end,
+                                                             bounding_box=bounding_box)
+            numpy.testing.assert_array_equal(selected, inside)
+
+            # Fewer points are read than without the index
+            self.assertLess(in_ranges.sum(), sorted_points.num_points)
+
+class TestSubsample(unittest.TestCase):
+    """
+    Tests for subsampling points (used for quicklooks).
+    """
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix='test_point_cache')
+        self.points = get_test_points()
+        self.in_ascii = os.path.join(self.test_dir, 'points.txt')
+        create_ascii_lidar(self.in_ascii, self.points)
+        # Read in several chunks, so subsampling continues across chunks
+        self.original_chunk_size = point_cache.POINT_CHUNK_SIZE
+        point_cache.POINT_CHUNK_SIZE = 300
+
+    def tearDown(self):
+        point_cache.POINT_CHUNK_SIZE = self.original_chunk_size
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _build_point_cache(self, subsample_method, subsample_factor):
+        out_dir = tempfile.mkdtemp(dir=self.test_dir)
+        return point_cache.build_point_cache(self.in_ascii, out_dir,
+                                             lidar_format='ASCII',
+                                             spatial_sort=False,
+                                             subsample_method=subsample_method,
+                                             subsample_factor=subsample_factor)
+
+    def test_nth(self):
+        points = self._build_point_cache('NTH', 4)
+        self.assertEqual(points.num_points, len(self.points['x']) // 4)
+        numpy.testing.assert_allclose(points.get_values('x'), self.points['x'][::4],
+                                      atol=1e-6)
+
+        # Factor of 1 keeps all points
+        points = self._build_point_cache('NTH', 1)
+        self.assertEqual(points.num_points, len(self.points['x']))
+
+    def test_random(self):
+        points = self._build_point_cache('RANDOM', 4)
+        expected_num_points = len(self.points['x']) / 4.0
+        self.assertGreater(points.num_points, expected_num_points * 0.8)
+        self.assertLess(points.num_points, expected_num_points * 1.2)
+
+        # Subsampled points are a subset of all points
+        in_x = numpy.round(self.points['x'], 3)
+        subsample_x = numpy.round(points.get_values('x'), 3)
+        self.assertTrue(numpy.isin(subsample_x, in_x).all())
+
+        # Same points are selected each time
+        repeat_points = self._build_point_cache('RANDOM', 4)
+        self.assertEqual(repeat_points.num_points, points.num_points)
+        for column_name in ['x', 'y', 'z', 'classification']:
+            numpy.testing.assert_array_equal(repeat_points.get_values(column_name),
+                                             points.get_values(column_name))
+
+if __name__ == '__main__':
+    unittest.main()